@@ -0,0 +1,116 @@
+"""
+Agrupamento (debounce) das mensagens de conversa livre.
+Mensagens de um chat que chegam em sequência rápida são juntadas e respondidas com uma
+única chamada ao Gemini. Um balde de tokens por chat limita o ritmo sustentado de
+respostas: acima dele as mensagens continuam sendo acumuladas (nenhuma é descartada)
+e são respondidas juntas assim que houver vaga.
+"""
+from __future__ import annotations
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from cache_persistente import CacheDuasCamadas
+from config import logger
+from fila_telegram import BaldeTokens
+
+# Respostas seguidas permitidas antes de o limite por minuto começar a valer
+_RAJADA_RESPOSTAS: int = 3
+
+
+def _agendar_com_timer(atraso: float, callback: Callable[[], None]) -> threading.Timer:
+    timer = threading.Timer(atraso, callback)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class AgrupadorMensagens:
+    """
+    Buffer de mensagens por chat.
+
+    - `ao_liberar(chat_id, itens)` recebe o lote quando o chat fica `janela` segundos
+      sem mandar nada (ou quando o lote mais antigo já espera `espera_maxima` segundos);
+    - `agendar(atraso, callback)` agenda o vencimento e devolve algo com `.cancel()`
+      (padrão: `threading.Timer`; no runtime assíncrono, `loop.call_later`).
+    """
+
+    def __init__(self, ao_liberar: Callable[[str, list], Any], janela: float = 2.0,
+                 espera_maxima: float = 8.0, respostas_por_minuto: float = 6.0,
+                 agendar: Optional[Callable[[float, Callable[[], None]], Any]] = None) -> None:
+        self._ao_liberar = ao_liberar
+        self.janela = janela
+        self.espera_maxima = max(janela, espera_maxima)
+        self._taxa = respostas_por_minuto / 60
+        self._agendar = agendar or _agendar_com_timer
+        self._lock = threading.Lock()
+        self._buffers: dict[str, dict] = {}
+        # Baldes de chats inativos expiram: voltar depois de 1h é como começar do zero.
+        # Só em memória: o balde usa o relógio monotônico, que não vale depois de um restart
+        self._baldes = CacheDuasCamadas('limite_respostas', ttl=3600, max_itens=10000)
+        self._metricas = {'recebidas': 0, 'lotes': 0}
+
+    def adicionar(self, chat_id: int | str, item: Any) -> None:
+        """Acrescenta uma mensagem ao buffer do chat e reinicia a janela de espera."""
+        chave = str(chat_id)
+        agora = time.monotonic()
+        with self._lock:
+            self._metricas['recebidas'] += 1
+            buffer = self._buffers.get(chave)
+            if buffer is None:
+                buffer = self._buffers[chave] = {'itens': [], 'inicio': agora, 'geracao': 0,
+                                                 'timer': None, 'reservado': False}
+            buffer['itens'].append(item)
+            if buffer['reservado']:
+                # Já esperando vaga no limite de ritmo: sai junto no próximo lote
+                return
+            if buffer['timer'] is not None:
+                buffer['timer'].cancel()
+            atraso = min(self.janela, max(0.0, buffer['inicio'] + self.espera_maxima - agora))
+            buffer['geracao'] += 1
+            buffer['timer'] = self._agendar(atraso, self._vencimento(chave, buffer['geracao']))
+
+    def _vencimento(self, chave: str, geracao: int) -> Callable[[], None]:
+        return lambda: self._vencer(chave, geracao)
+
+    def _vencer(self, chave: str, geracao: int) -> None:
+        with self._lock:
+            buffer = self._buffers.get(chave)
+            if buffer is None or buffer['geracao'] != geracao:
+                return  # timer cancelado tarde demais; o buffer já foi reagendado ou liberado
+            if not buffer['reservado']:
+                balde = self._baldes.obter(chave)
+                if balde is None:
+                    balde = BaldeTokens(self._taxa, _RAJADA_RESPOSTAS)
+                    self._baldes.guardar(chave, balde)
+                espera = balde.reservar()
+                if espera > 0:
+                    buffer['reservado'] = True
+                    buffer['geracao'] += 1
+                    buffer['timer'] = self._agendar(espera, self._vencimento(chave, buffer['geracao']))
+                    logger.debug(f"Chat {chave} no limite de respostas: lote adiado {espera:.1f}s.")
+                    return
+            itens = self._buffers.pop(chave)['itens']
+            self._metricas['lotes'] += 1
+        self._ao_liberar(chave, itens)
+
+    def liberar(self, chat_id: int | str) -> Any:
+        """
+        Libera na hora o lote pendente do chat, sem esperar a janela nem o limite de ritmo
+        (ex.: antes de um comando do mesmo chat, para o texto ser respondido antes dele).
+        Retorna o que `ao_liberar` devolveu, ou None se não havia nada pendente.
+        """
+        chave = str(chat_id)
+        with self._lock:
+            buffer = self._buffers.pop(chave, None)
+            if buffer is None:
+                return None
+            if buffer['timer'] is not None:
+                buffer['timer'].cancel()
+            self._metricas['lotes'] += 1
+        return self._ao_liberar(chave, buffer['itens'])
+
+    def metricas(self) -> dict[str, int]:
+        """Mensagens recebidas, lotes liberados e buffers abertos agora."""
+        with self._lock:
+            return {**self._metricas, 'buffers_abertos': len(self._buffers)}
@@ -4,16 +4,28 @@ Gerencia memória persistente (SQLite), sessões de chat do Gemini e processamen
 """
 from __future__ import annotations
 import os
+import json
+import asyncio
 import threading
 import sqlite3
-from typing import Optional
+from typing import AsyncIterator, Iterator, Optional
 from contextlib import contextmanager
 
 from google import genai
 from google.genai import types
-from cachetools import TTLCache
+from google.genai.chats import AsyncChat
 
-from config import GOOGLE_API_KEY, DB_PATH, TEAM_NAME, logger
+from config import (
+    GOOGLE_API_KEY, DB_PATH, TEAM_NAME, CACHE_CONTEXTO_TTL,
+    MAX_SESSOES, MAX_ITENS_SESSAO, MAX_MEMORIA_SESSOES_MB, MAX_CHAMADAS_GEMINI,
+    LIMITE_MIDIA_INLINE_KB, RETENCAO_MIDIA_HORAS, logger
+)
+from cache_contexto import GerenciadorCacheContexto
+from cache_persistente import armazem_padrao
+from pool_sessoes import PoolSessoes
+from midia_gemini import CacheMidiaGemini
+from despachante_ia import DespachanteIA, PRIORIDADE_INTERATIVA, PRIORIDADE_SEGUNDO_PLANO
+from orcamento_tokens import aplicar_orcamento, estimar_tokens, tokens_historico, referenciar_dados_repetidos
 
 _memory_lock = threading.Lock()
 
@@ -59,9 +71,131 @@ def init_db() -> None:
                         data_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
                 ''')
+                # Uso de tokens por mensagem (por chat e por comando)
+                c.execute('''
+                    CREATE TABLE IF NOT EXISTS uso_tokens (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        chat_id TEXT NOT NULL,
+                        comando TEXT NOT NULL,
+                        tokens_sistema INTEGER DEFAULT 0,
+                        tokens_historico INTEGER DEFAULT 0,
+                        tokens_dados INTEGER DEFAULT 0,
+                        tokens_usuario INTEGER DEFAULT 0,
+                        tokens_entrada INTEGER DEFAULT 0,
+                        tokens_resposta INTEGER DEFAULT 0,
+                        pixels_midia INTEGER DEFAULT 0,
+                        data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                # Bancos criados antes da coluna de pixels (fotos) ganham a coluna aqui
+                c.execute('PRAGMA table_info(uso_tokens)')
+                if 'pixels_midia' not in {coluna[1] for coluna in c.fetchall()}:
+                    c.execute('ALTER TABLE uso_tokens ADD COLUMN pixels_midia INTEGER DEFAULT 0')
+                # Tokens do Strava (linha única), renovados antes de expirar
+                c.execute('''
+                    CREATE TABLE IF NOT EXISTS tokens_strava (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        access_token TEXT NOT NULL,
+                        refresh_token TEXT NOT NULL,
+                        expires_at INTEGER NOT NULL,
+                        atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                # Histórico completo de atividades do Strava e checkpoint da importação
+                c.execute('''
+                    CREATE TABLE IF NOT EXISTS atividades_strava (
+                        id INTEGER PRIMARY KEY,
+                        inicio INTEGER NOT NULL,
+                        data_local TEXT NOT NULL,
+                        tipo TEXT NOT NULL,
+                        nome TEXT,
+                        distancia_m REAL DEFAULT 0,
+                        elevacao_m REAL DEFAULT 0,
+                        tempo_movimento_s INTEGER DEFAULT 0,
+                        polyline TEXT
+                    )
+                ''')
+                c.execute('CREATE INDEX IF NOT EXISTS idx_atividades_inicio ON atividades_strava (inicio)')
+                c.execute('CREATE INDEX IF NOT EXISTS idx_atividades_dia ON atividades_strava (substr(data_local, 1, 10))')
+                # Agregados por dia e tipo de atividade, mantidos junto com a tabela de atividades
+                c.execute('''
+                    CREATE TABLE IF NOT EXISTS estatisticas_diarias (
+                        data TEXT NOT NULL,
+                        tipo TEXT NOT NULL,
+                        km REAL NOT NULL DEFAULT 0,
+                        elevacao_m REAL NOT NULL DEFAULT 0,
+                        tempo_movimento_s INTEGER NOT NULL DEFAULT 0,
+                        atividades INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (data, tipo)
+                    )
+                ''')
+                # Bancos que já tinham atividades antes da tabela de agregados
+                c.execute('''
+                    INSERT INTO estatisticas_diarias (data, tipo, km, elevacao_m, tempo_movimento_s, atividades)
+                    SELECT substr(data_local, 1, 10), tipo, SUM(distancia_m) / 1000.0, SUM(elevacao_m),
+                           SUM(tempo_movimento_s), COUNT(*)
+                    FROM atividades_strava
+                    WHERE NOT EXISTS (SELECT 1 FROM estatisticas_diarias)
+                    GROUP BY substr(data_local, 1, 10), tipo
+                ''')
+                # Traçados já decodificados (int32 lat/lon × 1e5) para o mapa de calor
+                c.execute('''
+                    CREATE TABLE IF NOT EXISTS trajetos_strava (
+                        id INTEGER PRIMARY KEY,
+                        pontos BLOB NOT NULL
+                    )
+                ''')
+                c.execute('''
+                    CREATE TABLE IF NOT EXISTS importacao_strava (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        antes_de INTEGER,
+                        recente_ate INTEGER,
+                        paginas INTEGER NOT NULL DEFAULT 0,
+                        atividades INTEGER NOT NULL DEFAULT 0,
+                        concluida INTEGER NOT NULL DEFAULT 0,
+                        atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                # Snapshot do histórico das sessões ativas (restauração barata após reinício)
+                c.execute('''
+                    CREATE TABLE IF NOT EXISTS snapshots_sessao (
+                        chat_id TEXT PRIMARY KEY,
+                        historico TEXT NOT NULL,
+                        ultimo_id_conversa INTEGER NOT NULL,
+                        data_atualizacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                # Checkpoint das mensagens proativas (retoma o envio após uma queda)
+                c.execute('''
+                    CREATE TABLE IF NOT EXISTS execucoes_proativas (
+                        execucao TEXT PRIMARY KEY,
+                        concluida INTEGER DEFAULT 0,
+                        data_inicio TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                c.execute('''
+                    CREATE TABLE IF NOT EXISTS envios_proativos (
+                        execucao TEXT NOT NULL,
+                        chat_id TEXT NOT NULL,
+                        data_envio TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (execucao, chat_id)
+                    )
+                ''')
+                # Mensagens proativas geradas antes do horário de entrega
+                c.execute('''
+                    CREATE TABLE IF NOT EXISTS mensagens_pregeradas (
+                        execucao TEXT NOT NULL,
+                        chat_id TEXT NOT NULL,
+                        texto TEXT NOT NULL,
+                        impressao TEXT NOT NULL,
+                        data_geracao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (execucao, chat_id)
+                    )
+                ''')
                 # Índices para performance em queries frequentes
                 c.execute('CREATE INDEX IF NOT EXISTS idx_conversas_chat_id ON conversas(chat_id)')
                 c.execute('CREATE INDEX IF NOT EXISTS idx_conversas_chat_role ON conversas(chat_id, role)')
+                c.execute('CREATE INDEX IF NOT EXISTS idx_uso_tokens_comando ON uso_tokens(comando)')
                 conn.commit()
         except sqlite3.Error as e:
             logger.critical(f"Erro fatal ao inicializar o banco SQLite: {e}")
@@ -138,6 +272,58 @@ def guardar_memoria(chat_id: str, role: str, text: str) -> None:
             logger.error(f"Erro ao guardar memória no SQLite: {e}")
 
 
+def registrar_uso_tokens(chat_id: str, comando: str, contagem: dict[str, int], tokens_resposta: int = 0,
+                         pixels_midia: int = 0) -> None:
+    """Registra o consumo de tokens de uma mensagem enviada ao Gemini (e os pixels da foto, se houver)."""
+    chat_id = str(chat_id)
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                c = conn.cursor()
+                c.execute('''
+                    INSERT INTO uso_tokens (
+                        chat_id, comando, tokens_sistema, tokens_historico,
+                        tokens_dados, tokens_usuario, tokens_entrada, tokens_resposta, pixels_midia
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    chat_id, comando,
+                    contagem.get('sistema', 0), contagem.get('historico', 0),
+                    contagem.get('dados', 0), contagem.get('usuario', 0),
+                    contagem.get('total', 0), tokens_resposta, pixels_midia
+                ))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao registrar uso de tokens: {e}")
+
+
+def obter_uso_tokens_por_comando() -> list[dict]:
+    """Retorna a média e o total de tokens por comando, do mais caro para o mais barato."""
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                c = conn.cursor()
+                c.execute('''
+                    SELECT comando, COUNT(*), AVG(tokens_entrada), AVG(tokens_resposta),
+                           SUM(tokens_entrada + tokens_resposta)
+                    FROM uso_tokens
+                    GROUP BY comando
+                    ORDER BY AVG(tokens_entrada + tokens_resposta) DESC
+                ''')
+                return [
+                    {
+                        'comando': row[0],
+                        'mensagens': row[1],
+                        'media_entrada': row[2] or 0,
+                        'media_resposta': row[3] or 0,
+                        'total': row[4] or 0
+                    }
+                    for row in c.fetchall()
+                ]
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao obter uso de tokens: {e}")
+            return []
+
+
 # ==========================================
 # FUNÇÕES MULTI-USUÁRIO
 # ==========================================
@@ -176,6 +362,272 @@ def obter_todos_chat_ids() -> list[str]:
             return []
 
 
+def obter_horarios_conversa(dias: int = 28, minimo_dias: int = 2) -> dict[str, set[tuple[int, int]]]:
+    """
+    Horários em que cada usuário costuma falar com o bot: {chat_id: {(dia_semana, hora)}}
+    (dia_semana 0 = segunda, hora local), considerando só os que se repetiram em pelo menos
+    `minimo_dias` dias diferentes nos últimos `dias` dias.
+    """
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                c = conn.cursor()
+                c.execute('''
+                    SELECT chat_id,
+                           CAST(strftime('%w', data_criacao, 'localtime') AS INTEGER),
+                           CAST(strftime('%H', data_criacao, 'localtime') AS INTEGER),
+                           COUNT(DISTINCT date(data_criacao, 'localtime')) AS dias
+                    FROM conversas
+                    WHERE role = 'user' AND data_criacao >= datetime('now', ?)
+                    GROUP BY 1, 2, 3
+                    HAVING dias >= ?
+                ''', (f'-{dias} days', minimo_dias))
+                horarios: dict[str, set[tuple[int, int]]] = {}
+                for chat_id, dia_sqlite, hora, _ in c.fetchall():
+                    # No SQLite o domingo é 0; no Python a segunda é 0
+                    horarios.setdefault(chat_id, set()).add(((dia_sqlite + 6) % 7, hora))
+                return horarios
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao obter horários de conversa: {e}")
+            return {}
+
+
+def carregar_tokens_strava() -> Optional[dict]:
+    """Tokens do Strava guardados no banco ({'access_token', 'refresh_token', 'expires_at'}), se houver."""
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                c = conn.cursor()
+                c.execute('SELECT access_token, refresh_token, expires_at FROM tokens_strava WHERE id = 1')
+                row = c.fetchone()
+                if row is None:
+                    return None
+                return {'access_token': row[0], 'refresh_token': row[1], 'expires_at': row[2]}
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao carregar tokens do Strava: {e}")
+            return None
+
+
+def salvar_tokens_strava(tokens: dict) -> None:
+    """Grava os tokens do Strava renovados (substitui os anteriores)."""
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                c = conn.cursor()
+                c.execute('''
+                    INSERT OR REPLACE INTO tokens_strava (id, access_token, refresh_token, expires_at, atualizado_em)
+                    VALUES (1, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (tokens['access_token'], tokens['refresh_token'], int(tokens['expires_at'])))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao salvar tokens do Strava: {e}")
+
+
+def _recalcular_estatisticas_diarias(c: sqlite3.Cursor, datas: set[str]) -> None:
+    """Refaz as linhas de `estatisticas_diarias` dos dias informados (YYYY-MM-DD)."""
+    datas_lista = sorted(datas)
+    for i in range(0, len(datas_lista), 500):
+        lote = datas_lista[i:i + 500]
+        marcadores = ','.join('?' * len(lote))
+        c.execute(f'DELETE FROM estatisticas_diarias WHERE data IN ({marcadores})', lote)
+        c.execute(f'''
+            INSERT INTO estatisticas_diarias (data, tipo, km, elevacao_m, tempo_movimento_s, atividades)
+            SELECT substr(data_local, 1, 10), tipo, SUM(distancia_m) / 1000.0, SUM(elevacao_m),
+                   SUM(tempo_movimento_s), COUNT(*)
+            FROM atividades_strava
+            WHERE substr(data_local, 1, 10) IN ({marcadores})
+            GROUP BY substr(data_local, 1, 10), tipo
+        ''', lote)
+
+
+# Campos de `atividades_strava` comparados para saber se um registro sincronizado mudou
+_COLUNAS_ATIVIDADE: tuple[str, ...] = (
+    'inicio', 'data_local', 'tipo', 'nome', 'distancia_m', 'elevacao_m', 'tempo_movimento_s', 'polyline'
+)
+
+
+def _gravar_atividades(c: sqlite3.Cursor, registros: list[dict], desde: Optional[int] = None) -> None:
+    """
+    Grava as atividades e atualiza os agregados dos dias afetados. Com `desde`, os registros
+    são tudo o que o Strava tem depois desse instante: as que sumiram foram apagadas lá.
+    Registros iguais aos gravados são ignorados (a sincronização repete a última semana).
+    """
+    ids = [r['id'] for r in registros]
+    gravadas: dict[int, dict] = {}
+    for i in range(0, len(ids), 500):
+        lote = ids[i:i + 500]
+        c.execute(f"SELECT id, {', '.join(_COLUNAS_ATIVIDADE)} FROM atividades_strava "
+                  f"WHERE id IN ({','.join('?' * len(lote))})", lote)
+        gravadas.update((row[0], dict(zip(_COLUNAS_ATIVIDADE, row[1:]))) for row in c.fetchall())
+    registros = [r for r in registros
+                 if gravadas.get(r['id']) != {coluna: r[coluna] for coluna in _COLUNAS_ATIVIDADE}]
+    datas = {r['data_local'][:10] for r in registros}
+    # Dias antigos das atividades regravadas (a data de início pode ter sido editada)
+    datas.update(gravadas[r['id']]['data_local'][:10] for r in registros if r['id'] in gravadas)
+    if desde is not None:
+        c.execute('SELECT id, substr(data_local, 1, 10) FROM atividades_strava WHERE inicio > ?', (desde,))
+        presentes = set(ids)
+        apagadas = [(id_, data) for id_, data in c.fetchall() if id_ not in presentes]
+        c.executemany('DELETE FROM atividades_strava WHERE id = ?', [(id_,) for id_, _ in apagadas])
+        c.executemany('DELETE FROM trajetos_strava WHERE id = ?', [(id_,) for id_, _ in apagadas])
+        datas.update(data for _, data in apagadas)
+    # Traçado que mudou no Strava é decodificado de novo quando o mapa pedir
+    c.executemany('DELETE FROM trajetos_strava WHERE id = ?',
+                  [(r['id'],) for r in registros if r['id'] in gravadas and gravadas[r['id']]['polyline'] != r['polyline']])
+    if registros:
+        c.executemany('''
+            INSERT OR REPLACE INTO atividades_strava
+                (id, inicio, data_local, tipo, nome, distancia_m, elevacao_m, tempo_movimento_s, polyline)
+            VALUES (:id, :inicio, :data_local, :tipo, :nome, :distancia_m, :elevacao_m, :tempo_movimento_s, :polyline)
+        ''', registros)
+    if datas:
+        _recalcular_estatisticas_diarias(c, datas)
+
+
+def gravar_atividades_strava(registros: list[dict], desde: Optional[int] = None) -> None:
+    """Grava atividades recentes do Strava (ver `_gravar_atividades`)."""
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                _gravar_atividades(conn.cursor(), registros, desde)
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao gravar atividades do Strava: {e}")
+            raise
+
+
+def ultima_atividade_strava() -> Optional[int]:
+    """Início (epoch UTC) da atividade mais recente gravada, se houver alguma."""
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                row = conn.execute('SELECT MAX(inicio) FROM atividades_strava').fetchone()
+                return row[0] if row else None
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao consultar a última atividade do Strava: {e}")
+            return None
+
+
+def somar_estatisticas_diarias(inicio: str, fim: str, tipos: list[str]) -> dict[str, float]:
+    """Totais de km, elevação, tempo em movimento e atividades entre duas datas (YYYY-MM-DD, inclusivas)."""
+    marcadores = ','.join('?' * len(tipos))
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                row = conn.execute(f'''
+                    SELECT COALESCE(SUM(km), 0), COALESCE(SUM(elevacao_m), 0),
+                           COALESCE(SUM(tempo_movimento_s), 0), COALESCE(SUM(atividades), 0)
+                    FROM estatisticas_diarias
+                    WHERE data BETWEEN ? AND ? AND tipo IN ({marcadores})
+                ''', (inicio, fim, *tipos)).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao somar estatísticas diárias: {e}")
+            raise
+    return {'km': row[0], 'elevacao_m': row[1], 'tempo_movimento_s': row[2], 'atividades': row[3]}
+
+
+def km_por_dia_estatisticas(inicio: str, fim: str, tipos: list[str]) -> dict[str, float]:
+    """Km por dia (YYYY-MM-DD) entre duas datas inclusivas; dias sem atividade ficam de fora."""
+    marcadores = ','.join('?' * len(tipos))
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                linhas = conn.execute(f'''
+                    SELECT data, SUM(km) FROM estatisticas_diarias
+                    WHERE data BETWEEN ? AND ? AND tipo IN ({marcadores})
+                    GROUP BY data ORDER BY data
+                ''', (inicio, fim, *tipos)).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao consultar km por dia: {e}")
+            raise
+    return {data: km for data, km in linhas}
+
+
+def listar_polylines_mes(mes: str, tipos: list[str]) -> list[tuple[int, str]]:
+    """(id, polyline) das atividades do mês ('YYYY-MM') que têm traçado."""
+    marcadores = ','.join('?' * len(tipos))
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                return conn.execute(f'''
+                    SELECT id, polyline FROM atividades_strava
+                    WHERE substr(data_local, 1, 7) = ? AND tipo IN ({marcadores})
+                      AND polyline IS NOT NULL AND polyline != ''
+                    ORDER BY inicio
+                ''', (mes, *tipos)).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao listar traçados do mês {mes}: {e}")
+            raise
+
+
+def carregar_trajetos(ids: list[int]) -> dict[int, bytes]:
+    """Traçados já decodificados das atividades informadas (as que não têm ficam de fora)."""
+    trajetos: dict[int, bytes] = {}
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                for i in range(0, len(ids), 500):
+                    lote = ids[i:i + 500]
+                    linhas = conn.execute(
+                        f"SELECT id, pontos FROM trajetos_strava WHERE id IN ({','.join('?' * len(lote))})", lote
+                    ).fetchall()
+                    trajetos.update((id_, bytes(pontos)) for id_, pontos in linhas)
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao carregar traçados: {e}")
+    return trajetos
+
+
+def salvar_trajetos(trajetos: dict[int, bytes]) -> None:
+    """Grava traçados decodificados ({id da atividade: pontos})."""
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                conn.executemany('INSERT OR REPLACE INTO trajetos_strava (id, pontos) VALUES (?, ?)',
+                                 [(id_, sqlite3.Binary(pontos)) for id_, pontos in trajetos.items()])
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao salvar traçados: {e}")
+
+
+def gravar_pagina_importacao(registros: list[dict], checkpoint: dict) -> None:
+    """Grava uma página de atividades e o checkpoint da importação na mesma transação."""
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                c = conn.cursor()
+                _gravar_atividades(c, registros)
+                c.execute('''
+                    INSERT OR REPLACE INTO importacao_strava
+                        (id, antes_de, recente_ate, paginas, atividades, concluida, atualizado_em)
+                    VALUES (1, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (checkpoint['antes_de'], checkpoint['recente_ate'], checkpoint['paginas'],
+                      checkpoint['atividades'], int(checkpoint['concluida'])))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao gravar página da importação do Strava: {e}")
+            raise
+
+
+def carregar_checkpoint_importacao() -> Optional[dict]:
+    """Checkpoint da importação do histórico do Strava, se ela já começou."""
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                c = conn.cursor()
+                c.execute('''
+                    SELECT antes_de, recente_ate, paginas, atividades, concluida
+                    FROM importacao_strava WHERE id = 1
+                ''')
+                row = c.fetchone()
+                if row is None:
+                    return None
+                return {'antes_de': row[0], 'recente_ate': row[1], 'paginas': row[2],
+                        'atividades': row[3], 'concluida': bool(row[4])}
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao carregar checkpoint da importação do Strava: {e}")
+            return None
+
+
 def obter_meta_usuario(chat_id: str, meta_padrao: float) -> float:
     """Retorna a meta mensal personalizada do usuário ou a padrão."""
     chat_id = str(chat_id)
@@ -257,6 +709,103 @@ def obter_ranking_usuarios() -> str:
     return "🏆 Ranking Mensal da Equipe:\n" + "\n".join(linhas)
 
 
+# ==========================================
+# CHECKPOINT DAS MENSAGENS PROATIVAS
+# ==========================================
+def iniciar_execucao_proativa(execucao: str) -> None:
+    """Marca o início de um envio proativo (mantém o estado se ele já existir)."""
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                conn.execute('INSERT OR IGNORE INTO execucoes_proativas (execucao) VALUES (?)', (execucao,))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao iniciar execução proativa: {e}")
+
+
+def concluir_execucao_proativa(execucao: str) -> None:
+    """Marca o envio proativo como concluído."""
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                conn.execute('UPDATE execucoes_proativas SET concluida = 1 WHERE execucao = ?', (execucao,))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao concluir execução proativa: {e}")
+
+
+def execucao_proativa_pendente(execucao: str) -> bool:
+    """True se a execução começou e não terminou (o bot caiu no meio do envio)."""
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                c = conn.cursor()
+                c.execute('SELECT concluida FROM execucoes_proativas WHERE execucao = ?', (execucao,))
+                row = c.fetchone()
+                return row is not None and not row[0]
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao verificar execução proativa: {e}")
+            return False
+
+
+def marcar_envio_proativo(execucao: str, chat_id: str) -> None:
+    """Registra que o usuário já recebeu a mensagem desta execução."""
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                conn.execute(
+                    'INSERT OR IGNORE INTO envios_proativos (execucao, chat_id) VALUES (?, ?)',
+                    (execucao, str(chat_id))
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao marcar envio proativo: {e}")
+
+
+def obter_envios_proativos(execucao: str) -> set[str]:
+    """Retorna os chat IDs que já receberam a mensagem desta execução."""
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                c = conn.cursor()
+                c.execute('SELECT chat_id FROM envios_proativos WHERE execucao = ?', (execucao,))
+                return {row[0] for row in c.fetchall()}
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao obter envios proativos: {e}")
+            return set()
+
+
+def salvar_mensagem_pregerada(execucao: str, chat_id: str, texto: str, impressao: str) -> None:
+    """Guarda uma mensagem gerada antecipadamente junto com a impressão digital dos dados usados."""
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO mensagens_pregeradas (execucao, chat_id, texto, impressao)
+                    VALUES (?, ?, ?, ?)
+                ''', (execucao, str(chat_id), texto, impressao))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao salvar mensagem pré-gerada: {e}")
+
+
+def obter_mensagem_pregerada(execucao: str, chat_id: str) -> Optional[dict]:
+    """Retorna {'texto', 'impressao'} da mensagem pré-gerada, ou None."""
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                c = conn.cursor()
+                c.execute(
+                    'SELECT texto, impressao FROM mensagens_pregeradas WHERE execucao = ? AND chat_id = ?',
+                    (execucao, str(chat_id))
+                )
+                row = c.fetchone()
+                return {'texto': row[0], 'impressao': row[1]} if row else None
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao obter mensagem pré-gerada: {e}")
+            return None
+
+
 # ==========================================
 # CÉREBRO DA IA E GERENCIAMENTO DE SESSÕES
 # ==========================================
@@ -272,73 +821,429 @@ USE esses dados para responder ao atleta. Nunca diga que não tem acesso aos dad
 """
 
 client_ai = genai.Client(api_key=GOOGLE_API_KEY)
+MODELO_GEMINI: str = 'gemini-2.5-flash'
+
+# Todas as chamadas ao Gemini passam pelo despachante (concorrência, prioridade e cota)
+despachante_ia = DespachanteIA(max_concorrencia=MAX_CHAMADAS_GEMINI)
+
+# Cache explícito da instrução de sistema + prefixo estável do histórico de cada chat
+cache_contexto = GerenciadorCacheContexto(client_ai, MODELO_GEMINI, CACHE_CONTEXTO_TTL, armazem=armazem_padrao)
+
+def _ultimo_id_conversa(c: sqlite3.Cursor, chat_id: str) -> int:
+    c.execute('SELECT COALESCE(MAX(id), 0) FROM conversas WHERE chat_id = ?', (chat_id,))
+    return c.fetchone()[0]
+
+
+def salvar_snapshot_sessao(chat_id: str, historico: list[types.Content]) -> None:
+    """Salva o histórico (só texto) de uma sessão que saiu do pool ou no encerramento."""
+    chat_id = str(chat_id)
+    dados = [
+        {'role': conteudo.role, 'text': "".join(p.text for p in conteudo.parts or [] if p.text)}
+        for conteudo in historico
+    ]
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                c = conn.cursor()
+                c.execute('''
+                    INSERT OR REPLACE INTO snapshots_sessao (chat_id, historico, ultimo_id_conversa, data_atualizacao)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (chat_id, json.dumps(dados, ensure_ascii=False), _ultimo_id_conversa(c, chat_id)))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao salvar snapshot da sessão: {e}")
+
+
+def carregar_snapshot_sessao(chat_id: str) -> Optional[list[types.Content]]:
+    """
+    Restaura o histórico salvo da sessão. Retorna None se não houver snapshot
+    ou se ele estiver desatualizado (novas mensagens gravadas depois dele).
+    """
+    chat_id = str(chat_id)
+    with _memory_lock:
+        try:
+            with get_db_connection() as conn:
+                c = conn.cursor()
+                c.execute('SELECT historico, ultimo_id_conversa FROM snapshots_sessao WHERE chat_id = ?', (chat_id,))
+                row = c.fetchone()
+                if not row or row[1] != _ultimo_id_conversa(c, chat_id):
+                    return None
+                dados = json.loads(row[0])
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"Erro ao carregar snapshot da sessão: {e}")
+            return None
+
+    logger.info(f"Sessão restaurada do snapshot: {len(dados)} interações para o chat {chat_id}.")
+    return [
+        types.Content(role=msg['role'], parts=[types.Part.from_text(text=msg['text'])])
+        for msg in dados
+    ]
+
 
-# Sessões de chat com expiração por inatividade (TTL de 30 minutos)
-_active_sessions: TTLCache = TTLCache(maxsize=100, ttl=1800)
-_session_lock = threading.Lock()
+def _carregar_historico_sessao(chat_id: str) -> list[types.Content]:
+    snapshot = carregar_snapshot_sessao(chat_id)
+    return snapshot if snapshot is not None else carregar_memoria(chat_id)
+
+
+def _criar_sessao(chat_id: str, historico: list[types.Content]):
+    """
+    Cria a sessão do Gemini; o prefixo que foi para o cache de contexto é devolvido à parte,
+    junto com o modelo e a config da sessão (o runtime assíncrono monta a sua visão com eles).
+    """
+    config, recentes = cache_contexto.preparar_sessao(chat_id, instrucoes_coach, historico)
+    session = client_ai.chats.create(
+        model=MODELO_GEMINI,
+        config=config,
+        history=recentes
+    )
+    return session, historico[:len(historico) - len(recentes)], {'model': MODELO_GEMINI, 'config': config}
+
+
+# Sessões de chat limitadas em quantidade e memória, com expiração por inatividade (30 minutos);
+# uma sessão que aponta para um cache de contexto é recriada antes de ele vencer no servidor
+_active_sessions = PoolSessoes(
+    carregador=_carregar_historico_sessao,
+    fabrica=_criar_sessao,
+    persistir=salvar_snapshot_sessao,
+    validade=cache_contexto.expira_em,
+    max_sessoes=MAX_SESSOES,
+    max_itens_sessao=MAX_ITENS_SESSAO,
+    max_bytes=int(MAX_MEMORIA_SESSOES_MB * 1024 * 1024),
+    ttl_segundos=1800
+)
 
 
 def get_chat_session(chat_id: str):
     """Retorna uma sessão do Gemini inicializada com a memória específica do usuário."""
+    return _active_sessions.obter(str(chat_id))
+
+
+def vagas_sessoes() -> int:
+    """Sessões que ainda cabem no pool sem despejar as ativas (usado no pré-aquecimento)."""
+    return _active_sessions.vagas
+
+
+def salvar_sessoes_ativas() -> None:
+    """Grava o snapshot de todas as sessões ativas (chamado no encerramento)."""
+    _active_sessions.salvar_todas()
+
+
+def _registrar_uso_resposta(chat_id: str, comando: str, contagem: dict[str, int],
+                            uso, texto_resposta: str, pixels_midia: int = 0) -> None:
+    """Registra o uso de tokens, preferindo a contagem real (`usage_metadata`) devolvida pela API."""
+    if 'total' not in contagem:
+        contagem['total'] = sum(contagem.values())
+    if isinstance(getattr(uso, 'prompt_token_count', None), int):
+        contagem['total'] = uso.prompt_token_count
+    tokens_resposta = getattr(uso, 'candidates_token_count', None)
+    if not isinstance(tokens_resposta, int):
+        tokens_resposta = estimar_tokens(texto_resposta)
+    registrar_uso_tokens(chat_id, comando, contagem, tokens_resposta, pixels_midia)
+
+
+def _preparar_envio(chat_id: str, prompt: str, dados_extras: Optional[list[str]],
+                    texto_memoria: Optional[str]):
+    """Aplica o orçamento de tokens e guarda a mensagem do usuário na memória."""
+    session = get_chat_session(chat_id)
+    historico = session.get_history(curated=True)
+    # Dados que o modelo já viu nesta sessão viram referência; só o que mudou vai inteiro
+    itens_antes = len(historico)
+    dados = referenciar_dados_repetidos(dados_extras or [], historico)
+    prompt_final, contagem = aplicar_orcamento(prompt, dados, historico, instrucoes_coach)
+    if dados != (dados_extras or []) and len(historico) < itens_antes:
+        # O orçamento cortou turnos antigos: o bloco referenciado pode ter saído junto
+        dados = referenciar_dados_repetidos(dados_extras or [], historico)
+        prompt_final, contagem = aplicar_orcamento(prompt, dados, historico, instrucoes_coach)
+    guardar_memoria(chat_id, "user", texto_memoria if texto_memoria is not None else prompt)
+    return session, prompt_final, contagem
+
+
+def _concluir_envio(chat_id: str, comando: str, contagem: dict[str, int], uso, texto: str) -> None:
+    """Guarda a resposta na memória, ajusta a sessão no pool e registra o uso de tokens."""
+    guardar_memoria(chat_id, "model", texto)
+    _active_sessions.atualizar(chat_id)
+    _registrar_uso_resposta(chat_id, comando, contagem, uso, texto)
+
+
+def enviar_mensagem_ia(chat_id: str, prompt: str, comando: str,
+                       dados_extras: Optional[list[str]] = None,
+                       texto_memoria: Optional[str] = None,
+                       prioridade: int = PRIORIDADE_INTERATIVA) -> str:
+    """
+    Envia um prompt para a sessão do usuário respeitando o orçamento de tokens,
+    guarda a troca na memória e registra o consumo de tokens do comando.
+    `texto_memoria` é o que fica salvo como mensagem do usuário (padrão: o prompt).
+    """
     chat_id = str(chat_id)
-    with _session_lock:
-        if chat_id not in _active_sessions:
-            historico = carregar_memoria(chat_id)
-            session = client_ai.chats.create(
-                model='gemini-2.5-flash',
-                config=types.GenerateContentConfig(system_instruction=instrucoes_coach),
-                history=historico
-            )
-            _active_sessions[chat_id] = session
-        return _active_sessions[chat_id]
-
-
-def processar_mensagem_audio(chat_id: str, caminho_audio: str, prompt_adicional: str = "Diga o que você entendeu do áudio e responda como o Coach.") -> str:
-    """Faz o upload de um arquivo de áudio para o Gemini e processa a resposta."""
-    try:
-        chat_id = str(chat_id)
-        session = get_chat_session(chat_id)
+    session, prompt_final, contagem = _preparar_envio(chat_id, prompt, dados_extras, texto_memoria)
+
+    resposta = despachante_ia.executar(session.send_message, prompt_final, prioridade=prioridade, rotulo=comando)
+    _concluir_envio(chat_id, comando, contagem, resposta.usage_metadata, resposta.text)
+    return resposta.text
 
-        logger.info(f"Fazendo upload do áudio para o Gemini: {caminho_audio} (Chat ID: {chat_id})")
-        arquivo_gemini = client_ai.files.upload(file=caminho_audio)
 
-        conteudo = [arquivo_gemini]
-        if prompt_adicional:
-            conteudo.append(prompt_adicional)
+def enviar_mensagem_ia_stream(chat_id: str, prompt: str, comando: str,
+                              dados_extras: Optional[list[str]] = None,
+                              texto_memoria: Optional[str] = None,
+                              prioridade: int = PRIORIDADE_INTERATIVA) -> Iterator[str]:
+    """
+    Versão em streaming de `enviar_mensagem_ia`: devolve os pedaços de texto
+    conforme o Gemini os gera. A resposta completa só é guardada na memória
+    (e o uso de tokens registrado) quando o stream termina.
+    """
+    chat_id = str(chat_id)
+    session, prompt_final, contagem = _preparar_envio(chat_id, prompt, dados_extras, texto_memoria)
 
-        logger.info(f"Enviando áudio para a sessão de chat (ID: {chat_id})...")
-        resposta = session.send_message(conteudo)
+    partes: list[str] = []
+    uso = None
+    for chunk in despachante_ia.executar_stream(session.send_message_stream, prompt_final,
+                                                prioridade=prioridade, rotulo=comando):
+        if chunk.usage_metadata is not None:
+            uso = chunk.usage_metadata
+        if chunk.text:
+            partes.append(chunk.text)
+            yield chunk.text
 
-        # Como o banco guarda strings, salvamos a instrução de envio para ter contexto na re-leitura
-        guardar_memoria(chat_id, "user", f"[VOICE MESSAGE SENT] {prompt_adicional}")
-        guardar_memoria(chat_id, "model", resposta.text)
+    _concluir_envio(chat_id, comando, contagem, uso, "".join(partes))
+
+
+def gerar_mensagem_avulsa(chat_id: str, prompt: str, comando: str,
+                          prioridade: int = PRIORIDADE_SEGUNDO_PLANO) -> str:
+    """
+    Gera uma resposta com o contexto da conversa do usuário, mas sem gravá-la
+    na sessão nem na memória (usado para pré-gerar mensagens proativas).
+    A troca só entra no histórico ao ser entregue, via `registrar_mensagem_entregue`.
+    """
+    chat_id = str(chat_id)
+    historico = _active_sessions.historico_completo(chat_id)
+    prompt_final, contagem = aplicar_orcamento(prompt, [], historico, instrucoes_coach)
+    conteudos = historico + [types.Content(role='user', parts=[types.Part.from_text(text=prompt_final)])]
+
+    resposta = despachante_ia.executar(
+        client_ai.models.generate_content,
+        model=MODELO_GEMINI,
+        contents=conteudos,
+        config=types.GenerateContentConfig(system_instruction=instrucoes_coach),
+        prioridade=prioridade,
+        rotulo=comando
+    )
+    _registrar_uso_resposta(chat_id, comando, contagem, resposta.usage_metadata, resposta.text)
+    return resposta.text
+
+
+def registrar_mensagem_entregue(chat_id: str, texto_memoria: str, texto: str) -> None:
+    """Grava na memória (e na sessão ativa, se houver) uma mensagem gerada fora da sessão."""
+    chat_id = str(chat_id)
+    guardar_memoria(chat_id, "user", texto_memoria)
+    guardar_memoria(chat_id, "model", texto)
+    _active_sessions.anexar(chat_id, [
+        types.Content(role='user', parts=[types.Part.from_text(text=texto_memoria)]),
+        types.Content(role='model', parts=[types.Part.from_text(text=texto)])
+    ])
+
+
+# ==========================================
+# MÍDIA (áudio e foto, sem arquivos temporários)
+# ==========================================
+def _enviar_midia(arquivo, mime_type: str) -> types.File:
+    return despachante_ia.executar(client_ai.files.upload, file=arquivo,
+                                   config={'mime_type': mime_type}, rotulo='upload')
+
+
+async def _enviar_midia_async(arquivo, mime_type: str) -> types.File:
+    return await despachante_ia.executar_async(client_ai.aio.files.upload, file=arquivo,
+                                               config={'mime_type': mime_type}, rotulo='upload')
+
+
+# file_unique_id do Telegram -> arquivo no Gemini (mídia repetida ou encaminhada não sobe de novo)
+cache_midia = CacheMidiaGemini(
+    enviar=_enviar_midia,
+    apagar=lambda nome: client_ai.files.delete(name=nome),
+    enviar_async=_enviar_midia_async,
+    limite_inline=LIMITE_MIDIA_INLINE_KB * 1024,
+    retencao_segundos=RETENCAO_MIDIA_HORAS * 3600
+)
+
+
+def expirar_midias() -> int:
+    """Apaga do Gemini as mídias antigas que nenhuma sessão ativa ainda referencia (tarefa agendada)."""
+    em_uso = {
+        parte.file_data.file_uri
+        for historico in _active_sessions.historicos()
+        for conteudo in historico
+        for parte in conteudo.parts or []
+        if parte.file_data is not None
+    }
+    return cache_midia.expirar(em_uso)
 
-        return resposta.text
+
+def _processar_midia(chat_id: str, parte: types.Part, rotulo: str,
+                     marcador: str, prompt_adicional: str, pixels_midia: int = 0) -> str:
+    """Envia a mídia (já como parte da mensagem) na sessão do chat e grava a troca."""
+    session = get_chat_session(chat_id)
+
+    conteudo: list = [parte]
+    if prompt_adicional:
+        conteudo.append(prompt_adicional)
+
+    logger.info(f"Enviando {rotulo} para a sessão de chat (ID: {chat_id})...")
+    resposta = despachante_ia.executar(session.send_message, conteudo, rotulo=rotulo)
+    _registrar_uso_resposta(chat_id, rotulo, {
+        'sistema': estimar_tokens(instrucoes_coach),
+        'historico': tokens_historico(session.get_history(curated=True)),
+        'usuario': estimar_tokens(prompt_adicional)
+    }, resposta.usage_metadata, resposta.text, pixels_midia)
+
+    # Como o banco guarda strings, salvamos a instrução de envio para ter contexto na re-leitura
+    guardar_memoria(chat_id, "user", f"{marcador} {prompt_adicional}")
+    guardar_memoria(chat_id, "model", resposta.text)
+    _active_sessions.atualizar(chat_id)
+
+    return resposta.text
+
+
+def processar_mensagem_audio(chat_id: str, audio: bytes, prompt_adicional: str = "Diga o que você entendeu do áudio e responda como o Coach.",
+                             chave_midia: Optional[str] = None, mime_type: str = 'audio/ogg') -> str:
+    """Envia um áudio (bytes baixados do Telegram) ao Gemini e processa a resposta."""
+    try:
+        chat_id = str(chat_id)
+        parte = cache_midia.parte(audio, mime_type, chave_midia)
+        return _processar_midia(chat_id, parte, 'audio', "[VOICE MESSAGE SENT]", prompt_adicional)
     except Exception as e:
         logger.error(f"Erro ao processar áudio no Gemini (Chat ID: {chat_id}): {e}")
         return "Desculpe, tive um problema nos meus ouvidos digitais e não consegui processar o áudio. Pode escrever?"
 
 
-def processar_mensagem_foto(chat_id: str, caminho_foto: str, prompt_adicional: str = "O atleta enviou esta foto. Analise a imagem e responda como o Coach.") -> str:
-    """Faz o upload de uma foto para o Gemini e processa a resposta com análise visual."""
+def processar_mensagem_foto(chat_id: str, foto: bytes, prompt_adicional: str = "O atleta enviou esta foto. Analise a imagem e responda como o Coach.",
+                            chave_midia: Optional[str] = None, mime_type: str = 'image/jpeg',
+                            pixels: int = 0) -> str:
+    """
+    Envia uma foto (bytes baixados do Telegram) ao Gemini e processa a resposta com análise visual.
+    `pixels` é a resolução efetivamente enviada, registrada junto com o uso de tokens.
+    """
     try:
         chat_id = str(chat_id)
-        session = get_chat_session(chat_id)
+        parte = cache_midia.parte(foto, mime_type, chave_midia)
+        return _processar_midia(chat_id, parte, 'foto', "[PHOTO SENT]", prompt_adicional, pixels)
+    except Exception as e:
+        logger.error(f"Erro ao processar foto no Gemini (Chat ID: {chat_id}): {e}")
+        return "Desculpe, não consegui analisar a foto. Pode enviar novamente ou descrever por texto?"
+
+
+# ==========================================
+# VERSÕES ASSÍNCRONAS (runtime asyncio)
+# ==========================================
+# A espera pelo Gemini usa `client_ai.aio` e não ocupa thread; SQLite, pool e
+# cache de contexto (rápidos, mas bloqueantes) rodam em `asyncio.to_thread`.
+def _sessao_async(chat_id: str, session) -> AsyncChat:
+    """
+    Visão assíncrona de uma sessão do pool, criada pela API pública do SDK com o modelo e a
+    config guardados no pool e uma cópia do histórico curado. Depois do envio, `_devolver_turno`
+    copia o turno novo para a sessão, então o pool (janela, memória, snapshot) vale para os dois runtimes.
+    """
+    return client_ai.aio.chats.create(**_active_sessions.parametros(chat_id),
+                                      history=list(session.get_history(curated=True)))
+
+
+def _devolver_turno(session, visao: AsyncChat) -> None:
+    """Acrescenta à sessão do pool o que a visão assíncrona registrou além do histórico que recebeu."""
+    # Um envio por chat de cada vez: a sessão não mudou enquanto a visão conversava
+    inicio = len(session.get_history(curated=True))
+    for curado in (True, False):
+        session.get_history(curated=curado).extend(visao.get_history(curated=curado)[inicio:])
+
 
-        logger.info(f"Fazendo upload da foto para o Gemini: {caminho_foto} (Chat ID: {chat_id})")
-        arquivo_gemini = client_ai.files.upload(file=caminho_foto)
+async def enviar_mensagem_ia_async(chat_id: str, prompt: str, comando: str,
+                                   dados_extras: Optional[list[str]] = None,
+                                   texto_memoria: Optional[str] = None,
+                                   prioridade: int = PRIORIDADE_INTERATIVA) -> str:
+    """Versão assíncrona de `enviar_mensagem_ia`."""
+    chat_id = str(chat_id)
+    session, prompt_final, contagem = await asyncio.to_thread(
+        _preparar_envio, chat_id, prompt, dados_extras, texto_memoria
+    )
+    visao = _sessao_async(chat_id, session)
+    resposta = await despachante_ia.executar_async(
+        visao.send_message, prompt_final, prioridade=prioridade, rotulo=comando
+    )
+    _devolver_turno(session, visao)
+    await asyncio.to_thread(_concluir_envio, chat_id, comando, contagem, resposta.usage_metadata, resposta.text)
+    return resposta.text
+
+
+async def enviar_mensagem_ia_stream_async(chat_id: str, prompt: str, comando: str,
+                                          dados_extras: Optional[list[str]] = None,
+                                          texto_memoria: Optional[str] = None,
+                                          prioridade: int = PRIORIDADE_INTERATIVA) -> AsyncIterator[str]:
+    """Versão assíncrona de `enviar_mensagem_ia_stream`."""
+    chat_id = str(chat_id)
+    session, prompt_final, contagem = await asyncio.to_thread(
+        _preparar_envio, chat_id, prompt, dados_extras, texto_memoria
+    )
+
+    visao = _sessao_async(chat_id, session)
+    partes: list[str] = []
+    uso = None
+    async for chunk in despachante_ia.executar_stream_async(visao.send_message_stream,
+                                                            prompt_final, prioridade=prioridade, rotulo=comando):
+        if chunk.usage_metadata is not None:
+            uso = chunk.usage_metadata
+        if chunk.text:
+            partes.append(chunk.text)
+            yield chunk.text
 
-        conteudo = [arquivo_gemini]
-        if prompt_adicional:
-            conteudo.append(prompt_adicional)
+    _devolver_turno(session, visao)
+    await asyncio.to_thread(_concluir_envio, chat_id, comando, contagem, uso, "".join(partes))
 
-        logger.info(f"Enviando foto para a sessão de chat (ID: {chat_id})...")
-        resposta = session.send_message(conteudo)
 
-        guardar_memoria(chat_id, "user", f"[PHOTO SENT] {prompt_adicional}")
+async def _processar_midia_async(chat_id: str, parte: types.Part, rotulo: str,
+                                 marcador: str, prompt_adicional: str, pixels_midia: int = 0) -> str:
+    """Resposta da sessão à mídia, como em `_processar_midia`."""
+    session = await asyncio.to_thread(get_chat_session, chat_id)
+
+    conteudo: list = [parte]
+    if prompt_adicional:
+        conteudo.append(prompt_adicional)
+
+    visao = _sessao_async(chat_id, session)
+    resposta = await despachante_ia.executar_async(visao.send_message, conteudo, rotulo=rotulo)
+    _devolver_turno(session, visao)
+    contagem = {
+        'sistema': estimar_tokens(instrucoes_coach),
+        'historico': tokens_historico(session.get_history(curated=True)),
+        'usuario': estimar_tokens(prompt_adicional)
+    }
+
+    def _gravar() -> None:
+        _registrar_uso_resposta(chat_id, rotulo, contagem, resposta.usage_metadata, resposta.text, pixels_midia)
+        guardar_memoria(chat_id, "user", f"{marcador} {prompt_adicional}")
         guardar_memoria(chat_id, "model", resposta.text)
+        _active_sessions.atualizar(chat_id)
+
+    await asyncio.to_thread(_gravar)
+    return resposta.text
+
 
-        return resposta.text
+async def processar_mensagem_audio_async(chat_id: str, audio: bytes, prompt_adicional: str = "Diga o que você entendeu do áudio e responda como o Coach.",
+                                         chave_midia: Optional[str] = None, mime_type: str = 'audio/ogg') -> str:
+    """Versão assíncrona de `processar_mensagem_audio`."""
+    chat_id = str(chat_id)
+    try:
+        parte = await cache_midia.parte_async(audio, mime_type, chave_midia)
+        return await _processar_midia_async(chat_id, parte, 'audio', "[VOICE MESSAGE SENT]", prompt_adicional)
+    except Exception as e:
+        logger.error(f"Erro ao processar áudio no Gemini (Chat ID: {chat_id}): {e}")
+        return "Desculpe, tive um problema nos meus ouvidos digitais e não consegui processar o áudio. Pode escrever?"
+
+
+async def processar_mensagem_foto_async(chat_id: str, foto: bytes, prompt_adicional: str = "O atleta enviou esta foto. Analise a imagem e responda como o Coach.",
+                                        chave_midia: Optional[str] = None, mime_type: str = 'image/jpeg',
+                                        pixels: int = 0) -> str:
+    """Versão assíncrona de `processar_mensagem_foto`."""
+    chat_id = str(chat_id)
+    try:
+        parte = await cache_midia.parte_async(foto, mime_type, chave_midia)
+        return await _processar_midia_async(chat_id, parte, 'foto', "[PHOTO SENT]", prompt_adicional, pixels)
     except Exception as e:
         logger.error(f"Erro ao processar foto no Gemini (Chat ID: {chat_id}): {e}")
         return "Desculpe, não consegui analisar a foto. Pode enviar novamente ou descrever por texto?"
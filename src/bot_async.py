@@ -0,0 +1,589 @@
+"""
+Runtime assíncrono (asyncio) do Coach-Strava.
+Mesmos comandos do bot_coach, mas com o AsyncTeleBot, o cliente assíncrono do Gemini
+(`client_ai.aio`) e aiohttp para Strava e OpenWeather: cada conversa em andamento é
+uma corrotina, não uma thread presa esperando rede. As tarefas agendadas (sexta-feira)
+continuam no agendador em segundo plano do bot_coach.
+
+Uso: python src/bot_async.py
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import signal
+import time
+from typing import AsyncIterator, Optional
+
+from dotenv import set_key
+from telebot.async_telebot import AsyncTeleBot
+
+from config import (
+    TELEGRAM_TOKEN, META_MENSAL_KM, STREAMING_RESPOSTAS, MAX_WORKERS_CHATS, MAX_FILA_POR_CHAT,
+    JANELA_AGRUPAMENTO_SEG, RESPOSTAS_POR_MINUTO, env_path, logger
+)
+from strava_service import gerar_grafico_progresso, MAX_MESES_MAPA
+from servicos_async import (
+    obter_km_por_dia_async, gerar_mapa_calor_async, obter_progresso_mensal_async, obter_resumo_semana_async,
+    obter_ultimo_pedal_async, obter_status_bike_async, obter_historico_mensal_async,
+    obter_previsao_tempo_async, fechar_sessao_http
+)
+from provedores_contexto import registro_contexto
+from fila_telegram import BotComFila, FilaEnvioTelegramAsync
+from fila_chats import FilaChatsAsync
+from agrupador_mensagens import AgrupadorMensagens
+from ai_engine import (
+    enviar_mensagem_ia_async, enviar_mensagem_ia_stream_async,
+    processar_mensagem_audio_async, processar_mensagem_foto_async,
+    registrar_usuario, obter_meta_usuario, atualizar_meta_usuario,
+    obter_ranking_usuarios, salvar_sessoes_ativas
+)
+from bot_coach import (
+    TEXTO_COMANDOS, TEXTO_FILA_CHEIA, _MAX_MSG_LEN, _INTERVALO_EDICAO_SEG,
+    juntar_mensagens, _texto_erro, _verificar_conquistas, _escrever_heartbeat,
+    iniciar_agendador, importacao_historico, meses_do_mapa, mensagem_nao_modificada
+)
+from intencoes import detectar_intencoes
+from imagem_foto import lado_alvo_foto, escolher_tamanho_foto, reduzir_foto
+
+# ==========================================
+# INICIALIZAR O BOT DO TELEGRAM (ASYNC)
+# ==========================================
+bot = AsyncTeleBot(TELEGRAM_TOKEN)
+
+# Mesma política de flood do runtime síncrono, sem bloquear o event loop
+saida = BotComFila(bot, FilaEnvioTelegramAsync())
+
+
+async def _avisar_fila_cheia(chat_id: str) -> None:
+    await saida.send_message(chat_id, TEXTO_FILA_CHEIA)
+
+
+# Mensagens de um chat em ordem; até MAX_WORKERS_CHATS chats atendidos ao mesmo tempo
+fila_chats = FilaChatsAsync(MAX_WORKERS_CHATS, MAX_FILA_POR_CHAT, ao_recusar=_avisar_fila_cheia)
+
+# Provedores de contexto buscam pelo aiohttp em vez de ocupar threads
+registro_contexto.definir_busca_async('clima', obter_previsao_tempo_async)
+registro_contexto.definir_busca_async('ultimo_pedal', obter_ultimo_pedal_async)
+registro_contexto.definir_busca_async('semana', obter_resumo_semana_async)
+registro_contexto.definir_busca_async('bike', obter_status_bike_async)
+registro_contexto.definir_busca_async('progresso', obter_progresso_mensal_async)
+
+# A importação do histórico cede a vez às conversas deste runtime
+importacao_historico.definir_ocupado(lambda: fila_chats.metricas()['chats_ativos'] > 0)
+
+
+async def enviar_resposta_segura(chat_id: int | str, texto: str, reply_to=None) -> None:
+    """Envia mensagem dividindo em pedaços se exceder o limite do Telegram."""
+    for i in range(0, len(texto), _MAX_MSG_LEN):
+        pedaco = texto[i:i + _MAX_MSG_LEN]
+        if reply_to and i == 0:
+            await saida.reply_to(reply_to, pedaco)
+        else:
+            await saida.send_message(chat_id, pedaco)
+
+
+async def _publicar_trecho(chat_id: int | str, mensagem, texto: str, reply_to=None):
+    """Envia uma nova mensagem (se ainda não existe) ou edita a existente com o texto atual."""
+    if mensagem is None:
+        if reply_to:
+            return await saida.reply_to(reply_to, texto)
+        return await saida.send_message(chat_id, texto)
+    try:
+        await saida.edit_message_text(texto, chat_id=chat_id, message_id=mensagem.message_id)
+    except Exception as e:
+        if not mensagem_nao_modificada(e):
+            raise
+    return mensagem
+
+
+async def enviar_resposta_streaming(chat_id: int | str, pedacos: AsyncIterator[str], reply_to=None) -> str:
+    """Versão assíncrona de `bot_coach.enviar_resposta_streaming` (mesmas regras de edição)."""
+    texto = ""
+    inicio = 0
+    mensagem = None
+    exibido = ""
+    ultima_edicao = 0.0
+
+    async for pedaco in pedacos:
+        texto += pedaco
+
+        while len(texto) - inicio > _MAX_MSG_LEN:
+            trecho = texto[inicio:inicio + _MAX_MSG_LEN]
+            if trecho.strip() != exibido.strip():
+                mensagem = await _publicar_trecho(chat_id, mensagem, trecho, reply_to if inicio == 0 else None)
+            inicio += _MAX_MSG_LEN
+            mensagem, exibido = None, ""
+
+        atual = texto[inicio:]
+        if not atual.strip():
+            continue
+        agora = time.monotonic()
+        if mensagem is None or (agora - ultima_edicao >= _INTERVALO_EDICAO_SEG and atual.strip() != exibido.strip()):
+            mensagem = await _publicar_trecho(chat_id, mensagem, atual, reply_to if inicio == 0 else None)
+            exibido, ultima_edicao = atual, agora
+
+    atual = texto[inicio:]
+    if atual.strip() and atual.strip() != exibido.strip():
+        await _publicar_trecho(chat_id, mensagem, atual, reply_to if inicio == 0 else None)
+    return texto
+
+
+async def responder_com_ia(message, prompt: str, comando: str,
+                           dados_extras: Optional[list[str]] = None,
+                           texto_memoria: Optional[str] = None) -> str:
+    """Envia o prompt ao Gemini e responde à mensagem, em streaming se estiver ativado."""
+    if STREAMING_RESPOSTAS:
+        pedacos = enviar_mensagem_ia_stream_async(message.chat.id, prompt, comando, dados_extras, texto_memoria)
+        return await enviar_resposta_streaming(message.chat.id, pedacos, reply_to=message)
+
+    resposta_ia = await enviar_mensagem_ia_async(message.chat.id, prompt, comando, dados_extras, texto_memoria)
+    await enviar_resposta_segura(message.chat.id, resposta_ia, reply_to=message)
+    return resposta_ia
+
+
+async def _baixar(file_id: str) -> bytes:
+    """Baixa um arquivo do Telegram para a memória (vai direto para o Gemini, sem disco)."""
+    file_info = await bot.get_file(file_id)
+    return await bot.download_file(file_info.file_path)
+
+
+# ==========================================
+# ROTAS DO TELEGRAM
+# ==========================================
+@bot.message_handler(commands=['start'])
+@fila_chats.por_chat
+async def send_welcome(message) -> None:
+    """Registra o chat ID e dá as boas-vindas."""
+    chat_id = str(message.chat.id)
+    nome = message.from_user.first_name or "Atleta"
+
+    await asyncio.to_thread(registrar_usuario, chat_id, nome)
+    set_key(env_path, 'TELEGRAM_CHAT_ID', chat_id)
+    os.environ['TELEGRAM_CHAT_ID'] = chat_id
+    logger.info(f"Novo utilizador registado: {nome} (Chat ID: {chat_id})")
+
+    await saida.reply_to(
+        message,
+        f"Coach Inteligente ativado, {nome}! 🚵‍♂️\n"
+        "Já registrei o teu contato. Agora monitorizo o teu Strava, "
+        "o desgaste da tua bicicleta e o clima! SIMBOOOORA!\n\n"
+        f"{TEXTO_COMANDOS}",
+        parse_mode='Markdown'
+    )
+
+
+@bot.message_handler(commands=['help'])
+@fila_chats.por_chat
+async def send_help(message) -> None:
+    """Exibe apenas a lista de comandos disponíveis."""
+    await saida.reply_to(message, TEXTO_COMANDOS, parse_mode='Markdown')
+
+
+@bot.message_handler(commands=['grafico'])
+@fila_chats.por_chat
+async def enviar_grafico(message) -> None:
+    """Comando /grafico: consulta a série diária sem bloquear e desenha o gráfico numa thread."""
+    try:
+        await saida.send_chat_action(message.chat.id, 'typing')
+        msg_wait = await saida.reply_to(message, "A desenhar o teu gráfico de evolução dos últimos 30 dias... 📊⏳")
+
+        caminho_grafico = None
+        try:
+            km_dia = await obter_km_por_dia_async(30)
+            caminho_grafico = await asyncio.to_thread(gerar_grafico_progresso, 30, km_dia)
+        except Exception as e:
+            logger.error(f"Erro ao buscar atividades para o gráfico: {e}")
+
+        if caminho_grafico and os.path.exists(caminho_grafico):
+            with open(caminho_grafico, 'rb') as foto:
+                await saida.send_photo(message.chat.id, foto, caption="A tua evolução nos últimos 30 dias! 🚀")
+            os.remove(caminho_grafico)
+            await saida.delete_message(message.chat.id, msg_wait.message_id)
+        else:
+            await saida.edit_message_text(
+                "Não consegui gerar o teu gráfico neste momento. Tu tens pedalado nos últimos dias?",
+                chat_id=message.chat.id,
+                message_id=msg_wait.message_id
+            )
+
+    except Exception as e:
+        logger.error(f"Erro no /grafico: {e}")
+        await saida.reply_to(message, "⚠️ Erro ao gerar o gráfico. Tente novamente em instantes.")
+
+
+@bot.message_handler(commands=['mapa'])
+@fila_chats.por_chat
+async def enviar_mapa(message) -> None:
+    """Comando /mapa: sincroniza sem bloquear e rasteriza o mapa de calor numa thread."""
+    try:
+        meses = meses_do_mapa(message.text)
+        if meses is None:
+            await saida.reply_to(message, f"⚠️ Período inválido. Use de 1 a {MAX_MESES_MAPA} meses, ex: `/mapa 6`",
+                                 parse_mode='Markdown')
+            return
+
+        await saida.send_chat_action(message.chat.id, 'typing')
+        msg_wait = await saida.reply_to(message, "A desenhar o mapa de calor das tuas rotas... 🗺️⏳")
+        caminho_mapa = await gerar_mapa_calor_async(meses)
+
+        if caminho_mapa and os.path.exists(caminho_mapa):
+            with open(caminho_mapa, 'rb') as foto:
+                await saida.send_photo(message.chat.id, foto, caption="Por onde tu andaste a pedalar! 🔥")
+            os.remove(caminho_mapa)
+            await saida.delete_message(message.chat.id, msg_wait.message_id)
+        else:
+            await saida.edit_message_text(
+                "Não encontrei pedais com GPS nesse período para desenhar o mapa.",
+                chat_id=message.chat.id,
+                message_id=msg_wait.message_id
+            )
+
+    except Exception as e:
+        logger.error(f"Erro no /mapa: {e}")
+        await saida.reply_to(message, "⚠️ Erro ao gerar o mapa. Tente novamente em instantes.")
+
+
+@bot.message_handler(commands=['semana'])
+@fila_chats.por_chat
+async def analisar_semana(message) -> None:
+    """Comando /semana: treino, meta, clima e bike buscados em paralelo."""
+    try:
+        await saida.send_chat_action(message.chat.id, 'typing')
+        await saida.reply_to(message, "A procurar dados de treino, metas do mês, clima e equipamento... ⏳")
+
+        chat_id = str(message.chat.id)
+        meta_usuario = await asyncio.to_thread(obter_meta_usuario, chat_id, META_MENSAL_KM)
+        dados = await registro_contexto.resolver_async(['semana', ('progresso', meta_usuario), 'clima', 'bike'])
+        meta, bike = dados['progresso'], dados['bike']
+        texto_meta = registro_contexto.provedor('progresso').formatar(meta)
+
+        prompt = (
+            f"O atleta pediu um resumo manual agora. "
+            f"Treino Semana: {dados['semana']}. "
+            f"Meta Mês: {texto_meta}. "
+            f"Clima: {dados['clima']}. "
+            f"Bike: {bike[0]}."
+            f"\n\nInstruções: Faça um resumo engajador juntando todas as informações, motivando o atleta a bater a meta mensal."
+        )
+
+        await responder_com_ia(
+            message, prompt, '/semana',
+            texto_memoria="[AUTO] Resumo semanal solicitado via /semana"
+        )
+
+        conquista = _verificar_conquistas(chat_id, meta_usuario, progresso=meta, status_bike=bike)
+        if conquista:
+            await saida.send_message(message.chat.id, conquista)
+
+    except Exception as e:
+        logger.error(f"Erro no /semana: {e}")
+        await saida.reply_to(message, _texto_erro(e))
+
+
+@bot.message_handler(commands=['pedal'])
+@fila_chats.por_chat
+async def ultimo_pedal(message) -> None:
+    """Comando /pedal: mostra dados detalhados do último pedal."""
+    try:
+        await saida.send_chat_action(message.chat.id, 'typing')
+        await saida.reply_to(message, "A buscar o teu último pedal no Strava... 🚴⏳")
+        dados_pedal = await obter_ultimo_pedal_async()
+        prompt = (
+            f"O atleta pediu os dados do último pedal. "
+            f"[DADOS ÚLTIMO PEDAL: {dados_pedal}]. "
+            f"Analise o pedal, elogie os pontos fortes e sugira melhorias "
+            f"para construir o 'motor' aeróbico."
+        )
+
+        await responder_com_ia(message, prompt, '/pedal', texto_memoria="/pedal")
+    except Exception as e:
+        logger.error(f"Erro no /pedal: {e}")
+        await saida.reply_to(message, _texto_erro(e))
+
+
+@bot.message_handler(commands=['bike'])
+@fila_chats.por_chat
+async def status_bike(message) -> None:
+    """Comando /bike: mostra status e dicas de manutenção da bicicleta."""
+    try:
+        await saida.send_chat_action(message.chat.id, 'typing')
+        await saida.reply_to(message, "A verificar a garagem... 🔧⏳")
+        texto_bike, km, nome = await obter_status_bike_async()
+
+        prompt = (
+            f"O atleta pediu o status da bicicleta. "
+            f"[DADOS BIKE: {texto_bike}]. "
+            f"A bike tem {km:.0f} km acumulados. "
+            f"Com base na quilometragem, dê dicas de manutenção: "
+            f"lubrificação da corrente (a cada 300-500km), "
+            f"verificação das pastilhas de freio (a cada 1000km), "
+            f"troca de relação/cassete (a cada 3000-5000km). "
+            f"Seja amigável e prático."
+        )
+
+        await responder_com_ia(message, prompt, '/bike', texto_memoria="/bike")
+    except Exception as e:
+        logger.error(f"Erro no /bike: {e}")
+        await saida.reply_to(message, _texto_erro(e))
+
+
+@bot.message_handler(commands=['clima'])
+@fila_chats.por_chat
+async def comando_clima(message) -> None:
+    """Comando /clima: previsão do tempo com contexto de pedal."""
+    try:
+        await saida.send_chat_action(message.chat.id, 'typing')
+        await saida.reply_to(message, "A olhar para o céu... ☁️⏳")
+        clima_atual = await obter_previsao_tempo_async()
+        prompt = (
+            f"O atleta pediu a previsão do tempo. "
+            f"Responda de forma parceira e motivadora usando estes dados: {clima_atual}"
+        )
+
+        await responder_com_ia(message, prompt, '/clima', texto_memoria="/clima")
+    except Exception as e:
+        logger.error(f"Erro no /clima: {e}")
+        await saida.reply_to(message, _texto_erro(e))
+
+
+@bot.message_handler(commands=['meta'])
+@fila_chats.por_chat
+async def comando_meta(message) -> None:
+    """Comando /meta: permite ao atleta definir sua meta mensal de km."""
+    try:
+        chat_id = str(message.chat.id)
+        partes = message.text.strip().split()
+
+        if len(partes) < 2:
+            meta_atual = await asyncio.to_thread(obter_meta_usuario, chat_id, META_MENSAL_KM)
+            await saida.reply_to(
+                message,
+                f"🎯 Sua meta mensal atual é de *{meta_atual:.0f} km*.\n\n"
+                f"Para alterar, use: `/meta 200` (exemplo para 200km)",
+                parse_mode='Markdown'
+            )
+            return
+
+        try:
+            nova_meta = float(partes[1])
+        except ValueError:
+            await saida.reply_to(message, "⚠️ Valor inválido. Use um número, ex: `/meta 200`", parse_mode='Markdown')
+            return
+
+        if nova_meta <= 0 or nova_meta > 10000:
+            await saida.reply_to(message, "⚠️ A meta deve ser entre 1 e 10.000 km.")
+            return
+
+        await asyncio.to_thread(registrar_usuario, chat_id, message.from_user.first_name or "Atleta")
+        sucesso = await asyncio.to_thread(atualizar_meta_usuario, chat_id, nova_meta)
+
+        if sucesso:
+            await saida.send_chat_action(message.chat.id, 'typing')
+            prompt = f"O atleta acabou de atualizar sua meta mensal para {nova_meta:.0f} km. Parabenize e motive!"
+            await responder_com_ia(message, prompt, '/meta', texto_memoria=f"/meta {nova_meta:.0f}")
+        else:
+            await saida.reply_to(message, "⚠️ Erro ao salvar a meta. Tente novamente.")
+
+    except Exception as e:
+        logger.error(f"Erro no /meta: {e}")
+        await saida.reply_to(message, _texto_erro(e))
+
+
+@bot.message_handler(commands=['historico'])
+@fila_chats.por_chat
+async def comando_historico(message) -> None:
+    """Comando /historico: mostra evolução mensal comparativa."""
+    try:
+        await saida.send_chat_action(message.chat.id, 'typing')
+        await saida.reply_to(message, "A compilar o teu histórico de evolução... 📈⏳")
+
+        chat_id = str(message.chat.id)
+        historico, meta_usuario = await asyncio.gather(
+            obter_historico_mensal_async(meses=3),
+            asyncio.to_thread(obter_meta_usuario, chat_id, META_MENSAL_KM)
+        )
+
+        prompt = (
+            f"O atleta pediu seu histórico de evolução mensal. "
+            f"[DADOS HISTÓRICO: {historico}]. "
+            f"Meta mensal atual: {meta_usuario:.0f} km. "
+            f"Analise a evolução, identifique tendências (subindo, descendo, estável), "
+            f"parabenize os meses bons e motive para os próximos. "
+            f"Se houve queda, encoraje a retomar com dicas práticas."
+        )
+
+        await responder_com_ia(message, prompt, '/historico', texto_memoria="/historico")
+    except Exception as e:
+        logger.error(f"Erro no /historico: {e}")
+        await saida.reply_to(message, _texto_erro(e))
+
+
+@bot.message_handler(commands=['ranking'])
+@fila_chats.por_chat
+async def comando_ranking(message) -> None:
+    """Comando /ranking: mostra ranking de km entre membros registrados."""
+    try:
+        await saida.send_chat_action(message.chat.id, 'typing')
+        await saida.reply_to(message, "A montar o ranking da equipe... 🏆⏳")
+
+        ranking = await asyncio.to_thread(obter_ranking_usuarios)
+        prompt = (
+            f"O atleta pediu o ranking da equipe. "
+            f"[DADOS RANKING: {ranking}]. "
+            f"Monte uma apresentação divertida e motivadora do ranking, "
+            f"parabenize o líder, encoraje os demais, e use emojis de pódio "
+            f"(🥇🥈🥉) para os 3 primeiros."
+        )
+
+        await responder_com_ia(message, prompt, '/ranking', texto_memoria="/ranking")
+    except Exception as e:
+        logger.error(f"Erro no /ranking: {e}")
+        await saida.reply_to(message, _texto_erro(e))
+
+
+@bot.message_handler(commands=['importacao'])
+@fila_chats.por_chat
+async def comando_importacao(message) -> None:
+    """Comando /importacao: progresso da importação do histórico completo do Strava."""
+    try:
+        await saida.reply_to(message, await asyncio.to_thread(importacao_historico.texto_progresso))
+    except Exception as e:
+        logger.error(f"Erro no /importacao: {e}")
+        await saida.reply_to(message, _texto_erro(e))
+
+
+@bot.message_handler(content_types=['voice'])
+@fila_chats.por_chat
+async def receber_audio(message) -> None:
+    """Handler para receber e processar mensagens de áudio (Walkie-Talkie)."""
+    try:
+        msg_wait = await saida.reply_to(message, "A ouvir o teu áudio... 🎧⏳")
+        await saida.send_chat_action(message.chat.id, 'record_voice')
+
+        audio = await _baixar(message.voice.file_id)
+        prompt = "O atleta enviou esta mensagem de áudio (Walkie-Talkie) possivelmente durante ou após o seu pedal. Escute, faça um breve resumo do que ele falou e responda como seu Coach parceiro de treino."
+
+        resposta = await processar_mensagem_audio_async(
+            message.chat.id, audio, prompt_adicional=prompt,
+            chave_midia=message.voice.file_unique_id, mime_type=message.voice.mime_type or 'audio/ogg'
+        )
+
+        await saida.delete_message(message.chat.id, msg_wait.message_id)
+        await enviar_resposta_segura(message.chat.id, resposta, reply_to=message)
+
+    except Exception as e:
+        logger.error(f"Erro no processamento de áudio: {e}")
+        await saida.reply_to(message, "⚠️ Erro ao processar o seu áudio. Os meus ouvidos digitais falharam, pode gravar de novo ou enviar por texto?")
+
+
+@bot.message_handler(content_types=['photo'])
+@fila_chats.por_chat
+async def receber_foto(message) -> None:
+    """Handler para receber e analisar fotos enviadas pelo atleta."""
+    try:
+        msg_wait = await saida.reply_to(message, "A analisar a tua foto... 📸⏳")
+        await saida.send_chat_action(message.chat.id, 'typing')
+
+        lado_alvo = lado_alvo_foto(message.caption)
+        foto = escolher_tamanho_foto(message.photo, lado_alvo)
+        # Redução e recodificação rodam numa thread, fora do event loop
+        dados_foto, pixels = await asyncio.to_thread(reduzir_foto, await _baixar(foto.file_id), lado_alvo)
+        legenda = message.caption or ""
+        prompt = (
+            f"O atleta enviou esta foto{' com a legenda: ' + legenda if legenda else ''}. "
+            f"Analise a imagem (pode ser da trilha, bicicleta, paisagem, equipamento, lesão, etc.) "
+            f"e responda como o Coach parceiro de treino. Se for uma foto da bike ou equipamento, "
+            f"dê dicas relevantes. Se for da trilha, comente sobre o terreno e motivação."
+        )
+
+        resposta = await processar_mensagem_foto_async(
+            message.chat.id, dados_foto, prompt_adicional=prompt,
+            chave_midia=f"{foto.file_unique_id}@{lado_alvo}", pixels=pixels
+        )
+
+        await saida.delete_message(message.chat.id, msg_wait.message_id)
+        await enviar_resposta_segura(message.chat.id, resposta, reply_to=message)
+
+    except Exception as e:
+        logger.error(f"Erro no processamento de foto: {e}")
+        await saida.reply_to(message, "⚠️ Erro ao analisar a foto. Pode enviar novamente ou descrever por texto?")
+
+
+async def _responder_conversa(mensagens: list) -> None:
+    """Responde a um lote de conversa livre; os interceptadores de contexto buscam seus dados em paralelo."""
+    message = mensagens[-1]
+    texto = juntar_mensagens(mensagens)
+    try:
+        await saida.send_chat_action(message.chat.id, 'typing')
+        intencoes = detectar_intencoes(texto)
+
+        pedidos: list[str] = []
+        if 'clima' in intencoes:
+            pedidos.append('clima')
+        if 'strava' in intencoes:
+            pedidos.extend(['ultimo_pedal', 'semana'])
+        if 'bike' in intencoes:
+            pedidos.append('bike')
+
+        dados_extras = registro_contexto.blocos(await registro_contexto.resolver_async(pedidos)) if pedidos else []
+
+        await responder_com_ia(message, texto, 'conversa', dados_extras=dados_extras)
+    except Exception as e:
+        logger.error(f"Erro na conversa livre: {e}")
+        await saida.reply_to(message, _texto_erro(e))
+
+
+# Os vencimentos rodam no próprio event loop (loop.call_later), sem threads
+agrupador = AgrupadorMensagens(
+    lambda chat_id, mensagens: asyncio.ensure_future(
+        fila_chats.executar_sem_limite(chat_id, _responder_conversa, mensagens)
+    ),
+    janela=JANELA_AGRUPAMENTO_SEG,
+    respostas_por_minuto=RESPOSTAS_POR_MINUTO,
+    agendar=lambda atraso, callback: asyncio.get_running_loop().call_later(atraso, callback)
+)
+# Um comando não passa na frente do texto que o chat mandou antes dele
+fila_chats.definir_antes_de_enfileirar(agrupador.liberar)
+
+
+@bot.message_handler(func=lambda message: True)
+async def conversa_livre(message) -> None:
+    """Handler de conversa livre: a mensagem entra no agrupador do chat."""
+    if not message.text:
+        return
+    agrupador.adicionar(message.chat.id, message)
+
+
+# ==========================================
+# ARRANQUE DO BOT (ASYNC)
+# ==========================================
+async def _executar() -> None:
+    """Roda o polling até receber SIGINT/SIGTERM e então encerra de forma limpa."""
+    loop = asyncio.get_running_loop()
+    polling = asyncio.ensure_future(bot.infinity_polling())
+    for sinal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sinal, polling.cancel)
+
+    try:
+        await polling
+    except asyncio.CancelledError:
+        logger.info("Sinal recebido. Encerrando o bot de forma segura...")
+    finally:
+        await bot.close_session()
+        await fechar_sessao_http()
+        await asyncio.to_thread(salvar_sessoes_ativas)
+        logger.info("Bot encerrado com sucesso.")
+
+
+def main() -> None:
+    """Inicializa o agendador e roda o bot no event loop."""
+    iniciar_agendador()
+    _escrever_heartbeat()
+
+    logger.info("Coach (runtime assíncrono) ativo no Telegram!")
+    asyncio.run(_executar())
+
+
+if __name__ == '__main__':
+    main()
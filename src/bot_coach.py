@@ -5,44 +5,84 @@ Gerencia comandos, conversas livres, áudio, fotos e mensagens proativas.
 from __future__ import annotations
 
 import os
+import hashlib
 import signal
 import sys
-import tempfile
 import schedule
 import time
 import threading
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Iterable, Optional
 
 from dotenv import set_key
 import telebot
-from cachetools import TTLCache
 
-from config import TELEGRAM_TOKEN, TEAM_NAME, META_MENSAL_KM, env_path, logger
+from config import (
+    TELEGRAM_TOKEN, TEAM_NAME, META_MENSAL_KM, STREAMING_RESPOSTAS,
+    MAX_CHAMADAS_GEMINI, HORARIO_PREGERACAO_SEXTA, MAX_WORKERS_CHATS, MAX_FILA_POR_CHAT,
+    JANELA_AGRUPAMENTO_SEG, RESPOSTAS_POR_MINUTO, PREAQUECER_ANTECEDENCIA_MIN,
+    PREAQUECER_LIMITE_STRAVA_HORA, IMPORTACAO_TAMANHO_PAGINA, IMPORTACAO_LIMITE_STRAVA_HORA,
+    env_path, logger
+)
 from strava_service import (
-    obter_resumo_semana, obter_ultimo_pedal,
-    obter_status_bike, obter_status_bike_texto,
+    obter_resumo_semana, obter_ultimo_pedal, totais_semana,
+    obter_status_bike,
     obter_progresso_mensal, gerar_grafico_progresso,
-    obter_historico_mensal
+    obter_historico_mensal, renovar_token_se_preciso, buscar_pagina_historico,
+    gerar_mapa_calor, MESES_MAPA_PADRAO, MAX_MESES_MAPA
 )
 from weather_service import obter_previsao_tempo
+from provedores_contexto import registro_contexto
+from fila_telegram import BotComFila, FilaEnvioTelegram
+from fila_chats import FilaChats
+from agrupador_mensagens import AgrupadorMensagens
+from despachante_ia import CotaGeminiEsgotada, PRIORIDADE_PROATIVA, PRIORIDADE_SEGUNDO_PLANO
 from ai_engine import (
-    get_chat_session, guardar_memoria, processar_mensagem_audio,
+    enviar_mensagem_ia, enviar_mensagem_ia_stream, processar_mensagem_audio,
     processar_mensagem_foto, registrar_usuario, obter_todos_chat_ids,
-    obter_meta_usuario, atualizar_meta_usuario, obter_ranking_usuarios
+    obter_meta_usuario, atualizar_meta_usuario, obter_ranking_usuarios,
+    salvar_sessoes_ativas, iniciar_execucao_proativa, concluir_execucao_proativa,
+    execucao_proativa_pendente, marcar_envio_proativo, obter_envios_proativos,
+    gerar_mensagem_avulsa, registrar_mensagem_entregue,
+    salvar_mensagem_pregerada, obter_mensagem_pregerada, expirar_midias,
+    obter_horarios_conversa, get_chat_session, vagas_sessoes,
+    gravar_pagina_importacao, carregar_checkpoint_importacao
 )
-from constantes import PALAVRAS_CLIMA, PALAVRAS_STRAVA, PALAVRAS_BIKE
+from intencoes import detectar_intencoes
+from imagem_foto import lado_alvo_foto, escolher_tamanho_foto, reduzir_foto
+from cache_persistente import manter_caches
+from preaquecimento import PreAquecedor, OrcamentoChamadas, aquecer_chats
+from importacao_historico import ImportacaoHistorico
 
 # ==========================================
 # INICIALIZAR O BOT DO TELEGRAM
 # ==========================================
-bot = telebot.TeleBot(TELEGRAM_TOKEN)
+# threaded=False: o polling só entrega as mensagens; quem as executa é a fila por chat
+bot = telebot.TeleBot(TELEGRAM_TOKEN, threaded=False)
+
+# Todos os envios passam pela fila com controle de flood (global e por chat)
+saida = BotComFila(bot, FilaEnvioTelegram())
+
+# Texto enviado quando o atleta manda mensagens mais rápido do que o coach consegue responder
+TEXTO_FILA_CHEIA: str = "⏳ Calma! Ainda estou a responder às tuas mensagens anteriores. Já volto a ti!"
+
+
+def _avisar_fila_cheia(chat_id: str) -> None:
+    saida.send_message(chat_id, TEXTO_FILA_CHEIA)
+
+
+# Mensagens de um chat em ordem, uma de cada vez; chats diferentes em paralelo
+fila_chats = FilaChats(MAX_WORKERS_CHATS, MAX_FILA_POR_CHAT, ao_recusar=_avisar_fila_cheia)
 
 # Limite de caracteres por mensagem do Telegram
 _MAX_MSG_LEN: int = 4096
 
-# Rate limiter com expiração automática (evita vazamento de memória)
-_RATE_LIMIT_SECONDS: float = 3.0
-_rate_limit: TTLCache = TTLCache(maxsize=1000, ttl=_RATE_LIMIT_SECONDS)
+# Intervalo mínimo entre edições da mesma mensagem no streaming (limite do Telegram ~1/s por chat)
+_INTERVALO_EDICAO_SEG: float = 1.5
+
+# Pré-geração das mensagens de sexta: poucas chamadas por vez, espalhadas antes da entrega
+_WORKERS_PREGERACAO: int = 2
 
 # Caminho do arquivo de heartbeat para o healthcheck do Docker
 _HEALTH_FILE: str = '/tmp/bot_health'
@@ -53,25 +93,42 @@ TEXTO_COMANDOS: str = (
     "/start — Registrar e ativar o coach\n"
     "/semana — Resumo semanal completo e andamento da meta\n"
     "/grafico — Gráfico de evolução de treino\n"
+    "/mapa — Mapa de calor das tuas rotas (ex: /mapa 6 para 6 meses)\n"
     "/pedal — Dados do último pedal\n"
     "/bike — Status da bicicleta\n"
     "/clima — Previsão do tempo\n"
     "/meta — Definir sua meta mensal (ex: /meta 200)\n"
     "/historico — Evolução mensal comparativa\n"
     "/ranking — Ranking de km entre membros\n"
+    "/importacao — Progresso da importação do histórico do Strava\n"
     "📷 Envie uma foto da trilha para análise!\n"
     "🎙️ Envie um áudio como Walkie-Talkie!\n"
     "Ou simplesmente converse comigo! 💬"
 )
 
 
-def _check_rate_limit(chat_id: int | str) -> bool:
-    """Retorna True se o usuário pode enviar, False se está em cooldown."""
-    key = str(chat_id)
-    if key in _rate_limit:
-        return False
-    _rate_limit[key] = True
-    return True
+def juntar_mensagens(mensagens: list) -> str:
+    """Texto único de um lote de mensagens agrupadas (uma por linha, na ordem de chegada)."""
+    return "\n".join(m.text for m in mensagens)
+
+
+def meses_do_mapa(texto: str) -> Optional[int]:
+    """Período do /mapa em meses (padrão sem argumento); None se o argumento for inválido."""
+    partes = texto.strip().split()
+    if len(partes) < 2:
+        return MESES_MAPA_PADRAO
+    try:
+        meses = int(partes[1])
+    except ValueError:
+        return None
+    return meses if 1 <= meses <= MAX_MESES_MAPA else None
+
+
+def _texto_erro(e: Exception) -> str:
+    """Mensagem de erro para o atleta, diferenciando cota esgotada do Gemini."""
+    if isinstance(e, CotaGeminiEsgotada):
+        return "⏳ O coach está com muitas conversas agora. Tente de novo em um minuto!"
+    return "⚠️ Erro ao processar. Tente novamente em instantes."
 
 
 def _escrever_heartbeat() -> None:
@@ -93,9 +150,86 @@ def enviar_resposta_segura(bot: telebot.TeleBot, chat_id: int | str, texto: str,
             bot.send_message(chat_id, pedaco)
 
 
-def _verificar_conquistas(chat_id: int | str, meta_km: float) -> Optional[str]:
-    """Verifica se o atleta atingiu marcos e retorna mensagem de celebração."""
-    resultado = obter_progresso_mensal(meta_km)
+def mensagem_nao_modificada(erro: Exception) -> bool:
+    """
+    Edição recusada por não mudar nada: o Telegram apara os espaços das pontas, então um
+    pedaço que só traz espaços ou quebras de linha não altera a mensagem já entregue.
+    """
+    return 'message is not modified' in str(erro)
+
+
+def _publicar_trecho(bot: telebot.TeleBot, chat_id: int | str, mensagem, texto: str, reply_to=None):
+    """Envia uma nova mensagem (se ainda não existe) ou edita a existente com o texto atual."""
+    if mensagem is None:
+        if reply_to:
+            return bot.reply_to(reply_to, texto)
+        return bot.send_message(chat_id, texto)
+    try:
+        bot.edit_message_text(texto, chat_id=chat_id, message_id=mensagem.message_id)
+    except Exception as e:
+        if not mensagem_nao_modificada(e):
+            raise
+    return mensagem
+
+
+def enviar_resposta_streaming(bot: telebot.TeleBot, chat_id: int | str, pedacos: Iterable[str], reply_to=None) -> str:
+    """
+    Mostra a resposta do Gemini conforme ela chega: publica a primeira mensagem
+    no primeiro pedaço e depois a edita no máximo a cada _INTERVALO_EDICAO_SEG.
+    Ao passar de _MAX_MSG_LEN, a mensagem atual é fechada e uma nova é iniciada.
+    Retorna o texto completo.
+    """
+    texto = ""
+    inicio = 0          # posição no texto onde começa a mensagem atual
+    mensagem = None     # mensagem do Telegram sendo editada
+    exibido = ""        # texto que a mensagem atual mostra neste momento
+    ultima_edicao = 0.0
+
+    for pedaco in pedacos:
+        texto += pedaco
+
+        # Fecha as mensagens que já encheram e começa uma nova
+        while len(texto) - inicio > _MAX_MSG_LEN:
+            trecho = texto[inicio:inicio + _MAX_MSG_LEN]
+            if trecho.strip() != exibido.strip():
+                mensagem = _publicar_trecho(bot, chat_id, mensagem, trecho, reply_to if inicio == 0 else None)
+            inicio += _MAX_MSG_LEN
+            mensagem, exibido = None, ""
+
+        atual = texto[inicio:]
+        if not atual.strip():
+            continue
+        agora = time.monotonic()
+        if mensagem is None or (agora - ultima_edicao >= _INTERVALO_EDICAO_SEG and atual.strip() != exibido.strip()):
+            mensagem = _publicar_trecho(bot, chat_id, mensagem, atual, reply_to if inicio == 0 else None)
+            exibido, ultima_edicao = atual, agora
+
+    # Edição final com o texto completo da última mensagem
+    atual = texto[inicio:]
+    if atual.strip() and atual.strip() != exibido.strip():
+        _publicar_trecho(bot, chat_id, mensagem, atual, reply_to if inicio == 0 else None)
+    return texto
+
+
+def responder_com_ia(message, prompt: str, comando: str,
+                     dados_extras: Optional[list[str]] = None,
+                     texto_memoria: Optional[str] = None) -> str:
+    """Envia o prompt ao Gemini e responde à mensagem, em streaming se estiver ativado."""
+    if STREAMING_RESPOSTAS:
+        pedacos = enviar_mensagem_ia_stream(message.chat.id, prompt, comando, dados_extras, texto_memoria)
+        return enviar_resposta_streaming(saida, message.chat.id, pedacos, reply_to=message)
+
+    resposta_ia = enviar_mensagem_ia(message.chat.id, prompt, comando, dados_extras, texto_memoria)
+    enviar_resposta_segura(saida, message.chat.id, resposta_ia, reply_to=message)
+    return resposta_ia
+
+
+def _verificar_conquistas(chat_id: int | str, meta_km: float,
+                          progresso: dict | str | None = None,
+                          status_bike: Optional[tuple[str, float, str]] = None) -> Optional[str]:
+    """Verifica se o atleta atingiu marcos e retorna mensagem de celebração.
+    `progresso` e `status_bike` podem vir já calculados (ex.: no envio de sexta)."""
+    resultado = progresso if progresso is not None else obter_progresso_mensal(meta_km)
     if isinstance(resultado, str):
         return None
 
@@ -111,7 +245,7 @@ def _verificar_conquistas(chat_id: int | str, meta_km: float) -> Optional[str]:
         conquistas.append("⚡ Metade da meta já foi! O motor está quente!")
 
     # Marcos de quilometragem total na bike
-    _, km_bike, nome_bike = obter_status_bike()
+    _, km_bike, nome_bike = status_bike if status_bike is not None else obter_status_bike()
     if km_bike >= 5000 and km_bike < 5050:
         conquistas.append(f"🌟 WOW! A {nome_bike} passou dos 5.000 km! Lendária!")
     elif km_bike >= 3000 and km_bike < 3050:
@@ -125,60 +259,177 @@ def _verificar_conquistas(chat_id: int | str, meta_km: float) -> Optional[str]:
 # ==========================================
 # 🚀 MOTOR PROATIVO: SUPER PROMPT DE SEXTA
 # ==========================================
-def mensagem_planeamento_fim_de_semana() -> None:
-    """Envia mensagem proativa toda sexta-feira para TODOS os usuários registrados."""
+def _id_execucao_sexta(data: Optional[datetime] = None) -> str:
+    """Identificador do envio de sexta (um por dia), usado no checkpoint."""
+    return f"sexta-{(data or datetime.now()).strftime('%Y-%m-%d')}"
+
+
+def _chat_ids_proativos() -> list[str]:
+    """Usuários que recebem as mensagens proativas."""
     chat_ids = obter_todos_chat_ids()
     if not chat_ids:
         # Fallback para o chat ID do .env (compatibilidade)
         chat_id_env = os.getenv('TELEGRAM_CHAT_ID')
         if chat_id_env:
-            chat_ids = [chat_id_env]
-        else:
-            logger.warning("Nenhum usuário registrado. Mensagem proativa ignorada.")
-            return
+            return [chat_id_env]
+        logger.warning("Nenhum usuário registrado. Mensagem proativa ignorada.")
+    return chat_ids
+
+
+def _contexto_compartilhado_sexta() -> dict:
+    """Busca uma única vez, em paralelo, os dados que são iguais para todos os atletas."""
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        clima = pool.submit(obter_previsao_tempo)
+        semana = pool.submit(obter_resumo_semana)
+        bike = pool.submit(obter_status_bike)
+        return {
+            'clima': clima.result(),
+            'semana': semana.result(),
+            'bike': bike.result(),
+            # Lidos depois do resumo, que já sincronizou o banco
+            'totais_semana': _totais_semana_sexta()
+        }
+
+
+def _totais_semana_sexta() -> dict[str, float]:
+    """Números da semana para a impressão digital; vazio se o banco falhar."""
+    try:
+        return totais_semana()
+    except Exception as e:
+        logger.error(f"Erro ao somar os pedais da semana: {e}")
+        return {}
+
+
+def _dados_usuario_sexta(chat_id: str, compartilhado: dict) -> tuple[float, dict | str, str, str]:
+    """Monta o prompt de sexta do atleta e a impressão digital dos dados de treino usados nele."""
+    meta_usuario = obter_meta_usuario(chat_id, META_MENSAL_KM)
+    meta = obter_progresso_mensal(meta_usuario)
+    texto_meta = meta if isinstance(meta, str) else meta.get('texto', 'Erro ao obter meta.')
+
+    prompt = f"""
+    Inicia a conversa de forma proativa. Hoje é sexta-feira. 
+    Cruza estes 4 dados para criar a tua mensagem:
+    1. Resumo da Semana: {compartilhado['semana']}
+    2. Clima (Próx 24h): {compartilhado['clima']}
+    3. Status da Bicicleta: {compartilhado['bike'][0]}
+    4. Meta do Mês: {texto_meta}
+    
+    Diretrizes:
+    - Sugere um treino para o fim de semana com a {TEAM_NAME} adequado ao clima (se chover, avisa sobre a lama).
+    - Avalia se o volume da semana foi bom para manter o "motor".
+    - Celebre ou cobre (de forma amigável) o progresso em relação à meta do mês.
+    - Se a quilometragem da bicicleta for alta, deixa um alerta amigável sobre manutenção.
+    Sê um verdadeiro parceiro de treino!
+    """
+
+    # Só os números que mudam com um pedal novo: os textos trazem o aviso de dado antigo (com a
+    # idade em minutos) e pequenas variações do clima não invalidam a mensagem
+    totais = compartilhado['totais_semana']
+    numeros_meta = (round(meta['total_km'], 1), meta['meta_km']) if isinstance(meta, dict) else texto_meta
+    impressao = hashlib.sha256(repr((
+        totais.get('atividades'), round(totais.get('km', 0.0), 1), round(totais.get('elevacao_m', 0.0)),
+        compartilhado['bike'][2], round(compartilhado['bike'][1], 1), numeros_meta
+    )).encode('utf-8')).hexdigest()
+    return meta_usuario, meta, prompt, impressao
+
+
+def _pregerar_sexta_para_usuario(chat_id: str, compartilhado: dict, execucao: str) -> None:
+    """Gera a mensagem de sexta com antecedência, sem entregá-la nem gravá-la na conversa."""
+    _, _, prompt, impressao = _dados_usuario_sexta(chat_id, compartilhado)
+    texto = gerar_mensagem_avulsa(chat_id, prompt, 'sexta_pregerada', prioridade=PRIORIDADE_SEGUNDO_PLANO)
+    salvar_mensagem_pregerada(execucao, chat_id, texto, impressao)
+    logger.info(f"Mensagem de sexta pré-gerada para chat {chat_id}.")
+
+
+def pregerar_mensagens_sexta() -> None:
+    """
+    Roda antes do horário de entrega: gera e guarda a mensagem de cada atleta,
+    com poucas chamadas simultâneas e prioridade de segundo plano.
+    """
+    chat_ids = _chat_ids_proativos()
+    if not chat_ids:
+        return
+
+    execucao = _id_execucao_sexta()
+    compartilhado = _contexto_compartilhado_sexta()
+    with ThreadPoolExecutor(max_workers=_WORKERS_PREGERACAO, thread_name_prefix='pregeracao') as pool:
+        futuros = {pool.submit(_pregerar_sexta_para_usuario, c, compartilhado, execucao): c for c in chat_ids}
+        for futuro in as_completed(futuros):
+            try:
+                futuro.result()
+            except Exception as e:
+                logger.error(f"Erro ao pré-gerar mensagem de sexta para {futuros[futuro]}: {e}")
+
+
+def _enviar_sexta_para_usuario(chat_id: str, compartilhado: dict, execucao: str) -> None:
+    """
+    Pipeline de um atleta: usa a mensagem pré-gerada se os dados de treino
+    não mudaram desde a geração; senão gera agora. Depois entrega e grava o checkpoint.
+    """
+    logger.info(f"Enviando mensagem proativa para chat {chat_id}...")
+    meta_usuario, meta, prompt, impressao = _dados_usuario_sexta(chat_id, compartilhado)
+    texto_memoria = "[AUTO] Resumo proativo de sexta-feira solicitado"
+
+    pregerada = obter_mensagem_pregerada(execucao, chat_id)
+    if pregerada and pregerada['impressao'] == impressao:
+        resposta_ia = pregerada['texto']
+        registrar_mensagem_entregue(chat_id, texto_memoria, resposta_ia)
+    else:
+        if pregerada:
+            logger.info(f"Dados de treino mudaram desde a pré-geração. Regenerando para chat {chat_id}.")
+        resposta_ia = enviar_mensagem_ia(
+            chat_id, prompt, 'sexta',
+            texto_memoria=texto_memoria,
+            prioridade=PRIORIDADE_PROATIVA
+        )
 
-    for chat_id in chat_ids:
-        try:
-            logger.info(f"Enviando mensagem proativa para chat {chat_id}...")
-            meta_usuario = obter_meta_usuario(chat_id, META_MENSAL_KM)
-            dados_treino = obter_resumo_semana()
-            clima = obter_previsao_tempo()
-            bike = obter_status_bike_texto()
-
-            meta = obter_progresso_mensal(meta_usuario)
-            texto_meta = meta if isinstance(meta, str) else meta.get('texto', 'Erro ao obter meta.')
-
-            prompt = f"""
-            Inicia a conversa de forma proativa. Hoje é sexta-feira. 
-            Cruza estes 4 dados para criar a tua mensagem:
-            1. Resumo da Semana: {dados_treino}
-            2. Clima (Próx 24h): {clima}
-            3. Status da Bicicleta: {bike}
-            4. Meta do Mês: {texto_meta}
-            
-            Diretrizes:
-            - Sugere um treino para o fim de semana com a {TEAM_NAME} adequado ao clima (se chover, avisa sobre a lama).
-            - Avalia se o volume da semana foi bom para manter o "motor".
-            - Celebre ou cobre (de forma amigável) o progresso em relação à meta do mês.
-            - Se a quilometragem da bicicleta for alta, deixa um alerta amigável sobre manutenção.
-            Sê um verdadeiro parceiro de treino!
-            """
-
-            session = get_chat_session(chat_id)
-            guardar_memoria(chat_id, "user", "[AUTO] Resumo proativo de sexta-feira solicitado")
-            resposta_ia = session.send_message(prompt)
-            guardar_memoria(chat_id, "model", resposta_ia.text)
-
-            enviar_resposta_segura(bot, chat_id, resposta_ia.text)
-
-            # Verificar conquistas e enviar se houver
-            conquista = _verificar_conquistas(chat_id, meta_usuario)
-            if conquista:
-                bot.send_message(chat_id, conquista)
-
-            logger.info(f"Mensagem proativa enviada para chat {chat_id}.")
-        except Exception as e:
-            logger.error(f"Erro na mensagem proativa para {chat_id}: {e}")
+    enviar_resposta_segura(saida, chat_id, resposta_ia)
+
+    # Verificar conquistas e enviar se houver
+    conquista = _verificar_conquistas(chat_id, meta_usuario, progresso=meta, status_bike=compartilhado['bike'])
+    if conquista:
+        saida.send_message(chat_id, conquista)
+
+    marcar_envio_proativo(execucao, chat_id)
+    logger.info(f"Mensagem proativa enviada para chat {chat_id}.")
+
+
+def mensagem_planeamento_fim_de_semana() -> None:
+    """
+    Envia mensagem proativa toda sexta-feira para TODOS os usuários registrados.
+    O contexto comum (clima, semana, bike) é calculado uma vez; cada atleta segue
+    em paralelo (o despachante limita as chamadas ao Gemini) e, ao receber a
+    mensagem, fica registrado no checkpoint — se o bot cair, o reenvio pula quem já recebeu.
+    """
+    chat_ids = _chat_ids_proativos()
+    if not chat_ids:
+        return
+
+    execucao = _id_execucao_sexta()
+    iniciar_execucao_proativa(execucao)
+    ja_enviados = obter_envios_proativos(execucao)
+    pendentes = [c for c in chat_ids if c not in ja_enviados]
+    if ja_enviados:
+        logger.info(f"Retomando {execucao}: {len(ja_enviados)} já enviados, {len(pendentes)} pendentes.")
+
+    compartilhado = _contexto_compartilhado_sexta()
+
+    with ThreadPoolExecutor(max_workers=MAX_CHAMADAS_GEMINI, thread_name_prefix='sexta') as pool:
+        futuros = {pool.submit(_enviar_sexta_para_usuario, c, compartilhado, execucao): c for c in pendentes}
+        for futuro in as_completed(futuros):
+            try:
+                futuro.result()
+            except Exception as e:
+                logger.error(f"Erro na mensagem proativa para {futuros[futuro]}: {e}")
+
+    concluir_execucao_proativa(execucao)
+
+
+def _retomar_broadcast_pendente() -> None:
+    """No arranque: se o envio de hoje foi interrompido, continua de onde parou."""
+    if execucao_proativa_pendente(_id_execucao_sexta()):
+        logger.info("Envio proativo de hoje incompleto. Retomando em segundo plano...")
+        threading.Thread(target=mensagem_planeamento_fim_de_semana, daemon=True).start()
 
 
 def agendador_em_segundo_plano() -> None:
@@ -189,10 +440,69 @@ def agendador_em_segundo_plano() -> None:
         time.sleep(1)
 
 
+# Pré-aquecimento antes dos horários habituais de cada atleta e das janelas de sexta
+_orcamento_strava_preaquecimento = OrcamentoChamadas(PREAQUECER_LIMITE_STRAVA_HORA)
+preaquecedor = PreAquecedor(
+    aquecer=lambda chat_ids, chats_habituais: aquecer_chats(
+        chat_ids, registro_contexto, lambda chat_id: obter_meta_usuario(chat_id, META_MENSAL_KM),
+        get_chat_session, _orcamento_strava_preaquecimento,
+        chats_sessao=chats_habituais, vagas_sessoes=vagas_sessoes()
+    ),
+    habitos=obter_horarios_conversa,
+    chats_janelas_fixas=_chat_ids_proativos,
+    janelas_fixas=[(4, HORARIO_PREGERACAO_SEXTA), (4, "18:00")],
+    antecedencia_min=PREAQUECER_ANTECEDENCIA_MIN
+)
+
+
+def _preaquecer_caches() -> None:
+    """Dispara a verificação fora da thread do agendador (o aquecimento pode levar segundos)."""
+    threading.Thread(target=preaquecedor.verificar, daemon=True).start()
+
+
+# Importação do histórico completo do Strava, cedendo a vez às conversas em andamento
+importacao_historico = ImportacaoHistorico(
+    buscar_pagina=buscar_pagina_historico,
+    gravar_pagina=gravar_pagina_importacao,
+    carregar_checkpoint=carregar_checkpoint_importacao,
+    orcamento=OrcamentoChamadas(IMPORTACAO_LIMITE_STRAVA_HORA),
+    ocupado=lambda: fila_chats.metricas()['chats_ativos'] > 0,
+    tamanho_pagina=IMPORTACAO_TAMANHO_PAGINA
+)
+
+
+def _importar_historico() -> None:
+    """Roda uma rodada da importação fora da thread do agendador."""
+    threading.Thread(target=importacao_historico.rodada, daemon=True).start()
+
+
+def iniciar_agendador() -> None:
+    """Agenda as tarefas proativas e inicia o agendador (usado pelos dois runtimes)."""
+    # Agendamento: pré-geração fora de pico e entrega na sexta-feira às 18:00
+    if HORARIO_PREGERACAO_SEXTA:
+        schedule.every().friday.at(HORARIO_PREGERACAO_SEXTA).do(pregerar_mensagens_sexta)
+    schedule.every().friday.at("18:00").do(mensagem_planeamento_fim_de_semana)
+    # Mídias enviadas ao Gemini que nenhuma conversa ativa usa mais
+    schedule.every(30).minutes.do(expirar_midias)
+    # Poda do cache persistente e taxas de acerto por namespace no log
+    schedule.every(30).minutes.do(manter_caches)
+    # Token do Strava renovado antes de vencer (inclusive já na partida)
+    schedule.every(10).minutes.do(renovar_token_se_preciso)
+    renovar_token_se_preciso()
+    if PREAQUECER_ANTECEDENCIA_MIN > 0:
+        schedule.every(5).minutes.do(_preaquecer_caches)
+    # Histórico completo do Strava, algumas páginas por rodada
+    if IMPORTACAO_LIMITE_STRAVA_HORA > 0:
+        schedule.every(2).minutes.do(_importar_historico)
+    threading.Thread(target=agendador_em_segundo_plano, daemon=True).start()
+    _retomar_broadcast_pendente()
+
+
 # ==========================================
 # ROTAS DO TELEGRAM
 # ==========================================
 @bot.message_handler(commands=['start'])
+@fila_chats.por_chat
 def send_welcome(message) -> None:
     """Registra o chat ID e dá as boas-vindas."""
     chat_id = str(message.chat.id)
@@ -204,7 +514,7 @@ def send_welcome(message) -> None:
     os.environ['TELEGRAM_CHAT_ID'] = chat_id
     logger.info(f"Novo utilizador registado: {nome} (Chat ID: {chat_id})")
 
-    bot.reply_to(
+    saida.reply_to(
         message,
         f"Coach Inteligente ativado, {nome}! 🚵‍♂️\n"
         "Já registrei o teu contato. Agora monitorizo o teu Strava, "
@@ -215,26 +525,28 @@ def send_welcome(message) -> None:
 
 
 @bot.message_handler(commands=['help'])
+@fila_chats.por_chat
 def send_help(message) -> None:
     """Exibe apenas a lista de comandos disponíveis."""
-    bot.reply_to(message, TEXTO_COMANDOS, parse_mode='Markdown')
+    saida.reply_to(message, TEXTO_COMANDOS, parse_mode='Markdown')
 
 
 @bot.message_handler(commands=['grafico'])
+@fila_chats.por_chat
 def enviar_grafico(message) -> None:
     """Comando /grafico: envia a imagem gerada com o volume de treino."""
     try:
-        bot.send_chat_action(message.chat.id, 'typing')
-        msg_wait = bot.reply_to(message, "A desenhar o teu gráfico de evolução dos últimos 30 dias... 📊⏳")
+        saida.send_chat_action(message.chat.id, 'typing')
+        msg_wait = saida.reply_to(message, "A desenhar o teu gráfico de evolução dos últimos 30 dias... 📊⏳")
         caminho_grafico = gerar_grafico_progresso(30)
 
         if caminho_grafico and os.path.exists(caminho_grafico):
             with open(caminho_grafico, 'rb') as foto:
-                bot.send_photo(message.chat.id, foto, caption="A tua evolução nos últimos 30 dias! 🚀")
+                saida.send_photo(message.chat.id, foto, caption="A tua evolução nos últimos 30 dias! 🚀")
             os.remove(caminho_grafico)  # Limpa o arquivo temporário após o envio
-            bot.delete_message(message.chat.id, msg_wait.message_id)
+            saida.delete_message(message.chat.id, msg_wait.message_id)
         else:
-            bot.edit_message_text(
+            saida.edit_message_text(
                 "Não consegui gerar o teu gráfico neste momento. Tu tens pedalado nos últimos dias?",
                 chat_id=message.chat.id,
                 message_id=msg_wait.message_id
@@ -242,53 +554,87 @@ def enviar_grafico(message) -> None:
 
     except Exception as e:
         logger.error(f"Erro no /grafico: {e}")
-        bot.reply_to(message, "⚠️ Erro ao gerar o gráfico. Tente novamente em instantes.")
+        saida.reply_to(message, "⚠️ Erro ao gerar o gráfico. Tente novamente em instantes.")
+
+
+@bot.message_handler(commands=['mapa'])
+@fila_chats.por_chat
+def enviar_mapa(message) -> None:
+    """Comando /mapa: mapa de calor das rotas dos últimos meses."""
+    try:
+        meses = meses_do_mapa(message.text)
+        if meses is None:
+            saida.reply_to(message, f"⚠️ Período inválido. Use de 1 a {MAX_MESES_MAPA} meses, ex: `/mapa 6`",
+                           parse_mode='Markdown')
+            return
+
+        saida.send_chat_action(message.chat.id, 'typing')
+        msg_wait = saida.reply_to(message, "A desenhar o mapa de calor das tuas rotas... 🗺️⏳")
+        caminho_mapa = gerar_mapa_calor(meses)
+
+        if caminho_mapa and os.path.exists(caminho_mapa):
+            with open(caminho_mapa, 'rb') as foto:
+                saida.send_photo(message.chat.id, foto, caption="Por onde tu andaste a pedalar! 🔥")
+            os.remove(caminho_mapa)
+            saida.delete_message(message.chat.id, msg_wait.message_id)
+        else:
+            saida.edit_message_text(
+                "Não encontrei pedais com GPS nesse período para desenhar o mapa.",
+                chat_id=message.chat.id,
+                message_id=msg_wait.message_id
+            )
+
+    except Exception as e:
+        logger.error(f"Erro no /mapa: {e}")
+        saida.reply_to(message, "⚠️ Erro ao gerar o mapa. Tente novamente em instantes.")
 
 
 @bot.message_handler(commands=['semana'])
+@fila_chats.por_chat
 def analisar_semana(message) -> None:
     """Comando /semana: análise semanal com treino + clima + bike + meta."""
     try:
-        bot.send_chat_action(message.chat.id, 'typing')
-        bot.reply_to(message, "A procurar dados de treino, metas do mês, clima e equipamento... ⏳")
+        saida.send_chat_action(message.chat.id, 'typing')
+        saida.reply_to(message, "A procurar dados de treino, metas do mês, clima e equipamento... ⏳")
 
         chat_id = str(message.chat.id)
         meta_usuario = obter_meta_usuario(chat_id, META_MENSAL_KM)
-        meta = obter_progresso_mensal(meta_usuario)
-        texto_meta = meta if isinstance(meta, str) else meta.get('texto', 'Erro ao obter meta.')
+        # Fontes buscadas em paralelo sob o prazo de contexto; as lentas entram como indisponíveis
+        dados = registro_contexto.resolver(['semana', ('progresso', meta_usuario), 'clima', 'bike'])
+        texto_meta = registro_contexto.provedor('progresso').formatar(dados['progresso'])
 
         prompt = (
             f"O atleta pediu um resumo manual agora. "
-            f"Treino Semana: {obter_resumo_semana()}. "
+            f"Treino Semana: {dados['semana']}. "
             f"Meta Mês: {texto_meta}. "
-            f"Clima: {obter_previsao_tempo()}. "
-            f"Bike: {obter_status_bike_texto()}."
+            f"Clima: {dados['clima']}. "
+            f"Bike: {dados['bike'][0]}."
             f"\n\nInstruções: Faça um resumo engajador juntando todas as informações, motivando o atleta a bater a meta mensal."
         )
 
-        session = get_chat_session(chat_id)
-        guardar_memoria(chat_id, "user", "[AUTO] Resumo semanal solicitado via /semana")
-        resposta_ia = session.send_message(prompt)
-        guardar_memoria(chat_id, "model", resposta_ia.text)
-
-        enviar_resposta_segura(bot, message.chat.id, resposta_ia.text, reply_to=message)
+        responder_com_ia(
+            message, prompt, '/semana',
+            texto_memoria="[AUTO] Resumo semanal solicitado via /semana"
+        )
 
         # Verificar conquistas
-        conquista = _verificar_conquistas(chat_id, meta_usuario)
+        conquista = _verificar_conquistas(chat_id, meta_usuario, progresso=dados['progresso'],
+                                          status_bike=dados['bike'])
         if conquista:
-            bot.send_message(message.chat.id, conquista)
+            saida.send_message(message.chat.id, conquista)
 
     except Exception as e:
         logger.error(f"Erro no /semana: {e}")
-        bot.reply_to(message, "⚠️ Erro ao processar. Tente novamente em instantes.")
+        saida.reply_to(message, _texto_erro(e))
 
 
 @bot.message_handler(commands=['pedal'])
+@fila_chats.por_chat
 def ultimo_pedal(message) -> None:
     """Comando /pedal: mostra dados detalhados do último pedal."""
     try:
-        bot.send_chat_action(message.chat.id, 'typing')
-        bot.reply_to(message, "A buscar o teu último pedal no Strava... 🚴⏳")
+        saida.send_chat_action(message.chat.id, 'typing')
+        saida.reply_to(message, "A buscar o teu último pedal no Strava... 🚴⏳")
         dados_pedal = obter_ultimo_pedal()
         prompt = (
             f"O atleta pediu os dados do último pedal. "
@@ -297,25 +643,19 @@ def ultimo_pedal(message) -> None:
             f"para construir o 'motor' aeróbico."
         )
 
-        chat_id = message.chat.id
-        session = get_chat_session(chat_id)
-
-        guardar_memoria(chat_id, "user", "/pedal")
-        resposta_ia = session.send_message(prompt)
-        guardar_memoria(chat_id, "model", resposta_ia.text)
-
-        enviar_resposta_segura(bot, message.chat.id, resposta_ia.text, reply_to=message)
+        responder_com_ia(message, prompt, '/pedal', texto_memoria="/pedal")
     except Exception as e:
         logger.error(f"Erro no /pedal: {e}")
-        bot.reply_to(message, "⚠️ Erro ao processar. Tente novamente em instantes.")
+        saida.reply_to(message, _texto_erro(e))
 
 
 @bot.message_handler(commands=['bike'])
+@fila_chats.por_chat
 def status_bike(message) -> None:
     """Comando /bike: mostra status e dicas de manutenção da bicicleta."""
     try:
-        bot.send_chat_action(message.chat.id, 'typing')
-        bot.reply_to(message, "A verificar a garagem... 🔧⏳")
+        saida.send_chat_action(message.chat.id, 'typing')
+        saida.reply_to(message, "A verificar a garagem... 🔧⏳")
         resultado = obter_status_bike()
         texto_bike, km, nome = resultado
 
@@ -330,45 +670,33 @@ def status_bike(message) -> None:
             f"Seja amigável e prático."
         )
 
-        chat_id = message.chat.id
-        session = get_chat_session(chat_id)
-
-        guardar_memoria(chat_id, "user", "/bike")
-        resposta_ia = session.send_message(prompt)
-        guardar_memoria(chat_id, "model", resposta_ia.text)
-
-        enviar_resposta_segura(bot, message.chat.id, resposta_ia.text, reply_to=message)
+        responder_com_ia(message, prompt, '/bike', texto_memoria="/bike")
     except Exception as e:
         logger.error(f"Erro no /bike: {e}")
-        bot.reply_to(message, "⚠️ Erro ao processar. Tente novamente em instantes.")
+        saida.reply_to(message, _texto_erro(e))
 
 
 @bot.message_handler(commands=['clima'])
+@fila_chats.por_chat
 def comando_clima(message) -> None:
     """Comando /clima: previsão do tempo com contexto de pedal."""
     try:
-        bot.send_chat_action(message.chat.id, 'typing')
-        bot.reply_to(message, "A olhar para o céu... ☁️⏳")
+        saida.send_chat_action(message.chat.id, 'typing')
+        saida.reply_to(message, "A olhar para o céu... ☁️⏳")
         clima_atual = obter_previsao_tempo()
         prompt = (
             f"O atleta pediu a previsão do tempo. "
             f"Responda de forma parceira e motivadora usando estes dados: {clima_atual}"
         )
 
-        chat_id = message.chat.id
-        session = get_chat_session(chat_id)
-
-        guardar_memoria(chat_id, "user", "/clima")
-        resposta_ia = session.send_message(prompt)
-        guardar_memoria(chat_id, "model", resposta_ia.text)
-
-        enviar_resposta_segura(bot, message.chat.id, resposta_ia.text, reply_to=message)
+        responder_com_ia(message, prompt, '/clima', texto_memoria="/clima")
     except Exception as e:
         logger.error(f"Erro no /clima: {e}")
-        bot.reply_to(message, "⚠️ Erro ao processar. Tente novamente em instantes.")
+        saida.reply_to(message, _texto_erro(e))
 
 
 @bot.message_handler(commands=['meta'])
+@fila_chats.por_chat
 def comando_meta(message) -> None:
     """Comando /meta: permite ao atleta definir sua meta mensal de km."""
     try:
@@ -377,7 +705,7 @@ def comando_meta(message) -> None:
 
         if len(partes) < 2:
             meta_atual = obter_meta_usuario(chat_id, META_MENSAL_KM)
-            bot.reply_to(
+            saida.reply_to(
                 message,
                 f"🎯 Sua meta mensal atual é de *{meta_atual:.0f} km*.\n\n"
                 f"Para alterar, use: `/meta 200` (exemplo para 200km)",
@@ -388,11 +716,11 @@ def comando_meta(message) -> None:
         try:
             nova_meta = float(partes[1])
         except ValueError:
-            bot.reply_to(message, "⚠️ Valor inválido. Use um número, ex: `/meta 200`", parse_mode='Markdown')
+            saida.reply_to(message, "⚠️ Valor inválido. Use um número, ex: `/meta 200`", parse_mode='Markdown')
             return
 
         if nova_meta <= 0 or nova_meta > 10000:
-            bot.reply_to(message, "⚠️ A meta deve ser entre 1 e 10.000 km.")
+            saida.reply_to(message, "⚠️ A meta deve ser entre 1 e 10.000 km.")
             return
 
         # Garante que o usuário existe na tabela
@@ -400,27 +728,24 @@ def comando_meta(message) -> None:
         sucesso = atualizar_meta_usuario(chat_id, nova_meta)
 
         if sucesso:
-            bot.send_chat_action(message.chat.id, 'typing')
-            session = get_chat_session(chat_id)
+            saida.send_chat_action(message.chat.id, 'typing')
             prompt = f"O atleta acabou de atualizar sua meta mensal para {nova_meta:.0f} km. Parabenize e motive!"
-            guardar_memoria(chat_id, "user", f"/meta {nova_meta:.0f}")
-            resposta_ia = session.send_message(prompt)
-            guardar_memoria(chat_id, "model", resposta_ia.text)
-            enviar_resposta_segura(bot, message.chat.id, resposta_ia.text, reply_to=message)
+            responder_com_ia(message, prompt, '/meta', texto_memoria=f"/meta {nova_meta:.0f}")
         else:
-            bot.reply_to(message, "⚠️ Erro ao salvar a meta. Tente novamente.")
+            saida.reply_to(message, "⚠️ Erro ao salvar a meta. Tente novamente.")
 
     except Exception as e:
         logger.error(f"Erro no /meta: {e}")
-        bot.reply_to(message, "⚠️ Erro ao processar. Tente novamente em instantes.")
+        saida.reply_to(message, _texto_erro(e))
 
 
 @bot.message_handler(commands=['historico'])
+@fila_chats.por_chat
 def comando_historico(message) -> None:
     """Comando /historico: mostra evolução mensal comparativa."""
     try:
-        bot.send_chat_action(message.chat.id, 'typing')
-        bot.reply_to(message, "A compilar o teu histórico de evolução... 📈⏳")
+        saida.send_chat_action(message.chat.id, 'typing')
+        saida.reply_to(message, "A compilar o teu histórico de evolução... 📈⏳")
 
         historico = obter_historico_mensal(meses=3)
 
@@ -436,23 +761,19 @@ def comando_historico(message) -> None:
             f"Se houve queda, encoraje a retomar com dicas práticas."
         )
 
-        session = get_chat_session(chat_id)
-        guardar_memoria(chat_id, "user", "/historico")
-        resposta_ia = session.send_message(prompt)
-        guardar_memoria(chat_id, "model", resposta_ia.text)
-
-        enviar_resposta_segura(bot, message.chat.id, resposta_ia.text, reply_to=message)
+        responder_com_ia(message, prompt, '/historico', texto_memoria="/historico")
     except Exception as e:
         logger.error(f"Erro no /historico: {e}")
-        bot.reply_to(message, "⚠️ Erro ao processar. Tente novamente em instantes.")
+        saida.reply_to(message, _texto_erro(e))
 
 
 @bot.message_handler(commands=['ranking'])
+@fila_chats.por_chat
 def comando_ranking(message) -> None:
     """Comando /ranking: mostra ranking de km entre membros registrados."""
     try:
-        bot.send_chat_action(message.chat.id, 'typing')
-        bot.reply_to(message, "A montar o ranking da equipe... 🏆⏳")
+        saida.send_chat_action(message.chat.id, 'typing')
+        saida.reply_to(message, "A montar o ranking da equipe... 🏆⏳")
 
         ranking = obter_ranking_usuarios()
 
@@ -465,69 +786,63 @@ def comando_ranking(message) -> None:
             f"(🥇🥈🥉) para os 3 primeiros."
         )
 
-        session = get_chat_session(chat_id)
-        guardar_memoria(chat_id, "user", "/ranking")
-        resposta_ia = session.send_message(prompt)
-        guardar_memoria(chat_id, "model", resposta_ia.text)
-
-        enviar_resposta_segura(bot, message.chat.id, resposta_ia.text, reply_to=message)
+        responder_com_ia(message, prompt, '/ranking', texto_memoria="/ranking")
     except Exception as e:
         logger.error(f"Erro no /ranking: {e}")
-        bot.reply_to(message, "⚠️ Erro ao processar. Tente novamente em instantes.")
+        saida.reply_to(message, _texto_erro(e))
+
+
+@bot.message_handler(commands=['importacao'])
+@fila_chats.por_chat
+def comando_importacao(message) -> None:
+    """Comando /importacao: progresso da importação do histórico completo do Strava."""
+    try:
+        saida.reply_to(message, importacao_historico.texto_progresso())
+    except Exception as e:
+        logger.error(f"Erro no /importacao: {e}")
+        saida.reply_to(message, _texto_erro(e))
 
 
 @bot.message_handler(content_types=['voice'])
+@fila_chats.por_chat
 def receber_audio(message) -> None:
     """Handler para receber e processar mensagens de áudio (Walkie-Talkie)."""
     try:
-        msg_wait = bot.reply_to(message, "A ouvir o teu áudio... 🎧⏳")
-        bot.send_chat_action(message.chat.id, 'record_voice')
+        msg_wait = saida.reply_to(message, "A ouvir o teu áudio... 🎧⏳")
+        saida.send_chat_action(message.chat.id, 'record_voice')
 
+        # Os bytes vão da memória direto para o Gemini, sem arquivo temporário
         file_info = bot.get_file(message.voice.file_id)
-        downloaded_file = bot.download_file(file_info.file_path)
-
-        # Arquivo temporário seguro
-        tmp_file = tempfile.NamedTemporaryFile(
-            suffix='.ogg', prefix=f'audio_{message.chat.id}_', delete=False
-        )
-        tmp_file.write(downloaded_file)
-        tmp_file.close()
-        caminho_temporario = tmp_file.name
+        audio = bot.download_file(file_info.file_path)
 
         prompt = "O atleta enviou esta mensagem de áudio (Walkie-Talkie) possivelmente durante ou após o seu pedal. Escute, faça um breve resumo do que ele falou e responda como seu Coach parceiro de treino."
 
-        resposta = processar_mensagem_audio(message.chat.id, caminho_temporario, prompt_adicional=prompt)
-
-        # Limpar o arquivo temporário
-        if os.path.exists(caminho_temporario):
-            os.remove(caminho_temporario)
+        resposta = processar_mensagem_audio(
+            message.chat.id, audio, prompt_adicional=prompt,
+            chave_midia=message.voice.file_unique_id, mime_type=message.voice.mime_type or 'audio/ogg'
+        )
 
-        bot.delete_message(message.chat.id, msg_wait.message_id)
-        enviar_resposta_segura(bot, message.chat.id, resposta, reply_to=message)
+        saida.delete_message(message.chat.id, msg_wait.message_id)
+        enviar_resposta_segura(saida, message.chat.id, resposta, reply_to=message)
 
     except Exception as e:
         logger.error(f"Erro no processamento de áudio: {e}")
-        bot.reply_to(message, "⚠️ Erro ao processar o seu áudio. Os meus ouvidos digitais falharam, pode gravar de novo ou enviar por texto?")
+        saida.reply_to(message, "⚠️ Erro ao processar o seu áudio. Os meus ouvidos digitais falharam, pode gravar de novo ou enviar por texto?")
 
 
 @bot.message_handler(content_types=['photo'])
+@fila_chats.por_chat
 def receber_foto(message) -> None:
     """Handler para receber e analisar fotos enviadas pelo atleta."""
     try:
-        msg_wait = bot.reply_to(message, "A analisar a tua foto... 📸⏳")
-        bot.send_chat_action(message.chat.id, 'typing')
-
-        # Pegar a foto de maior resolução (último item da lista)
-        file_info = bot.get_file(message.photo[-1].file_id)
-        downloaded_file = bot.download_file(file_info.file_path)
+        msg_wait = saida.reply_to(message, "A analisar a tua foto... 📸⏳")
+        saida.send_chat_action(message.chat.id, 'typing')
 
-        # Arquivo temporário seguro
-        tmp_file = tempfile.NamedTemporaryFile(
-            suffix='.jpg', prefix=f'foto_{message.chat.id}_', delete=False
-        )
-        tmp_file.write(downloaded_file)
-        tmp_file.close()
-        caminho_temporario = tmp_file.name
+        # Menor resolução que atende a análise; o que sobrar é reduzido antes do upload
+        lado_alvo = lado_alvo_foto(message.caption)
+        foto = escolher_tamanho_foto(message.photo, lado_alvo)
+        file_info = bot.get_file(foto.file_id)
+        dados_foto, pixels = reduzir_foto(bot.download_file(file_info.file_path), lado_alvo)
 
         # Usar a legenda da foto como contexto adicional, se houver
         legenda = message.caption or ""
@@ -538,69 +853,69 @@ def receber_foto(message) -> None:
             f"dê dicas relevantes. Se for da trilha, comente sobre o terreno e motivação."
         )
 
-        resposta = processar_mensagem_foto(message.chat.id, caminho_temporario, prompt_adicional=prompt)
-
-        # Limpar o arquivo temporário
-        if os.path.exists(caminho_temporario):
-            os.remove(caminho_temporario)
+        resposta = processar_mensagem_foto(
+            message.chat.id, dados_foto, prompt_adicional=prompt,
+            chave_midia=f"{foto.file_unique_id}@{lado_alvo}", pixels=pixels
+        )
 
-        bot.delete_message(message.chat.id, msg_wait.message_id)
-        enviar_resposta_segura(bot, message.chat.id, resposta, reply_to=message)
+        saida.delete_message(message.chat.id, msg_wait.message_id)
+        enviar_resposta_segura(saida, message.chat.id, resposta, reply_to=message)
 
     except Exception as e:
         logger.error(f"Erro no processamento de foto: {e}")
-        bot.reply_to(message, "⚠️ Erro ao analisar a foto. Pode enviar novamente ou descrever por texto?")
+        saida.reply_to(message, "⚠️ Erro ao analisar a foto. Pode enviar novamente ou descrever por texto?")
 
 
-@bot.message_handler(func=lambda message: True)
-def conversa_livre(message) -> None:
-    """Handler de conversa livre com interceptação inteligente de contexto."""
+def _responder_conversa(mensagens: list) -> None:
+    """Responde a um lote de mensagens de conversa livre com interceptação inteligente de contexto."""
+    message = mensagens[-1]
+    texto = juntar_mensagens(mensagens)
     try:
-        # Guard: ignora mensagens sem texto (stickers, GIFs, documentos, etc.)
-        if not message.text:
-            return
-
-        # Rate limiting: evita spam de chamadas ao Gemini
-        if not _check_rate_limit(message.chat.id):
-            return
-
-        bot.send_chat_action(message.chat.id, 'typing')
-        texto_usuario = message.text.lower()
+        saida.send_chat_action(message.chat.id, 'typing')
+        intencoes = detectar_intencoes(texto)
 
-        prompt_final = message.text
-        dados_extras: list[str] = []
+        pedidos: list[str] = []
 
         # 🕵️ INTERCEPTADOR DE CLIMA
-        if any(palavra in texto_usuario for palavra in PALAVRAS_CLIMA):
-            clima_atual = obter_previsao_tempo()
-            dados_extras.append(f"[DADOS DE CLIMA: {clima_atual}]")
+        if 'clima' in intencoes:
+            pedidos.append('clima')
 
         # 🚴 INTERCEPTADOR DE STRAVA
-        if any(palavra in texto_usuario for palavra in PALAVRAS_STRAVA):
-            dados_strava = obter_ultimo_pedal()
-            resumo_semana = obter_resumo_semana()
-            dados_extras.append(f"[DADOS ÚLTIMO PEDAL: {dados_strava}]")
-            dados_extras.append(f"[DADOS SEMANA: {resumo_semana}]")
+        if 'strava' in intencoes:
+            pedidos.extend(['ultimo_pedal', 'semana'])
 
         # 🔧 INTERCEPTADOR DE BIKE
-        if any(palavra in texto_usuario for palavra in PALAVRAS_BIKE):
-            bike_texto = obter_status_bike_texto()
-            dados_extras.append(f"[DADOS BIKE: {bike_texto}]")
-
-        if dados_extras:
-            prompt_final = message.text + "\n\n" + "\n".join(dados_extras)
-
-        chat_id = message.chat.id
-        session = get_chat_session(chat_id)
+        if 'bike' in intencoes:
+            pedidos.append('bike')
 
-        guardar_memoria(chat_id, "user", message.text)
-        resposta_ia = session.send_message(prompt_final)
-        guardar_memoria(chat_id, "model", resposta_ia.text)
+        # Busca em paralelo; a resposta espera no máximo o prazo de contexto
+        dados_extras = registro_contexto.blocos(registro_contexto.resolver(pedidos)) if pedidos else []
 
-        enviar_resposta_segura(bot, message.chat.id, resposta_ia.text, reply_to=message)
+        # O orçamento de tokens decide quais blocos cabem no prompt final
+        responder_com_ia(message, texto, 'conversa', dados_extras=dados_extras)
     except Exception as e:
         logger.error(f"Erro na conversa livre: {e}")
-        bot.reply_to(message, "⚠️ Erro ao processar. Tente novamente em instantes.")
+        saida.reply_to(message, _texto_erro(e))
+
+
+# Mensagens seguidas do mesmo chat viram um único lote (uma chamada ao Gemini), respondido na fila do chat;
+# o lote não conta no limite da fila, que recusaria de uma vez todas as mensagens juntadas nele
+agrupador = AgrupadorMensagens(
+    lambda chat_id, mensagens: fila_chats.submeter_sem_limite(chat_id, _responder_conversa, mensagens),
+    janela=JANELA_AGRUPAMENTO_SEG,
+    respostas_por_minuto=RESPOSTAS_POR_MINUTO
+)
+# Um comando não passa na frente do texto que o chat mandou antes dele
+fila_chats.definir_antes_de_enfileirar(agrupador.liberar)
+
+
+@bot.message_handler(func=lambda message: True)
+def conversa_livre(message) -> None:
+    """Handler de conversa livre: a mensagem entra no agrupador do chat."""
+    # Guard: ignora mensagens sem texto (stickers, GIFs, documentos, etc.)
+    if not message.text:
+        return
+    agrupador.adicionar(message.chat.id, message)
 
 
 # ==========================================
@@ -610,6 +925,8 @@ def _graceful_shutdown(signum, frame) -> None:
     """Encerra o bot de forma limpa ao receber SIGTERM ou SIGINT."""
     logger.info(f"Sinal {signum} recebido. Encerrando o bot de forma segura...")
     bot.stop_polling()
+    fila_chats.encerrar()
+    salvar_sessoes_ativas()
     logger.info("Bot encerrado com sucesso.")
     sys.exit(0)
 
@@ -622,9 +939,7 @@ def main() -> None:
     signal.signal(signal.SIGINT, _graceful_shutdown)
     signal.signal(signal.SIGTERM, _graceful_shutdown)
 
-    # Agendamento: Sexta-feira às 18:00
-    schedule.every().friday.at("18:00").do(mensagem_planeamento_fim_de_semana)
-    threading.Thread(target=agendador_em_segundo_plano, daemon=True).start()
+    iniciar_agendador()
 
     # Heartbeat inicial
     _escrever_heartbeat()
@@ -0,0 +1,139 @@
+"""
+Cache de contexto explícito do Gemini (cached content).
+Guarda no servidor a instrução de sistema e a parte estável (mais antiga) do histórico
+de cada chat, para que essas partes não sejam reprocessadas a cada mensagem.
+Os nomes dos caches criados ficam no cache em duas camadas: depois de um restart o
+bot volta a usar os caches que ainda estão vivos no servidor em vez de criar outros.
+"""
+from __future__ import annotations
+import hashlib
+import threading
+import time
+from typing import Optional
+
+from google.genai import types
+
+from cache_persistente import ArmazemCache, CacheDuasCamadas
+from config import logger
+from orcamento_tokens import estimar_tokens, tokens_historico
+
+# Quantidade de itens recentes do histórico que ficam fora do cache (mudam a cada turno)
+_ITENS_RECENTES: int = 6
+
+# Mínimo de tokens aceito pela API para criar um cache explícito
+_MIN_TOKENS_CACHE: int = 1024
+
+# Margem de segurança: um cache prestes a expirar é tratado como expirado
+_MARGEM_EXPIRACAO_SEG: int = 60
+
+# Tempo que o cache fica desligado depois que a API recusa a criação
+_PAUSA_APOS_FALHA_SEG: int = 600
+
+
+def _impressao_digital(instrucao: str, prefixo: list[types.Content]) -> str:
+    """Hash estável da instrução de sistema + prefixo do histórico."""
+    h = hashlib.sha256(instrucao.encode('utf-8'))
+    for conteudo in prefixo:
+        h.update(f"\x00{conteudo.role}\x00".encode('utf-8'))
+        for parte in conteudo.parts or []:
+            h.update((parte.text or '').encode('utf-8'))
+    return h.hexdigest()
+
+
+class GerenciadorCacheContexto:
+    """
+    Cria, reutiliza e invalida os caches de contexto por chat.
+    O cliente é injetado para permitir testes com um cliente falso.
+    """
+
+    def __init__(self, cliente, modelo: str, ttl_segundos: int,
+                 armazem: Optional[ArmazemCache] = None) -> None:
+        self._cliente = cliente
+        self._modelo = modelo
+        self._ttl = ttl_segundos
+        # chat_id -> {'nome', 'impressao'}; cada item vence junto com o cache no servidor
+        self._caches = CacheDuasCamadas(
+            'cache_contexto', ttl=max(0, ttl_segundos - _MARGEM_EXPIRACAO_SEG), max_itens=1000, armazem=armazem
+        )
+        self._indisponivel_ate: float = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def ativo(self) -> bool:
+        return self._ttl > 0 and time.time() >= self._indisponivel_ate
+
+    def preparar_sessao(
+        self, chat_id: str, instrucao: str, historico: list[types.Content]
+    ) -> tuple[types.GenerateContentConfig, list[types.Content]]:
+        """
+        Retorna a configuração e o histórico a usar ao criar a sessão do chat.
+        Com cache: a config aponta para o cached content e o histórico contém só
+        os itens recentes. Sem cache (desligado, pequeno demais ou erro da API):
+        config normal com a instrução de sistema e o histórico completo.
+        """
+        chat_id = str(chat_id)
+        config_normal = types.GenerateContentConfig(system_instruction=instrucao)
+        if not self.ativo:
+            return config_normal, historico
+
+        prefixo, recentes = self._dividir_historico(historico)
+        if estimar_tokens(instrucao) + tokens_historico(prefixo) < _MIN_TOKENS_CACHE:
+            # Conteúdo pequeno demais para a API aceitar; um cache antigo perdeu a validade
+            self.invalidar(chat_id)
+            return config_normal, historico
+
+        impressao = _impressao_digital(instrucao, prefixo)
+        atual = self._caches.obter(chat_id)
+        if atual and atual['impressao'] == impressao:
+            logger.debug(f"Cache de contexto reutilizado para o chat {chat_id}.")
+            return types.GenerateContentConfig(cached_content=atual['nome']), recentes
+
+        # Prefixo mudou ou expirou: o cache anterior não serve mais
+        self.invalidar(chat_id)
+        try:
+            cache = self._cliente.caches.create(
+                model=self._modelo,
+                config=types.CreateCachedContentConfig(
+                    display_name=f"coach_{chat_id}",
+                    system_instruction=instrucao,
+                    contents=prefixo,
+                    ttl=f"{self._ttl}s"
+                )
+            )
+        except Exception as e:
+            logger.warning(f"Cache de contexto indisponível, seguindo sem cache: {e}")
+            self._indisponivel_ate = time.time() + _PAUSA_APOS_FALHA_SEG
+            return config_normal, historico
+
+        self._caches.guardar(chat_id, {'nome': cache.name, 'impressao': impressao})
+        logger.info(f"Cache de contexto criado para o chat {chat_id} ({len(prefixo)} itens).")
+        return types.GenerateContentConfig(cached_content=cache.name), recentes
+
+    def expira_em(self, chat_id: str) -> Optional[float]:
+        """
+        Até quando (epoch, já com a margem) vale o cache que a sessão do chat usa; None sem
+        cache. Um cache reaproveitado vence no prazo de quando foi criado, não de agora.
+        """
+        item = self._caches.obter_item(str(chat_id))
+        return None if item is None else item[1] + self._caches.ttl
+
+    def invalidar(self, chat_id: str) -> None:
+        """Descarta o cache do chat (localmente e, se possível, no servidor)."""
+        with self._lock:
+            atual = self._caches.obter(str(chat_id))
+            if not atual:
+                return
+            self._caches.remover(str(chat_id))
+        try:
+            self._cliente.caches.delete(name=atual['nome'])
+        except Exception as e:
+            # O cache expira sozinho no servidor; falhar aqui não é grave
+            logger.debug(f"Não foi possível apagar o cache {atual['nome']}: {e}")
+
+    def _dividir_historico(
+        self, historico: list[types.Content]
+    ) -> tuple[list[types.Content], list[types.Content]]:
+        """Separa o prefixo estável dos itens recentes, mantendo pares user/model."""
+        corte = max(0, len(historico) - _ITENS_RECENTES)
+        corte -= corte % 2
+        return historico[:corte], historico[corte:]
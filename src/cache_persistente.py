@@ -0,0 +1,263 @@
+"""
+Cache em duas camadas do Coach-Strava: LRU em memória sobre uma tabela SQLite no
+volume `data/`. A memória atende o caminho quente; o disco guarda cada valor até o
+TTL vencer, então um restart (deploy, `restart: unless-stopped`) começa com os
+caches aquecidos em vez de disparar tudo contra o Strava, o OpenWeather e o Gemini.
+Cada namespace tem seu TTL, seu limite de itens e suas estatísticas de acerto.
+No runtime assíncrono o disco nunca é tocado no event loop: leituras vão para uma
+thread e gravações (pickle + commit) são feitas em segundo plano.
+"""
+from __future__ import annotations
+import asyncio
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Hashable, Optional
+
+from config import CACHE_DB_PATH, logger
+
+
+class ArmazemCache:
+    """Camada persistente: uma tabela (namespace, chave) -> valor serializado com pickle."""
+
+    def __init__(self, caminho: str) -> None:
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _conexao(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.caminho, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL;')
+            self._conn.execute('PRAGMA synchronous=NORMAL;')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS cache (
+                    namespace TEXT NOT NULL,
+                    chave TEXT NOT NULL,
+                    valor BLOB NOT NULL,
+                    guardado_em REAL NOT NULL,
+                    expira_em REAL NOT NULL,
+                    PRIMARY KEY (namespace, chave)
+                )
+            ''')
+            self._conn.commit()
+        return self._conn
+
+    def ler(self, namespace: str, chave: str) -> Optional[tuple[bytes, float, float]]:
+        """(valor serializado, guardado_em, expira_em) ou None."""
+        with self._lock:
+            try:
+                return self._conexao().execute(
+                    'SELECT valor, guardado_em, expira_em FROM cache WHERE namespace = ? AND chave = ?',
+                    (namespace, chave)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"Erro ao ler o cache persistente ({namespace}): {e}")
+                return None
+
+    def gravar(self, namespace: str, chave: str, valor: bytes, guardado_em: float, expira_em: float) -> None:
+        with self._lock:
+            try:
+                conn = self._conexao()
+                conn.execute(
+                    'INSERT OR REPLACE INTO cache (namespace, chave, valor, guardado_em, expira_em) VALUES (?, ?, ?, ?, ?)',
+                    (namespace, chave, valor, guardado_em, expira_em)
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Erro ao gravar no cache persistente ({namespace}): {e}")
+
+    def apagar(self, namespace: str, chave: Optional[str] = None) -> None:
+        """Apaga uma chave ou, sem chave, o namespace inteiro."""
+        with self._lock:
+            try:
+                conn = self._conexao()
+                if chave is None:
+                    conn.execute('DELETE FROM cache WHERE namespace = ?', (namespace,))
+                else:
+                    conn.execute('DELETE FROM cache WHERE namespace = ? AND chave = ?', (namespace, chave))
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Erro ao apagar do cache persistente ({namespace}): {e}")
+
+    def podar(self, namespace: str, max_itens: int) -> int:
+        """Remove os itens vencidos e, passando de `max_itens`, os mais antigos. Retorna quantos saíram."""
+        with self._lock:
+            try:
+                conn = self._conexao()
+                removidos = conn.execute(
+                    'DELETE FROM cache WHERE namespace = ? AND expira_em <= ?', (namespace, time.time())
+                ).rowcount
+                removidos += conn.execute('''
+                    DELETE FROM cache WHERE namespace = ? AND chave NOT IN (
+                        SELECT chave FROM cache WHERE namespace = ? ORDER BY guardado_em DESC LIMIT ?
+                    )
+                ''', (namespace, namespace, max_itens)).rowcount
+                conn.commit()
+                return removidos
+            except sqlite3.Error as e:
+                logger.error(f"Erro ao podar o cache persistente ({namespace}): {e}")
+                return 0
+
+
+# Gravações em disco dos caminhos assíncronos: uma thread só, na ordem em que chegaram
+_gravacoes_disco = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cache-disco')
+
+
+class CacheDuasCamadas:
+    """
+    Cache de um namespace: LRU em memória (`max_itens`) sobre o `armazem` em disco.
+
+    - `obter(chave)` procura na memória, depois no disco (e promove para a memória);
+    - `guardar(chave, valor, ttl)` grava nas duas camadas; `ttl` sobrescreve o do namespace;
+    - valores que o pickle não serializa (ou `armazem=None`) ficam só na memória;
+    - `obter_item_async` e `guardar(..., disco_em_segundo_plano=True)` não bloqueiam o event loop.
+    """
+
+    def __init__(self, namespace: str, ttl: float, max_itens: int = 256,
+                 max_itens_disco: Optional[int] = None,
+                 armazem: Optional[ArmazemCache] = None) -> None:
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self.max_itens_disco = max_itens_disco or max_itens * 4
+        self._armazem = armazem
+        self._lock = threading.Lock()
+        # chave -> (valor, guardado_em, expira_em), em ordem de uso
+        self._memoria: OrderedDict[Hashable, tuple[Any, float, float]] = OrderedDict()
+        self._estatisticas = {'acertos_memoria': 0, 'acertos_disco': 0, 'faltas': 0,
+                              'gravacoes': 0, 'despejos': 0}
+        _caches_registrados[namespace] = self
+
+    def _guardar_memoria(self, chave: Hashable, entrada: tuple[Any, float, float]) -> None:
+        self._memoria[chave] = entrada
+        self._memoria.move_to_end(chave)
+        while len(self._memoria) > self.max_itens:
+            self._memoria.popitem(last=False)
+            self._estatisticas['despejos'] += 1
+
+    def _ler_memoria(self, chave: Hashable, agora: float) -> Optional[tuple[Any, float]]:
+        with self._lock:
+            entrada = self._memoria.get(chave)
+            if entrada is None:
+                return None
+            if entrada[2] > agora:
+                self._memoria.move_to_end(chave)
+                self._estatisticas['acertos_memoria'] += 1
+                return entrada[0], entrada[1]
+            del self._memoria[chave]
+            return None
+
+    def _ler_disco(self, chave: Hashable, agora: float) -> Optional[tuple[Any, float]]:
+        linha = self._armazem.ler(self.namespace, repr(chave)) if self._armazem is not None else None
+        if linha is not None and linha[2] > agora:
+            try:
+                valor = pickle.loads(linha[0])
+            except Exception as e:
+                logger.warning(f"Valor ilegível no cache persistente ({self.namespace}): {e}")
+            else:
+                with self._lock:
+                    self._guardar_memoria(chave, (valor, linha[1], linha[2]))
+                    self._estatisticas['acertos_disco'] += 1
+                return valor, linha[1]
+
+        with self._lock:
+            self._estatisticas['faltas'] += 1
+        return None
+
+    def obter_item(self, chave: Hashable) -> Optional[tuple[Any, float]]:
+        """(valor, guardado_em em epoch) se ainda dentro do TTL, ou None."""
+        agora = time.time()
+        item = self._ler_memoria(chave, agora)
+        return item if item is not None else self._ler_disco(chave, agora)
+
+    async def obter_item_async(self, chave: Hashable) -> Optional[tuple[Any, float]]:
+        """Versão assíncrona de `obter_item`: a memória responde na hora; o disco, numa thread."""
+        agora = time.time()
+        item = self._ler_memoria(chave, agora)
+        if item is not None or self._armazem is None:
+            return item if item is not None else self._ler_disco(chave, agora)
+        return await asyncio.to_thread(self._ler_disco, chave, agora)
+
+    def obter(self, chave: Hashable, padrao: Any = None) -> Any:
+        item = self.obter_item(chave)
+        return padrao if item is None else item[0]
+
+    def guardar(self, chave: Hashable, valor: Any, ttl: Optional[float] = None,
+                guardado_em: Optional[float] = None, disco_em_segundo_plano: bool = False) -> None:
+        """Grava na memória na hora; no disco também, ou depois numa thread (`disco_em_segundo_plano`)."""
+        guardado_em = time.time() if guardado_em is None else guardado_em
+        expira_em = guardado_em + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._guardar_memoria(chave, (valor, guardado_em, expira_em))
+            self._estatisticas['gravacoes'] += 1
+        if self._armazem is None:
+            return
+        if disco_em_segundo_plano:
+            _gravacoes_disco.submit(self._gravar_disco, chave, valor, guardado_em, expira_em)
+        else:
+            self._gravar_disco(chave, valor, guardado_em, expira_em)
+
+    def _gravar_disco(self, chave: Hashable, valor: Any, guardado_em: float, expira_em: float) -> None:
+        try:
+            dados = pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.debug(f"Valor do cache '{self.namespace}' fica só na memória (não serializável): {e}")
+            return
+        self._armazem.gravar(self.namespace, repr(chave), dados, guardado_em, expira_em)
+
+    def remover(self, chave: Hashable) -> None:
+        with self._lock:
+            self._memoria.pop(chave, None)
+        if self._armazem is not None:
+            self._armazem.apagar(self.namespace, repr(chave))
+
+    def limpar(self) -> None:
+        """Esvazia as duas camadas do namespace."""
+        with self._lock:
+            self._memoria.clear()
+        if self._armazem is not None:
+            self._armazem.apagar(self.namespace)
+
+    def podar(self) -> int:
+        """Remove do disco os itens vencidos e o excesso acima de `max_itens_disco`."""
+        if self._armazem is None:
+            return 0
+        return self._armazem.podar(self.namespace, self.max_itens_disco)
+
+    def __len__(self) -> int:
+        return len(self._memoria)
+
+    def estatisticas(self) -> dict[str, float]:
+        """Acertos por camada, faltas, gravações, despejos da memória e taxa de acerto."""
+        with self._lock:
+            est = dict(self._estatisticas)
+            est['itens_memoria'] = len(self._memoria)
+        consultas = est['acertos_memoria'] + est['acertos_disco'] + est['faltas']
+        est['taxa_acerto'] = round((est['acertos_memoria'] + est['acertos_disco']) / consultas, 3) if consultas else 0.0
+        return est
+
+
+# Armazém padrão (data/cache.db) e todos os caches criados, por namespace
+armazem_padrao = ArmazemCache(CACHE_DB_PATH)
+_caches_registrados: dict[str, CacheDuasCamadas] = {}
+
+
+def estatisticas_caches() -> dict[str, dict[str, float]]:
+    """Estatísticas de todos os namespaces."""
+    return {namespace: cache.estatisticas() for namespace, cache in list(_caches_registrados.items())}
+
+
+def manter_caches() -> None:
+    """Tarefa periódica: poda o disco de cada namespace e registra as taxas de acerto."""
+    for namespace, cache in list(_caches_registrados.items()):
+        removidos = cache.podar()
+        est = cache.estatisticas()
+        logger.info(
+            f"Cache '{namespace}': {est['taxa_acerto']:.0%} de acerto "
+            f"(memória {est['acertos_memoria']}, disco {est['acertos_disco']}, faltas {est['faltas']}), "
+            f"{removidos} itens podados do disco."
+        )
@@ -0,0 +1,180 @@
+"""
+Cache "stale-while-revalidate" dos dados externos (Strava, OpenWeather).
+Cada valor tem duas idades: até `fresco` segundos é servido direto; depois disso
+continua sendo servido na hora enquanto uma renovação roda em segundo plano, e só
+passado o `limite` o próximo pedido volta a esperar pela API. Se a fonte estiver fora
+do ar, o valor antigo segue valendo até o limite, marcado como desatualizado.
+A latência de quem pede deixa de depender das oscilações do serviço externo.
+Os valores ficam no cache em duas camadas (memória + disco), então sobrevivem a restarts.
+"""
+from __future__ import annotations
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Hashable, NamedTuple, Optional
+
+from cache_persistente import ArmazemCache, CacheDuasCamadas, armazem_padrao
+from config import logger
+
+# Renovações em segundo plano de todos os caches (são poucas e curtas)
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='renovacao')
+
+
+class Leitura(NamedTuple):
+    """Valor lido do cache, idade em segundos e se a última renovação falhou."""
+    valor: Any
+    idade: float = 0.0
+    desatualizado: bool = False
+
+
+def nota_desatualizado(leitura: Leitura) -> str:
+    """Aviso para o prompt quando o dado é antigo porque a fonte não respondeu."""
+    if not leitura.desatualizado:
+        return ""
+    return f" (dados de {leitura.idade / 60:.0f} min atrás: fonte fora do ar, usando a última leitura)"
+
+
+class CacheSWR:
+    """
+    chave -> valor com idade "fresco" e idade "limite".
+
+    - `obter(chave, buscar)` / `obter_async(chave, buscar_async)` devolvem uma `Leitura`;
+    - sem valor (ou passado o limite) a busca é feita na hora e o erro sobe para quem pediu;
+    - com valor velho, a renovação vai para o segundo plano (uma por chave por vez).
+    """
+
+    def __init__(self, nome: str, fresco: float, limite: float, max_itens: int = 32,
+                 armazem: Optional[ArmazemCache] = armazem_padrao) -> None:
+        self.nome = nome
+        self.fresco = fresco
+        self.limite = max(limite, fresco)
+        self._lock = threading.Lock()
+        self._itens = CacheDuasCamadas(nome, ttl=self.limite, max_itens=max_itens, armazem=armazem)
+        # Chaves cuja última renovação falhou (estado do processo, não vai para o disco)
+        self._falhas: set[Hashable] = set()
+        self._em_andamento: dict[Hashable, Future] = {}
+        self._em_andamento_async: dict[Hashable, asyncio.Future] = {}
+
+    # ------------------------------------------
+    # Leitura e escrita
+    # ------------------------------------------
+    def ler(self, chave: Hashable) -> Optional[Leitura]:
+        """Valor ainda dentro do limite (fresco ou não), ou None."""
+        return self._leitura(chave, self._itens.obter_item(chave))
+
+    async def ler_async(self, chave: Hashable) -> Optional[Leitura]:
+        """Versão assíncrona de `ler` (o disco é lido fora do event loop)."""
+        return self._leitura(chave, await self._itens.obter_item_async(chave))
+
+    def _leitura(self, chave: Hashable, item: Optional[tuple[Any, float]]) -> Optional[Leitura]:
+        if item is None:
+            return None
+        valor, guardado_em = item
+        idade = max(0.0, time.time() - guardado_em)
+        with self._lock:
+            falhou = chave in self._falhas
+        return Leitura(valor, idade, idade >= self.fresco and falhou)
+
+    def guardar(self, chave: Hashable, valor: Any, guardado_em: Optional[float] = None,
+                disco_em_segundo_plano: bool = False) -> None:
+        """Guarda o valor (`guardado_em` em epoch; padrão: agora)."""
+        self._itens.guardar(chave, valor, guardado_em=guardado_em, disco_em_segundo_plano=disco_em_segundo_plano)
+        with self._lock:
+            self._falhas.discard(chave)
+
+    def _registrar_falha(self, chave: Hashable, erro: BaseException) -> None:
+        # Sem valor anterior a marca não tem efeito: o erro já sobe para quem pediu
+        with self._lock:
+            self._falhas.add(chave)
+        logger.warning(f"Busca do cache '{self.nome}' ({chave}) falhou: {erro}")
+
+    def limpar(self) -> None:
+        self._itens.limpar()
+        with self._lock:
+            self._falhas.clear()
+
+    def estatisticas(self) -> dict[str, float]:
+        return self._itens.estatisticas()
+
+    def __len__(self) -> int:
+        return len(self._itens)
+
+    # ------------------------------------------
+    # Busca síncrona (threads)
+    # ------------------------------------------
+    @staticmethod
+    def _executar(futuro: Future, buscar: Callable[[], Any]) -> None:
+        try:
+            futuro.set_result(buscar())
+        except Exception as e:
+            futuro.set_exception(e)
+
+    def _buscar(self, chave: Hashable, buscar: Callable[[], Any], em_segundo_plano: bool) -> Future:
+        """
+        Reaproveita a busca em andamento da chave ou inicia uma nova: no segundo plano
+        (renovação) ou na própria thread de quem pediu (sem valor para servir).
+        """
+        with self._lock:
+            futuro = self._em_andamento.get(chave)
+            if futuro is not None:
+                return futuro
+            futuro = Future()
+            self._em_andamento[chave] = futuro
+
+        def _concluir(f: Future) -> None:
+            # Guarda antes de liberar a chave: quem chegar no meio já encontra o valor
+            if f.exception() is None:
+                self.guardar(chave, f.result())
+            else:
+                self._registrar_falha(chave, f.exception())
+            with self._lock:
+                self._em_andamento.pop(chave, None)
+
+        futuro.add_done_callback(_concluir)
+        if em_segundo_plano:
+            _executor.submit(self._executar, futuro, buscar)
+        else:
+            self._executar(futuro, buscar)
+        return futuro
+
+    def obter(self, chave: Hashable, buscar: Callable[[], Any]) -> Leitura:
+        """Valor do cache (renovando em segundo plano se velho) ou buscado agora."""
+        leitura = self.ler(chave)
+        if leitura is None:
+            return Leitura(self._buscar(chave, buscar, em_segundo_plano=False).result())
+        if leitura.idade >= self.fresco:
+            self._buscar(chave, buscar, em_segundo_plano=True)
+        return leitura
+
+    # ------------------------------------------
+    # Busca assíncrona
+    # ------------------------------------------
+    def _buscar_async(self, chave: Hashable, buscar_async: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        tarefa = self._em_andamento_async.get(chave)
+        if tarefa is not None:
+            return tarefa
+        tarefa = asyncio.ensure_future(buscar_async())
+        self._em_andamento_async[chave] = tarefa
+
+        def _concluir(t: asyncio.Future) -> None:
+            if not t.cancelled():
+                if t.exception() is None:
+                    # Callback no event loop: o pickle e o commit vão para a thread do disco
+                    self.guardar(chave, t.result(), disco_em_segundo_plano=True)
+                else:
+                    self._registrar_falha(chave, t.exception())
+            self._em_andamento_async.pop(chave, None)
+
+        tarefa.add_done_callback(_concluir)
+        return tarefa
+
+    async def obter_async(self, chave: Hashable, buscar_async: Callable[[], Awaitable[Any]]) -> Leitura:
+        """Versão assíncrona de `obter`."""
+        leitura = await self.ler_async(chave)
+        if leitura is None:
+            # shield: quem desistir de esperar não cancela a busca dos outros
+            return Leitura(await asyncio.shield(self._buscar_async(chave, buscar_async)))
+        if leitura.idade >= self.fresco:
+            self._buscar_async(chave, buscar_async)
+        return leitura
@@ -0,0 +1,135 @@
+"""
+Camada HTTP compartilhada do Coach-Strava (Strava e OpenWeather).
+Uma `SessaoHTTP` por serviço externo: conexões keep-alive reaproveitadas (sem refazer
+TCP/TLS a cada chamada), timeout padrão e um disjuntor (circuit breaker) que, depois de
+falhas seguidas, recusa as chamadas na hora por um tempo em vez de deixar threads
+presas esperando um serviço fora do ar. A mesma política de retry (com jitter) vale
+para todos os módulos.
+"""
+from __future__ import annotations
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from config import logger
+
+# (conexão, leitura) em segundos, para chamadas sem timeout explícito
+TIMEOUT_PADRAO: tuple[float, float] = (3.05, 10.0)
+
+
+class DisjuntorAberto(ConnectionError):
+    """O serviço está fora do ar: a chamada foi recusada sem ir à rede."""
+
+
+class Disjuntor:
+    """
+    Circuit breaker de um serviço externo.
+
+    - fechado: chamadas passam; `limite_falhas` falhas seguidas abrem o disjuntor;
+    - aberto: chamadas falham na hora com `DisjuntorAberto` por `tempo_aberto` segundos;
+    - meio-aberto: passado esse tempo, uma única chamada de teste decide se fecha ou reabre.
+    """
+
+    def __init__(self, nome: str, limite_falhas: int = 5, tempo_aberto: float = 30.0) -> None:
+        self.nome = nome
+        self.limite_falhas = limite_falhas
+        self.tempo_aberto = tempo_aberto
+        self._lock = threading.Lock()
+        self._falhas = 0
+        self._aberto_em: float | None = None
+        self._testando = False
+
+    @property
+    def estado(self) -> str:
+        with self._lock:
+            if self._aberto_em is None:
+                return 'fechado'
+            if self._testando or time.monotonic() - self._aberto_em >= self.tempo_aberto:
+                return 'meio_aberto'
+            return 'aberto'
+
+    def permitir(self) -> None:
+        """Levanta `DisjuntorAberto` se a chamada não deve ir à rede agora."""
+        with self._lock:
+            if self._aberto_em is None:
+                return
+            if self._testando or time.monotonic() - self._aberto_em < self.tempo_aberto:
+                raise DisjuntorAberto(f"{self.nome} indisponível (disjuntor aberto).")
+            self._testando = True  # esta chamada é o teste
+
+    def registrar_sucesso(self) -> None:
+        with self._lock:
+            if self._aberto_em is not None:
+                logger.info(f"Disjuntor de {self.nome} fechado: serviço respondendo de novo.")
+            self._falhas = 0
+            self._aberto_em = None
+            self._testando = False
+
+    def registrar_falha(self) -> None:
+        with self._lock:
+            self._falhas += 1
+            if self._testando or (self._aberto_em is None and self._falhas >= self.limite_falhas):
+                logger.warning(f"Disjuntor de {self.nome} aberto por {self.tempo_aberto:.0f}s após {self._falhas} falhas.")
+                self._aberto_em = time.monotonic()
+            self._testando = False
+
+
+class SessaoHTTP(requests.Session):
+    """`requests.Session` com pool de conexões, timeout padrão e disjuntor do serviço."""
+
+    def __init__(self, nome: str, timeout: tuple[float, float] = TIMEOUT_PADRAO,
+                 limite_falhas: int = 5, tempo_aberto: float = 30.0, conexoes: int = 10) -> None:
+        super().__init__()
+        self.nome = nome
+        self.timeout = timeout
+        self.disjuntor = Disjuntor(nome, limite_falhas, tempo_aberto)
+        adaptador = HTTPAdapter(pool_connections=2, pool_maxsize=conexoes)
+        self.mount('https://', adaptador)
+        self.mount('http://', adaptador)
+
+    def request(self, method, url, *args, **kwargs) -> requests.Response:
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        self.disjuntor.permitir()
+        try:
+            resposta = super().request(method, url, *args, **kwargs)
+        except BaseException:
+            # Qualquer erro (rede, corpo truncado, interrupção) conta como falha: a chamada
+            # de teste do meio-aberto nunca pode ficar pendurada
+            self.disjuntor.registrar_falha()
+            raise
+        # Erro do servidor ou limite de requisições contam como falha; 4xx é problema da chamada
+        if resposta.status_code >= 500 or resposta.status_code == 429:
+            self.disjuntor.registrar_falha()
+        else:
+            self.disjuntor.registrar_sucesso()
+        return resposta
+
+
+# Uma sessão por serviço externo, compartilhada por todo o bot
+sessao_strava = SessaoHTTP('Strava')
+sessao_openweather = SessaoHTTP('OpenWeather')
+
+
+# Erros de rede que valem nova tentativa (o cliente aiohttp passa os seus)
+ERROS_TRANSITORIOS: tuple[type[BaseException], ...] = (
+    requests.exceptions.Timeout, requests.exceptions.ConnectionError, ConnectionError, TimeoutError
+)
+
+
+def politica_retry(tentativas: int = 3, espera_maxima: float = 10.0,
+                   excecoes: tuple[type[BaseException], ...] = ERROS_TRANSITORIOS):
+    """Decorador de retry comum: erros de rede transitórios, backoff exponencial com jitter."""
+    def _transitorio(erro: BaseException) -> bool:
+        # Disjuntor aberto não é transitório: tentar de novo só aumentaria a fila de espera
+        return isinstance(erro, excecoes) and not isinstance(erro, DisjuntorAberto)
+
+    return retry(
+        stop=stop_after_attempt(tentativas),
+        wait=wait_random_exponential(multiplier=1, max=espera_maxima),
+        retry=retry_if_exception(_transitorio),
+        reraise=True
+    )
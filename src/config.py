@@ -46,10 +46,116 @@ except ValueError:
     logger.warning("Valor inválido para META_MENSAL_KM. Usando o padrão de 150km.")
     META_MENSAL_KM = 150.0
 
+# Orçamento máximo de tokens por mensagem enviada ao Gemini (sistema + histórico + dados + texto)
+try:
+    ORCAMENTO_TOKENS: int = int(os.getenv('ORCAMENTO_TOKENS', '8000'))
+except ValueError:
+    logger.warning("Valor inválido para ORCAMENTO_TOKENS. Usando o padrão de 8000 tokens.")
+    ORCAMENTO_TOKENS = 8000
+
+# Tempo de vida (segundos) do cache de contexto do Gemini; 0 desliga o cache
+try:
+    CACHE_CONTEXTO_TTL: int = int(os.getenv('CACHE_CONTEXTO_TTL', '1800'))
+except ValueError:
+    logger.warning("Valor inválido para CACHE_CONTEXTO_TTL. Usando o padrão de 1800s.")
+    CACHE_CONTEXTO_TTL = 1800
+
+# Respostas do Gemini em streaming (mensagem editada conforme o texto chega)
+STREAMING_RESPOSTAS: bool = os.getenv('STREAMING_RESPOSTAS', 'true').lower() in ('1', 'true', 'sim', 'yes')
+
+# Limites do pool de sessões do Gemini
+try:
+    MAX_SESSOES: int = int(os.getenv('MAX_SESSOES', '100'))
+    MAX_ITENS_SESSAO: int = int(os.getenv('MAX_ITENS_SESSAO', '40'))
+    MAX_MEMORIA_SESSOES_MB: float = float(os.getenv('MAX_MEMORIA_SESSOES_MB', '50'))
+except ValueError:
+    logger.warning("Valor inválido nos limites de sessões. Usando os padrões (100 sessões, 40 itens, 50 MB).")
+    MAX_SESSOES, MAX_ITENS_SESSAO, MAX_MEMORIA_SESSOES_MB = 100, 40, 50.0
+
+# Máximo de chamadas simultâneas ao Gemini (uma vaga fica reservada para conversas interativas)
+try:
+    MAX_CHAMADAS_GEMINI: int = int(os.getenv('MAX_CHAMADAS_GEMINI', '4'))
+except ValueError:
+    logger.warning("Valor inválido para MAX_CHAMADAS_GEMINI. Usando o padrão de 4.")
+    MAX_CHAMADAS_GEMINI = 4
+
+# Horário (HH:MM) da pré-geração das mensagens de sexta; vazio desliga (tudo é gerado às 18:00)
+HORARIO_PREGERACAO_SEXTA: str = os.getenv('HORARIO_PREGERACAO_SEXTA', '17:00')
+
+# Processamento das mensagens: workers em paralelo (chats diferentes) e fila máxima por chat
+try:
+    MAX_WORKERS_CHATS: int = int(os.getenv('MAX_WORKERS_CHATS', '8'))
+    MAX_FILA_POR_CHAT: int = int(os.getenv('MAX_FILA_POR_CHAT', '5'))
+except ValueError:
+    logger.warning("Valor inválido em MAX_WORKERS_CHATS/MAX_FILA_POR_CHAT. Usando os padrões (8 workers, 5 mensagens).")
+    MAX_WORKERS_CHATS, MAX_FILA_POR_CHAT = 8, 5
+
+# Conversa livre: janela (s) para juntar mensagens seguidas e limite sustentado de respostas por chat
+try:
+    JANELA_AGRUPAMENTO_SEG: float = float(os.getenv('JANELA_AGRUPAMENTO_SEG', '2'))
+    RESPOSTAS_POR_MINUTO: float = float(os.getenv('RESPOSTAS_POR_MINUTO', '6'))
+except ValueError:
+    logger.warning("Valor inválido em JANELA_AGRUPAMENTO_SEG/RESPOSTAS_POR_MINUTO. Usando os padrões (2s, 6/min).")
+    JANELA_AGRUPAMENTO_SEG, RESPOSTAS_POR_MINUTO = 2.0, 6.0
+
+# Prazo total (s) para buscar os dados de contexto (clima, Strava) antes de responder
+try:
+    PRAZO_CONTEXTO_SEG: float = float(os.getenv('PRAZO_CONTEXTO_SEG', '5'))
+except ValueError:
+    logger.warning("Valor inválido em PRAZO_CONTEXTO_SEG. Usando o padrão (5s).")
+    PRAZO_CONTEXTO_SEG = 5.0
+
+# Mídia: tamanho máximo (KB) enviado inline ao Gemini e horas sem uso até apagar o arquivo enviado
+try:
+    LIMITE_MIDIA_INLINE_KB: int = int(os.getenv('LIMITE_MIDIA_INLINE_KB', '256'))
+    RETENCAO_MIDIA_HORAS: float = float(os.getenv('RETENCAO_MIDIA_HORAS', '2'))
+except ValueError:
+    logger.warning("Valor inválido em LIMITE_MIDIA_INLINE_KB/RETENCAO_MIDIA_HORAS. Usando os padrões (256 KB, 2h).")
+    LIMITE_MIDIA_INLINE_KB, RETENCAO_MIDIA_HORAS = 256, 2.0
+
+# Fotos: lado maior (px) enviado ao Gemini na análise comum e na de equipamento (mais detalhe)
+try:
+    RESOLUCAO_FOTO_PX: int = int(os.getenv('RESOLUCAO_FOTO_PX', '768'))
+    RESOLUCAO_FOTO_DETALHE_PX: int = int(os.getenv('RESOLUCAO_FOTO_DETALHE_PX', '1280'))
+except ValueError:
+    logger.warning("Valor inválido em RESOLUCAO_FOTO_PX/RESOLUCAO_FOTO_DETALHE_PX. Usando os padrões (768 e 1280 px).")
+    RESOLUCAO_FOTO_PX, RESOLUCAO_FOTO_DETALHE_PX = 768, 1280
+
+# Cache de Strava e clima: idade (s) em que o dado é renovado em segundo plano e idade
+# máxima em que ainda é servido (inclusive com a fonte fora do ar)
+try:
+    CACHE_STRAVA_FRESCO_SEG: float = float(os.getenv('CACHE_STRAVA_FRESCO_SEG', '300'))
+    CACHE_STRAVA_LIMITE_SEG: float = float(os.getenv('CACHE_STRAVA_LIMITE_SEG', '10800'))
+    CACHE_CLIMA_FRESCO_SEG: float = float(os.getenv('CACHE_CLIMA_FRESCO_SEG', '600'))
+    CACHE_CLIMA_LIMITE_SEG: float = float(os.getenv('CACHE_CLIMA_LIMITE_SEG', '10800'))
+except ValueError:
+    logger.warning("Valor inválido nas idades de cache do Strava/clima. Usando os padrões (5/10 min frescos, 3h de limite).")
+    CACHE_STRAVA_FRESCO_SEG, CACHE_STRAVA_LIMITE_SEG = 300.0, 10800.0
+    CACHE_CLIMA_FRESCO_SEG, CACHE_CLIMA_LIMITE_SEG = 600.0, 10800.0
+
+# Pré-aquecimento: minutos de antecedência antes dos horários habituais de cada usuário
+# (0 desliga) e máximo de buscas ao Strava por hora feitas pelo pré-aquecimento
+try:
+    PREAQUECER_ANTECEDENCIA_MIN: float = float(os.getenv('PREAQUECER_ANTECEDENCIA_MIN', '10'))
+    PREAQUECER_LIMITE_STRAVA_HORA: int = int(os.getenv('PREAQUECER_LIMITE_STRAVA_HORA', '30'))
+except ValueError:
+    logger.warning("Valor inválido em PREAQUECER_ANTECEDENCIA_MIN/PREAQUECER_LIMITE_STRAVA_HORA. Usando os padrões (10 min, 30/h).")
+    PREAQUECER_ANTECEDENCIA_MIN, PREAQUECER_LIMITE_STRAVA_HORA = 10.0, 30
+
+# Importação do histórico completo do Strava: atividades por página e páginas por hora
+try:
+    IMPORTACAO_TAMANHO_PAGINA: int = int(os.getenv('IMPORTACAO_TAMANHO_PAGINA', '100'))
+    IMPORTACAO_LIMITE_STRAVA_HORA: int = int(os.getenv('IMPORTACAO_LIMITE_STRAVA_HORA', '20'))
+except ValueError:
+    logger.warning("Valor inválido em IMPORTACAO_TAMANHO_PAGINA/IMPORTACAO_LIMITE_STRAVA_HORA. Usando os padrões (100, 20/h).")
+    IMPORTACAO_TAMANHO_PAGINA, IMPORTACAO_LIMITE_STRAVA_HORA = 100, 20
+
 # Caminho do banco de dados SQLite (no diretório data/)
 _data_dir: str = os.path.join(_project_root, 'data')
 os.makedirs(_data_dir, exist_ok=True)
 DB_PATH: str = os.path.join(_data_dir, 'coach_database.db')
+# Camada persistente dos caches (sobrevive a restarts do container)
+CACHE_DB_PATH: str = os.path.join(_data_dir, 'cache.db')
 
 # ==========================================
 # VALIDAÇÃO DE VARIÁVEIS OBRIGATÓRIAS
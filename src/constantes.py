@@ -26,3 +26,47 @@ PALAVRAS_BIKE: list[str] = [
     'freio', 'pastilha', 'relação', 'relacao', 'cassete',
     'pneu', 'câmbio', 'cambio', 'kaéti', 'kaeti'
 ]
+
+# Pesos dos termos no detector de intenções (intencoes.py). Termos das listas acima valem 1.0;
+# aqui ficam os ambíguos (valem menos e só disparam junto de outro termo) e as flexões extras.
+# Os termos são comparados sem acento e como palavra inteira.
+PESOS_INTENCOES: dict[str, dict[str, float]] = {
+    'clima': {
+        'chove': 1.0, 'chovendo': 1.0, 'previsao': 1.0, 'vento': 0.6, 'ventando': 1.0,
+        'ensolarado': 1.0, 'nublado': 1.0, 'garoa': 1.0,
+        # "tempo pra/para" sozinho é neutro ("tempo pra pedalar"); seguido de dia é previsão
+        **{f'tempo {prep} {artigo}{dia}': 1.0
+           for prep in ('pra', 'para')
+           for artigo in ('', 'o ', 'a ')
+           for dia in ('hoje', 'amanhã', 'domingo', 'segunda', 'terça', 'quarta', 'quinta',
+                       'sexta', 'sábado', 'fim de semana', 'semana', 'manhã', 'tarde', 'noite')},
+    },
+    'strava': {
+        'hoje': 0.4, 'ontem': 0.4, 'semana': 0.4, 'resultado': 0.6, 'resultados': 0.6,
+        'ultimo': 0.5, 'avalie': 0.6, 'avaliar': 0.6, 'analise': 0.6, 'andei': 0.6, 'rodei': 0.6,
+        'pedalada': 1.0, 'pedaladas': 1.0, 'treinei': 1.0, 'quilometros': 1.0, 'kms': 1.0,
+        'pedalar': 0.5,
+    },
+    'bike': {
+        # Termos do vocabulário básico disparam sozinhos ("pneu gasto?"); os usos que não são
+        # da bike ("em relação", "relação com") ficam nas expressões neutras
+        'freios': 1.0, 'pneus': 1.0, 'pastilhas': 1.0,
+    },
+}
+
+# Pontuação mínima para uma intenção disparar a busca dos seus dados
+LIMIAR_INTENCAO: float = 1.0
+
+# Expressões que contêm um termo mas não indicam a intenção ("faz tempo", "ao mesmo tempo").
+# Casam antes do termo isolado e não somam pontos.
+EXPRESSOES_NEUTRAS: list[str] = [
+    'faz tempo', 'ha tempo', 'ha quanto tempo', 'mesmo tempo', 'tempo todo', 'tempo livre',
+    'a tempo', 'perder tempo', 'sem tempo', 'com tempo', 'tempo pra', 'tempo para',
+    'corrente de', 'relacao com', 'em relacao', 'frio na barriga',
+]
+
+# Ordem de prioridade dos blocos de dados injetados (do mais importante ao menos importante).
+# Quando o orçamento de tokens estoura, os blocos do fim da lista são descartados primeiro.
+PRIORIDADE_DADOS: list[str] = [
+    'DADOS ÚLTIMO PEDAL', 'DADOS SEMANA', 'DADOS BIKE', 'DADOS DE CLIMA'
+]
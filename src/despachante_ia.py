@@ -0,0 +1,288 @@
+"""
+Despachante central das chamadas ao Gemini.
+Limita quantas chamadas ficam em andamento ao mesmo tempo, atende por classe de
+prioridade (interativa > proativa > segundo plano), respeita os erros de cota (429)
+com backoff que segue a dica de retry da API e mede a latência de cada chamada.
+Atende tanto threads (`executar`) quanto corrotinas (`executar_async`) na mesma fila.
+"""
+from __future__ import annotations
+import asyncio
+import heapq
+import itertools
+import random
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Optional
+
+from config import logger
+
+# Classes de prioridade (menor número = atendido primeiro)
+PRIORIDADE_INTERATIVA: int = 0
+PRIORIDADE_PROATIVA: int = 1
+PRIORIDADE_SEGUNDO_PLANO: int = 2
+
+# Dica de retry da API: "retryDelay': '17s'" dentro dos detalhes do erro
+_RE_RETRY_DELAY = re.compile(r"retryDelay['\"]?\s*:\s*['\"]?(\d+(?:\.\d+)?)s")
+
+
+class CotaGeminiEsgotada(Exception):
+    """A cota do Gemini continuou esgotada depois de todas as tentativas."""
+
+
+def erro_de_cota(e: Exception) -> bool:
+    """Identifica erros 429 / RESOURCE_EXHAUSTED do google-genai."""
+    if getattr(e, 'code', None) == 429:
+        return True
+    texto = str(e)
+    return texto.startswith('429') or 'RESOURCE_EXHAUSTED' in texto
+
+
+def espera_sugerida(e: Exception) -> Optional[float]:
+    """Extrai do erro o tempo de espera sugerido pela API, se houver."""
+    achado = _RE_RETRY_DELAY.search(str(e))
+    return float(achado.group(1)) if achado else None
+
+
+def _resolver_aviso(aviso: asyncio.Future) -> None:
+    if not aviso.done():
+        aviso.set_result(None)
+
+
+class DespachanteIA:
+    """
+    Fila de prioridade com um número fixo de vagas. Chamadas não interativas
+    nunca ocupam todas as vagas: uma fica sempre reservada para quem está
+    esperando resposta no chat.
+    """
+
+    def __init__(self, max_concorrencia: int = 4, max_tentativas: int = 4, espera_maxima: float = 60.0) -> None:
+        self.max_concorrencia = max(1, max_concorrencia)
+        self.max_tentativas = max_tentativas
+        self.espera_maxima = espera_maxima
+        self._cond = threading.Condition()
+        self._em_uso = 0
+        self._fila: list[tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._pausado_ate = 0.0
+        self._metricas: dict[str, dict[str, float]] = {}
+        # Esperas de corrotinas: (loop, future) acordados a cada vaga liberada
+        self._esperas_async: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    # ------------------------------------------
+    # Vagas
+    # ------------------------------------------
+    def _limite(self, prioridade: int) -> int:
+        if prioridade == PRIORIDADE_INTERATIVA or self.max_concorrencia == 1:
+            return self.max_concorrencia
+        return self.max_concorrencia - 1
+
+    def _adquirir(self, prioridade: int) -> None:
+        ticket = (prioridade, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._fila, ticket)
+            while True:
+                pausa = self._pausado_ate - time.monotonic()
+                if pausa <= 0 and self._fila[0] == ticket and self._em_uso < self._limite(prioridade):
+                    heapq.heappop(self._fila)
+                    self._em_uso += 1
+                    return
+                self._cond.wait(timeout=pausa if pausa > 0 else None)
+
+    async def _adquirir_async(self, prioridade: int) -> None:
+        """Igual a `_adquirir`, mas espera sem bloquear o event loop (a fila é a mesma)."""
+        ticket = (prioridade, next(self._seq))
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            heapq.heappush(self._fila, ticket)
+        try:
+            while True:
+                with self._cond:
+                    pausa = self._pausado_ate - time.monotonic()
+                    if pausa <= 0 and self._fila[0] == ticket and self._em_uso < self._limite(prioridade):
+                        heapq.heappop(self._fila)
+                        self._em_uso += 1
+                        return
+                    aviso = loop.create_future()
+                    self._esperas_async.append((loop, aviso))
+                try:
+                    await asyncio.wait_for(aviso, timeout=pausa if pausa > 0 else None)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            # Tarefa cancelada na fila: o ticket sai para não travar quem vem atrás
+            with self._cond:
+                if ticket in self._fila:
+                    self._fila.remove(ticket)
+                    heapq.heapify(self._fila)
+                self._acordar()
+            raise
+
+    def _acordar(self) -> None:
+        """Acorda as threads e as corrotinas que esperam vaga. Chamar com `_cond` seguro."""
+        self._cond.notify_all()
+        for loop, aviso in self._esperas_async:
+            loop.call_soon_threadsafe(_resolver_aviso, aviso)
+        self._esperas_async.clear()
+
+    def _liberar(self) -> None:
+        with self._cond:
+            self._em_uso -= 1
+            self._acordar()
+
+    def _pausar(self, segundos: float) -> None:
+        """Segura todas as chamadas até a cota voltar."""
+        with self._cond:
+            self._pausado_ate = max(self._pausado_ate, time.monotonic() + segundos)
+            self._acordar()
+
+    def _tratar_falha(self, e: Exception, tentativa: int, rotulo: str) -> None:
+        """Pausa e retorna se valer tentar de novo; caso contrário, relança o erro."""
+        if not erro_de_cota(e):
+            raise e
+        if tentativa >= self.max_tentativas:
+            raise CotaGeminiEsgotada(f"Cota do Gemini esgotada ({rotulo}): {e}") from e
+        espera = espera_sugerida(e)
+        if espera is None:
+            espera = min(self.espera_maxima, 2 ** tentativa) + random.uniform(0, 1)
+        espera = min(espera, self.espera_maxima)
+        logger.warning(f"Cota do Gemini atingida ({rotulo}). Nova tentativa em {espera:.1f}s.")
+        self._pausar(espera)
+
+    # ------------------------------------------
+    # Execução
+    # ------------------------------------------
+    def executar(self, funcao: Callable[..., Any], *args,
+                 prioridade: int = PRIORIDADE_INTERATIVA, rotulo: str = 'gemini', **kwargs) -> Any:
+        """Executa `funcao(*args, **kwargs)` quando houver vaga, com retry em erros de cota."""
+        for tentativa in range(1, self.max_tentativas + 1):
+            chegada = time.monotonic()
+            self._adquirir(prioridade)
+            inicio = time.monotonic()
+            try:
+                resultado = funcao(*args, **kwargs)
+            except Exception as e:
+                self._registrar(rotulo, chegada, inicio, erro=True)
+                self._liberar()
+                self._tratar_falha(e, tentativa, rotulo)
+                continue
+            self._registrar(rotulo, chegada, inicio)
+            self._liberar()
+            return resultado
+        raise CotaGeminiEsgotada(f"Cota do Gemini esgotada ({rotulo}).")
+
+    def executar_stream(self, funcao: Callable[..., Iterator], *args,
+                        prioridade: int = PRIORIDADE_INTERATIVA, rotulo: str = 'gemini', **kwargs) -> Iterator:
+        """
+        Versão para streams: a vaga fica ocupada enquanto o stream é consumido.
+        Só há nova tentativa se o erro de cota vier antes do primeiro pedaço.
+        """
+        for tentativa in range(1, self.max_tentativas + 1):
+            chegada = time.monotonic()
+            self._adquirir(prioridade)
+            inicio = time.monotonic()
+            recebeu = False
+            try:
+                for item in funcao(*args, **kwargs):
+                    recebeu = True
+                    yield item
+            except Exception as e:
+                self._registrar(rotulo, chegada, inicio, erro=True)
+                self._liberar()
+                if recebeu:
+                    raise
+                self._tratar_falha(e, tentativa, rotulo)
+                continue
+            except BaseException:
+                # Stream abandonado pelo consumidor (GeneratorExit): só devolve a vaga
+                self._liberar()
+                raise
+            self._registrar(rotulo, chegada, inicio)
+            self._liberar()
+            return
+        raise CotaGeminiEsgotada(f"Cota do Gemini esgotada ({rotulo}).")
+
+    async def executar_async(self, funcao: Callable[..., Awaitable[Any]], *args,
+                             prioridade: int = PRIORIDADE_INTERATIVA, rotulo: str = 'gemini', **kwargs) -> Any:
+        """Versão para corrotinas (cliente `client.aio`): mesmas vagas, prioridades e retry."""
+        for tentativa in range(1, self.max_tentativas + 1):
+            chegada = time.monotonic()
+            await self._adquirir_async(prioridade)
+            inicio = time.monotonic()
+            try:
+                resultado = await funcao(*args, **kwargs)
+            except Exception as e:
+                self._registrar(rotulo, chegada, inicio, erro=True)
+                self._liberar()
+                self._tratar_falha(e, tentativa, rotulo)
+                continue
+            except BaseException:
+                self._liberar()
+                raise
+            self._registrar(rotulo, chegada, inicio)
+            self._liberar()
+            return resultado
+        raise CotaGeminiEsgotada(f"Cota do Gemini esgotada ({rotulo}).")
+
+    async def executar_stream_async(self, funcao: Callable[..., Awaitable[AsyncIterator]], *args,
+                                    prioridade: int = PRIORIDADE_INTERATIVA, rotulo: str = 'gemini',
+                                    **kwargs) -> AsyncIterator:
+        """Versão assíncrona de `executar_stream` (`funcao` devolve, ao ser aguardada, um iterador assíncrono)."""
+        for tentativa in range(1, self.max_tentativas + 1):
+            chegada = time.monotonic()
+            await self._adquirir_async(prioridade)
+            inicio = time.monotonic()
+            recebeu = False
+            try:
+                async for item in await funcao(*args, **kwargs):
+                    recebeu = True
+                    yield item
+            except Exception as e:
+                self._registrar(rotulo, chegada, inicio, erro=True)
+                self._liberar()
+                if recebeu:
+                    raise
+                self._tratar_falha(e, tentativa, rotulo)
+                continue
+            except BaseException:
+                self._liberar()
+                raise
+            self._registrar(rotulo, chegada, inicio)
+            self._liberar()
+            return
+        raise CotaGeminiEsgotada(f"Cota do Gemini esgotada ({rotulo}).")
+
+    # ------------------------------------------
+    # Métricas
+    # ------------------------------------------
+    def _registrar(self, rotulo: str, chegada: float, inicio: float, erro: bool = False) -> None:
+        fim = time.monotonic()
+        with self._cond:
+            m = self._metricas.setdefault(rotulo, {
+                'chamadas': 0, 'erros': 0, 'latencia_total': 0.0, 'latencia_max': 0.0, 'espera_total': 0.0
+            })
+            m['chamadas'] += 1
+            m['erros'] += int(erro)
+            m['latencia_total'] += fim - inicio
+            m['latencia_max'] = max(m['latencia_max'], fim - inicio)
+            m['espera_total'] += inicio - chegada
+        logger.debug(f"Gemini [{rotulo}]: {(fim - inicio) * 1000:.0f} ms (fila {(inicio - chegada) * 1000:.0f} ms)")
+
+    def metricas(self) -> dict[str, dict[str, float]]:
+        """Latência média/máxima e espera média na fila (ms) por rótulo."""
+        with self._cond:
+            return {
+                rotulo: {
+                    'chamadas': m['chamadas'],
+                    'erros': m['erros'],
+                    'latencia_media_ms': m['latencia_total'] / m['chamadas'] * 1000,
+                    'latencia_max_ms': m['latencia_max'] * 1000,
+                    'espera_media_ms': m['espera_total'] / m['chamadas'] * 1000,
+                }
+                for rotulo, m in self._metricas.items()
+            }
+
+    @property
+    def em_andamento(self) -> int:
+        with self._cond:
+            return self._em_uso
@@ -0,0 +1,208 @@
+"""
+Execução das mensagens recebidas, organizada por chat.
+As mensagens de um mesmo chat rodam estritamente em ordem (uma de cada vez, então a
+sessão do Gemini e a memória do chat nunca são usadas por duas ao mesmo tempo);
+chats diferentes rodam em paralelo num pool fixo de workers. A fila de cada chat tem
+limite: acima dele a mensagem é recusada (backpressure) em vez de acumular.
+"""
+from __future__ import annotations
+import asyncio
+import functools
+import inspect
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from config import logger
+
+
+class FilaChats:
+    """
+    Pool de workers com uma fila FIFO por chat. Cada chat ocupa no máximo um worker;
+    depois de cada mensagem o chat volta para o fim da fila do pool, para que um chat
+    com muitas mensagens não segure um worker enquanto outros esperam.
+    """
+
+    def __init__(self, max_workers: int = 8, max_fila_chat: int = 5,
+                 ao_recusar: Optional[Callable[[str], None]] = None) -> None:
+        self.max_fila_chat = max_fila_chat
+        self._ao_recusar = ao_recusar
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='chat')
+        self._lock = threading.Condition()
+        self._filas: dict[str, deque] = {}
+        self._avisados: set[str] = set()
+        self._metricas = {'executadas': 0, 'recusadas': 0, 'erros': 0}
+        self._antes_de_enfileirar: Optional[Callable[[str], Any]] = None
+
+    def definir_antes_de_enfileirar(self, funcao: Callable[[str], Any]) -> None:
+        """
+        Chamada com o chat antes de cada mensagem de `por_chat` entrar na fila (ex.: liberar
+        o texto que o agrupador ainda segura, para ele entrar na fila antes do comando).
+        """
+        self._antes_de_enfileirar = funcao
+
+    def submeter(self, chat_id: int | str, funcao: Callable[..., Any], *args, **kwargs) -> bool:
+        """Enfileira `funcao(*args, **kwargs)` no chat. Retorna False se a fila do chat estiver cheia."""
+        return self._submeter(str(chat_id), (funcao, args, kwargs), limitar=True)
+
+    def submeter_sem_limite(self, chat_id: int | str, funcao: Callable[..., Any], *args, **kwargs) -> bool:
+        """
+        Como `submeter`, mas sem o limite da fila do chat: para o lote do agrupador, que já
+        junta várias mensagens numa tarefa só (uma por chat de cada vez) e não pode ser recusado.
+        """
+        return self._submeter(str(chat_id), (funcao, args, kwargs), limitar=False)
+
+    def _submeter(self, chave: str, tarefa: tuple, limitar: bool) -> bool:
+        with self._lock:
+            fila = self._filas.get(chave)
+            if limitar and fila is not None and len(fila) > self.max_fila_chat:
+                # A primeira posição é a mensagem em execução; o limite vale para as que esperam
+                self._metricas['recusadas'] += 1
+                avisar = chave not in self._avisados
+                self._avisados.add(chave)
+            else:
+                avisar = None
+                nova = fila is None
+                if nova:
+                    fila = self._filas[chave] = deque()
+                fila.append(tarefa)
+
+        if avisar is not None:
+            logger.warning(f"Fila do chat {chave} cheia: mensagem recusada.")
+            if avisar and self._ao_recusar is not None:
+                self._executor.submit(self._ao_recusar, chave)
+            return False
+        if nova:
+            self._executor.submit(self._executar_proxima, chave)
+        return True
+
+    def _executar_proxima(self, chave: str) -> None:
+        with self._lock:
+            funcao, args, kwargs = self._filas[chave][0]
+        try:
+            funcao(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Erro não tratado na mensagem do chat {chave}: {e}")
+            with self._lock:
+                self._metricas['erros'] += 1
+
+        with self._lock:
+            fila = self._filas[chave]
+            fila.popleft()
+            self._metricas['executadas'] += 1
+            if len(fila) <= self.max_fila_chat:
+                self._avisados.discard(chave)
+            if not fila:
+                del self._filas[chave]
+                self._lock.notify_all()
+                return
+        try:
+            self._executor.submit(self._executar_proxima, chave)
+        except RuntimeError:
+            logger.debug(f"Pool encerrado: mensagens pendentes do chat {chave} descartadas.")
+
+    def metricas(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                **self._metricas,
+                'chats_ativos': len(self._filas),
+                'na_fila': sum(len(f) for f in self._filas.values()),
+            }
+
+    def encerrar(self, timeout: float = 5.0) -> None:
+        """Espera até `timeout` segundos as filas esvaziarem; o que sobrar é descartado."""
+        with self._lock:
+            self._lock.wait_for(lambda: not self._filas, timeout=timeout)
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def por_chat(self, handler: Callable[[Any], None]) -> Callable[[Any], None]:
+        """Decorador de handler do Telegram: a mensagem entra na fila do seu chat."""
+        @functools.wraps(handler)
+        def _enfileirar(message) -> None:
+            if self._antes_de_enfileirar is not None:
+                self._antes_de_enfileirar(str(message.chat.id))
+            self.submeter(message.chat.id, handler, message)
+        return _enfileirar
+
+
+class FilaChatsAsync:
+    """
+    Equivalente da `FilaChats` para o runtime assíncrono: um `asyncio.Lock` (FIFO) por chat
+    garante a ordem e um semáforo limita quantos chats são atendidos ao mesmo tempo.
+    """
+
+    def __init__(self, max_workers: int = 8, max_fila_chat: int = 5,
+                 ao_recusar: Optional[Callable[[str], Any]] = None) -> None:
+        self.max_fila_chat = max_fila_chat
+        self._ao_recusar = ao_recusar
+        self._max_workers = max(1, max_workers)
+        self._vagas: Optional[asyncio.Semaphore] = None
+        self._travas: dict[str, asyncio.Lock] = {}
+        self._pendentes: dict[str, int] = {}
+        self._avisados: set[str] = set()
+        self._metricas = {'executadas': 0, 'recusadas': 0, 'erros': 0}
+        self._antes_de_enfileirar: Optional[Callable[[str], Any]] = None
+
+    def definir_antes_de_enfileirar(self, funcao: Callable[[str], Any]) -> None:
+        """Como em `FilaChats`; se a função devolver um awaitable, ele é aguardado antes."""
+        self._antes_de_enfileirar = funcao
+
+    async def executar(self, chat_id: int | str, funcao: Callable[..., Any], *args, **kwargs) -> bool:
+        """Aguarda a vez do chat e executa a corrotina. Retorna False se a fila do chat estiver cheia."""
+        return await self._executar(str(chat_id), funcao, args, kwargs, limitar=True)
+
+    async def executar_sem_limite(self, chat_id: int | str, funcao: Callable[..., Any], *args, **kwargs) -> bool:
+        """Como `executar`, mas sem o limite da fila do chat (ver `FilaChats.submeter_sem_limite`)."""
+        return await self._executar(str(chat_id), funcao, args, kwargs, limitar=False)
+
+    async def _executar(self, chave: str, funcao: Callable[..., Any], args: tuple, kwargs: dict,
+                        limitar: bool) -> bool:
+        if limitar and self._pendentes.get(chave, 0) > self.max_fila_chat:
+            self._metricas['recusadas'] += 1
+            logger.warning(f"Fila do chat {chave} cheia: mensagem recusada.")
+            if chave not in self._avisados and self._ao_recusar is not None:
+                self._avisados.add(chave)
+                await self._ao_recusar(chave)
+            return False
+
+        if self._vagas is None:
+            # Criado aqui para ficar ligado ao event loop em execução
+            self._vagas = asyncio.Semaphore(self._max_workers)
+        trava = self._travas.setdefault(chave, asyncio.Lock())
+        self._pendentes[chave] = self._pendentes.get(chave, 0) + 1
+        try:
+            async with trava, self._vagas:
+                try:
+                    await funcao(*args, **kwargs)
+                except Exception as e:
+                    logger.error(f"Erro não tratado na mensagem do chat {chave}: {e}")
+                    self._metricas['erros'] += 1
+                self._metricas['executadas'] += 1
+        finally:
+            self._pendentes[chave] -= 1
+            if self._pendentes[chave] <= self.max_fila_chat:
+                self._avisados.discard(chave)
+            if not self._pendentes[chave]:
+                del self._pendentes[chave]
+                del self._travas[chave]
+        return True
+
+    def metricas(self) -> dict[str, int]:
+        return {
+            **self._metricas,
+            'chats_ativos': len(self._pendentes),
+            'na_fila': sum(self._pendentes.values()),
+        }
+
+    def por_chat(self, handler: Callable[[Any], Any]) -> Callable[[Any], Any]:
+        """Decorador de handler assíncrono: a mensagem espera a vez do seu chat."""
+        @functools.wraps(handler)
+        async def _enfileirar(message) -> None:
+            if self._antes_de_enfileirar is not None:
+                pendente = self._antes_de_enfileirar(str(message.chat.id))
+                if inspect.isawaitable(pendente):
+                    # A tarefa liberada ainda nem pegou a vez do chat: espera por ela
+                    await pendente
+            await self.executar(message.chat.id, handler, message)
+        return _enfileirar
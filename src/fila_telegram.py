@@ -0,0 +1,227 @@
+"""
+Fila de saída do Telegram com controle de flood.
+Todo envio passa por um balde de tokens global (~30 msg/s) e por um balde por chat,
+mantém a ordem das mensagens dentro de cada chat e repete automaticamente
+quando o Telegram responde 429 com `retry_after`.
+"""
+from __future__ import annotations
+import asyncio
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Optional
+
+from config import logger
+
+
+def retry_after_telegram(e: Exception) -> Optional[float]:
+    """Extrai o `retry_after` de um erro 429 do pyTelegramBotAPI (ApiTelegramException)."""
+    if getattr(e, 'error_code', None) != 429:
+        return None
+    resultado = getattr(e, 'result_json', None) or {}
+    parametros = resultado.get('parameters') or {}
+    return float(parametros.get('retry_after', 1))
+
+
+class BaldeTokens:
+    """Balde de tokens simples. Não é thread-safe: o chamador segura o lock."""
+
+    def __init__(self, taxa: float, capacidade: float) -> None:
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self._tokens = capacidade
+        self._ultimo = time.monotonic()
+
+    def reservar(self) -> float:
+        """Reserva um token e retorna quantos segundos esperar até ele valer (0 = já)."""
+        agora = time.monotonic()
+        self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa)
+        self._ultimo = agora
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.taxa
+
+
+class FilaEnvioTelegram:
+    """
+    Serializa os envios de cada chat (ordem garantida) e respeita os limites
+    global e por chat. Chats de grupo (ID negativo) usam o limite de grupos.
+    """
+
+    def __init__(self, taxa_global: float = 30.0, taxa_chat: float = 1.0,
+                 rajada_chat: float = 3.0, taxa_grupo: float = 20 / 60,
+                 max_tentativas: int = 5) -> None:
+        self.taxa_chat = taxa_chat
+        self.rajada_chat = rajada_chat
+        self.taxa_grupo = taxa_grupo
+        self.max_tentativas = max_tentativas
+        self._cond = threading.Condition()
+        self._global = BaldeTokens(taxa_global, taxa_global)
+        self._baldes: dict[str, BaldeTokens] = {}
+        self._filas: dict[str, deque] = {}
+        self._seq = itertools.count()
+        self._metricas = {'enviadas': 0, 'retentativas': 0, 'falhas': 0, 'espera_total': 0.0, 'espera_max': 0.0}
+
+    def _balde_chat(self, chave: str) -> BaldeTokens:
+        balde = self._baldes.get(chave)
+        if balde is None:
+            if chave.startswith('-'):
+                balde = BaldeTokens(self.taxa_grupo, 1)
+            else:
+                balde = BaldeTokens(self.taxa_chat, self.rajada_chat)
+            self._baldes[chave] = balde
+        return balde
+
+    def chamar(self, chat_id: int | str, funcao: Callable[..., Any], /, *args, **kwargs) -> Any:
+        """Executa o envio `funcao(*args, **kwargs)` na vez do chat e dentro dos limites."""
+        chave = str(chat_id)
+        ticket = next(self._seq)
+        chegada = time.monotonic()
+        with self._cond:
+            fila = self._filas.setdefault(chave, deque())
+            fila.append(ticket)
+            while fila[0] != ticket:
+                self._cond.wait()
+
+        try:
+            for tentativa in range(1, self.max_tentativas + 1):
+                espera = self.reservar(chave)
+                if espera > 0:
+                    time.sleep(espera)
+                try:
+                    resultado = funcao(*args, **kwargs)
+                except Exception as e:
+                    retry_after = retry_after_telegram(e)
+                    if retry_after is None or tentativa == self.max_tentativas:
+                        self.contar('falhas')
+                        raise
+                    logger.warning(f"Flood control do Telegram no chat {chave}: aguardando {retry_after:.0f}s.")
+                    self.contar('retentativas')
+                    time.sleep(retry_after)
+                    continue
+                self._registrar(time.monotonic() - chegada)
+                return resultado
+        finally:
+            with self._cond:
+                fila.popleft()
+                if not fila:
+                    del self._filas[chave]
+                self._cond.notify_all()
+
+    def reservar(self, chat_id: int | str) -> float:
+        """Reserva um envio nos baldes global e do chat; retorna quanto esperar antes dele."""
+        chave = str(chat_id)
+        with self._cond:
+            return max(self._balde_chat(chave).reservar(), self._global.reservar())
+
+    def contar(self, metrica: str) -> None:
+        with self._cond:
+            self._metricas[metrica] += 1
+
+    def _registrar(self, latencia: float) -> None:
+        with self._cond:
+            self._metricas['enviadas'] += 1
+            self._metricas['espera_total'] += latencia
+            self._metricas['espera_max'] = max(self._metricas['espera_max'], latencia)
+
+    def metricas(self) -> dict[str, float]:
+        """Profundidade atual da fila e latência (ms) dos envios concluídos."""
+        with self._cond:
+            enviadas = self._metricas['enviadas']
+            return {
+                'na_fila': sum(len(f) for f in self._filas.values()),
+                'chats_na_fila': len(self._filas),
+                'enviadas': enviadas,
+                'retentativas': self._metricas['retentativas'],
+                'falhas': self._metricas['falhas'],
+                'latencia_media_ms': (self._metricas['espera_total'] / enviadas * 1000) if enviadas else 0.0,
+                'latencia_max_ms': self._metricas['espera_max'] * 1000,
+            }
+
+
+class FilaEnvioTelegramAsync:
+    """
+    Equivalente da `FilaEnvioTelegram` para o runtime assíncrono: a ordem por chat
+    vem de um `asyncio.Lock` por chat (FIFO) e as esperas não bloqueiam o event loop.
+    """
+
+    def __init__(self, taxa_global: float = 30.0, taxa_chat: float = 1.0,
+                 rajada_chat: float = 3.0, taxa_grupo: float = 20 / 60,
+                 max_tentativas: int = 5) -> None:
+        self._limites = FilaEnvioTelegram(taxa_global, taxa_chat, rajada_chat, taxa_grupo, max_tentativas)
+        self.max_tentativas = max_tentativas
+        self._travas: dict[str, asyncio.Lock] = {}
+        self._na_fila: dict[str, int] = {}
+
+    async def chamar(self, chat_id: int | str, funcao: Callable[..., Any], /, *args, **kwargs) -> Any:
+        """Aguarda `funcao(*args, **kwargs)` na vez do chat e dentro dos limites."""
+        chave = str(chat_id)
+        chegada = time.monotonic()
+        trava = self._travas.setdefault(chave, asyncio.Lock())
+        self._na_fila[chave] = self._na_fila.get(chave, 0) + 1
+        try:
+            async with trava:
+                for tentativa in range(1, self.max_tentativas + 1):
+                    espera = self._limites.reservar(chave)
+                    if espera > 0:
+                        await asyncio.sleep(espera)
+                    try:
+                        resultado = await funcao(*args, **kwargs)
+                    except Exception as e:
+                        retry_after = retry_after_telegram(e)
+                        if retry_after is None or tentativa == self.max_tentativas:
+                            self._limites.contar('falhas')
+                            raise
+                        logger.warning(f"Flood control do Telegram no chat {chave}: aguardando {retry_after:.0f}s.")
+                        self._limites.contar('retentativas')
+                        await asyncio.sleep(retry_after)
+                        continue
+                    self._limites._registrar(time.monotonic() - chegada)
+                    return resultado
+        finally:
+            self._na_fila[chave] -= 1
+            if not self._na_fila[chave]:
+                del self._na_fila[chave]
+                del self._travas[chave]
+
+    def metricas(self) -> dict[str, float]:
+        metricas = self._limites.metricas()
+        metricas['na_fila'] = sum(self._na_fila.values())
+        metricas['chats_na_fila'] = len(self._na_fila)
+        return metricas
+
+
+class BotComFila:
+    """
+    Fachada sobre o TeleBot: os métodos de envio passam pela fila;
+    o resto (get_file, download_file, ...) vai direto para o bot.
+    Com AsyncTeleBot + FilaEnvioTelegramAsync, os mesmos métodos devolvem corrotinas.
+    """
+
+    def __init__(self, bot, fila: FilaEnvioTelegram) -> None:
+        self._bot = bot
+        self.fila = fila
+
+    def send_message(self, chat_id, *args, **kwargs):
+        return self.fila.chamar(chat_id, self._bot.send_message, chat_id, *args, **kwargs)
+
+    def send_photo(self, chat_id, *args, **kwargs):
+        return self.fila.chamar(chat_id, self._bot.send_photo, chat_id, *args, **kwargs)
+
+    def send_chat_action(self, chat_id, *args, **kwargs):
+        return self.fila.chamar(chat_id, self._bot.send_chat_action, chat_id, *args, **kwargs)
+
+    def reply_to(self, message, *args, **kwargs):
+        return self.fila.chamar(message.chat.id, self._bot.reply_to, message, *args, **kwargs)
+
+    def edit_message_text(self, texto, chat_id=None, message_id=None, **kwargs):
+        return self.fila.chamar(
+            chat_id, self._bot.edit_message_text, texto, chat_id=chat_id, message_id=message_id, **kwargs
+        )
+
+    def delete_message(self, chat_id, message_id, **kwargs):
+        return self.fila.chamar(chat_id, self._bot.delete_message, chat_id, message_id, **kwargs)
+
+    def __getattr__(self, nome: str):
+        return getattr(self._bot, nome)
+
@@ -0,0 +1,60 @@
+"""
+Preparo das fotos antes da análise visual do Gemini.
+O Telegram já entrega cada foto em várias resoluções (`PhotoSize`): escolhemos a menor
+que atende o lado mínimo do tipo de análise e, se ainda sobrar resolução, reduzimos e
+recodificamos em JPEG. Imagem menor = download e upload mais rápidos e menos tokens.
+"""
+from __future__ import annotations
+import io
+from typing import Optional, Sequence
+
+from PIL import Image
+
+from config import RESOLUCAO_FOTO_PX, RESOLUCAO_FOTO_DETALHE_PX, logger
+from intencoes import detectar_intencoes
+
+# Qualidade JPEG da recodificação (boa o bastante para análise visual)
+_QUALIDADE_JPEG: int = 85
+
+# Só reduz se a imagem passar do alvo com folga (evita recodificar por poucos pixels)
+_FOLGA_REDUCAO: float = 1.25
+
+
+def lado_alvo_foto(legenda: Optional[str]) -> int:
+    """Lado maior desejado: fotos de equipamento (desgaste, peças) pedem mais detalhe."""
+    if legenda and 'bike' in detectar_intencoes(legenda):
+        return RESOLUCAO_FOTO_DETALHE_PX
+    return RESOLUCAO_FOTO_PX
+
+
+def escolher_tamanho_foto(tamanhos: Sequence, lado_alvo: int):
+    """Menor `PhotoSize` cujo lado maior atinge `lado_alvo` (ou o maior disponível)."""
+    ordenados = sorted(tamanhos, key=lambda t: t.width * t.height)
+    for tamanho in ordenados:
+        if max(tamanho.width, tamanho.height) >= lado_alvo:
+            return tamanho
+    return ordenados[-1]
+
+
+def reduzir_foto(dados: bytes, lado_alvo: int) -> tuple[bytes, int]:
+    """
+    Reduz a foto para caber em `lado_alvo` (mantendo a proporção) e recodifica em JPEG.
+    Retorna os bytes finais e a quantidade de pixels efetivamente enviada.
+    CPU pesada: no runtime assíncrono, chamar via `asyncio.to_thread`.
+    """
+    try:
+        with Image.open(io.BytesIO(dados)) as imagem:
+            largura, altura = imagem.size
+            if max(largura, altura) <= lado_alvo * _FOLGA_REDUCAO:
+                return dados, largura * altura
+            imagem.draft('RGB', (lado_alvo, lado_alvo))  # JPEG: decodifica já em escala reduzida
+            imagem = imagem.convert('RGB')
+            imagem.thumbnail((lado_alvo, lado_alvo), Image.LANCZOS)
+            saida = io.BytesIO()
+            imagem.save(saida, format='JPEG', quality=_QUALIDADE_JPEG, optimize=True)
+            logger.debug(f"Foto reduzida de {largura}x{altura} para {imagem.width}x{imagem.height}.")
+            return saida.getvalue(), imagem.width * imagem.height
+    except OSError as e:
+        # Formato não reconhecido: segue com o original, sem contagem de pixels
+        logger.warning(f"Não foi possível reduzir a foto: {e}")
+        return dados, 0
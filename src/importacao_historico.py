@@ -0,0 +1,154 @@
+"""
+Importação do histórico completo do Strava para o banco.
+As consultas do bot olham só janelas curtas (7 dias, mês atual, alguns meses); para
+análises de longo prazo o histórico inteiro fica na tabela de atividades. A importação
+anda da atividade mais recente para a mais antiga em páginas limitadas, grava um
+checkpoint junto com cada página (retoma de onde parou depois de um restart), cede a
+vez quando há conversas em andamento e respeita um orçamento de chamadas por hora.
+Terminado o histórico, passa a buscar só as atividades novas, de tempos em tempos.
+"""
+from __future__ import annotations
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from config import logger
+from preaquecimento import OrcamentoChamadas
+
+# Página máxima aceita pela API de atividades do Strava
+MAX_TAMANHO_PAGINA: int = 200
+
+
+def checkpoint_inicial() -> dict:
+    """Checkpoint de uma importação que ainda não começou."""
+    return {'antes_de': None, 'recente_ate': None, 'paginas': 0, 'atividades': 0, 'concluida': False}
+
+
+class ImportacaoHistorico:
+    """
+    Importação retomável do histórico do atleta.
+
+    - `buscar_pagina(antes_de, depois_de, tamanho)` -> atividades como dicts com `inicio`
+      (epoch UTC): antes de `antes_de`, mais novas primeiro, ou depois de `depois_de`;
+    - `gravar_pagina(registros, checkpoint)` grava a página e o checkpoint numa transação;
+    - `carregar_checkpoint()` devolve o último checkpoint gravado (ou None);
+    - `ocupado()` diz se há conversas em andamento: a importação espera a próxima rodada.
+    """
+
+    def __init__(self, buscar_pagina: Callable[[Optional[int], Optional[int], int], list[dict]],
+                 gravar_pagina: Callable[[list[dict], dict], None],
+                 carregar_checkpoint: Callable[[], Optional[dict]],
+                 orcamento: OrcamentoChamadas, ocupado: Callable[[], bool] = lambda: False,
+                 tamanho_pagina: int = 100, paginas_por_rodada: int = 5,
+                 intervalo_novas_seg: float = 1800) -> None:
+        self._buscar_pagina = buscar_pagina
+        self._gravar_pagina = gravar_pagina
+        self._carregar_checkpoint = carregar_checkpoint
+        self._orcamento = orcamento
+        self._ocupado = ocupado
+        self.tamanho_pagina = max(1, min(tamanho_pagina, MAX_TAMANHO_PAGINA))
+        self.paginas_por_rodada = paginas_por_rodada
+        self.intervalo_novas_seg = intervalo_novas_seg
+        self._rodando = threading.Lock()
+        self._novas_em: Optional[float] = None
+        self._ultimo_motivo: str = ""
+
+    def definir_ocupado(self, ocupado: Callable[[], bool]) -> None:
+        """Troca o sinal de tráfego interativo (o runtime assíncrono tem a sua fila de chats)."""
+        self._ocupado = ocupado
+
+    def checkpoint(self) -> dict:
+        return {**checkpoint_inicial(), **(self._carregar_checkpoint() or {})}
+
+    # ------------------------------------------
+    # Rodadas
+    # ------------------------------------------
+    def _proxima_pagina(self, checkpoint: dict) -> Optional[list[dict]]:
+        """Busca a próxima página e atualiza o checkpoint; None se não há nada novo."""
+        if not checkpoint['concluida']:
+            registros = self._buscar_pagina(checkpoint['antes_de'], None, self.tamanho_pagina)
+            if registros:
+                checkpoint['antes_de'] = min(r['inicio'] for r in registros)
+            if len(registros) < self.tamanho_pagina:
+                checkpoint['concluida'] = True
+                logger.info(f"Importação do histórico concluída: {checkpoint['atividades'] + len(registros)} atividades.")
+        else:
+            if checkpoint['recente_ate'] is None:
+                return None
+            registros = self._buscar_pagina(None, checkpoint['recente_ate'], self.tamanho_pagina)
+            if len(registros) < self.tamanho_pagina:
+                self._novas_em = time.monotonic()
+            if not registros:
+                return None
+        if registros:
+            checkpoint['recente_ate'] = max(checkpoint['recente_ate'] or 0, max(r['inicio'] for r in registros))
+        checkpoint['paginas'] += 1
+        checkpoint['atividades'] += len(registros)
+        return registros
+
+    def _pode_buscar_novas(self) -> bool:
+        return self._novas_em is None or time.monotonic() - self._novas_em >= self.intervalo_novas_seg
+
+    def rodada(self) -> dict[str, int | str]:
+        """
+        Tarefa periódica: busca até `paginas_por_rodada` páginas, parando se aparecer
+        conversa, se o orçamento acabar ou se não houver mais nada. Retorna o que fez.
+        """
+        if not self._rodando.acquire(blocking=False):
+            return {'paginas': 0, 'atividades': 0, 'motivo': 'rodada anterior em andamento'}
+        paginas = atividades = 0
+        motivo = 'limite da rodada'
+        try:
+            checkpoint = self.checkpoint()
+            for _ in range(self.paginas_por_rodada):
+                if checkpoint['concluida'] and not self._pode_buscar_novas():
+                    motivo = 'em dia'
+                    break
+                if self._ocupado():
+                    motivo = 'conversas em andamento'
+                    break
+                if not self._orcamento.reservar(1):
+                    motivo = 'orçamento do Strava esgotado'
+                    break
+                try:
+                    registros = self._proxima_pagina(checkpoint)
+                    if registros is None:
+                        motivo = 'em dia'
+                        break
+                    self._gravar_pagina(registros, dict(checkpoint))
+                except Exception as e:
+                    # Nada gravado: a próxima rodada repete a página a partir do checkpoint
+                    logger.warning(f"Importação do histórico: falha na página: {e}")
+                    motivo = 'erro na busca'
+                    break
+                paginas += 1
+                atividades += len(registros)
+                if checkpoint['concluida'] and len(registros) < self.tamanho_pagina:
+                    motivo = 'em dia'
+                    break
+        finally:
+            self._rodando.release()
+        self._ultimo_motivo = motivo
+        if paginas:
+            logger.info(f"Importação do histórico: {paginas} páginas, {atividades} atividades ({motivo}).")
+        return {'paginas': paginas, 'atividades': atividades, 'motivo': motivo}
+
+    # ------------------------------------------
+    # Progresso
+    # ------------------------------------------
+    def texto_progresso(self) -> str:
+        """Resumo para o comando de progresso."""
+        checkpoint = self.checkpoint()
+        if not checkpoint['paginas']:
+            return "📥 A importação do teu histórico do Strava ainda não começou. Ela roda em segundo plano; volta daqui a pouco!"
+        total = f"{checkpoint['atividades']} atividades em {checkpoint['paginas']} páginas"
+        mais_antiga = ""
+        if checkpoint['antes_de']:
+            data = datetime.fromtimestamp(checkpoint['antes_de'], tz=timezone.utc).astimezone()
+            mais_antiga = f", desde {data.strftime('%m/%Y')}"
+        if checkpoint['concluida']:
+            return f"✅ Histórico do Strava importado: {total}{mais_antiga}. As atividades novas entram automaticamente."
+        pausa = f" (pausada: {self._ultimo_motivo})" if self._ultimo_motivo in (
+            'conversas em andamento', 'orçamento do Strava esgotado', 'erro na busca') else ""
+        return f"📥 Importando o histórico do Strava{pausa}: {total}{mais_antiga} até agora."
@@ -0,0 +1,119 @@
+"""
+Detector de intenções da conversa livre (clima, Strava, bike).
+Todas as palavras-chave são compiladas uma única vez numa só expressão regular: a
+mensagem é normalizada (minúsculas, sem acento) e percorrida uma vez, casando apenas
+palavras inteiras. Cada termo soma seu peso à intenção; só as intenções que passam do
+limiar disparam a busca de dados, evitando chamadas ao Strava/OpenWeather à toa.
+
+Benchmark contra a busca por substring: python src/intencoes.py
+"""
+from __future__ import annotations
+import re
+import unicodedata
+from typing import Iterable
+
+from constantes import (
+    PALAVRAS_CLIMA, PALAVRAS_STRAVA, PALAVRAS_BIKE,
+    PESOS_INTENCOES, LIMIAR_INTENCAO, EXPRESSOES_NEUTRAS
+)
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas e sem acentos ("Último Pedal" -> "ultimo pedal"); emojis e afins são descartados."""
+    # Decompor e descartar o que não é ASCII roda inteiro em C (str.translate é ~4x mais lento)
+    return unicodedata.normalize('NFKD', texto.lower()).encode('ascii', 'ignore').decode('ascii')
+
+
+def _montar_termos() -> dict[str, list[tuple[str, float]]]:
+    """termo normalizado -> [(intenção, peso)]; expressões neutras têm lista vazia."""
+    pesos: dict[str, dict[str, float]] = {}
+    for intencao, palavras in (('clima', PALAVRAS_CLIMA), ('strava', PALAVRAS_STRAVA), ('bike', PALAVRAS_BIKE)):
+        termos = pesos.setdefault(intencao, {})
+        for palavra in palavras:
+            termos[normalizar(palavra)] = 1.0
+    for intencao, termos_extras in PESOS_INTENCOES.items():
+        for termo, peso in termos_extras.items():
+            pesos.setdefault(intencao, {})[normalizar(termo)] = peso
+
+    termos: dict[str, list[tuple[str, float]]] = {}
+    for intencao, termos_intencao in pesos.items():
+        for termo, peso in termos_intencao.items():
+            termos.setdefault(termo, []).append((intencao, peso))
+    for expressao in EXPRESSOES_NEUTRAS:
+        termos[normalizar(expressao)] = []
+    return termos
+
+
+def _regex_trie(termos: Iterable[str]) -> str:
+    """
+    Alternativas agrupadas por prefixo comum ("pedal|pedais" -> "peda(?:is|l)"), para o
+    motor de regex não testar cada termo do zero em cada posição do texto.
+    """
+    raiz: dict = {}
+    for termo in termos:
+        no = raiz
+        for letra in termo:
+            no = no.setdefault(letra, {})
+        no[''] = {}
+
+    def _gerar(no: dict) -> str:
+        ramos = [re.escape(letra).replace(r'\ ', r'\s+') + _gerar(filho)
+                 for letra, filho in sorted(no.items()) if letra]
+        if not ramos:
+            return ''
+        corpo = ramos[0] if len(ramos) == 1 else '(?:' + '|'.join(ramos) + ')'
+        # Termo que termina aqui: o resto é opcional (guloso, então o mais longo casa primeiro)
+        return f'(?:{corpo})?' if '' in no else corpo
+
+    return _gerar(raiz)
+
+
+_TERMOS: dict[str, list[tuple[str, float]]] = _montar_termos()
+
+# O casamento mais longo vence: "faz tempo" casa antes de "tempo". As bordas só exigem
+# que não haja letra colada, então "50km" ainda casa "km" e "consolo" não casa "sol".
+_PADRAO: re.Pattern = re.compile(r'(?<![a-z])' + _regex_trie(_TERMOS) + r'(?![a-z])')
+
+
+def pontuar_intencoes(texto: str) -> dict[str, float]:
+    """Pontuação de cada intenção encontrada na mensagem (uma passada pelo texto)."""
+    pontos: dict[str, float] = {}
+    for casamento in _PADRAO.finditer(normalizar(texto)):
+        for intencao, peso in _TERMOS.get(' '.join(casamento.group().split()), ()):
+            pontos[intencao] = pontos.get(intencao, 0.0) + peso
+    return pontos
+
+
+def detectar_intencoes(texto: str, limiar: float = LIMIAR_INTENCAO) -> set[str]:
+    """Intenções com pontuação suficiente para buscar dados ('clima', 'strava', 'bike')."""
+    return {intencao for intencao, pontos in pontuar_intencoes(texto).items() if pontos >= limiar}
+
+
+def _detectar_por_substring(texto: str) -> set[str]:
+    """Detecção antiga (substring em cada lista), mantida só para comparação no benchmark."""
+    texto = texto.lower()
+    listas = (('clima', PALAVRAS_CLIMA), ('strava', PALAVRAS_STRAVA), ('bike', PALAVRAS_BIKE))
+    return {intencao for intencao, palavras in listas if any(p in texto for p in palavras)}
+
+
+def medir_desempenho(frases: list[str], repeticoes: int = 2000) -> dict[str, float]:
+    """Microssegundos por mensagem do detector compilado e da busca por substring."""
+    import timeit
+    resultado: dict[str, float] = {}
+    for nome, funcao in (('compilado', detectar_intencoes), ('substring', _detectar_por_substring)):
+        segundos = timeit.timeit(lambda: [funcao(f) for f in frases], number=repeticoes)
+        resultado[nome] = segundos / (repeticoes * len(frases)) * 1e6
+    return resultado
+
+
+if __name__ == '__main__':
+    _FRASES = [
+        "bom dia, tudo bem?",
+        "como está o tempo hoje? vai chover na serra?",
+        "faz tempo que não pedalo, que consolo ver a galera",
+        "avalie meu último pedal, fiz 80km com 1200m de elevação",
+        "preciso trocar a corrente e as pastilhas de freio da Kaéti",
+        "obrigado coach, amanhã tem mais! " * 5,
+    ]
+    for nome, micros in medir_desempenho(_FRASES).items():
+        print(f"{nome:>10}: {micros:6.2f} µs/mensagem")
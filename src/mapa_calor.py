@@ -0,0 +1,253 @@
+"""
+Mapa de calor das rotas do atleta.
+Cada atividade traz o traçado resumido do Strava (`map.summary_polyline`). O traçado é
+decodificado uma única vez e guardado no banco como um array compacto de inteiros
+(lat/lon × 1e5). Para desenhar, os traçados viram pixels numa grade fixa de tiles
+(projeção de Mercator, a mesma dos mapas da web), tudo com operações vetorizadas do
+NumPy, sem desenhar linha por linha. As grades de cada mês ficam em cache junto com as
+atividades que já contêm, e uma atividade nova só soma a própria contribuição ao mês.
+"""
+from __future__ import annotations
+import tempfile
+import threading
+import zlib
+from datetime import date
+from typing import Callable, Optional
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from cache_persistente import CacheDuasCamadas
+from config import logger
+
+# Nível de zoom da grade e lado do tile em pixels: em z12 com tiles de 128 px cada pixel
+# cobre ~38 m (no equador; menos em latitudes maiores)
+ZOOM: int = 12
+TILE_PX: int = 128
+
+# Passo da interpolação entre dois pontos do traçado, em pixels
+PASSO_PX: float = 0.5
+
+# Segmentos mais longos que isso são saltos do GPS (ou atividades com pausa e
+# deslocamento de carro): não são ligados
+MAX_SEGMENTO_PX: float = 400.0
+
+# O mapa mostra no máximo uma janela de N × N tiles em volta da região mais pedalada
+MAX_TILES_LADO: int = 12
+
+# Tiles de um mês: {(tile_x, tile_y): grade TILE_PX × TILE_PX com quantas atividades passaram em cada pixel}
+Tiles = dict[tuple[int, int], np.ndarray]
+
+
+# ==========================================
+# TRAÇADOS
+# ==========================================
+def decodificar_polyline(texto: str) -> np.ndarray:
+    """
+    Decodifica um "encoded polyline" (formato do Google, usado pelo Strava) sem laço em
+    Python: array (N, 2) int32 com lat/lon × 1e5.
+    """
+    if not texto:
+        return np.empty((0, 2), dtype=np.int32)
+    blocos = np.frombuffer(texto.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    # Cada número ocupa blocos de 5 bits; o último bloco de um número não tem o bit 0x20
+    ultimo = blocos < 0x20
+    numero = np.concatenate(([0], np.cumsum(ultimo[:-1])))
+    inicio_numero = np.flatnonzero(np.concatenate(([True], ultimo[:-1])))
+    posicao = np.arange(len(blocos)) - inicio_numero[numero]
+    valores = np.zeros(numero[-1] + 1, dtype=np.int64)
+    np.add.at(valores, numero, (blocos & 0x1f) << (5 * posicao))
+    valores = np.where(valores & 1, ~(valores >> 1), valores >> 1)
+    # Texto truncado: descarta a coordenada incompleta
+    valores = valores[:len(valores) // 2 * 2]
+    return np.cumsum(valores.reshape(-1, 2), axis=0).astype(np.int32)
+
+
+def pontos_para_bytes(pontos: np.ndarray) -> bytes:
+    return np.ascontiguousarray(pontos, dtype=np.int32).tobytes()
+
+
+def bytes_para_pontos(dados: bytes) -> np.ndarray:
+    return np.frombuffer(dados, dtype=np.int32).reshape(-1, 2)
+
+
+def assinatura_polyline(texto: str) -> int:
+    """Identifica a versão do traçado (o atleta pode recortar a atividade no Strava)."""
+    return zlib.crc32(texto.encode('ascii'))
+
+
+# ==========================================
+# RASTERIZAÇÃO
+# ==========================================
+def para_pixels(pontos: np.ndarray) -> np.ndarray:
+    """Lat/lon × 1e5 -> coordenadas (x, y) em pixels do mundo inteiro no ZOOM da grade."""
+    lat = np.radians(np.clip(pontos[:, 0] / 1e5, -85.0511, 85.0511))
+    lon = pontos[:, 1] / 1e5
+    escala = TILE_PX * 2 ** ZOOM
+    x = (lon + 180.0) / 360.0 * escala
+    y = (1.0 - np.arcsinh(np.tan(lat)) / np.pi) / 2.0 * escala
+    return np.column_stack((x, y))
+
+
+def densificar(pixels: np.ndarray, passo: float = PASSO_PX) -> np.ndarray:
+    """Interpola pontos a cada `passo` pixels ao longo dos segmentos, todos de uma vez."""
+    if len(pixels) < 2:
+        return pixels
+    inicio = pixels[:-1]
+    delta = np.diff(pixels, axis=0)
+    comprimento = np.hypot(delta[:, 0], delta[:, 1])
+    passos = np.maximum(1, np.ceil(comprimento / passo)).astype(np.int64)
+    passos[comprimento > MAX_SEGMENTO_PX] = 1
+    segmento = np.repeat(np.arange(len(delta)), passos)
+    fracao = (np.arange(passos.sum()) - np.repeat(np.cumsum(passos) - passos, passos)) / passos[segmento]
+    return np.vstack((inicio[segmento] + delta[segmento] * fracao[:, None], pixels[-1:]))
+
+
+def rasterizar(pontos: np.ndarray) -> Tiles:
+    """Tiles de uma atividade: 1 em cada pixel por onde o traçado passa."""
+    if len(pontos) == 0:
+        return {}
+    pixels = np.floor(densificar(para_pixels(pontos))).astype(np.int64)
+    largura = TILE_PX * 2 ** ZOOM
+    # Cada pixel conta uma vez por atividade (idas e voltas pela mesma rua não somam)
+    indices = np.unique(pixels[:, 1] * largura + pixels[:, 0])
+    x, y = indices % largura, indices // largura
+    tiles_por_lado = 2 ** ZOOM
+    tile = (y // TILE_PX) * tiles_por_lado + x // TILE_PX
+    ordem = np.argsort(tile, kind='stable')
+    tile, x, y = tile[ordem], x[ordem], y[ordem]
+    tiles_unicos, cortes = np.unique(tile, return_index=True)
+    resultado: Tiles = {}
+    for numero, ini, fim in zip(tiles_unicos, cortes, np.append(cortes[1:], len(tile))):
+        grade = np.zeros((TILE_PX, TILE_PX), dtype=np.float32)
+        np.add.at(grade, (y[ini:fim] % TILE_PX, x[ini:fim] % TILE_PX), 1)
+        resultado[(int(numero % tiles_por_lado), int(numero // tiles_por_lado))] = grade
+    return resultado
+
+
+def somar_tiles(destino: Tiles, origem: Tiles) -> Tiles:
+    """Soma `origem` em `destino` sem alterar as grades de nenhum dos dois (podem estar em cache)."""
+    for chave, grade in origem.items():
+        destino[chave] = destino[chave] + grade if chave in destino else grade
+    return destino
+
+
+def montar_mosaico(tiles: Tiles, max_lado: int = MAX_TILES_LADO) -> Optional[np.ndarray]:
+    """
+    Junta os tiles numa imagem só, limitada a `max_lado` × `max_lado` tiles em volta do
+    tile mais denso (uma viagem distante não encolhe a região de sempre), sem bordas vazias.
+    """
+    if not tiles:
+        return None
+    centro_x, centro_y = max(tiles, key=lambda chave: float(tiles[chave].sum()))
+    meio = max_lado // 2
+    janela = {(tx, ty): grade for (tx, ty), grade in tiles.items()
+              if abs(tx - centro_x) <= meio and abs(ty - centro_y) <= meio}
+    x0 = min(tx for tx, _ in janela)
+    y0 = min(ty for _, ty in janela)
+    largura = max(tx for tx, _ in janela) - x0 + 1
+    altura = max(ty for _, ty in janela) - y0 + 1
+    mosaico = np.zeros((altura * TILE_PX, largura * TILE_PX), dtype=np.float32)
+    for (tx, ty), grade in janela.items():
+        linha, coluna = (ty - y0) * TILE_PX, (tx - x0) * TILE_PX
+        mosaico[linha:linha + TILE_PX, coluna:coluna + TILE_PX] = grade
+    linhas = np.flatnonzero(mosaico.any(axis=1))
+    colunas = np.flatnonzero(mosaico.any(axis=0))
+    margem = 8
+    return mosaico[max(0, linhas[0] - margem):linhas[-1] + margem + 1,
+                   max(0, colunas[0] - margem):colunas[-1] + margem + 1]
+
+
+def meses_do_periodo(meses: int, hoje: Optional[date] = None) -> list[str]:
+    """Os últimos N meses ('YYYY-MM'), incluindo o atual, do mais antigo para o mais novo."""
+    hoje = hoje or date.today()
+    indice = hoje.year * 12 + hoje.month - 1
+    return [f"{i // 12:04d}-{i % 12 + 1:02d}" for i in range(indice - meses + 1, indice + 1)]
+
+
+# ==========================================
+# MAPA
+# ==========================================
+class MapaCalor:
+    """
+    Mapa de calor dos últimos meses.
+
+    - `listar_polylines(mes)` -> [(id, polyline)] das atividades do mês ('YYYY-MM') com traçado;
+    - `carregar_pontos(ids)` -> {id: bytes} e `salvar_pontos({id: bytes})`: traçados já decodificados;
+    - `cache` guarda, por mês, os tiles e a assinatura de cada atividade já somada.
+    """
+
+    def __init__(self, listar_polylines: Callable[[str], list[tuple[int, str]]],
+                 carregar_pontos: Callable[[list[int]], dict[int, bytes]],
+                 salvar_pontos: Callable[[dict[int, bytes]], None],
+                 cache: CacheDuasCamadas) -> None:
+        self._listar_polylines = listar_polylines
+        self._carregar_pontos = carregar_pontos
+        self._salvar_pontos = salvar_pontos
+        self._cache = cache
+        self._lock = threading.Lock()
+
+    def _pontos(self, polylines: dict[int, str]) -> dict[int, np.ndarray]:
+        """Traçados decodificados; os que ainda não estão no banco são decodificados e gravados."""
+        guardados = self._carregar_pontos(list(polylines))
+        novos = {id_: pontos_para_bytes(decodificar_polyline(texto))
+                 for id_, texto in polylines.items() if id_ not in guardados}
+        if novos:
+            self._salvar_pontos(novos)
+        return {id_: bytes_para_pontos(dados) for id_, dados in {**guardados, **novos}.items()}
+
+    def tiles_mes(self, mes: str) -> Tiles:
+        """Tiles de um mês, somando ao cache só as atividades que ainda não estão nele."""
+        with self._lock:
+            polylines = dict(self._listar_polylines(mes))
+            assinaturas = {id_: assinatura_polyline(texto) for id_, texto in polylines.items()}
+            entrada = self._cache.obter(mes)
+            if entrada is not None and all(assinaturas.get(id_) == assinatura
+                                           for id_, assinatura in entrada['assinaturas'].items()):
+                pendentes = [id_ for id_ in assinaturas if id_ not in entrada['assinaturas']]
+                if not pendentes:
+                    return entrada['tiles']
+                tiles = dict(entrada['tiles'])
+            else:
+                # Primeira vez no mês, ou atividade apagada/recortada: refaz o mês
+                tiles = {}
+                pendentes = list(assinaturas)
+
+            for pontos in self._pontos({id_: polylines[id_] for id_ in pendentes}).values():
+                somar_tiles(tiles, rasterizar(pontos))
+            self._cache.guardar(mes, {'assinaturas': assinaturas, 'tiles': tiles})
+            logger.info(f"Mapa de calor de {mes}: {len(pendentes)} atividades somadas ({len(assinaturas)} no mês).")
+            return tiles
+
+    def mosaico(self, meses: int) -> Optional[np.ndarray]:
+        """Soma dos tiles dos últimos N meses, montada numa imagem (None sem nenhum traçado)."""
+        total: Tiles = {}
+        for mes in meses_do_periodo(meses):
+            somar_tiles(total, self.tiles_mes(mes))
+        return montar_mosaico(total)
+
+    def gerar_imagem(self, meses: int) -> Optional[str]:
+        """Desenha o mapa dos últimos N meses num PNG temporário e retorna o caminho."""
+        mosaico = self.mosaico(meses)
+        if mosaico is None:
+            return None
+        altura, largura = mosaico.shape
+        escala = 8 / max(altura, largura)
+        fig, ax = plt.subplots(figsize=(max(largura * escala, 3), max(altura * escala, 3)), facecolor='black')
+        try:
+            # Escala logarítmica: as ruas de sempre não apagam as que só apareceram uma vez
+            ax.imshow(np.log1p(mosaico), cmap='inferno', interpolation='nearest')
+            ax.set_axis_off()
+            periodo = "no último mês" if meses == 1 else f"nos últimos {meses} meses"
+            ax.set_title(f"Mapa de calor dos teus pedais {periodo}", color='white', fontsize=12)
+
+            tmp_file = tempfile.NamedTemporaryFile(suffix='.png', prefix='mapa_', delete=False)
+            caminho_arquivo = tmp_file.name
+            tmp_file.close()
+
+            fig.savefig(caminho_arquivo, dpi=150, bbox_inches='tight', facecolor=fig.get_facecolor())
+            return caminho_arquivo
+        finally:
+            plt.close(fig)
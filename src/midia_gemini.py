@@ -0,0 +1,168 @@
+"""
+Envio de mídia (áudio, foto) para o Gemini sem passar pelo disco.
+Os bytes baixados do Telegram vão direto na mensagem quando são pequenos (inline) ou
+num upload feito da memória. Cada upload fica associado ao `file_unique_id` do
+Telegram, então mídia encaminhada ou reenviada reaproveita o arquivo já no Gemini.
+Os arquivos remotos que nenhuma sessão ativa usa mais são apagados em segundo plano.
+"""
+from __future__ import annotations
+import asyncio
+import io
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from google.genai import types
+
+from config import logger
+
+# Margem antes da expiração do arquivo no Gemini (48h) para não referenciar um arquivo prestes a sumir
+_MARGEM_EXPIRACAO_SEG: float = 3600
+
+
+def _expira_em(arquivo: types.File) -> float:
+    """Instante (time.monotonic) em que o arquivo deixa de ser confiável."""
+    validade = 47 * 3600
+    expiracao = getattr(arquivo, 'expiration_time', None)
+    if isinstance(expiracao, datetime):
+        restante = (expiracao - datetime.now(timezone.utc)).total_seconds() - _MARGEM_EXPIRACAO_SEG
+        validade = max(0.0, restante)
+    return time.monotonic() + validade
+
+
+class CacheMidiaGemini:
+    """
+    `file_unique_id` -> arquivo no Gemini.
+
+    - `enviar(arquivo, mime_type)` / `enviar_async(...)` fazem o upload de um `io.BytesIO`;
+    - `apagar(nome)` remove o arquivo remoto (usado pela expiração);
+    - payloads até `limite_inline` bytes vão na própria mensagem, sem upload.
+    """
+
+    def __init__(self, enviar: Callable[[io.BytesIO, str], types.File],
+                 apagar: Callable[[str], Any],
+                 enviar_async: Optional[Callable[[io.BytesIO, str], Awaitable[types.File]]] = None,
+                 limite_inline: int = 256 * 1024, retencao_segundos: float = 7200,
+                 max_itens: int = 1000) -> None:
+        self._enviar = enviar
+        self._apagar = apagar
+        self._enviar_async = enviar_async
+        self.limite_inline = limite_inline
+        self.retencao_segundos = retencao_segundos
+        self.max_itens = max_itens
+        self._lock = threading.Lock()
+        self._arquivos: dict[str, dict] = {}
+        self._travas: dict[str, threading.Lock] = {}
+        self._envios_async: dict[str, asyncio.Future] = {}
+        self._metricas = {'inline': 0, 'uploads': 0, 'reaproveitados': 0, 'apagados': 0}
+
+    # ------------------------------------------
+    # Montagem da parte da mensagem
+    # ------------------------------------------
+    def _inline(self, dados: bytes, mime_type: str) -> Optional[types.Part]:
+        if len(dados) > self.limite_inline:
+            return None
+        with self._lock:
+            self._metricas['inline'] += 1
+        return types.Part.from_bytes(data=dados, mime_type=mime_type)
+
+    def _do_cache(self, chave: Optional[str]) -> Optional[types.Part]:
+        if chave is None:
+            return None
+        with self._lock:
+            entrada = self._arquivos.get(chave)
+            if entrada is None or entrada['expira_em'] <= time.monotonic():
+                return None
+            entrada['ultimo_uso'] = time.monotonic()
+            self._metricas['reaproveitados'] += 1
+            arquivo = entrada['arquivo']
+        logger.debug(f"Mídia {chave} já está no Gemini: upload evitado.")
+        return types.Part.from_uri(file_uri=arquivo.uri, mime_type=arquivo.mime_type)
+
+    def _guardar(self, chave: Optional[str], arquivo: types.File) -> types.Part:
+        # Sem file_unique_id o arquivo não é reaproveitado, mas entra no índice para ser apagado depois
+        chave = chave if chave is not None else arquivo.name
+        agora = time.monotonic()
+        with self._lock:
+            self._metricas['uploads'] += 1
+            self._arquivos[chave] = {'arquivo': arquivo, 'ultimo_uso': agora, 'expira_em': _expira_em(arquivo)}
+            if len(self._arquivos) > self.max_itens:
+                # Só sai do índice; o arquivo remoto expira sozinho no Gemini
+                mais_antigo = min(self._arquivos, key=lambda c: self._arquivos[c]['ultimo_uso'])
+                del self._arquivos[mais_antigo]
+        return types.Part.from_uri(file_uri=arquivo.uri, mime_type=arquivo.mime_type)
+
+    def parte(self, dados: bytes, mime_type: str, chave: Optional[str] = None) -> types.Part:
+        """Parte da mensagem com a mídia: inline, arquivo já enviado ou upload novo."""
+        parte = self._inline(dados, mime_type) or self._do_cache(chave)
+        if parte is not None:
+            return parte
+        if chave is None:
+            return self._guardar(None, self._enviar(io.BytesIO(dados), mime_type))
+
+        with self._lock:
+            trava = self._travas.setdefault(chave, threading.Lock())
+        # A mesma mídia chegando duas vezes ao mesmo tempo gera um upload só
+        with trava:
+            parte = self._do_cache(chave)
+            if parte is None:
+                parte = self._guardar(chave, self._enviar(io.BytesIO(dados), mime_type))
+        with self._lock:
+            self._travas.pop(chave, None)
+        return parte
+
+    async def parte_async(self, dados: bytes, mime_type: str, chave: Optional[str] = None) -> types.Part:
+        """Versão assíncrona de `parte` (usa `enviar_async`)."""
+        parte = self._inline(dados, mime_type) or self._do_cache(chave)
+        if parte is not None:
+            return parte
+
+        envio = self._envios_async.get(chave) if chave is not None else None
+        if envio is None:
+            envio = asyncio.ensure_future(self._enviar_async(io.BytesIO(dados), mime_type))
+            if chave is not None:
+                self._envios_async[chave] = envio
+                envio.add_done_callback(lambda _: self._envios_async.pop(chave, None))
+            return self._guardar(chave, await asyncio.shield(envio))
+        arquivo = await asyncio.shield(envio)
+        with self._lock:
+            self._metricas['reaproveitados'] += 1
+        return types.Part.from_uri(file_uri=arquivo.uri, mime_type=arquivo.mime_type)
+
+    # ------------------------------------------
+    # Expiração em segundo plano
+    # ------------------------------------------
+    def expirar(self, uris_em_uso: Iterable[str] = ()) -> int:
+        """
+        Apaga do Gemini os arquivos sem uso há mais de `retencao_segundos` que nenhuma
+        sessão ativa referencia. Retorna quantos arquivos foram apagados.
+        """
+        em_uso = set(uris_em_uso)
+        agora = time.monotonic()
+        with self._lock:
+            vencidos = [
+                (chave, entrada['arquivo']) for chave, entrada in self._arquivos.items()
+                if entrada['expira_em'] <= agora
+                or (entrada['ultimo_uso'] + self.retencao_segundos <= agora and entrada['arquivo'].uri not in em_uso)
+            ]
+            for chave, _ in vencidos:
+                del self._arquivos[chave]
+
+        apagados = 0
+        for chave, arquivo in vencidos:
+            try:
+                self._apagar(arquivo.name)
+                apagados += 1
+            except Exception as e:
+                # Já expirado no Gemini ou falha de rede: o Gemini apaga sozinho em até 48h
+                logger.debug(f"Não foi possível apagar a mídia {chave} ({arquivo.name}): {e}")
+        if apagados:
+            with self._lock:
+                self._metricas['apagados'] += apagados
+            logger.info(f"Expiração de mídia: {apagados} arquivos apagados do Gemini.")
+        return apagados
+
+    def metricas(self) -> dict[str, int]:
+        with self._lock:
+            return {**self._metricas, 'arquivos': len(self._arquivos)}
@@ -0,0 +1,145 @@
+"""
+Orçamento de tokens do Coach-Strava.
+Estima os tokens de cada parte do prompt (instrução de sistema, histórico, dados injetados
+e texto do usuário) e corta o excesso seguindo uma ordem de prioridade.
+"""
+from __future__ import annotations
+import math
+from typing import Optional
+
+from google.genai import types
+
+from config import ORCAMENTO_TOKENS, logger
+from constantes import PRIORIDADE_DADOS
+
+# Média aproximada de caracteres por token do Gemini para texto em português
+_CHARS_POR_TOKEN: float = 4.0
+
+# Custo fixo estimado de partes não textuais (áudio, imagem, arquivos)
+_TOKENS_PARTE_MIDIA: int = 258
+
+# Referência usada no lugar de um bloco de dados que o modelo já recebeu nesta sessão
+_TEXTO_SEM_MUDANCA: str = "sem mudanças desde o último envio nesta conversa (ver acima)"
+
+# Sufixo adicionado quando o texto do usuário precisa ser truncado
+_SUFIXO_TRUNCADO: str = " [...]"
+
+
+def estimar_tokens(texto: Optional[str]) -> int:
+    """Estimativa local (sem chamada de rede) da quantidade de tokens de um texto."""
+    if not texto:
+        return 0
+    return math.ceil(len(texto) / _CHARS_POR_TOKEN)
+
+
+def tokens_conteudo(conteudo: types.Content) -> int:
+    """Estima os tokens de um item do histórico do Gemini."""
+    total = 0
+    for parte in conteudo.parts or []:
+        if parte.text is not None:
+            total += estimar_tokens(parte.text)
+        else:
+            total += _TOKENS_PARTE_MIDIA
+    return total
+
+
+def tokens_historico(historico: list[types.Content]) -> int:
+    """Soma a estimativa de tokens de todo o histórico."""
+    return sum(tokens_conteudo(c) for c in historico)
+
+
+def _prioridade_bloco(bloco: str) -> int:
+    """Posição do bloco em PRIORIDADE_DADOS (blocos desconhecidos ficam por último)."""
+    for i, tag in enumerate(PRIORIDADE_DADOS):
+        if bloco.startswith(f"[{tag}"):
+            return i
+    return len(PRIORIDADE_DADOS)
+
+
+def _compactar_historico(historico: list[types.Content], excesso: int) -> int:
+    """
+    Remove os turnos mais antigos do histórico (em pares user/model, para manter
+    a alternância exigida pela API) até liberar `excesso` tokens.
+    Altera a lista no lugar e retorna quantos tokens foram liberados.
+    """
+    liberados = 0
+    while excesso > liberados and len(historico) >= 2:
+        liberados += tokens_conteudo(historico[0]) + tokens_conteudo(historico[1])
+        del historico[:2]
+    return liberados
+
+
+def _textos_usuario(historico: list[types.Content]) -> list[str]:
+    return [parte.text for c in historico if c.role == 'user' for parte in c.parts or [] if parte.text]
+
+
+def referenciar_dados_repetidos(dados_extras: list[str], historico: list[types.Content]) -> list[str]:
+    """
+    Troca por uma referência curta os blocos de dados idênticos a um já enviado e ainda
+    presente no histórico da sessão: o modelo já os viu, reenviar só repete tokens.
+    Blocos novos ou com valores diferentes (a "diferença") seguem inteiros.
+    """
+    if not dados_extras or not historico:
+        return list(dados_extras)
+    enviados = _textos_usuario(historico)
+    resultado: list[str] = []
+    for bloco in dados_extras:
+        if any(bloco in texto for texto in enviados):
+            etiqueta = bloco[1:bloco.find(':')] if bloco.startswith('[') and ':' in bloco else bloco[:30]
+            resultado.append(f"[{etiqueta}: {_TEXTO_SEM_MUDANCA}]")
+            logger.debug(f"Bloco {etiqueta} já está no histórico: enviada só a referência.")
+        else:
+            resultado.append(bloco)
+    return resultado
+
+
+def aplicar_orcamento(
+    texto_usuario: str,
+    dados_extras: list[str],
+    historico: list[types.Content],
+    instrucao_sistema: str,
+    orcamento: Optional[int] = None
+) -> tuple[str, dict[str, int]]:
+    """
+    Monta o prompt final respeitando o orçamento de tokens.
+
+    Ordem de corte: (1) turnos antigos do histórico, (2) blocos de dados de menor
+    prioridade, (3) o próprio texto do usuário. A instrução de sistema nunca é cortada.
+    O histórico é compactado no lugar, para que a sessão ativa também encolha.
+    Retorna o prompt e a contagem de tokens por parte.
+    """
+    limite = orcamento if orcamento is not None else ORCAMENTO_TOKENS
+    dados = sorted(dados_extras, key=_prioridade_bloco)
+
+    contagem = {
+        'sistema': estimar_tokens(instrucao_sistema),
+        'historico': tokens_historico(historico),
+        'dados': sum(estimar_tokens(d) for d in dados),
+        'usuario': estimar_tokens(texto_usuario),
+    }
+
+    def _excesso() -> int:
+        return sum(contagem.values()) - limite
+
+    if _excesso() > 0:
+        contagem['historico'] -= _compactar_historico(historico, _excesso())
+
+    while _excesso() > 0 and dados:
+        descartado = dados.pop()
+        contagem['dados'] -= estimar_tokens(descartado)
+        logger.info(f"Orçamento de tokens: bloco descartado {descartado[:30]}...")
+
+    if _excesso() > 0:
+        max_chars = max(0, int((contagem['usuario'] - _excesso()) * _CHARS_POR_TOKEN) - len(_SUFIXO_TRUNCADO))
+        texto_usuario = texto_usuario[:max_chars] + _SUFIXO_TRUNCADO
+        contagem['usuario'] = estimar_tokens(texto_usuario)
+        logger.warning("Orçamento de tokens: texto do usuário truncado.")
+
+    # Mantém a ordem original dos blocos que sobreviveram
+    dados_finais = [d for d in dados_extras if d in dados]
+    prompt = texto_usuario
+    if dados_finais:
+        prompt = texto_usuario + "\n\n" + "\n".join(dados_finais)
+
+    contagem['total'] = sum(contagem.values())
+    return prompt, contagem
@@ -0,0 +1,246 @@
+"""
+Pool de sessões de chat do Gemini com limite de quantidade e de memória.
+Mantém uma janela deslizante do histórico de cada sessão, contabiliza a memória
+aproximada e, ao remover uma sessão, entrega o estado para ser salvo em disco.
+"""
+from __future__ import annotations
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from google.genai import types
+
+from config import logger
+
+# Custo fixo aproximado (bytes) de cada item do histórico e de partes não textuais
+_BYTES_POR_ITEM: int = 256
+_BYTES_PARTE_MIDIA: int = 1024
+
+
+def bytes_historico(historico: list[types.Content]) -> int:
+    """Estimativa do espaço ocupado em memória por um histórico do Gemini."""
+    total = 0
+    for conteudo in historico:
+        total += _BYTES_POR_ITEM
+        for parte in conteudo.parts or []:
+            if parte.text is not None:
+                total += len(parte.text.encode('utf-8'))
+            elif parte.inline_data is not None and parte.inline_data.data:
+                # Mídia enviada inline fica inteira na memória da sessão
+                total += len(parte.inline_data.data)
+            else:
+                total += _BYTES_PARTE_MIDIA
+    return total
+
+
+class PoolSessoes:
+    """
+    Guarda as sessões ativas por chat.
+
+    - `carregador(chat_id)` devolve o histórico inicial (snapshot ou memória do SQLite);
+    - `fabrica(chat_id, historico)` cria a sessão e devolve `(sessao, prefixo, parametros)`, onde
+      `prefixo` é a parte do histórico que ficou fora da sessão (ex.: no cache de contexto) e
+      `parametros` são os argumentos com que ela foi criada (ex.: modelo e config), guardados
+      para montar outras visões da mesma sessão;
+    - `persistir(chat_id, historico)` recebe o histórico lógico completo quando a sessão sai do pool;
+    - `validade(chat_id)`, logo depois de criar a sessão, diz até quando (epoch) ela pode ser usada
+      (ex.: quando vence o cache de contexto a que a config aponta); passado isso é recriada.
+    """
+
+    def __init__(
+        self,
+        carregador: Callable[[str], list[types.Content]],
+        fabrica: Callable[[str, list[types.Content]], tuple[Any, list[types.Content], dict[str, Any]]],
+        persistir: Optional[Callable[[str, list[types.Content]], None]] = None,
+        validade: Optional[Callable[[str], Optional[float]]] = None,
+        max_sessoes: int = 100,
+        max_itens_sessao: int = 40,
+        max_bytes: int = 50 * 1024 * 1024,
+        ttl_segundos: float = 1800
+    ) -> None:
+        self._carregador = carregador
+        self._fabrica = fabrica
+        self._persistir = persistir
+        self._validade = validade
+        self.max_sessoes = max_sessoes
+        self.max_itens_sessao = max_itens_sessao
+        self.max_bytes = max_bytes
+        self.ttl_segundos = ttl_segundos
+        self._entradas: dict[str, dict] = {}
+        self._lock = threading.RLock()
+        # Uma criação de sessão por chat de cada vez, sem segurar o pool inteiro
+        self._travas_criacao: dict[str, threading.Lock] = {}
+
+    def __contains__(self, chat_id: object) -> bool:
+        with self._lock:
+            return str(chat_id) in self._entradas
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entradas)
+
+    @property
+    def vagas(self) -> int:
+        """Sessões que ainda cabem no pool sem remover nenhuma."""
+        with self._lock:
+            return max(0, self.max_sessoes - len(self._entradas))
+
+    @property
+    def bytes_em_uso(self) -> int:
+        with self._lock:
+            return sum(e['bytes'] for e in self._entradas.values())
+
+    @staticmethod
+    def _vencida(entrada: dict) -> bool:
+        return entrada['expira_em'] is not None and time.time() >= entrada['expira_em']
+
+    def obter(self, chat_id: str):
+        """
+        Retorna a sessão do chat, criando-a (e abrindo espaço no pool) se necessário.
+        Uma sessão vencida é recriada com o mesmo histórico. A criação (SQLite e cache
+        de contexto na rede) roda fora do lock do pool: só trava o próprio chat.
+        """
+        chat_id = str(chat_id)
+        self._salvar_removidas(self._expirar())
+        with self._lock:
+            trava = self._travas_criacao.setdefault(chat_id, threading.Lock())
+        with trava:
+            with self._lock:
+                entrada = self._entradas.get(chat_id)
+                if entrada is not None and not self._vencida(entrada):
+                    entrada['ultimo_uso'] = time.monotonic()
+                    return entrada['sessao']
+                historico = self._historico_entrada(entrada) if entrada is not None else None
+
+            if historico is None:
+                historico = self._carregador(chat_id)
+            else:
+                logger.info(f"Sessão do chat {chat_id} venceu (cache de contexto): recriando.")
+            sessao, prefixo, parametros = self._fabrica(chat_id, historico)
+            expira_em = self._validade(chat_id) if self._validade is not None else None
+
+            with self._lock:
+                entrada = {'sessao': sessao, 'prefixo': prefixo, 'parametros': parametros, 'bytes': 0,
+                           'expira_em': expira_em, 'ultimo_uso': time.monotonic()}
+                self._entradas[chat_id] = entrada
+                self._medir(entrada)
+                removidas = self._liberar_espaco(manter=chat_id)
+        self._salvar_removidas(removidas)
+        return sessao
+
+    def atualizar(self, chat_id: str) -> None:
+        """Aplica a janela deslizante e recalcula a memória depois de um turno."""
+        chat_id = str(chat_id)
+        with self._lock:
+            entrada = self._entradas.get(chat_id)
+            if entrada is None:
+                return
+            self._aplicar_janela(entrada['sessao'])
+            self._medir(entrada)
+            entrada['ultimo_uso'] = time.monotonic()
+            removidas = self._liberar_espaco(manter=chat_id)
+        self._salvar_removidas(removidas)
+
+    def parametros(self, chat_id: str) -> dict[str, Any]:
+        """Argumentos com que a sessão ativa do chat foi criada (vazio se ela não está no pool)."""
+        with self._lock:
+            entrada = self._entradas.get(str(chat_id))
+            return dict(entrada['parametros']) if entrada is not None else {}
+
+    def historico_completo(self, chat_id: str) -> list[types.Content]:
+        """
+        Histórico lógico do chat: prefixo fora da sessão + histórico vivo, se a sessão está
+        no pool; senão o do `carregador`. Não cria sessão nem mexe na ordem de remoção
+        (ex.: pré-geração para todos os chats sem despejar quem está conversando).
+        """
+        with self._lock:
+            entrada = self._entradas.get(str(chat_id))
+            if entrada is not None:
+                return self._historico_entrada(entrada)
+        return self._carregador(str(chat_id))
+
+    def anexar(self, chat_id: str, conteudos: list[types.Content]) -> None:
+        """Acrescenta ao histórico de uma sessão ativa uma troca feita fora dela."""
+        with self._lock:
+            entrada = self._entradas.get(str(chat_id))
+            if entrada is None:
+                return
+            for curado in (True, False):
+                entrada['sessao'].get_history(curated=curado).extend(conteudos)
+        self.atualizar(chat_id)
+
+    def historicos(self) -> list[list[types.Content]]:
+        """Cópia do histórico vivo de cada sessão ativa (ex.: para saber que mídias ainda estão em uso)."""
+        with self._lock:
+            return [list(e['prefixo']) + list(e['sessao'].get_history(curated=False))
+                    for e in self._entradas.values()]
+
+    def remover(self, chat_id: str) -> None:
+        """Tira a sessão do pool, entregando o estado para ser persistido."""
+        with self._lock:
+            entrada = self._entradas.pop(str(chat_id), None)
+        if entrada is not None:
+            self._salvar(str(chat_id), entrada)
+
+    def salvar_todas(self) -> None:
+        """Persiste todas as sessões (usado no encerramento do bot)."""
+        with self._lock:
+            entradas = list(self._entradas.items())
+        for chat_id, entrada in entradas:
+            self._salvar(chat_id, entrada)
+        logger.info(f"Snapshot de {len(entradas)} sessões salvo.")
+
+    @staticmethod
+    def _historico_entrada(entrada: dict) -> list[types.Content]:
+        return entrada['prefixo'] + list(entrada['sessao'].get_history(curated=True))
+
+    def _salvar(self, chat_id: str, entrada: dict) -> None:
+        if self._persistir is None:
+            return
+        try:
+            self._persistir(chat_id, self._historico_entrada(entrada))
+        except Exception as e:
+            logger.error(f"Erro ao salvar snapshot da sessão {chat_id}: {e}")
+
+    def _aplicar_janela(self, sessao) -> None:
+        """Mantém só os itens mais recentes do histórico vivo da sessão (em pares user/model)."""
+        for curado in (True, False):
+            historico = sessao.get_history(curated=curado)
+            excesso = len(historico) - self.max_itens_sessao
+            if excesso > 0:
+                excesso += excesso % 2
+                del historico[:excesso]
+
+    def _medir(self, entrada: dict) -> None:
+        entrada['bytes'] = bytes_historico(entrada['sessao'].get_history(curated=False))
+
+    def _salvar_removidas(self, removidas: list[tuple[str, dict]]) -> None:
+        """Persiste, fora do lock do pool, as sessões que saíram dele."""
+        for chat_id, entrada in removidas:
+            self._salvar(chat_id, entrada)
+
+    def _expirar(self) -> list[tuple[str, dict]]:
+        """Tira do pool as sessões ociosas há mais de `ttl_segundos`; retorna as removidas."""
+        limite = time.monotonic() - self.ttl_segundos
+        with self._lock:
+            ociosas = [c for c, e in self._entradas.items() if e.get('ultimo_uso', 0) < limite]
+            return [(chat_id, self._entradas.pop(chat_id)) for chat_id in ociosas]
+
+    def _liberar_espaco(self, manter: str) -> list[tuple[str, dict]]:
+        """
+        Remove sessões até respeitar os limites e as retorna (chamado com o lock).
+        A vítima é a de maior pontuação `tempo_ocioso * tamanho` (LRU ponderado pelo tamanho).
+        """
+        removidas = []
+        while len(self._entradas) > 1 and (
+            len(self._entradas) > self.max_sessoes or self.bytes_em_uso > self.max_bytes
+        ):
+            agora = time.monotonic()
+            candidatos = [(c, e) for c, e in self._entradas.items() if c != manter]
+            vitima, _ = max(
+                candidatos,
+                key=lambda item: (agora - item[1].get('ultimo_uso', agora) + 1) * (item[1]['bytes'] + 1)
+            )
+            logger.debug(f"Pool de sessões cheio: removendo a sessão {vitima}.")
+            removidas.append((vitima, self._entradas.pop(vitima)))
+        return removidas
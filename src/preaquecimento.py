@@ -0,0 +1,151 @@
+"""
+Pré-aquecimento dos caches antes de o atleta aparecer.
+Pelo histórico da conversa o bot aprende em que horários (dia da semana + hora) cada
+usuário costuma escrever. Alguns minutos antes desses horários, e das janelas fixas de
+sexta (pré-geração e entrega das 18:00), busca os dados de Strava, bike e clima e
+hidrata a sessão do Gemini dos chats. Assim o primeiro comando e o envio proativo
+encontram tudo em cache. As buscas ao Strava respeitam um orçamento por hora.
+"""
+from __future__ import annotations
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Callable, Iterable, Optional
+
+from config import logger
+
+# Pedidos de contexto que vão ao Strava e valem para todos os chats (atleta único)
+PEDIDOS_STRAVA: tuple[str, ...] = ('semana', 'ultimo_pedal', 'bike')
+
+
+class OrcamentoChamadas:
+    """Limite de chamadas numa janela deslizante (ex.: 30 idas ao Strava por hora)."""
+
+    def __init__(self, limite: int, janela_segundos: float = 3600) -> None:
+        self.limite = limite
+        self.janela_segundos = janela_segundos
+        self._lock = threading.Lock()
+        self._chamadas: deque[float] = deque()
+
+    def _descartar_antigas(self, agora: float) -> None:
+        while self._chamadas and self._chamadas[0] <= agora - self.janela_segundos:
+            self._chamadas.popleft()
+
+    def reservar(self, quantidade: int) -> int:
+        """Reserva até `quantidade` chamadas; retorna quantas foram liberadas."""
+        with self._lock:
+            agora = time.monotonic()
+            self._descartar_antigas(agora)
+            liberadas = max(0, min(quantidade, self.limite - len(self._chamadas)))
+            self._chamadas.extend([agora] * liberadas)
+            return liberadas
+
+
+def aquecer_chats(chat_ids: list[str], registro, meta_do_chat: Callable[[str], float],
+                  hidratar_sessao: Callable[[str], Any], orcamento: OrcamentoChamadas,
+                  prazo: float = 60.0, chats_sessao: Iterable[str] = (),
+                  vagas_sessoes: int = 0) -> dict[str, int]:
+    """
+    Busca o contexto dos chats (só o que não está em cache, dentro do orçamento do Strava)
+    e hidrata as sessões do Gemini só de `chats_sessao` (quem deve escrever em seguida),
+    no máximo `vagas_sessoes`: uma sessão a mais cria cache de contexto e, com o pool
+    cheio, despejaria quem está conversando. Retorna contadores para o log e os testes.
+    """
+    pedidos_strava: list = list(PEDIDOS_STRAVA)
+    pedidos_strava += [('progresso', meta) for meta in sorted({meta_do_chat(c) for c in chat_ids})]
+    pendentes = [pedido for pedido in pedidos_strava if not registro.em_cache(pedido)]
+    liberados = orcamento.reservar(len(pendentes))
+    if liberados < len(pendentes):
+        logger.info(f"Pré-aquecimento: orçamento do Strava esgotado, {len(pendentes) - liberados} buscas adiadas.")
+    registro.resolver(['clima', *pendentes[:liberados]], prazo=prazo)
+
+    sessoes = 0
+    for chat_id in list(chats_sessao)[:max(0, vagas_sessoes)]:
+        try:
+            hidratar_sessao(chat_id)
+            sessoes += 1
+        except Exception as e:
+            logger.warning(f"Pré-aquecimento: não foi possível hidratar a sessão do chat {chat_id}: {e}")
+    return {'buscas_strava': liberados, 'adiadas': len(pendentes) - liberados, 'sessoes': sessoes}
+
+
+class PreAquecedor:
+    """
+    Decide quando aquecer e para quais chats.
+
+    - `habitos()` -> {chat_id: {(dia_semana, hora)}}: horários habituais (segunda = 0);
+    - `chats_janelas_fixas()` -> chats aquecidos antes das `janelas_fixas` [(dia_semana, "HH:MM")];
+    - `aquecer(chat_ids, chats_habituais)` faz o trabalho; roda `antecedencia_min` minutos antes
+      de cada horário. `chats_habituais` são os que vão escrever (as janelas fixas são envios
+      pré-gerados, que não usam a sessão do chat).
+    """
+
+    def __init__(self, aquecer: Callable[[list[str], list[str]], Any],
+                 habitos: Callable[[], dict[str, set[tuple[int, int]]]],
+                 chats_janelas_fixas: Callable[[], list[str]],
+                 janelas_fixas: Iterable[tuple[int, str]] = (),
+                 antecedencia_min: float = 10, reaprender_segundos: float = 3600) -> None:
+        self._aquecer = aquecer
+        self._habitos = habitos
+        self._chats_janelas_fixas = chats_janelas_fixas
+        self.janelas_fixas = [(dia, horario) for dia, horario in janelas_fixas if horario]
+        self.antecedencia = timedelta(minutes=antecedencia_min)
+        self.reaprender_segundos = reaprender_segundos
+        self._lock = threading.Lock()
+        self._cache_habitos: dict[str, set[tuple[int, int]]] = {}
+        self._aprendido_em: Optional[float] = None
+        # (chat_id, horário aquecido) -> horário, para não aquecer duas vezes o mesmo
+        self._aquecidos: dict[tuple[str, datetime], datetime] = {}
+
+    def _habitos_atuais(self) -> dict[str, set[tuple[int, int]]]:
+        agora = time.monotonic()
+        if self._aprendido_em is None or agora - self._aprendido_em >= self.reaprender_segundos:
+            self._cache_habitos = self._habitos()
+            self._aprendido_em = agora
+        return self._cache_habitos
+
+    def devidos(self, agora: datetime) -> list[str]:
+        """Chats com um horário habitual ou janela fixa começando nos próximos minutos."""
+        return list(self._devidos(agora))
+
+    def _devidos(self, agora: datetime) -> dict[str, bool]:
+        """Chats devidos -> se algum horário habitual do chat está começando."""
+        alvo = agora + self.antecedencia
+        horarios: dict[str, datetime] = {}
+
+        hora_cheia = alvo.replace(minute=0, second=0, microsecond=0)
+        habituais: set[str] = set()
+        for chat_id, habitos in self._habitos_atuais().items():
+            if (alvo.weekday(), alvo.hour) in habitos:
+                horarios[chat_id] = hora_cheia
+                habituais.add(chat_id)
+
+        for dia, horario in self.janelas_fixas:
+            hora, minuto = (int(parte) for parte in horario.split(':'))
+            janela = alvo.replace(hour=hora, minute=minuto, second=0, microsecond=0)
+            if alvo.weekday() == dia and agora < janela <= alvo:
+                for chat_id in self._chats_janelas_fixas():
+                    horarios[str(chat_id)] = janela
+
+        with self._lock:
+            # Esquece o que já passou há mais de um dia
+            for chave, horario in list(self._aquecidos.items()):
+                if horario < agora - timedelta(days=1):
+                    del self._aquecidos[chave]
+            devidos = [chat_id for chat_id, horario in horarios.items() if (chat_id, horario) not in self._aquecidos]
+            for chat_id in devidos:
+                self._aquecidos[(chat_id, horarios[chat_id])] = horarios[chat_id]
+        return {chat_id: chat_id in habituais for chat_id in devidos}
+
+    def verificar(self, agora: Optional[datetime] = None) -> list[str]:
+        """Tarefa periódica: aquece os chats devidos agora. Retorna os chats aquecidos."""
+        if self.antecedencia <= timedelta(0):
+            return []
+        devidos = self._devidos(agora or datetime.now())
+        chat_ids = list(devidos)
+        if chat_ids:
+            inicio = time.monotonic()
+            resultado = self._aquecer(chat_ids, [chat_id for chat_id, habitual in devidos.items() if habitual])
+            logger.info(f"Pré-aquecimento de {len(chat_ids)} chats em {time.monotonic() - inicio:.1f}s: {resultado}")
+        return chat_ids
@@ -0,0 +1,251 @@
+"""
+Provedores de contexto do Coach-Strava (dados injetados no prompt do Gemini).
+Cada fonte de dados declara sua chave, etiqueta, TTL e timeout. O resolvedor busca
+em paralelo as fontes pedidas sob um prazo total e devolve o que ficou pronto; as
+lentas entram como indisponíveis e, quando terminam, já deixam o valor no cache
+para a próxima mensagem. A latência fica limitada pela fonte mais lenta ou pelo prazo,
+não pela soma de todas.
+"""
+from __future__ import annotations
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from cache_persistente import ArmazemCache, CacheDuasCamadas, armazem_padrao
+from config import PRAZO_CONTEXTO_SEG, logger
+from strava_service import obter_resumo_semana, obter_ultimo_pedal, obter_status_bike, obter_progresso_mensal
+from weather_service import obter_previsao_tempo
+
+# Texto usado no prompt quando uma fonte não respondeu a tempo
+TEXTO_INDISPONIVEL: str = "indisponível no momento"
+
+# Um pedido é a chave do provedor ou (chave, argumento), ex.: ('progresso', 200.0)
+Pedido = str | tuple
+
+
+class ProvedorContexto:
+    """Uma fonte de dados: como buscar, por quanto tempo guardar e quanto esperar por ela."""
+
+    def __init__(self, chave: str, etiqueta: str, buscar: Callable[..., Any],
+                 ttl: float, timeout: float, padrao: Any = TEXTO_INDISPONIVEL,
+                 buscar_async: Optional[Callable[..., Awaitable[Any]]] = None,
+                 formatar: Callable[[Any], str] = str) -> None:
+        self.chave = chave
+        self.etiqueta = etiqueta
+        self.buscar = buscar
+        self.buscar_async = buscar_async
+        self.ttl = ttl
+        self.timeout = timeout
+        self.padrao = padrao
+        self.formatar = formatar
+
+
+def _separar(pedido: Pedido) -> tuple[str, tuple]:
+    if isinstance(pedido, tuple):
+        return pedido[0], tuple(pedido[1:])
+    return pedido, ()
+
+
+class RegistroContexto:
+    """
+    Registro dos provedores + cache por (chave, argumentos) + buscas em andamento.
+    Com `armazem`, o cache também vai para o disco e sobrevive a restarts.
+    """
+
+    def __init__(self, max_workers: int = 8, armazem: Optional[ArmazemCache] = None) -> None:
+        self._provedores: dict[str, ProvedorContexto] = {}
+        # O TTL de cada item vem do provedor; o do namespace é só o padrão
+        self._cache = CacheDuasCamadas('contexto', ttl=3600, max_itens=64, armazem=armazem)
+        self._em_andamento: dict[tuple, Future] = {}
+        self._em_andamento_async: dict[tuple, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='contexto')
+
+    def registrar(self, provedor: ProvedorContexto) -> None:
+        self._provedores[provedor.chave] = provedor
+
+    def provedor(self, chave: str) -> ProvedorContexto:
+        return self._provedores[chave]
+
+    def definir_busca_async(self, chave: str, buscar_async: Callable[..., Awaitable[Any]]) -> None:
+        """Associa a versão assíncrona da busca (usada por `resolver_async`)."""
+        self._provedores[chave].buscar_async = buscar_async
+
+    # ------------------------------------------
+    # Cache
+    # ------------------------------------------
+    def _do_cache(self, id_busca: tuple) -> tuple[bool, Any]:
+        item = self._cache.obter_item(id_busca)
+        if item is None:
+            return False, None
+        return True, item[0]
+
+    async def _do_cache_async(self, id_busca: tuple) -> tuple[bool, Any]:
+        item = await self._cache.obter_item_async(id_busca)
+        if item is None:
+            return False, None
+        return True, item[0]
+
+    def em_cache(self, pedido: Pedido) -> bool:
+        """Se o pedido seria atendido pelo cache, sem ir à fonte."""
+        chave, argumentos = _separar(pedido)
+        return self._do_cache((chave, *argumentos))[0]
+
+    def _guardar(self, id_busca: tuple, valor: Any, disco_em_segundo_plano: bool = False) -> None:
+        provedor = self._provedores[id_busca[0]]
+        if provedor.formatar(valor).startswith("Erro"):
+            return  # os serviços devolvem o erro como texto; não vale guardar
+        self._cache.guardar(id_busca, valor, ttl=provedor.ttl, disco_em_segundo_plano=disco_em_segundo_plano)
+
+    # ------------------------------------------
+    # Resolvedor síncrono (threads)
+    # ------------------------------------------
+    def _iniciar_busca(self, id_busca: tuple) -> Future:
+        """Reaproveita a busca em andamento da mesma fonte ou inicia uma nova."""
+        with self._lock:
+            futuro = self._em_andamento.get(id_busca)
+            if futuro is not None:
+                return futuro
+            provedor = self._provedores[id_busca[0]]
+            futuro = self._executor.submit(provedor.buscar, *id_busca[1:])
+            self._em_andamento[id_busca] = futuro
+
+        def _concluir(f: Future) -> None:
+            with self._lock:
+                self._em_andamento.pop(id_busca, None)
+            if f.exception() is None:
+                self._guardar(id_busca, f.result())
+
+        futuro.add_done_callback(_concluir)
+        return futuro
+
+    def resolver(self, pedidos: Iterable[Pedido], prazo: Optional[float] = None) -> dict[str, Any]:
+        """
+        Busca em paralelo as fontes pedidas e devolve {chave: valor}. Fontes que falharam
+        ou passaram do seu timeout (ou do prazo total) recebem o valor padrão do provedor.
+        """
+        prazo = PRAZO_CONTEXTO_SEG if prazo is None else prazo
+        inicio = time.monotonic()
+        resultado: dict[str, Any] = {}
+        pendentes: dict[Future, tuple[tuple, float]] = {}
+
+        for pedido in pedidos:
+            chave, argumentos = _separar(pedido)
+            id_busca = (chave, *argumentos)
+            em_cache, valor = self._do_cache(id_busca)
+            if em_cache:
+                resultado[chave] = valor
+                continue
+            limite = inicio + min(self._provedores[chave].timeout, prazo)
+            pendentes[self._iniciar_busca(id_busca)] = (id_busca, limite)
+
+        while pendentes:
+            agora = time.monotonic()
+            for futuro, (id_busca, limite) in list(pendentes.items()):
+                if futuro.done() or limite <= agora:
+                    resultado[id_busca[0]] = self._valor_final(id_busca, futuro)
+                    del pendentes[futuro]
+            if pendentes:
+                proximo_limite = min(limite for _, limite in pendentes.values())
+                wait(list(pendentes), timeout=max(0.0, proximo_limite - time.monotonic()),
+                     return_when=FIRST_COMPLETED)
+
+        return resultado
+
+    def _valor_final(self, id_busca: tuple, futuro) -> Any:
+        provedor = self._provedores[id_busca[0]]
+        if not futuro.done():
+            logger.warning(f"Contexto '{provedor.chave}' não respondeu a tempo; seguindo sem ele.")
+            return provedor.padrao
+        if futuro.exception() is not None:
+            logger.error(f"Erro ao buscar contexto '{provedor.chave}': {futuro.exception()}")
+            return provedor.padrao
+        return futuro.result()
+
+    # ------------------------------------------
+    # Resolvedor assíncrono
+    # ------------------------------------------
+    def _iniciar_busca_async(self, id_busca: tuple) -> asyncio.Task:
+        tarefa = self._em_andamento_async.get(id_busca)
+        if tarefa is not None:
+            return tarefa
+        provedor = self._provedores[id_busca[0]]
+        if provedor.buscar_async is not None:
+            tarefa = asyncio.ensure_future(provedor.buscar_async(*id_busca[1:]))
+        else:
+            tarefa = asyncio.ensure_future(asyncio.to_thread(provedor.buscar, *id_busca[1:]))
+        self._em_andamento_async[id_busca] = tarefa
+
+        def _concluir(t: asyncio.Task) -> None:
+            self._em_andamento_async.pop(id_busca, None)
+            if not t.cancelled() and t.exception() is None:
+                self._guardar(id_busca, t.result(), disco_em_segundo_plano=True)
+
+        tarefa.add_done_callback(_concluir)
+        return tarefa
+
+    async def resolver_async(self, pedidos: Iterable[Pedido], prazo: Optional[float] = None) -> dict[str, Any]:
+        """Versão assíncrona de `resolver` (mesmas regras de cache, timeout e prazo)."""
+        prazo = PRAZO_CONTEXTO_SEG if prazo is None else prazo
+        resultado: dict[str, Any] = {}
+        esperas: list[tuple[tuple, Awaitable]] = []
+
+        for pedido in pedidos:
+            chave, argumentos = _separar(pedido)
+            id_busca = (chave, *argumentos)
+            em_cache, valor = await self._do_cache_async(id_busca)
+            if em_cache:
+                resultado[chave] = valor
+                continue
+            tarefa = self._iniciar_busca_async(id_busca)
+            # shield: estourar o timeout não cancela a busca, que ainda abastece o cache
+            limite = min(self._provedores[chave].timeout, prazo)
+            esperas.append((id_busca, asyncio.wait_for(asyncio.shield(tarefa), timeout=limite)))
+
+        valores = await asyncio.gather(*(espera for _, espera in esperas), return_exceptions=True)
+        for (id_busca, _), valor in zip(esperas, valores):
+            provedor = self._provedores[id_busca[0]]
+            if isinstance(valor, asyncio.TimeoutError):
+                logger.warning(f"Contexto '{provedor.chave}' não respondeu a tempo; seguindo sem ele.")
+                valor = provedor.padrao
+            elif isinstance(valor, BaseException):
+                logger.error(f"Erro ao buscar contexto '{provedor.chave}': {valor}")
+                valor = provedor.padrao
+            resultado[id_busca[0]] = valor
+        return resultado
+
+    def blocos(self, resultado: dict[str, Any]) -> list[str]:
+        """Blocos `[ETIQUETA: valor]` prontos para o prompt, na ordem do resultado."""
+        blocos: list[str] = []
+        for chave, valor in resultado.items():
+            provedor = self._provedores[chave]
+            blocos.append(f"[{provedor.etiqueta}: {provedor.formatar(valor)}]")
+        return blocos
+
+
+# ==========================================
+# PROVEDORES REGISTRADOS
+# ==========================================
+registro_contexto = RegistroContexto(armazem=armazem_padrao)
+
+registro_contexto.registrar(ProvedorContexto(
+    'clima', "DADOS DE CLIMA", obter_previsao_tempo, ttl=600, timeout=3.0
+))
+registro_contexto.registrar(ProvedorContexto(
+    'ultimo_pedal', "DADOS ÚLTIMO PEDAL", obter_ultimo_pedal, ttl=300, timeout=4.0
+))
+registro_contexto.registrar(ProvedorContexto(
+    'semana', "DADOS SEMANA", obter_resumo_semana, ttl=300, timeout=4.0
+))
+registro_contexto.registrar(ProvedorContexto(
+    'bike', "DADOS BIKE", obter_status_bike, ttl=900, timeout=4.0,
+    padrao=(f"Status da bicicleta {TEXTO_INDISPONIVEL}.", 0.0, "Desconhecida"),
+    formatar=lambda status: status[0]
+))
+registro_contexto.registrar(ProvedorContexto(
+    'progresso', "DADOS META", obter_progresso_mensal, ttl=300, timeout=4.0,
+    padrao=f"Progresso do mês {TEXTO_INDISPONIVEL}.",
+    formatar=lambda meta: meta if isinstance(meta, str) else meta.get('texto', 'Erro ao obter meta.')
+))
@@ -0,0 +1,227 @@
+"""
+Clientes HTTP assíncronos (aiohttp) do Strava e do OpenWeather, usados pelo runtime assíncrono.
+Reaproveitam os caches e os cálculos de `strava_service` e `weather_service`:
+só a ida à rede é diferente, e nenhuma thread fica presa esperando resposta.
+"""
+from __future__ import annotations
+import asyncio
+from datetime import datetime
+from typing import Optional
+
+import aiohttp
+from stravalib.model import DetailedAthlete, SummaryActivity
+
+from cliente_http import Disjuntor, politica_retry, sessao_strava, sessao_openweather
+from config import OPENWEATHER_API_KEY, logger
+from constantes import TIPOS_PEDAL
+import strava_service
+from cache_swr import Leitura, nota_desatualizado
+from strava_service import (
+    cache_sincronizacao, CHAVE_SINCRONIZACAO, inicio_sincronizacao, registro_atividade, nota_falha_sincronizacao,
+    cache_atleta, CHAVE_CACHE_ATLETA, renovar_token_strava,
+    cache_ultimo_pedal, CHAVE_CACHE_ULTIMO_PEDAL, POR_PAGINA_ULTIMO_PEDAL, MAX_PAGINAS_ULTIMO_PEDAL,
+    calcular_progresso_mensal, resumir_semana, descrever_ultimo_pedal,
+    status_bike_com_nota, calcular_historico_mensal, km_por_dia, gerar_mapa_calor
+)
+from ai_engine import gravar_atividades_strava
+from weather_service import (
+    cache_clima, CHAVE_CACHE_CLIMA, resumir_previsao, url_previsao, texto_previsao, erro_previsao
+)
+
+_API_STRAVA: str = "https://www.strava.com/api/v3"
+
+# Máximo de atividades por página aceito pela API do Strava
+_POR_PAGINA: int = 200
+
+_TIMEOUT = aiohttp.ClientTimeout(total=15)
+
+# Sessão HTTP compartilhada (pool de conexões keep-alive); criada dentro do event loop
+_sessao_http: Optional[aiohttp.ClientSession] = None
+
+# Erros de rede do aiohttp que valem nova tentativa
+_ERROS_TRANSITORIOS = (asyncio.TimeoutError, aiohttp.ClientConnectionError, ConnectionError)
+
+
+def _sessao() -> aiohttp.ClientSession:
+    global _sessao_http
+    if _sessao_http is None or _sessao_http.closed:
+        _sessao_http = aiohttp.ClientSession(timeout=_TIMEOUT, connector=aiohttp.TCPConnector(limit=100))
+    return _sessao_http
+
+
+async def _get(disjuntor: Disjuntor, url: str, **kwargs) -> aiohttp.ClientResponse:
+    """
+    GET pela sessão compartilhada sob o disjuntor do serviço (o mesmo do cliente síncrono).
+    O corpo já vem lido; a resposta pode ser usada depois de fechada a conexão.
+    """
+    disjuntor.permitir()
+    try:
+        async with _sessao().get(url, **kwargs) as resposta:
+            await resposta.read()
+    except BaseException:
+        # Inclui ClientPayloadError e CancelledError: a chamada de teste do meio-aberto sempre é liberada
+        disjuntor.registrar_falha()
+        raise
+    if resposta.status >= 500 or resposta.status == 429:
+        disjuntor.registrar_falha()
+    else:
+        disjuntor.registrar_sucesso()
+    return resposta
+
+
+async def fechar_sessao_http() -> None:
+    """Fecha a sessão HTTP compartilhada (no encerramento do bot)."""
+    if _sessao_http is not None and not _sessao_http.closed:
+        await _sessao_http.close()
+
+
+# ==========================================
+# STRAVA
+# ==========================================
+async def _get_strava(caminho: str, params: Optional[dict] = None):
+    """GET autenticado na API do Strava, renovando o token uma vez em caso de 401."""
+    gerenciador = strava_service.gerenciador_token
+    for tentativa in range(2):
+        # Token vencido: espera a renovação numa thread; senão ela já roda em segundo plano
+        token = await asyncio.to_thread(gerenciador.token) if gerenciador.expirado() else gerenciador.token()
+        cabecalhos = {'Authorization': f"Bearer {token}"}
+        resposta = await _get(sessao_strava.disjuntor, f"{_API_STRAVA}{caminho}", params=params, headers=cabecalhos)
+        if resposta.status == 401 and tentativa == 0:
+            # Rede de segurança: token revogado antes da expiração informada
+            if not await asyncio.to_thread(renovar_token_strava):
+                raise ConnectionError("Erro crítico na renovação de token do Strava.")
+            continue
+        resposta.raise_for_status()
+        return await resposta.json()
+
+
+@politica_retry(excecoes=_ERROS_TRANSITORIOS)
+async def _buscar_atividades(after: datetime) -> list:
+    atividades: list = []
+    pagina = 1
+    while True:
+        lote = await _get_strava('/athlete/activities', params={
+            'after': int(after.timestamp()), 'per_page': _POR_PAGINA, 'page': pagina
+        })
+        atividades.extend(SummaryActivity.model_validate(item) for item in lote)
+        if len(lote) < _POR_PAGINA:
+            return atividades
+        pagina += 1
+
+
+async def _sincronizar_recentes() -> int:
+    """Versão assíncrona de `strava_service._sincronizar_recentes`."""
+    desde = await asyncio.to_thread(inicio_sincronizacao)
+    registros = [registro_atividade(act) for act in await _buscar_atividades(desde)]
+    await asyncio.to_thread(gravar_atividades_strava, registros, int(desde.timestamp()))
+    return len(registros)
+
+
+async def _sincronizar_async() -> str:
+    """Banco em dia pela sincronização compartilhada; retorna o aviso de dado antigo."""
+    try:
+        return nota_desatualizado(await cache_sincronizacao.obter_async(CHAVE_SINCRONIZACAO, _sincronizar_recentes))
+    except Exception as e:
+        return await asyncio.to_thread(nota_falha_sincronizacao, e)
+
+
+async def obter_progresso_mensal_async(meta_km: float) -> dict | str:
+    """Versão assíncrona de `strava_service.obter_progresso_mensal`."""
+    try:
+        nota = await _sincronizar_async()
+        progresso = await asyncio.to_thread(calcular_progresso_mensal, meta_km)
+    except Exception as e:
+        logger.error(f"Erro ao buscar atividades do mês: {e}")
+        return "Erro ao buscar dados do mês no Strava."
+    progresso['texto'] += nota
+    return progresso
+
+
+async def obter_resumo_semana_async() -> str:
+    """Versão assíncrona de `strava_service.obter_resumo_semana`."""
+    try:
+        nota = await _sincronizar_async()
+        return await asyncio.to_thread(resumir_semana) + nota
+    except Exception as e:
+        logger.error(f"Erro ao buscar resumo semanal: {e}")
+        return f"Erro ao buscar dados do Strava: {e}"
+
+
+async def obter_km_por_dia_async(dias: int = 30) -> dict[str, float]:
+    """Versão assíncrona de `strava_service.obter_km_por_dia`."""
+    await _sincronizar_async()
+    return await asyncio.to_thread(km_por_dia, dias)
+
+
+async def gerar_mapa_calor_async(meses: int) -> Optional[str]:
+    """Versão assíncrona de `strava_service.gerar_mapa_calor`: a rasterização vai para uma thread."""
+    await _sincronizar_async()
+    return await asyncio.to_thread(gerar_mapa_calor, meses, False)
+
+
+@politica_retry(excecoes=_ERROS_TRANSITORIOS)
+async def _buscar_ultimo_pedal() -> Optional[SummaryActivity]:
+    """Pedal mais recente (ou None), parando na primeira página em que aparecer um."""
+    for pagina in range(1, MAX_PAGINAS_ULTIMO_PEDAL + 1):
+        lote = await _get_strava('/athlete/activities', params={'per_page': POR_PAGINA_ULTIMO_PEDAL, 'page': pagina})
+        for item in lote:
+            atividade = SummaryActivity.model_validate(item)
+            if atividade.type in TIPOS_PEDAL:
+                return atividade
+        if len(lote) < POR_PAGINA_ULTIMO_PEDAL:
+            return None
+    return None
+
+
+async def obter_ultimo_pedal_async() -> str:
+    """Versão assíncrona de `strava_service.obter_ultimo_pedal`."""
+    try:
+        leitura = await cache_ultimo_pedal.obter_async(CHAVE_CACHE_ULTIMO_PEDAL, _buscar_ultimo_pedal)
+    except Exception as e:
+        logger.error(f"Erro ao buscar último pedal: {e}")
+        return "Erro ao buscar último pedal no Strava."
+    return descrever_ultimo_pedal(leitura.valor) + nota_desatualizado(leitura)
+
+
+@politica_retry(excecoes=_ERROS_TRANSITORIOS)
+async def _buscar_atleta() -> DetailedAthlete:
+    return DetailedAthlete.model_validate(await _get_strava('/athlete'))
+
+
+async def obter_status_bike_async() -> tuple[str, float, str]:
+    """Versão assíncrona de `strava_service.obter_status_bike`."""
+    try:
+        leitura = await cache_atleta.obter_async(CHAVE_CACHE_ATLETA, _buscar_atleta)
+    except Exception as e:
+        logger.error(f"Erro ao verificar status da bicicleta: {e}")
+        return ("Erro ao verificar desgaste da bicicleta.", 0.0, "Desconhecida")
+    return status_bike_com_nota(leitura)
+
+
+async def obter_historico_mensal_async(meses: int = 3) -> str:
+    """Versão assíncrona de `strava_service.obter_historico_mensal`."""
+    try:
+        nota = await _sincronizar_async()
+        return await asyncio.to_thread(calcular_historico_mensal, meses) + nota
+    except Exception as e:
+        logger.error(f"Erro ao buscar histórico mensal: {e}")
+        return "Erro ao buscar o histórico no Strava."
+
+
+# ==========================================
+# OPENWEATHER
+# ==========================================
+@politica_retry(excecoes=_ERROS_TRANSITORIOS)
+async def _buscar_previsao() -> str:
+    resposta = await _get(sessao_openweather.disjuntor, url_previsao())
+    return resumir_previsao(await resposta.json(content_type=None))
+
+
+async def obter_previsao_tempo_async() -> str:
+    """Versão assíncrona de `weather_service.obter_previsao_tempo`."""
+    if not OPENWEATHER_API_KEY:
+        return "Clima: API Key não configurada."
+    try:
+        return texto_previsao(await cache_clima.obter_async(CHAVE_CACHE_CLIMA, _buscar_previsao))
+    except Exception as e:
+        return erro_previsao(e)
@@ -1,124 +1,268 @@
 """
 Serviço de integração com a API do Strava.
 Gerencia autenticação, atividades, status da bike e geração de gráficos.
+Resumos de semana, mês, histórico e gráfico são somas nos agregados diários do banco,
+que a sincronização das atividades recentes mantém em dia.
 """
 from __future__ import annotations
-import os
 import tempfile
-from typing import Optional
-from datetime import datetime, timedelta
+from typing import Iterable, Iterator, Optional
+from datetime import datetime, timedelta, timezone
 
-import requests
 import pandas as pd
 import matplotlib
 matplotlib.use('Agg')  # Backend não-interativo para evitar erros em servidores
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from dateutil.relativedelta import relativedelta
-from dotenv import set_key
 from stravalib.client import Client
-from cachetools import TTLCache
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
 from config import (
-    STRAVA_CLIENT_ID, STRAVA_CLIENT_SECRET, STRAVA_TOKEN,
-    env_path, logger
+    STRAVA_CLIENT_ID, STRAVA_CLIENT_SECRET, STRAVA_TOKEN, STRAVA_REFRESH_TOKEN,
+    CACHE_STRAVA_FRESCO_SEG, CACHE_STRAVA_LIMITE_SEG, logger
 )
 from constantes import TIPOS_PEDAL
+from cliente_http import sessao_strava, politica_retry
+from cache_swr import CacheSWR, Leitura, nota_desatualizado
+from cache_persistente import CacheDuasCamadas, armazem_padrao
+from mapa_calor import MapaCalor
+from token_strava import ErroRenovacaoToken, GerenciadorTokenStrava
+from ai_engine import (
+    carregar_tokens_strava, salvar_tokens_strava, gravar_atividades_strava, ultima_atividade_strava,
+    somar_estatisticas_diarias, km_por_dia_estatisticas,
+    listar_polylines_mes, carregar_trajetos, salvar_trajetos
+)
 
 # ==========================================
 # SERVIÇO DO STRAVA
 # ==========================================
-client_strava = Client(access_token=STRAVA_TOKEN)
+# O stravalib usa a sessão compartilhada (keep-alive, timeout padrão e disjuntor do Strava)
+client_strava = Client(access_token=STRAVA_TOKEN, requests_session=sessao_strava)
 
-# Cache de atividades com TTL de 5 minutos (evita chamadas repetidas à API)
-_strava_cache: TTLCache = TTLCache(maxsize=20, ttl=300)
+# Sincronização das atividades recentes com o banco: refeita em segundo plano quando deixa
+# de ser fresca; com o Strava fora do ar os resumos seguem saindo do banco, com aviso
+cache_sincronizacao: CacheSWR = CacheSWR(
+    'sincronizacao', fresco=CACHE_STRAVA_FRESCO_SEG, limite=CACHE_STRAVA_LIMITE_SEG, max_itens=1
+)
+CHAVE_SINCRONIZACAO: str = 'recentes'
 
+# Cada sincronização busca de novo os últimos dias antes da atividade mais recente do banco
+# (pega edições e exclusões); sem nada no banco, os últimos meses dos resumos
+SOBREPOSICAO_SINCRONIZACAO: timedelta = timedelta(days=7)
+MESES_SINCRONIZACAO_INICIAL: int = 3
 
-def renovar_token_strava() -> bool:
-    """Renova o token de acesso do Strava usando o refresh token."""
-    logger.info("Tentando renovar o token do Strava...")
-    url = "https://www.strava.com/oauth/token"
+# Perfil do atleta (bicicletas e quilometragem), com a mesma política
+cache_atleta: CacheSWR = CacheSWR(
+    'atleta', fresco=CACHE_STRAVA_FRESCO_SEG, limite=CACHE_STRAVA_LIMITE_SEG, max_itens=1
+)
+CHAVE_CACHE_ATLETA: str = 'atleta'
+
+# Último pedal: a atividade em si (ou None), buscada com páginas pequenas, da mais nova para a mais antiga
+cache_ultimo_pedal: CacheSWR = CacheSWR(
+    'ultimo_pedal', fresco=CACHE_STRAVA_FRESCO_SEG, limite=CACHE_STRAVA_LIMITE_SEG, max_itens=1
+)
+CHAVE_CACHE_ULTIMO_PEDAL: str = 'ultimo_pedal'
+POR_PAGINA_ULTIMO_PEDAL: int = 10
+MAX_PAGINAS_ULTIMO_PEDAL: int = 10
+
+# Mapa de calor: pedais ao ar livre (o traçado de um pedal virtual é de um mundo de jogo)
+TIPOS_MAPA: list[str] = [tipo for tipo in TIPOS_PEDAL if tipo != 'VirtualRide']
+MESES_MAPA_PADRAO: int = 3
+MAX_MESES_MAPA: int = 12
+mapa_calor = MapaCalor(
+    listar_polylines=lambda mes: listar_polylines_mes(mes, TIPOS_MAPA),
+    carregar_pontos=carregar_trajetos,
+    salvar_pontos=salvar_trajetos,
+    cache=CacheDuasCamadas('mapa_calor', ttl=180 * 86400, max_itens=MAX_MESES_MAPA, armazem=armazem_padrao),
+)
+
+
+def _trocar_refresh_token(refresh_token: str) -> dict:
+    """Troca o refresh token por um access token novo (OAuth do Strava)."""
+    logger.info("Renovando o token do Strava...")
     payload = {
         'client_id': STRAVA_CLIENT_ID,
         'client_secret': STRAVA_CLIENT_SECRET,
         'grant_type': 'refresh_token',
-        'refresh_token': os.getenv('STRAVA_REFRESH_TOKEN')
+        'refresh_token': refresh_token
     }
-    try:
-        response = requests.post(url, data=payload, timeout=15)
-        if response.status_code == 200:
-            dados = response.json()
-            set_key(env_path, 'STRAVA_TOKEN', dados['access_token'])
-            set_key(env_path, 'STRAVA_REFRESH_TOKEN', dados['refresh_token'])
-            os.environ['STRAVA_TOKEN'] = dados['access_token']
-            os.environ['STRAVA_REFRESH_TOKEN'] = dados['refresh_token']
-            client_strava.access_token = dados['access_token']
-            logger.info("Token do Strava renovado com sucesso.")
-            return True
-        else:
-            logger.error(f"Falha ao renovar token. Status: {response.status_code}")
-            return False
-    except Exception as e:
-        logger.error(f"Erro ao renovar token do Strava: {e}")
-        return False
+    response = sessao_strava.post("https://www.strava.com/oauth/token", data=payload, timeout=15)
+    if response.status_code in (400, 401):
+        raise ErroRenovacaoToken(f"Refresh token recusado. Status: {response.status_code}")
+    if response.status_code != 200:
+        raise ConnectionError(f"Falha ao renovar token. Status: {response.status_code}")
+    return response.json()
+
+
+# Tokens ficam no banco (o .env só fornece os do setup inicial e o refresh token de reserva);
+# a renovação acontece antes de o token vencer, uma por vez
+gerenciador_token: GerenciadorTokenStrava = GerenciadorTokenStrava(
+    renovar_remoto=_trocar_refresh_token,
+    carregar=carregar_tokens_strava,
+    salvar=salvar_tokens_strava,
+    ao_renovar=lambda access_token: setattr(client_strava, 'access_token', access_token),
+    access_inicial=STRAVA_TOKEN,
+    refresh_reserva=STRAVA_REFRESH_TOKEN
+)
 
 
-def _obter_atividades(after: datetime) -> list:
-    """Busca atividades do Strava com cache e renovação automática de token."""
-    cache_key = f"atividades_{after.strftime('%Y%m%d%H')}"
+def renovar_token_strava() -> bool:
+    """Renova o token de acesso do Strava agora (ou espera a renovação em andamento)."""
+    return gerenciador_token.renovar()
 
-    if cache_key in _strava_cache:
-        logger.debug(f"Cache hit para atividades: {cache_key}")
-        return _strava_cache[cache_key]
 
+def renovar_token_se_preciso() -> None:
+    """Tarefa periódica: renova o token em segundo plano antes de ele vencer."""
+    gerenciador_token.renovar_se_preciso()
+
+
+def _obter_atividades(after: datetime) -> list:
+    """Busca atividades na API do Strava com o token sempre válido."""
+    gerenciador_token.token()
     try:
-        atividades = list(client_strava.get_activities(after=after))
-        _strava_cache[cache_key] = atividades
-        return atividades
+        return list(client_strava.get_activities(after=after))
     except Exception as e:
+        # Rede de segurança: o token foi revogado antes da expiração informada
         if "401" in str(e) or "unauthorized" in str(e).lower():
             if renovar_token_strava():
-                atividades = list(client_strava.get_activities(after=after))
-                _strava_cache[cache_key] = atividades
-                return atividades
+                return list(client_strava.get_activities(after=after))
             else:
                 raise ConnectionError("Erro crítico na renovação de token do Strava.")
         raise
 
 
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=2, max=10),
-    retry=retry_if_exception_type((requests.exceptions.Timeout, requests.exceptions.ConnectionError, ConnectionError)),
-    reraise=True
-)
+@politica_retry()
 def _obter_atividades_com_retry(after: datetime) -> list:
     """Wrapper com retry automático para chamadas ao Strava."""
     return _obter_atividades(after)
 
 
+def inicio_sincronizacao() -> datetime:
+    """Instante (UTC) a partir do qual a sincronização busca as atividades."""
+    ultima = ultima_atividade_strava()
+    if ultima is None:
+        primeiro_dia_mes = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        return (primeiro_dia_mes - relativedelta(months=MESES_SINCRONIZACAO_INICIAL)).astimezone(timezone.utc)
+    return datetime.fromtimestamp(ultima, tz=timezone.utc) - SOBREPOSICAO_SINCRONIZACAO
+
+
+def _sincronizar_recentes() -> int:
+    """Grava no banco as atividades desde `inicio_sincronizacao()`. Retorna quantas vieram."""
+    desde = inicio_sincronizacao()
+    registros = [registro_atividade(act) for act in _obter_atividades_com_retry(desde)]
+    gravar_atividades_strava(registros, desde=int(desde.timestamp()))
+    return len(registros)
+
+
+def nota_falha_sincronizacao(erro: Exception) -> str:
+    """Sincronização sem valor anterior falhou: usa o banco se houver dados, senão propaga o erro."""
+    if ultima_atividade_strava() is None:
+        raise erro
+    logger.warning(f"Sincronização com o Strava falhou, usando os dados do banco: {erro}")
+    return " (Strava fora do ar: dados até a última sincronização)"
+
+
+def _sincronizar() -> str:
+    """Garante o banco em dia (no máximo uma busca por `fresco`); retorna o aviso de dado antigo."""
+    try:
+        return nota_desatualizado(cache_sincronizacao.obter(CHAVE_SINCRONIZACAO, _sincronizar_recentes))
+    except Exception as e:
+        return nota_falha_sincronizacao(e)
+
+
+def _somar_pedais(inicio: datetime, fim: datetime) -> dict[str, float]:
+    """Totais dos pedais entre duas datas (dias inteiros) nos agregados diários."""
+    return somar_estatisticas_diarias(inicio.strftime('%Y-%m-%d'), fim.strftime('%Y-%m-%d'), TIPOS_PEDAL)
+
+
 def _filtrar_pedais(atividades: list) -> list:
     """Filtra apenas atividades do tipo pedal."""
     return [act for act in atividades if act.type in TIPOS_PEDAL]
 
 
+def iterar_atividades(antes_de: Optional[datetime] = None, tipos: Optional[Iterable[str]] = None,
+                      limite: Optional[int] = None, por_pagina: int = 30,
+                      max_paginas: Optional[int] = None) -> Iterator:
+    """
+    Atividades da mais nova para a mais antiga, filtradas por tipo. O iterador do stravalib
+    é preguiçoso: cada página de `por_pagina` só é pedida quando a anterior se esgota, então
+    parar cedo (`limite`, `max_paginas` ou quem consome) não busca o resto do histórico.
+    """
+    gerenciador_token.token()
+    atividades = client_strava.get_activities(before=antes_de)
+    atividades.per_page = por_pagina
+    tipos = set(tipos) if tipos is not None else None
+    max_verificadas = por_pagina * max_paginas if max_paginas else None
+    encontradas = 0
+    for verificadas, act in enumerate(atividades, 1):
+        if tipos is None or act.type in tipos:
+            yield act
+            encontradas += 1
+            if limite is not None and encontradas >= limite:
+                return
+        if max_verificadas is not None and verificadas >= max_verificadas:
+            return
+
+
+@politica_retry()
+def _buscar_ultimo_pedal():
+    """Pedal mais recente (ou None), parando na primeira página em que aparecer um."""
+    return next(iterar_atividades(tipos=TIPOS_PEDAL, limite=1, por_pagina=POR_PAGINA_ULTIMO_PEDAL,
+                                  max_paginas=MAX_PAGINAS_ULTIMO_PEDAL), None)
+
+
+def registro_atividade(act) -> dict:
+    """Linha da tabela de atividades a partir de uma atividade do stravalib."""
+    mapa = getattr(act, 'map', None)
+    return {
+        'id': int(act.id),
+        'inicio': int(act.start_date.timestamp()),
+        'data_local': act.start_date_local.strftime('%Y-%m-%d %H:%M:%S'),
+        'tipo': str(getattr(act.type, 'root', act.type)),
+        'nome': act.name,
+        'distancia_m': float(act.distance or 0),
+        'elevacao_m': float(act.total_elevation_gain or 0),
+        'tempo_movimento_s': int(act.moving_time or 0),
+        'polyline': getattr(mapa, 'summary_polyline', None) or None,
+    }
+
+
+@politica_retry()
+def buscar_pagina_historico(antes_de: Optional[int], depois_de: Optional[int], tamanho: int) -> list[dict]:
+    """
+    Uma única página da API (no máximo `tamanho` atividades) para a importação do histórico:
+    antes de `antes_de` (mais novas primeiro) ou depois de `depois_de` (epochs UTC).
+    """
+    gerenciador_token.token()
+    atividades = client_strava.get_activities(
+        before=datetime.fromtimestamp(antes_de, tz=timezone.utc) if antes_de else None,
+        after=datetime.fromtimestamp(depois_de, tz=timezone.utc) if depois_de else None,
+        limit=tamanho
+    )
+    atividades.per_page = tamanho  # uma requisição só, do tamanho da página
+    return [registro_atividade(act) for act in atividades]
+
+
 # ==========================================
 # FUNÇÕES PÚBLICAS
 # ==========================================
 def obter_progresso_mensal(meta_km: float) -> dict | str:
     """Calcula o total de km rodados no mês atual e compara com a meta."""
-    hoje = datetime.now()
-    primeiro_dia_mes = hoje.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-
     try:
-        atividades_lista = _obter_atividades_com_retry(after=primeiro_dia_mes)
+        nota = _sincronizar()
+        progresso = calcular_progresso_mensal(meta_km)
     except Exception as e:
         logger.error(f"Erro ao buscar atividades do mês: {e}")
         return "Erro ao buscar dados do mês no Strava."
 
-    pedais = _filtrar_pedais(atividades_lista)
-    total_km = sum(float(act.distance) / 1000 for act in pedais)
+    progresso['texto'] += nota
+    return progresso
+
+
+def calcular_progresso_mensal(meta_km: float) -> dict:
+    """Progresso do mês atual em relação à meta, somando os agregados diários do mês."""
+    hoje = datetime.now()
+    total_km = _somar_pedais(hoje.replace(day=1), hoje)['km']
     percentual = (total_km / meta_km) * 100 if meta_km > 0 else 0
 
     return {
@@ -132,40 +276,45 @@ def obter_progresso_mensal(meta_km: float) -> dict | str:
 
 def obter_resumo_semana() -> str:
     """Retorna um resumo textual dos pedais dos últimos 7 dias."""
-    uma_semana_atras = datetime.now() - timedelta(days=7)
     try:
-        atividades_lista = _obter_atividades_com_retry(after=uma_semana_atras)
+        nota = _sincronizar()
+        return resumir_semana() + nota
     except Exception as e:
         logger.error(f"Erro ao buscar resumo semanal: {e}")
         return f"Erro ao buscar dados do Strava: {e}"
 
-    pedais = _filtrar_pedais(atividades_lista)
-    total_km = sum(float(act.distance) / 1000 for act in pedais)
-    total_elevacao = sum(float(act.total_elevation_gain) for act in pedais)
-    qtd_pedais = len(pedais)
 
-    if qtd_pedais == 0:
+def totais_semana() -> dict[str, float]:
+    """Totais (km, elevação, tempo em movimento e pedais) dos últimos 7 dias, hoje incluído."""
+    hoje = datetime.now()
+    return _somar_pedais(hoje - timedelta(days=6), hoje)
+
+
+def resumir_semana() -> str:
+    """Resumo textual dos pedais dos últimos 7 dias (hoje incluído)."""
+    soma = totais_semana()
+
+    if soma['atividades'] == 0:
         return "Nenhum pedal registado nos últimos 7 dias."
-    return f"{qtd_pedais} pedais, {total_km:.1f} km rodados, {total_elevacao:.0f}m de elevação."
+    return f"{soma['atividades']} pedais, {soma['km']:.1f} km rodados, {soma['elevacao_m']:.0f}m de elevação."
 
 
 def obter_ultimo_pedal() -> str:
     """Retorna dados detalhados do pedal mais recente."""
-    um_mes_atras = datetime.now() - timedelta(days=30)
     try:
-        atividades_lista = _obter_atividades_com_retry(after=um_mes_atras)
+        leitura = cache_ultimo_pedal.obter(CHAVE_CACHE_ULTIMO_PEDAL, _buscar_ultimo_pedal)
     except Exception as e:
         logger.error(f"Erro ao buscar último pedal: {e}")
         return "Erro ao buscar último pedal no Strava."
+    return descrever_ultimo_pedal(leitura.valor) + nota_desatualizado(leitura)
 
-    pedais = _filtrar_pedais(atividades_lista)
 
-    if not pedais:
-        return "Nenhum pedal encontrado nos últimos 30 dias."
+def descrever_ultimo_pedal(ultimo) -> str:
+    """Texto com os dados do pedal mais recente (None se não houver)."""
+    if ultimo is None:
+        return (f"Nenhum pedal encontrado nas últimas "
+                f"{POR_PAGINA_ULTIMO_PEDAL * MAX_PAGINAS_ULTIMO_PEDAL} atividades do Strava.")
 
-    # Ordena pelo mais recente primeiro
-    pedais.sort(key=lambda x: x.start_date_local, reverse=True)
-    ultimo = pedais[0]
     distancia_km = float(ultimo.distance) / 1000
     elevacao = float(ultimo.total_elevation_gain)
     tempo_seg = int(ultimo.moving_time)
@@ -177,35 +326,52 @@ def obter_ultimo_pedal() -> str:
         f"Último pedal ({data_pedal}): "
         f"{distancia_km:.1f} km, {elevacao:.0f}m de elevação, "
         f"{velocidade_media:.1f} km/h de média, {tempo_min:.0f} min pedalando. "
-        f"Tipo: {ultimo.type}."
+        f"Tipo: {getattr(ultimo.type, 'root', ultimo.type)}."
     )
 
 
+@politica_retry()
+def _obter_atleta_com_retry():
+    gerenciador_token.token()
+    return client_strava.get_athlete()
+
+
 def obter_status_bike() -> tuple[str, float, str]:
     """Retorna informações da bicicleta principal do atleta."""
     try:
-        athlete = client_strava.get_athlete()
-        if not athlete.bikes:
-            return ("Nenhuma bicicleta registada no Strava.", 0.0, "Desconhecida")
-
-        bike_principal = None
-        for bike in athlete.bikes:
-            if bike.primary:
-                bike_principal = bike
-                break
-
-        if not bike_principal:
-            bike_principal = athlete.bikes[0]
-
-        distancia_km = float(bike_principal.distance) / 1000
-        return (
-            f"A bicicleta '{bike_principal.name}' tem {distancia_km:.1f} km acumulados no Strava.",
-            distancia_km,
-            bike_principal.name
-        )
+        leitura = cache_atleta.obter(CHAVE_CACHE_ATLETA, _obter_atleta_com_retry)
     except Exception as e:
         logger.error(f"Erro ao verificar status da bicicleta: {e}")
         return ("Erro ao verificar desgaste da bicicleta.", 0.0, "Desconhecida")
+    return status_bike_com_nota(leitura)
+
+
+def status_bike_com_nota(leitura: Leitura) -> tuple[str, float, str]:
+    """Status da bike a partir do perfil em cache, com o aviso de dado antigo no texto."""
+    texto, distancia_km, nome = descrever_status_bike(leitura.valor)
+    return texto + nota_desatualizado(leitura), distancia_km, nome
+
+
+def descrever_status_bike(athlete) -> tuple[str, float, str]:
+    """Texto, km e nome da bicicleta principal a partir do perfil do atleta."""
+    if not athlete.bikes:
+        return ("Nenhuma bicicleta registada no Strava.", 0.0, "Desconhecida")
+
+    bike_principal = None
+    for bike in athlete.bikes:
+        if bike.primary:
+            bike_principal = bike
+            break
+
+    if not bike_principal:
+        bike_principal = athlete.bikes[0]
+
+    distancia_km = float(bike_principal.distance) / 1000
+    return (
+        f"A bicicleta '{bike_principal.name}' tem {distancia_km:.1f} km acumulados no Strava.",
+        distancia_km,
+        bike_principal.name
+    )
 
 
 def obter_status_bike_texto() -> str:
@@ -214,10 +380,10 @@ def obter_status_bike_texto() -> str:
     return resultado[0]
 
 
-def obter_historico_mensal(meses: int = 3) -> str:
-    """Retorna comparativo de quilometragem dos últimos N meses para evolução."""
+def periodos_historico(meses: int = 3) -> list[tuple[datetime, datetime]]:
+    """(primeiro dia, último instante) de cada um dos últimos N meses, do atual para trás."""
     hoje = datetime.now()
-    resumos: list[str] = []
+    periodos: list[tuple[datetime, datetime]] = []
 
     for i in range(meses):
         primeiro_dia = (hoje.replace(day=1) - relativedelta(months=i)).replace(
@@ -229,53 +395,72 @@ def obter_historico_mensal(meses: int = 3) -> str:
         else:
             # Último dia do mês: primeiro dia do próximo mês menos 1 segundo
             ultimo_dia = (primeiro_dia + relativedelta(months=1)) - timedelta(seconds=1)
+        periodos.append((primeiro_dia, ultimo_dia))
+    return periodos
 
-        try:
-            atividades = _obter_atividades_com_retry(after=primeiro_dia)
-            pedais = [act for act in _filtrar_pedais(atividades)
-                      if act.start_date_local.replace(tzinfo=None) <= ultimo_dia]
-            total_km = sum(float(act.distance) / 1000 for act in pedais)
-            qtd = len(pedais)
-            nome_mes = primeiro_dia.strftime('%B/%Y').capitalize()
-            resumos.append(f"{nome_mes}: {total_km:.1f} km em {qtd} pedais")
-        except Exception as e:
-            logger.error(f"Erro ao buscar histórico do mês {i}: {e}")
-            nome_mes = primeiro_dia.strftime('%B/%Y').capitalize()
-            resumos.append(f"{nome_mes}: erro ao buscar dados")
 
-    # Calcular evolução entre meses
-    resultado = "📊 Evolução Mensal:\n" + "\n".join(f"  • {r}" for r in resumos)
-    return resultado
+def resumir_mes(primeiro_dia: datetime, ultimo_dia: datetime) -> str:
+    """Linha do histórico de um mês: km e quantidade de pedais até `ultimo_dia`."""
+    soma = _somar_pedais(primeiro_dia, ultimo_dia)
+    nome_mes = primeiro_dia.strftime('%B/%Y').capitalize()
+    return f"{nome_mes}: {soma['km']:.1f} km em {soma['atividades']} pedais"
+
+
+def formatar_historico(resumos: list[str]) -> str:
+    """Texto final do histórico mensal."""
+    return "📊 Evolução Mensal:\n" + "\n".join(f"  • {r}" for r in resumos)
+
+
+def obter_historico_mensal(meses: int = 3) -> str:
+    """Retorna comparativo de quilometragem dos últimos N meses para evolução."""
+    try:
+        nota = _sincronizar()
+        return calcular_historico_mensal(meses) + nota
+    except Exception as e:
+        logger.error(f"Erro ao buscar histórico mensal: {e}")
+        return "Erro ao buscar o histórico no Strava."
+
+
+def calcular_historico_mensal(meses: int = 3) -> str:
+    """Histórico dos últimos N meses: uma soma nos agregados diários por mês."""
+    return formatar_historico([resumir_mes(primeiro_dia, ultimo_dia)
+                               for primeiro_dia, ultimo_dia in periodos_historico(meses)])
+
+
+def km_por_dia(dias: int = 30) -> dict[str, float]:
+    """Km pedalados por dia (YYYY-MM-DD) nos últimos N dias, dos agregados diários."""
+    hoje = datetime.now()
+    inicio = hoje - timedelta(days=dias)
+    return km_por_dia_estatisticas(inicio.strftime('%Y-%m-%d'), hoje.strftime('%Y-%m-%d'), TIPOS_PEDAL)
+
+
+def obter_km_por_dia(dias: int = 30) -> dict[str, float]:
+    """Série diária do gráfico, com o banco sincronizado antes."""
+    _sincronizar()
+    return km_por_dia(dias)
 
 
-def gerar_grafico_progresso(dias_historico: int = 30) -> Optional[str]:
+def gerar_grafico_progresso(dias_historico: int = 30,
+                            km_dia: Optional[dict[str, float]] = None) -> Optional[str]:
     """
     Gera um gráfico do volume de treinos (km) por dia nos últimos N dias.
     Salva em arquivo temporário e retorna o caminho.
+    `km_dia` pode vir já consultado (ex.: pelo runtime assíncrono).
     """
     data_inicio = datetime.now() - timedelta(days=dias_historico)
 
-    try:
-        atividades = _obter_atividades_com_retry(after=data_inicio)
-    except Exception as e:
-        logger.error(f"Erro ao buscar atividades para o gráfico: {e}")
-        return None
-
-    pedais = _filtrar_pedais(atividades)
+    if km_dia is None:
+        try:
+            km_dia = obter_km_por_dia(dias_historico)
+        except Exception as e:
+            logger.error(f"Erro ao buscar atividades para o gráfico: {e}")
+            return None
 
-    if not pedais:
+    if not km_dia:
         return None
 
-    # Montar DataFrame
-    dados = []
-    for p in pedais:
-        data_str = p.start_date_local.strftime('%Y-%m-%d')
-        distancia_km = float(p.distance) / 1000
-        dados.append({'data': data_str, 'km': distancia_km})
-
-    df = pd.DataFrame(dados)
-    df = df.groupby('data')['km'].sum().reset_index()
-    df['data'] = pd.to_datetime(df['data'])
+    # Montar DataFrame (um valor por dia, já agregado no banco)
+    df = pd.DataFrame({'data': pd.to_datetime(list(km_dia.keys())), 'km': list(km_dia.values())})
 
     # DataFrame completo com todos os dias do período
     todos_os_dias = pd.date_range(start=data_inicio.date(), end=datetime.now().date())
@@ -320,3 +505,14 @@ def gerar_grafico_progresso(dias_historico: int = 30) -> Optional[str]:
         return caminho_arquivo
     finally:
         plt.close(fig)
+
+
+def gerar_mapa_calor(meses: int = MESES_MAPA_PADRAO, sincronizar: bool = True) -> Optional[str]:
+    """
+    Mapa de calor dos pedais dos últimos N meses num PNG temporário (None sem traçados).
+    Com `sincronizar`, atualiza antes as atividades recentes do banco (o runtime
+    assíncrono sincroniza por conta própria).
+    """
+    if sincronizar:
+        _sincronizar()
+    return mapa_calor.gerar_imagem(max(1, min(meses, MAX_MESES_MAPA)))
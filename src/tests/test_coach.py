@@ -6,6 +6,7 @@ Cobre: memória SQLite, interceptadores, configuração, utilidades do bot,
 import os
 import tempfile
 import sqlite3
+from types import SimpleNamespace
 from typing import Optional
 from unittest.mock import patch, MagicMock
 
@@ -331,13 +332,13 @@ class TestEnviarRespostaSegura:
 class TestWeatherService:
     """Testa cache e tratamento de erros do serviço de clima."""
 
-    @patch('weather_service.requests.get')
+    @patch('weather_service.sessao_openweather.get')
     def test_weather_cache_hit(self, mock_get) -> None:
         """Verifica que o cache evita chamadas duplicadas à API."""
-        from weather_service import _weather_cache, obter_previsao_tempo, CITY
+        from weather_service import cache_clima, obter_previsao_tempo, CITY
 
         # Limpar cache
-        _weather_cache.clear()
+        cache_clima.limpar()
 
         # Simular resposta da API
         mock_response = MagicMock()
@@ -401,3 +402,2420 @@ class TestStravaService:
         resultado = _obter_atividades_com_retry(after=datetime.now())
         assert resultado == ["atividade1"]
 
+
+
+# ==========================================
+# TESTES DO ORÇAMENTO DE TOKENS
+# ==========================================
+class TestOrcamentoTokens:
+    """Testa a estimativa e o corte de tokens por prioridade."""
+
+    def _historico(self, pares: int, tamanho: int = 400) -> list:
+        from google.genai import types
+        historico = []
+        for i in range(pares):
+            historico.append(types.Content(role='user', parts=[types.Part.from_text(text='u' * tamanho)]))
+            historico.append(types.Content(role='model', parts=[types.Part.from_text(text='m' * tamanho)]))
+        return historico
+
+    def test_estimar_tokens(self) -> None:
+        from orcamento_tokens import estimar_tokens
+        assert estimar_tokens("") == 0
+        assert estimar_tokens("abcd") == 1
+        assert estimar_tokens("abcde") == 2
+
+    def test_dentro_do_orcamento_nao_corta(self) -> None:
+        from orcamento_tokens import aplicar_orcamento
+        historico = self._historico(2)
+        prompt, contagem = aplicar_orcamento("oi", ["[DADOS BIKE: ok]"], historico, "sistema", orcamento=10000)
+        assert prompt == "oi\n\n[DADOS BIKE: ok]"
+        assert len(historico) == 4
+        assert contagem['total'] == sum(v for k, v in contagem.items() if k != 'total')
+
+    def test_corta_historico_antigo_primeiro(self) -> None:
+        from orcamento_tokens import aplicar_orcamento
+        historico = self._historico(5)  # 1000 tokens
+        prompt, contagem = aplicar_orcamento("oi", ["[DADOS BIKE: ok]"], historico, "", orcamento=450)
+        assert len(historico) == 4  # sobram os 2 pares mais recentes
+        assert historico[0].role == 'user'
+        assert "[DADOS BIKE: ok]" in prompt
+        assert contagem['total'] <= 450
+
+    def test_descarta_dados_de_menor_prioridade(self) -> None:
+        from orcamento_tokens import aplicar_orcamento
+        dados = [
+            "[DADOS DE CLIMA: " + "c" * 400 + "]",
+            "[DADOS ÚLTIMO PEDAL: " + "p" * 400 + "]",
+        ]
+        prompt, _ = aplicar_orcamento("oi", dados, [], "", orcamento=150)
+        assert "DADOS ÚLTIMO PEDAL" in prompt
+        assert "DADOS DE CLIMA" not in prompt
+
+    def test_trunca_texto_usuario_em_ultimo_caso(self) -> None:
+        from orcamento_tokens import aplicar_orcamento
+        prompt, contagem = aplicar_orcamento("x" * 4000, [], [], "", orcamento=100)
+        assert prompt.endswith("[...]")
+        assert contagem['total'] <= 100
+
+    @patch('ai_engine.DB_PATH')
+    def test_registrar_uso_tokens_por_comando(self, mock_db_path) -> None:
+        tmp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        tmp_db.close()
+        try:
+            with patch('ai_engine.DB_PATH', tmp_db.name):
+                from ai_engine import init_db, registrar_uso_tokens, obter_uso_tokens_por_comando
+                init_db()
+                registrar_uso_tokens("1", "/semana", {'total': 900}, 300)
+                registrar_uso_tokens("1", "/clima", {'total': 100}, 50)
+                registrar_uso_tokens("2", "/semana", {'total': 1100}, 300)
+
+                uso = obter_uso_tokens_por_comando()
+                assert uso[0]['comando'] == "/semana"
+                assert uso[0]['mensagens'] == 2
+                assert uso[0]['media_entrada'] == 1000
+                assert uso[1]['comando'] == "/clima"
+        finally:
+            os.remove(tmp_db.name)
+
+
+# ==========================================
+# TESTES DO CACHE DE CONTEXTO (Gemini)
+# ==========================================
+class _CachesFalsos:
+    """Cliente falso com a mesma interface de client.caches do google-genai."""
+
+    def __init__(self, falhar: bool = False) -> None:
+        self.falhar = falhar
+        self.criados: list = []
+        self.apagados: list[str] = []
+
+    def create(self, model, config):
+        if self.falhar:
+            raise RuntimeError("caching não suportado")
+        self.criados.append(config)
+        return SimpleNamespace(name=f"cachedContents/{len(self.criados)}")
+
+    def delete(self, name):
+        self.apagados.append(name)
+
+
+class TestCacheContexto:
+    """Testa reuso, invalidação e fallback do cache de contexto."""
+
+    def _historico(self, itens: int) -> list:
+        from google.genai import types
+        return [
+            types.Content(role='user' if i % 2 == 0 else 'model',
+                          parts=[types.Part.from_text(text=f"{i}" + "x" * 2000)])
+            for i in range(itens)
+        ]
+
+    def _gerenciador(self, falhar: bool = False):
+        from cache_contexto import GerenciadorCacheContexto
+        cliente = MagicMock()
+        cliente.caches = _CachesFalsos(falhar)
+        return GerenciadorCacheContexto(cliente, 'gemini-2.5-flash', 1800), cliente.caches
+
+    def test_cria_e_reutiliza_cache(self) -> None:
+        gerenciador, caches = self._gerenciador()
+        historico = self._historico(10)
+
+        config, recentes = gerenciador.preparar_sessao("1", "sistema", historico)
+        assert config.cached_content == "cachedContents/1"
+        assert config.system_instruction is None
+        assert len(recentes) == 6
+        assert len(caches.criados[0].contents) == 4
+
+        config2, _ = gerenciador.preparar_sessao("1", "sistema", historico)
+        assert config2.cached_content == "cachedContents/1"
+        assert len(caches.criados) == 1
+
+    def test_invalida_quando_prefixo_muda(self) -> None:
+        gerenciador, caches = self._gerenciador()
+        gerenciador.preparar_sessao("1", "sistema", self._historico(10))
+        config, _ = gerenciador.preparar_sessao("1", "sistema", self._historico(12))
+        assert config.cached_content == "cachedContents/2"
+        assert caches.apagados == ["cachedContents/1"]
+
+    def test_historico_pequeno_nao_usa_cache(self) -> None:
+        gerenciador, caches = self._gerenciador()
+        historico = self._historico(2)
+        config, recentes = gerenciador.preparar_sessao("1", "sistema", historico)
+        assert config.system_instruction == "sistema"
+        assert recentes == historico
+        assert caches.criados == []
+
+    def test_fallback_quando_api_recusa(self) -> None:
+        gerenciador, _ = self._gerenciador(falhar=True)
+        historico = self._historico(10)
+        config, recentes = gerenciador.preparar_sessao("1", "sistema", historico)
+        assert config.system_instruction == "sistema"
+        assert config.cached_content is None
+        assert recentes == historico
+        assert not gerenciador.ativo
+
+    def test_expiracao_conta_da_criacao_do_cache(self) -> None:
+        import time
+        gerenciador, _ = self._gerenciador()
+        assert gerenciador.expira_em("1") is None
+        antes = time.time()
+        gerenciador.preparar_sessao("1", "sistema", self._historico(10))
+        # TTL de 1800s menos a margem de segurança de 60s
+        assert antes + 1740 <= gerenciador.expira_em("1") <= time.time() + 1740
+
+
+# ==========================================
+# TESTES DO STREAMING DE RESPOSTAS
+# ==========================================
+class TestStreamingRespostas:
+    """Testa a publicação progressiva das respostas no Telegram."""
+
+    def test_publica_no_primeiro_pedaco_e_edita_no_final(self) -> None:
+        from bot_coach import enviar_resposta_streaming
+        mock_bot = MagicMock()
+        mock_reply = MagicMock()
+
+        texto = enviar_resposta_streaming(mock_bot, "123", iter(["Olá", ", campeão", "!"]), reply_to=mock_reply)
+
+        assert texto == "Olá, campeão!"
+        mock_bot.reply_to.assert_called_once_with(mock_reply, "Olá")
+        # Pedaços rápidos não geram edições intermediárias, só a final
+        mock_bot.edit_message_text.assert_called_once()
+        assert mock_bot.edit_message_text.call_args[0][0] == "Olá, campeão!"
+
+    def test_pedaco_final_so_com_espacos_nao_edita(self) -> None:
+        from bot_coach import enviar_resposta_streaming
+        mock_bot = MagicMock()
+        texto = enviar_resposta_streaming(mock_bot, "123", iter(["Bom pedal!", "\n", "  "]))
+        assert texto == "Bom pedal!\n  "
+        mock_bot.send_message.assert_called_once_with("123", "Bom pedal!")
+        mock_bot.edit_message_text.assert_not_called()
+
+    def test_edicao_sem_mudanca_recusada_pelo_telegram_e_ignorada(self) -> None:
+        from bot_coach import enviar_resposta_streaming
+        mock_bot = MagicMock()
+        mock_bot.edit_message_text.side_effect = Exception(
+            "A request to the Telegram API was unsuccessful. Error code: 400. "
+            "Description: Bad Request: message is not modified")
+        assert enviar_resposta_streaming(mock_bot, "123", iter(["Olá", " campeão"])) == "Olá campeão"
+        mock_bot.edit_message_text.side_effect = Exception("Error code: 400. Description: Bad Request: chat not found")
+        with pytest.raises(Exception, match="chat not found"):
+            enviar_resposta_streaming(mock_bot, "123", iter(["Olá", " campeão"]))
+
+    def test_divide_ao_passar_do_limite(self) -> None:
+        from bot_coach import enviar_resposta_streaming
+        mock_bot = MagicMock()
+
+        texto = enviar_resposta_streaming(mock_bot, "123", iter(["A" * 3000, "B" * 3000]))
+
+        assert len(texto) == 6000
+        publicados = [c[0][1] for c in mock_bot.send_message.call_args_list]
+        editados = [c[0][0] for c in mock_bot.edit_message_text.call_args_list]
+        assert len(mock_bot.send_message.call_args_list) == 2
+        assert editados[0] == ("A" * 3000 + "B" * 1096)
+        assert publicados[1] == "B" * 1904
+
+    def test_stream_guarda_resposta_completa_na_memoria(self) -> None:
+        import ai_engine
+        chunks = [
+            SimpleNamespace(text="Bom ", usage_metadata=None),
+            SimpleNamespace(text="pedal!", usage_metadata=SimpleNamespace(prompt_token_count=50, candidates_token_count=3)),
+        ]
+        sessao = MagicMock()
+        sessao.get_history.return_value = []
+        sessao.send_message_stream.return_value = iter(chunks)
+
+        with patch('ai_engine.get_chat_session', return_value=sessao), \
+                patch('ai_engine.guardar_memoria') as mock_guardar, \
+                patch('ai_engine.registrar_uso_tokens') as mock_uso:
+            pedacos = list(ai_engine.enviar_mensagem_ia_stream("1", "oi", "conversa"))
+
+        assert pedacos == ["Bom ", "pedal!"]
+        mock_guardar.assert_any_call("1", "user", "oi")
+        mock_guardar.assert_any_call("1", "model", "Bom pedal!")
+        assert mock_uso.call_args[0][2]['total'] == 50
+        assert mock_uso.call_args[0][3] == 3
+
+
+# ==========================================
+# TESTES DO POOL DE SESSÕES
+# ==========================================
+class _SessaoFalsa:
+    """Sessão falsa com a mesma interface de histórico do Chat do google-genai."""
+
+    def __init__(self, historico: list) -> None:
+        self.curado = list(historico)
+        self.completo = list(historico)
+
+    def get_history(self, curated: bool = False) -> list:
+        return self.curado if curated else self.completo
+
+
+class TestPoolSessoes:
+    """Testa limites, janela deslizante e snapshot das sessões."""
+
+    def _conteudo(self, role: str, texto: str):
+        from google.genai import types
+        return types.Content(role=role, parts=[types.Part.from_text(text=texto)])
+
+    def _pool(self, **kwargs):
+        from pool_sessoes import PoolSessoes
+        self.salvos: dict = {}
+        return PoolSessoes(
+            carregador=lambda chat_id: [],
+            fabrica=lambda chat_id, historico: (_SessaoFalsa(historico), [], {}),
+            persistir=lambda chat_id, historico: self.salvos.__setitem__(chat_id, historico),
+            **kwargs
+        )
+
+    def test_reutiliza_sessao_existente(self) -> None:
+        pool = self._pool()
+        assert pool.obter("1") is pool.obter("1")
+        assert len(pool) == 1
+
+    def test_limite_de_sessoes_remove_e_salva(self) -> None:
+        pool = self._pool(max_sessoes=2)
+        pool.obter("1")
+        pool.obter("2")
+        pool.obter("3")
+        assert len(pool) == 2
+        assert "1" not in pool
+        assert "1" in self.salvos
+
+    def test_janela_deslizante_do_historico(self) -> None:
+        pool = self._pool(max_itens_sessao=4)
+        sessao = pool.obter("1")
+        for i in range(5):
+            sessao.curado += [self._conteudo('user', f"p{i}"), self._conteudo('model', f"r{i}")]
+            sessao.completo += [self._conteudo('user', f"p{i}"), self._conteudo('model', f"r{i}")]
+            pool.atualizar("1")
+        assert len(sessao.curado) == 4
+        assert sessao.curado[0].parts[0].text == "p3"
+        assert pool.bytes_em_uso > 0
+
+    def test_limite_de_memoria_remove_a_maior_ociosa(self) -> None:
+        pool = self._pool(max_bytes=6000)
+        grande = pool.obter("grande")
+        grande.completo += [self._conteudo('user', "x" * 4000)]
+        pool.atualizar("grande")
+        pool.obter("pequena")
+        pequena = pool.obter("outra")
+        pequena.completo += [self._conteudo('user', "y" * 2000)]
+        pool.atualizar("outra")
+        assert "grande" not in pool
+        assert "pequena" in pool
+
+    def test_historico_completo_nao_cria_sessao(self) -> None:
+        from pool_sessoes import PoolSessoes
+        criadas = []
+        pool = PoolSessoes(carregador=lambda chat_id: [self._conteudo('user', f"oi {chat_id}")],
+                           fabrica=lambda chat_id, historico: (criadas.append(chat_id) or _SessaoFalsa(historico), [], {}),
+                           max_sessoes=1)
+        sessao = pool.obter("ativo")
+        sessao.curado.append(self._conteudo('model', "olá!"))
+        assert [c.parts[0].text for c in pool.historico_completo("outro")] == ["oi outro"]
+        assert [c.parts[0].text for c in pool.historico_completo("ativo")] == ["oi ativo", "olá!"]
+        # Quem está conversando continua no pool; nenhuma sessão nova foi criada
+        assert criadas == ["ativo"]
+        assert "ativo" in pool and "outro" not in pool
+        assert pool.vagas == 0
+
+    def test_sessao_vencida_e_recriada_com_o_mesmo_historico(self) -> None:
+        import time
+        from pool_sessoes import PoolSessoes
+        validades = [time.time() - 1, time.time() + 600]
+        historicos = []
+
+        def fabrica(chat_id, historico):
+            historicos.append(list(historico))
+            return _SessaoFalsa(historico), [], {}
+
+        pool = PoolSessoes(carregador=lambda chat_id: [self._conteudo('user', "oi")], fabrica=fabrica,
+                           validade=lambda chat_id: validades.pop(0))
+        antiga = pool.obter("1")
+        antiga.curado.append(self._conteudo('model', "olá!"))
+        # O cache de contexto da primeira sessão já venceu: a próxima chamada recria a sessão
+        nova = pool.obter("1")
+        assert nova is not antiga
+        assert [c.parts[0].text for c in historicos[1]] == ["oi", "olá!"]
+        assert pool.obter("1") is nova
+
+    def test_criacao_lenta_nao_trava_outros_chats(self) -> None:
+        import threading
+        from pool_sessoes import PoolSessoes
+        liberar, criando = threading.Event(), threading.Event()
+
+        def fabrica(chat_id, historico):
+            if chat_id == "lento":
+                criando.set()
+                liberar.wait(5)
+            return _SessaoFalsa(historico), [], {}
+
+        pool = PoolSessoes(carregador=lambda chat_id: [], fabrica=fabrica)
+        lento = threading.Thread(target=pool.obter, args=("lento",))
+        lento.start()
+        assert criando.wait(5)
+        try:
+            # Outro chat consegue a sessão enquanto a do primeiro ainda está sendo criada
+            assert pool.obter("rapido") is not None
+            assert "lento" not in pool
+        finally:
+            liberar.set()
+            lento.join()
+        assert "lento" in pool
+
+    @patch('ai_engine.DB_PATH')
+    def test_snapshot_restaura_e_invalida(self, mock_db_path) -> None:
+        tmp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        tmp_db.close()
+        try:
+            with patch('ai_engine.DB_PATH', tmp_db.name):
+                from ai_engine import init_db, guardar_memoria, salvar_snapshot_sessao, carregar_snapshot_sessao
+                init_db()
+                guardar_memoria("7", "user", "oi")
+                guardar_memoria("7", "model", "olá!")
+                salvar_snapshot_sessao("7", [self._conteudo('user', "oi"), self._conteudo('model', "olá!")])
+
+                restaurado = carregar_snapshot_sessao("7")
+                assert [c.parts[0].text for c in restaurado] == ["oi", "olá!"]
+
+                # Mensagem nova depois do snapshot: ele deixa de valer
+                guardar_memoria("7", "user", "e aí?")
+                assert carregar_snapshot_sessao("7") is None
+        finally:
+            os.remove(tmp_db.name)
+
+
+# ==========================================
+# TESTES DO DESPACHANTE DO GEMINI
+# ==========================================
+class TestDespachanteIA:
+    """Testa concorrência, prioridade, backoff de cota e métricas."""
+
+    def test_limita_chamadas_simultaneas(self) -> None:
+        import threading
+        import time
+        from despachante_ia import DespachanteIA
+
+        despachante = DespachanteIA(max_concorrencia=2)
+        pico = {'atual': 0, 'max': 0}
+        lock = threading.Lock()
+
+        def chamada():
+            with lock:
+                pico['atual'] += 1
+                pico['max'] = max(pico['max'], pico['atual'])
+            time.sleep(0.02)
+            with lock:
+                pico['atual'] -= 1
+
+        threads = [threading.Thread(target=despachante.executar, args=(chamada,)) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert pico['max'] == 2
+        assert despachante.em_andamento == 0
+        assert despachante.metricas()['gemini']['chamadas'] == 6
+
+    def test_vaga_reservada_para_interativas(self) -> None:
+        import threading
+        from despachante_ia import DespachanteIA, PRIORIDADE_PROATIVA
+
+        despachante = DespachanteIA(max_concorrencia=2)
+        liberar = threading.Event()
+        proativa = threading.Thread(
+            target=despachante.executar, args=(liberar.wait,), kwargs={'prioridade': PRIORIDADE_PROATIVA}
+        )
+        proativa.start()
+        # Com uma proativa rodando, a interativa ainda encontra vaga livre
+        assert despachante.executar(lambda: "ok") == "ok"
+        liberar.set()
+        proativa.join()
+
+    def test_retry_em_erro_de_cota_com_dica(self) -> None:
+        from despachante_ia import DespachanteIA
+
+        tentativas = []
+
+        def chamada():
+            tentativas.append(1)
+            if len(tentativas) < 2:
+                raise RuntimeError("429 RESOURCE_EXHAUSTED. {'retryDelay': '0.01s'}")
+            return "resposta"
+
+        despachante = DespachanteIA(max_concorrencia=1)
+        assert despachante.executar(chamada, rotulo='/clima') == "resposta"
+        assert len(tentativas) == 2
+        assert despachante.metricas()['/clima']['erros'] == 1
+
+    def test_cota_esgotada_depois_das_tentativas(self) -> None:
+        from despachante_ia import DespachanteIA, CotaGeminiEsgotada
+
+        def chamada():
+            raise RuntimeError("429 RESOURCE_EXHAUSTED. {'retryDelay': '0s'}")
+
+        despachante = DespachanteIA(max_concorrencia=1, max_tentativas=2)
+        with pytest.raises(CotaGeminiEsgotada):
+            despachante.executar(chamada)
+
+    def test_erro_comum_nao_tem_retry(self) -> None:
+        from despachante_ia import DespachanteIA
+
+        chamadas = []
+
+        def chamada():
+            chamadas.append(1)
+            raise ValueError("falha")
+
+        with pytest.raises(ValueError):
+            DespachanteIA().executar(chamada)
+        assert len(chamadas) == 1
+
+
+# ==========================================
+# TESTES DO ENVIO PROATIVO DE SEXTA
+# ==========================================
+class TestBroadcastSexta:
+    """Testa o pipeline paralelo e o checkpoint do envio de sexta-feira."""
+
+    def setup_method(self) -> None:
+        self.tmp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.tmp_db.close()
+
+    def teardown_method(self) -> None:
+        if os.path.exists(self.tmp_db.name):
+            os.remove(self.tmp_db.name)
+
+    def _executar(self, chat_ids: list[str], ja_enviados: list[str]) -> tuple:
+        import bot_coach
+        from ai_engine import init_db, iniciar_execucao_proativa, marcar_envio_proativo, execucao_proativa_pendente
+
+        with patch('ai_engine.DB_PATH', self.tmp_db.name), \
+                patch('bot_coach.obter_todos_chat_ids', return_value=chat_ids), \
+                patch('bot_coach.obter_previsao_tempo', return_value="sol") as mock_clima, \
+                patch('bot_coach.obter_resumo_semana', return_value="3 pedais"), \
+                patch('bot_coach.totais_semana', return_value={'atividades': 3, 'km': 60.0, 'elevacao_m': 500.0}), \
+                patch('bot_coach.obter_status_bike', return_value=("bike ok", 200.0, "Kaéti")), \
+                patch('bot_coach.obter_progresso_mensal', return_value={
+                    'texto': 'meta', 'total_km': 30.0, 'meta_km': 300.0, 'percentual_concluido': 10}), \
+                patch('bot_coach.enviar_mensagem_ia', return_value="Bom fim de semana!") as mock_ia, \
+                patch('bot_coach.saida') as mock_bot:
+            init_db()
+            execucao = bot_coach._id_execucao_sexta()
+            iniciar_execucao_proativa(execucao)
+            for chat_id in ja_enviados:
+                marcar_envio_proativo(execucao, chat_id)
+
+            bot_coach.mensagem_planeamento_fim_de_semana()
+            pendente = execucao_proativa_pendente(execucao)
+        return mock_clima, mock_ia, mock_bot, pendente
+
+    def test_contexto_compartilhado_calculado_uma_vez(self) -> None:
+        mock_clima, mock_ia, mock_bot, pendente = self._executar(["1", "2", "3"], [])
+        assert mock_clima.call_count == 1
+        assert mock_ia.call_count == 3
+        assert mock_bot.send_message.call_count == 3
+        assert not pendente
+
+    def test_retoma_sem_reenviar(self) -> None:
+        _, mock_ia, mock_bot, _ = self._executar(["1", "2", "3"], ["1", "3"])
+        assert mock_ia.call_count == 1
+        assert mock_ia.call_args[0][0] == "2"
+        destinos = {c[0][0] for c in mock_bot.send_message.call_args_list}
+        assert destinos == {"2"}
+
+    def _patches_dados(self, pedais: int, nota: str = ""):
+        return [
+            patch('ai_engine.DB_PATH', self.tmp_db.name),
+            patch('bot_coach.obter_todos_chat_ids', return_value=["1"]),
+            patch('bot_coach.obter_previsao_tempo', return_value="sol"),
+            patch('bot_coach.obter_resumo_semana', return_value=f"{pedais} pedais, {pedais * 20:.1f} km{nota}"),
+            patch('bot_coach.totais_semana', return_value={'atividades': pedais, 'km': pedais * 20.0,
+                                                           'elevacao_m': 500.0, 'tempo_movimento_s': 3600}),
+            patch('bot_coach.obter_status_bike', return_value=("bike ok" + nota, 200.0, "Kaéti")),
+            patch('bot_coach.obter_progresso_mensal', return_value={
+                'texto': 'meta' + nota, 'total_km': 120.0, 'meta_km': 300.0, 'percentual_concluido': 40}),
+        ]
+
+    def _entregar_apos_pregeracao(self, pedais_na_entrega: int, nota_na_entrega: str = "") -> tuple:
+        import contextlib
+        import bot_coach
+        from ai_engine import init_db
+
+        with contextlib.ExitStack() as pilha:
+            for p in self._patches_dados(3, " (dados de 12 min atrás: fonte fora do ar)"):
+                pilha.enter_context(p)
+            pilha.enter_context(patch('bot_coach.gerar_mensagem_avulsa', return_value="Pré-gerada!"))
+            init_db()
+            bot_coach.pregerar_mensagens_sexta()
+
+        with contextlib.ExitStack() as pilha:
+            for p in self._patches_dados(pedais_na_entrega, nota_na_entrega):
+                pilha.enter_context(p)
+            mock_ia = pilha.enter_context(patch('bot_coach.enviar_mensagem_ia', return_value="Nova!"))
+            mock_registro = pilha.enter_context(patch('bot_coach.registrar_mensagem_entregue'))
+            mock_bot = pilha.enter_context(patch('bot_coach.saida'))
+            bot_coach.mensagem_planeamento_fim_de_semana()
+        return mock_ia, mock_registro, mock_bot
+
+    def test_entrega_mensagem_pregerada_sem_nova_chamada(self) -> None:
+        mock_ia, mock_registro, mock_bot = self._entregar_apos_pregeracao(3)
+        mock_ia.assert_not_called()
+        mock_registro.assert_called_once()
+        assert mock_bot.send_message.call_args[0] == ("1", "Pré-gerada!")
+
+    def test_regenera_quando_houve_pedal_novo(self) -> None:
+        mock_ia, mock_registro, mock_bot = self._entregar_apos_pregeracao(4)
+        mock_ia.assert_called_once()
+        mock_registro.assert_not_called()
+        assert mock_bot.send_message.call_args[0] == ("1", "Nova!")
+
+    def test_aviso_de_dado_antigo_nao_invalida_a_pregerada(self) -> None:
+        # Mesmos números, mas o aviso de dado antigo mudou de idade entre a pré-geração e a entrega
+        mock_ia, mock_registro, mock_bot = self._entregar_apos_pregeracao(3, " (dados de 72 min atrás: fonte fora do ar)")
+        mock_ia.assert_not_called()
+        assert mock_bot.send_message.call_args[0] == ("1", "Pré-gerada!")
+
+
+# ==========================================
+# TESTES DA FILA DE SAÍDA DO TELEGRAM
+# ==========================================
+class TestFilaTelegram:
+    """Testa limites de taxa, ordem por chat e retry_after."""
+
+    def _erro_429(self, retry_after: float):
+        from telebot.apihelper import ApiTelegramException
+        resposta = MagicMock()
+        resposta.status_code = 429
+        resposta.reason = "Too Many Requests"
+        return ApiTelegramException("sendMessage", resposta, {
+            'ok': False, 'error_code': 429, 'description': 'Too Many Requests',
+            'parameters': {'retry_after': retry_after}
+        })
+
+    def test_balde_tokens_espaca_apos_rajada(self) -> None:
+        from fila_telegram import BaldeTokens
+        balde = BaldeTokens(taxa=10, capacidade=2)
+        assert balde.reservar() == 0
+        assert balde.reservar() == 0
+        assert balde.reservar() == pytest.approx(0.1, abs=0.01)
+
+    def test_repete_apos_retry_after(self) -> None:
+        from fila_telegram import FilaEnvioTelegram
+        fila = FilaEnvioTelegram()
+        envio = MagicMock(side_effect=[self._erro_429(0), "ok"])
+
+        assert fila.chamar("1", envio, "1", "oi") == "ok"
+        assert envio.call_count == 2
+        assert fila.metricas()['retentativas'] == 1
+        assert fila.metricas()['enviadas'] == 1
+
+    def test_erro_comum_nao_repete(self) -> None:
+        from fila_telegram import FilaEnvioTelegram
+        fila = FilaEnvioTelegram()
+        envio = MagicMock(side_effect=ValueError("chat não encontrado"))
+        with pytest.raises(ValueError):
+            fila.chamar("1", envio)
+        assert envio.call_count == 1
+        assert fila.metricas()['na_fila'] == 0
+
+    def test_mantem_ordem_dentro_do_chat(self) -> None:
+        import threading
+        from fila_telegram import FilaEnvioTelegram
+        fila = FilaEnvioTelegram(taxa_chat=1000, rajada_chat=1000, taxa_global=1000)
+        recebidas: list[int] = []
+        primeira_entrou = threading.Event()
+        liberar = threading.Event()
+
+        def lenta(n):
+            primeira_entrou.set()
+            liberar.wait()
+            recebidas.append(n)
+
+        t1 = threading.Thread(target=fila.chamar, args=("1", lenta, 1))
+        t1.start()
+        primeira_entrou.wait()
+        t2 = threading.Thread(target=fila.chamar, args=("1", recebidas.append, 2))
+        t2.start()
+        assert fila.metricas()['chats_na_fila'] == 1
+        liberar.set()
+        t1.join()
+        t2.join()
+        assert recebidas == [1, 2]
+
+    def test_bot_com_fila_encaminha_envios(self) -> None:
+        from fila_telegram import BotComFila, FilaEnvioTelegram
+        mock_bot = MagicMock()
+        saida = BotComFila(mock_bot, FilaEnvioTelegram())
+        mensagem = MagicMock()
+        mensagem.chat.id = 42
+
+        saida.reply_to(mensagem, "oi")
+        saida.edit_message_text("editado", chat_id=42, message_id=7)
+        saida.get_file("abc")
+
+        mock_bot.reply_to.assert_called_once_with(mensagem, "oi")
+        mock_bot.edit_message_text.assert_called_once_with("editado", chat_id=42, message_id=7)
+        mock_bot.get_file.assert_called_once_with("abc")
+        assert saida.fila.metricas()['enviadas'] == 2
+
+
+# ==========================================
+# TESTES DO RUNTIME ASSÍNCRONO
+# ==========================================
+class TestRuntimeAssincrono:
+    """Testa as peças assíncronas: despachante, fila do Telegram e sessões do Gemini."""
+
+    def test_despachante_async_limita_concorrencia(self) -> None:
+        import asyncio
+        from despachante_ia import DespachanteIA
+        despachante = DespachanteIA(max_concorrencia=2)
+        picos: list[int] = []
+
+        async def chamada():
+            picos.append(despachante.em_andamento)
+            await asyncio.sleep(0.01)
+            return "ok"
+
+        async def rodar():
+            return await asyncio.gather(*(despachante.executar_async(chamada) for _ in range(6)))
+
+        assert asyncio.run(rodar()) == ["ok"] * 6
+        assert max(picos) == 2
+        assert despachante.em_andamento == 0
+        assert despachante.metricas()['gemini']['chamadas'] == 6
+
+    def test_despachante_async_repete_apos_cota(self) -> None:
+        import asyncio
+        from despachante_ia import DespachanteIA
+        despachante = DespachanteIA(max_concorrencia=1)
+        chamada = MagicMock(side_effect=[Exception("429 RESOURCE_EXHAUSTED retryDelay': '0s'"), "ok"])
+
+        async def funcao():
+            return chamada()
+
+        assert asyncio.run(despachante.executar_async(funcao, rotulo='teste')) == "ok"
+        assert despachante.metricas()['teste']['erros'] == 1
+
+    def test_despachante_async_stream(self) -> None:
+        import asyncio
+        from despachante_ia import DespachanteIA
+        despachante = DespachanteIA()
+
+        async def gerar():
+            async def _pedacos():
+                for pedaco in ("a", "b"):
+                    yield pedaco
+            return _pedacos()
+
+        async def consumir():
+            return [p async for p in despachante.executar_stream_async(gerar)]
+
+        assert asyncio.run(consumir()) == ["a", "b"]
+        assert despachante.em_andamento == 0
+
+    def test_fila_async_mantem_ordem_e_repete_429(self) -> None:
+        import asyncio
+        from fila_telegram import FilaEnvioTelegramAsync
+        fila = FilaEnvioTelegramAsync(taxa_chat=1000, rajada_chat=1000, taxa_global=1000)
+        erro = Exception("Too Many Requests")
+        erro.error_code = 429
+        erro.result_json = {'parameters': {'retry_after': 0}}
+        recebidas: list[int] = []
+        falhou = []
+
+        async def enviar(n):
+            if n == 1 and not falhou:
+                falhou.append(True)
+                raise erro
+            await asyncio.sleep(0)
+            recebidas.append(n)
+
+        async def rodar():
+            await asyncio.gather(*(fila.chamar("1", enviar, n) for n in range(1, 4)))
+
+        asyncio.run(rodar())
+        assert recebidas == [1, 2, 3]
+        assert fila.metricas()['retentativas'] == 1
+        assert fila.metricas()['na_fila'] == 0
+
+    def test_sessao_async_usa_o_pool_e_devolve_o_turno(self, monkeypatch) -> None:
+        from google.genai import types
+        import ai_engine
+        from pool_sessoes import PoolSessoes
+        historico = [
+            types.Content(role='user', parts=[types.Part.from_text(text='oi')]),
+            types.Content(role='model', parts=[types.Part.from_text(text='olá')]),
+        ]
+        parametros = {'model': ai_engine.MODELO_GEMINI, 'config': types.GenerateContentConfig(temperature=0.3)}
+        pool = PoolSessoes(
+            carregador=lambda chat_id: list(historico),
+            fabrica=lambda chat_id, h: (ai_engine.client_ai.chats.create(history=h, **parametros), [], parametros)
+        )
+        monkeypatch.setattr(ai_engine, '_active_sessions', pool)
+        sessao = pool.obter("1")
+        visao = ai_engine._sessao_async("1", sessao)
+        assert pool.parametros("1") == parametros
+
+        visao.record_history(
+            types.Content(role='user', parts=[types.Part.from_text(text='tudo bem?')]),
+            [types.Content(role='model', parts=[types.Part.from_text(text='tudo!')])],
+            None, True
+        )
+        # A visão trabalha numa cópia; o turno só chega à sessão do pool quando é devolvido
+        assert len(sessao.get_history(curated=True)) == 2
+        ai_engine._devolver_turno(sessao, visao)
+        assert len(sessao.get_history(curated=True)) == 4
+        assert len(sessao.get_history(curated=False)) == 4
+        assert sessao.get_history(curated=True)[-1].parts[0].text == 'tudo!'
+
+
+# ==========================================
+# TESTES DA FILA DE MENSAGENS POR CHAT
+# ==========================================
+class TestFilaChats:
+    """Testa ordem por chat, paralelismo entre chats e backpressure."""
+
+    def test_mesmo_chat_em_ordem_e_chats_em_paralelo(self) -> None:
+        import threading
+        from fila_chats import FilaChats
+        fila = FilaChats(max_workers=4, max_fila_chat=10)
+        liberar = threading.Event()
+        outro_chat_rodou = threading.Event()
+        ordem: list[int] = []
+
+        def lenta(n):
+            liberar.wait(timeout=2)
+            ordem.append(n)
+
+        assert fila.submeter("1", lenta, 1)
+        assert fila.submeter("1", ordem.append, 2)
+        assert fila.submeter("2", lambda: outro_chat_rodou.set())
+
+        # O chat 2 não espera o chat 1, que está travado
+        assert outro_chat_rodou.wait(timeout=2)
+        assert ordem == []
+        liberar.set()
+        fila.encerrar()
+        assert ordem == [1, 2]
+
+    def test_recusa_quando_fila_do_chat_enche(self) -> None:
+        import threading
+        from fila_chats import FilaChats
+        avisos: list[str] = []
+        fila = FilaChats(max_workers=2, max_fila_chat=1, ao_recusar=avisos.append)
+        liberar = threading.Event()
+
+        assert fila.submeter("1", liberar.wait, 2)
+        assert fila.submeter("1", lambda: None)
+        assert not fila.submeter("1", lambda: None)
+        assert not fila.submeter("1", lambda: None)
+        liberar.set()
+        fila.encerrar()
+
+        assert avisos == ["1"]
+        assert fila.metricas()['recusadas'] == 2
+        assert fila.metricas()['executadas'] == 2
+
+    def test_erro_no_handler_nao_trava_o_chat(self) -> None:
+        from fila_chats import FilaChats
+        fila = FilaChats(max_workers=1)
+        executadas: list[str] = []
+
+        def falha():
+            raise ValueError("boom")
+
+        fila.submeter("1", falha)
+        fila.submeter("1", executadas.append, "depois")
+        fila.encerrar()
+        assert executadas == ["depois"]
+        assert fila.metricas()['erros'] == 1
+
+    def test_fila_async_ordem_e_recusa(self) -> None:
+        import asyncio
+        from fila_chats import FilaChatsAsync
+        avisos: list[str] = []
+
+        async def avisar(chat_id):
+            avisos.append(chat_id)
+
+        fila = FilaChatsAsync(max_workers=2, max_fila_chat=1, ao_recusar=avisar)
+        ordem: list[int] = []
+
+        async def handler(n):
+            await asyncio.sleep(0.01 if n == 1 else 0)
+            ordem.append(n)
+
+        async def rodar():
+            return await asyncio.gather(*(fila.executar("1", handler, n) for n in (1, 2, 3)))
+
+        assert asyncio.run(rodar()) == [True, True, False]
+        assert ordem == [1, 2]
+        assert avisos == ["1"]
+
+
+# ==========================================
+# TESTES DO AGRUPAMENTO DE MENSAGENS
+# ==========================================
+class _AgendaFalsa:
+    """Agenda manual: os vencimentos só acontecem quando o teste chama `disparar`."""
+
+    def __init__(self) -> None:
+        self.pendentes: list[list] = []
+
+    def __call__(self, atraso, callback):
+        entrada = [atraso, callback, False]
+        self.pendentes.append(entrada)
+        return SimpleNamespace(cancel=lambda: entrada.__setitem__(2, True))
+
+    def disparar(self) -> list[float]:
+        """Executa os vencimentos não cancelados e retorna os atrasos deles."""
+        ativos = [e for e in self.pendentes if not e[2]]
+        self.pendentes = []
+        for _, callback, _ in ativos:
+            callback()
+        return [e[0] for e in ativos]
+
+
+class TestAgrupadorMensagens:
+    """Testa a junção de mensagens seguidas e o limite de ritmo sem perda de mensagens."""
+
+    def test_junta_mensagens_da_janela_num_lote(self) -> None:
+        from agrupador_mensagens import AgrupadorMensagens
+        agenda = _AgendaFalsa()
+        lotes: list[tuple[str, list]] = []
+        agrupador = AgrupadorMensagens(lambda c, itens: lotes.append((c, itens)), janela=2, agendar=agenda)
+
+        for texto in ("oi", "coach", "como foi meu pedal?"):
+            agrupador.adicionar(1, texto)
+        assert lotes == []
+
+        agenda.disparar()
+        assert lotes == [("1", ["oi", "coach", "como foi meu pedal?"])]
+        assert agrupador.metricas() == {'recebidas': 3, 'lotes': 1, 'buffers_abertos': 0}
+
+    def test_chats_diferentes_nao_se_misturam(self) -> None:
+        from agrupador_mensagens import AgrupadorMensagens
+        agenda = _AgendaFalsa()
+        lotes: dict[str, list] = {}
+        agrupador = AgrupadorMensagens(lambda c, itens: lotes.__setitem__(c, itens), agendar=agenda)
+
+        agrupador.adicionar(1, "a")
+        agrupador.adicionar(2, "b")
+        agenda.disparar()
+        assert lotes == {"1": ["a"], "2": ["b"]}
+
+    def test_limite_de_ritmo_adia_sem_descartar(self) -> None:
+        from agrupador_mensagens import AgrupadorMensagens
+        agenda = _AgendaFalsa()
+        lotes: list[list] = []
+        agrupador = AgrupadorMensagens(lambda c, itens: lotes.append(itens),
+                                       respostas_por_minuto=1, agendar=agenda)
+
+        # A rajada (3 respostas) passa direto
+        for i in range(3):
+            agrupador.adicionar(1, f"m{i}")
+            agenda.disparar()
+        assert len(lotes) == 3
+
+        # Acima do ritmo: o lote espera vaga e junta o que chegar nesse meio tempo
+        agrupador.adicionar(1, "m3")
+        agenda.disparar()
+        agrupador.adicionar(1, "m4")
+        assert len(lotes) == 3
+        atrasos = agenda.disparar()
+        assert atrasos and atrasos[0] > 30
+        assert lotes[-1] == ["m3", "m4"]
+
+    def test_comando_libera_o_texto_pendente_antes_de_entrar_na_fila(self) -> None:
+        import threading
+        from agrupador_mensagens import AgrupadorMensagens
+        from fila_chats import FilaChats
+        agenda = _AgendaFalsa()
+        fila = FilaChats(max_workers=2, max_fila_chat=10)
+        ordem: list[str] = []
+        fim = threading.Event()
+        agrupador = AgrupadorMensagens(lambda c, itens: fila.submeter(c, ordem.extend, itens),
+                                       janela=8, agendar=agenda)
+        fila.definir_antes_de_enfileirar(agrupador.liberar)
+
+        @fila.por_chat
+        def semana(message):
+            ordem.append("/semana")
+            fim.set()
+
+        agrupador.adicionar(1, "texto")
+        semana(SimpleNamespace(chat=SimpleNamespace(id=1)))
+        assert fim.wait(timeout=2)
+        assert ordem == ["texto", "/semana"]
+        # O vencimento antigo não libera o lote de novo
+        agenda.disparar()
+        assert ordem == ["texto", "/semana"]
+        assert agrupador.metricas() == {'recebidas': 1, 'lotes': 1, 'buffers_abertos': 0}
+
+    def test_lote_nao_e_recusado_com_a_fila_do_chat_cheia(self) -> None:
+        import threading
+        from agrupador_mensagens import AgrupadorMensagens
+        from fila_chats import FilaChats
+        agenda = _AgendaFalsa()
+        recusados: list[str] = []
+        fila = FilaChats(max_workers=1, max_fila_chat=1, ao_recusar=recusados.append)
+        liberar, fim = threading.Event(), threading.Event()
+        respondidas: list[str] = []
+        agrupador = AgrupadorMensagens(
+            lambda c, itens: fila.submeter_sem_limite(c, lambda: (respondidas.extend(itens), fim.set())),
+            agendar=agenda)
+
+        # Um comando lento rodando e outro esperando: a fila do chat está no limite
+        assert fila.submeter("1", lambda: liberar.wait(timeout=2))
+        assert fila.submeter("1", lambda: None)
+        assert not fila.submeter("1", lambda: None)
+
+        agrupador.adicionar(1, "oi")
+        agrupador.adicionar(1, "como foi meu pedal?")
+        agenda.disparar()
+        liberar.set()
+        assert fim.wait(timeout=2)
+        assert respondidas == ["oi", "como foi meu pedal?"]
+        assert fila.metricas()['recusadas'] == 1
+
+    def test_comando_assincrono_espera_o_texto_pendente(self) -> None:
+        import asyncio
+        from agrupador_mensagens import AgrupadorMensagens
+        from fila_chats import FilaChatsAsync
+
+        async def cenario() -> list[str]:
+            fila = FilaChatsAsync(max_workers=2)
+            ordem: list[str] = []
+
+            async def responder(itens):
+                await asyncio.sleep(0.01)
+                ordem.extend(itens)
+
+            agrupador = AgrupadorMensagens(
+                lambda c, itens: asyncio.ensure_future(fila.executar(c, responder, itens)),
+                janela=8, agendar=lambda atraso, callback: asyncio.get_running_loop().call_later(atraso, callback))
+            fila.definir_antes_de_enfileirar(agrupador.liberar)
+
+            @fila.por_chat
+            async def semana(message):
+                ordem.append("/semana")
+
+            agrupador.adicionar(1, "texto")
+            await semana(SimpleNamespace(chat=SimpleNamespace(id=1)))
+            return ordem
+
+        assert asyncio.run(cenario()) == ["texto", "/semana"]
+
+    def test_juntar_mensagens(self) -> None:
+        from bot_coach import juntar_mensagens
+        mensagens = [SimpleNamespace(text="vai chover?"), SimpleNamespace(text="quero pedalar amanhã")]
+        assert juntar_mensagens(mensagens) == "vai chover?\nquero pedalar amanhã"
+
+
+# ==========================================
+# TESTES DOS PROVEDORES DE CONTEXTO
+# ==========================================
+class TestProvedoresContexto:
+    """Busca paralela das fontes de contexto com timeout, prazo e cache."""
+
+    def _registro(self, **buscas):
+        from provedores_contexto import RegistroContexto, ProvedorContexto
+        registro = RegistroContexto(max_workers=4)
+        for chave, (buscar, timeout) in buscas.items():
+            registro.registrar(ProvedorContexto(chave, chave.upper(), buscar, ttl=60, timeout=timeout))
+        return registro
+
+    def test_buscas_rodam_em_paralelo(self) -> None:
+        import time
+        def lento(valor):
+            return lambda: (time.sleep(0.2), valor)[1]
+        registro = self._registro(a=(lento("A"), 2.0), b=(lento("B"), 2.0), c=(lento("C"), 2.0))
+
+        inicio = time.monotonic()
+        resultado = registro.resolver(['a', 'b', 'c'], prazo=2.0)
+        assert resultado == {'a': "A", 'b': "B", 'c': "C"}
+        assert time.monotonic() - inicio < 0.5
+
+    def test_fonte_lenta_fica_indisponivel_e_abastece_o_cache(self) -> None:
+        import threading, time
+        from provedores_contexto import TEXTO_INDISPONIVEL
+        liberar = threading.Event()
+        registro = self._registro(rapido=(lambda: "ok", 1.0),
+                                  lento=(lambda: (liberar.wait(2), "tarde")[1], 1.0))
+
+        inicio = time.monotonic()
+        resultado = registro.resolver(['rapido', 'lento'], prazo=0.1)
+        assert time.monotonic() - inicio < 0.5
+        assert resultado == {'rapido': "ok", 'lento': TEXTO_INDISPONIVEL}
+        assert registro.blocos(resultado)[1] == f"[LENTO: {TEXTO_INDISPONIVEL}]"
+
+        # A busca continua em segundo plano e serve a próxima mensagem
+        liberar.set()
+        time.sleep(0.1)
+        assert registro.resolver(['lento'], prazo=0.1) == {'lento': "tarde"}
+
+    def test_erro_usa_padrao_e_nao_vai_para_o_cache(self) -> None:
+        from provedores_contexto import TEXTO_INDISPONIVEL
+        chamadas: list[int] = []
+        def falha():
+            chamadas.append(1)
+            raise ConnectionError("fora do ar")
+        def erro_em_texto():
+            chamadas.append(1)
+            return "Erro ao buscar dados do Strava."
+        registro = self._registro(falha=(falha, 1.0), texto=(erro_em_texto, 1.0))
+
+        assert registro.resolver(['falha'], prazo=1.0) == {'falha': TEXTO_INDISPONIVEL}
+        registro.resolver(['texto'], prazo=1.0)
+        registro.resolver(['texto'], prazo=1.0)
+        assert len(chamadas) == 3
+
+    def test_argumentos_fazem_parte_da_chave_do_cache(self) -> None:
+        registro = self._registro(meta=(lambda km: f"meta {km}", 1.0))
+        assert registro.resolver([('meta', 100)]) == {'meta': "meta 100"}
+        assert registro.resolver([('meta', 200)]) == {'meta': "meta 200"}
+
+    def test_resolver_async_respeita_o_prazo(self) -> None:
+        import asyncio
+        from provedores_contexto import TEXTO_INDISPONIVEL
+        registro = self._registro(rapido=(lambda: "ok", 1.0), lento=(lambda: "nunca", 1.0))
+
+        async def lento():
+            await asyncio.sleep(5)
+        registro.definir_busca_async('lento', lento)
+
+        resultado = asyncio.run(registro.resolver_async(['rapido', 'lento'], prazo=0.1))
+        assert resultado == {'rapido': "ok", 'lento': TEXTO_INDISPONIVEL}
+
+
+# ==========================================
+# TESTES DO DETECTOR DE INTENÇÕES
+# ==========================================
+# Corpus rotulado: mensagem -> intenções que devem buscar dados
+CORPUS_INTENCOES: list[tuple[str, set[str]]] = [
+    ("como está o tempo hoje?", {'clima'}),
+    ("como vai estar o tempo pra amanhã?", {'clima'}),
+    ("e o tempo para domingo?", {'clima'}),
+    ("como fica o tempo pro fim de semana?", {'clima'}),
+    ("e o tempo para o sábado?", {'clima'}),
+    ("não tenho tempo pra pedalar", set()),
+    ("vai chover amanhã?", {'clima'}),
+    ("Tá chovendo aí em Curitiba?", {'clima'}),
+    ("qual a previsão pro fim de semana?", {'clima'}),
+    ("vai fazer sol no sábado? quero pedalar", {'clima'}),
+    ("que frio hoje, será que dá pra pedalar?", {'clima'}),
+    ("avalie meu pedal de hoje", {'strava'}),
+    ("quanto km fiz na semana?", {'strava'}),
+    ("meu último treino foi bom?", {'strava'}),
+    ("fiz 80km ontem, o que achou?", {'strava'}),
+    ("como está meu desempenho no Strava?", {'strava'}),
+    ("ÚLTIMO PEDAL: o que achou da subida?", {'strava'}),
+    ("preciso trocar a corrente", {'bike'}),
+    ("como está a kaéti?", {'bike'}),
+    ("quando faço a manutenção da bicicleta?", {'bike'}),
+    ("as pastilhas de freio estão chiando", {'bike'}),
+    # Um termo do vocabulário básico da bike basta sozinho
+    ("pneu gasto?", {'bike'}),
+    ("olha o freio", {'bike'}),
+    ("cambio desregulado", {'bike'}),
+    ("a relação tá pulando", {'bike'}),
+    ("vai chover? e como foi meu treino de ontem?", {'clima', 'strava'}),
+    ("quantos km a bike já tem?", {'strava', 'bike'}),
+    # Mensagens que a busca por substring pegava por engano
+    ("bom dia, tudo bem?", set()),
+    ("me manda uma rota", set()),
+    ("faz tempo que não converso contigo", set()),
+    ("que consolo ouvir isso", set()),
+    ("estou sem tempo essa semana", set()),
+    ("hoje estou cansado", set()),
+    ("isso foi um resultado de muito esforço da equipe", set()),
+    ("obrigado pela ajuda, coach!", set()),
+    ("consegui chegar a tempo no trabalho", set()),
+    ("gosto de pedalar com a galera", set()),
+    ("em relação à dieta, o que comer antes?", set()),
+]
+
+
+class TestIntencoes:
+    """Detector compilado: palavras inteiras, sem acento e com pesos."""
+
+    @pytest.mark.parametrize("mensagem,esperado", CORPUS_INTENCOES)
+    def test_corpus_rotulado(self, mensagem: str, esperado: set) -> None:
+        from intencoes import detectar_intencoes
+        assert detectar_intencoes(mensagem) == esperado
+
+    def test_menos_falsos_positivos_que_substring(self) -> None:
+        from intencoes import detectar_intencoes, _detectar_por_substring
+        def erros(funcao) -> int:
+            return sum(len(funcao(m) - esperado) for m, esperado in CORPUS_INTENCOES)
+        assert erros(detectar_intencoes) == 0
+        assert erros(_detectar_por_substring) > 5
+
+    def test_normalizar_remove_acentos(self) -> None:
+        from intencoes import normalizar
+        assert normalizar("Último Câmbio da Kaéti 🚴") == "ultimo cambio da kaeti "
+
+    def test_borda_de_palavra_aceita_numeros(self) -> None:
+        from intencoes import pontuar_intencoes
+        assert pontuar_intencoes("pedalei 50km")['strava'] >= 2.0
+        assert pontuar_intencoes("consolo") == {}
+
+    def test_termo_ambiguo_sozinho_nao_dispara(self) -> None:
+        from intencoes import pontuar_intencoes, detectar_intencoes
+        assert 0 < pontuar_intencoes("como foi hoje?")['strava'] < 1.0
+        assert detectar_intencoes("como foi hoje?") == set()
+        assert detectar_intencoes("como foi hoje?", limiar=0.3) == {'strava'}
+
+    def test_medir_desempenho(self) -> None:
+        from intencoes import medir_desempenho
+        resultado = medir_desempenho([m for m, _ in CORPUS_INTENCOES], repeticoes=2)
+        assert set(resultado) == {'compilado', 'substring'}
+        assert all(v > 0 for v in resultado.values())
+
+
+# ==========================================
+# TESTES DE DADOS JÁ ENVIADOS NA SESSÃO
+# ==========================================
+class TestDadosRepetidos:
+    """Blocos de dados que o modelo já viu viram referência; os que mudaram vão inteiros."""
+
+    def _historico(self, *textos_usuario: str) -> list:
+        from google.genai import types
+        historico = []
+        for texto in textos_usuario:
+            historico.append(types.Content(role='user', parts=[types.Part.from_text(text=texto)]))
+            historico.append(types.Content(role='model', parts=[types.Part.from_text(text="ok")]))
+        return historico
+
+    def test_bloco_identico_vira_referencia(self) -> None:
+        from orcamento_tokens import referenciar_dados_repetidos
+        semana = "[DADOS SEMANA: 3 pedais, 120 km]"
+        historico = self._historico(f"como foi minha semana?\n\n{semana}")
+
+        dados = referenciar_dados_repetidos([semana, "[DADOS BIKE: 2000 km]"], historico)
+        assert dados[0].startswith("[DADOS SEMANA: sem mudanças")
+        assert dados[1] == "[DADOS BIKE: 2000 km]"
+
+    def test_bloco_alterado_vai_inteiro(self) -> None:
+        from orcamento_tokens import referenciar_dados_repetidos
+        historico = self._historico("oi\n\n[DADOS SEMANA: 3 pedais, 120 km]")
+        novo = "[DADOS SEMANA: 4 pedais, 160 km]"
+        assert referenciar_dados_repetidos([novo], historico) == [novo]
+
+    def test_resposta_do_modelo_nao_conta(self) -> None:
+        from google.genai import types
+        from orcamento_tokens import referenciar_dados_repetidos
+        bloco = "[DADOS BIKE: 2000 km]"
+        historico = [types.Content(role='model', parts=[types.Part.from_text(text=bloco)])]
+        assert referenciar_dados_repetidos([bloco], historico) == [bloco]
+
+    def test_preparar_envio_reenvia_se_o_historico_foi_cortado(self) -> None:
+        import ai_engine
+        bloco = "[DADOS SEMANA: 3 pedais]"
+        historico = self._historico("x" * 4000 + f"\n\n{bloco}", "tudo bem?")
+        sessao = MagicMock()
+        sessao.get_history.return_value = historico
+
+        with patch.object(ai_engine, 'get_chat_session', return_value=sessao), \
+                patch.object(ai_engine, 'guardar_memoria'), \
+                patch('orcamento_tokens.ORCAMENTO_TOKENS', 600), \
+                patch.object(ai_engine, 'instrucoes_coach', "sistema"):
+            _, prompt_final, _ = ai_engine._preparar_envio("1", "e a semana?", [bloco], None)
+        assert bloco in prompt_final
+
+        historico_curto = self._historico(f"oi\n\n{bloco}")
+        sessao.get_history.return_value = historico_curto
+        with patch.object(ai_engine, 'get_chat_session', return_value=sessao), \
+                patch.object(ai_engine, 'guardar_memoria'), \
+                patch.object(ai_engine, 'instrucoes_coach', "sistema"):
+            _, prompt_final, _ = ai_engine._preparar_envio("1", "e a semana?", [bloco], None)
+        assert bloco not in prompt_final and "[DADOS SEMANA: sem mudanças" in prompt_final
+
+
+# ==========================================
+# TESTES DO CACHE DE MÍDIA DO GEMINI
+# ==========================================
+class TestCacheMidia:
+    """Mídia inline ou enviada uma vez por file_unique_id, com expiração dos arquivos remotos."""
+
+    def _cache(self, **kwargs):
+        from google.genai import types
+        from midia_gemini import CacheMidiaGemini
+        self.enviados: list[bytes] = []
+        self.apagados: list[str] = []
+
+        def enviar(arquivo, mime_type):
+            self.enviados.append(arquivo.read())
+            n = len(self.enviados)
+            return types.File(name=f"files/{n}", uri=f"https://gemini/files/{n}", mime_type=mime_type)
+
+        return CacheMidiaGemini(enviar, self.apagados.append, limite_inline=10, **kwargs)
+
+    def test_payload_pequeno_vai_inline(self) -> None:
+        cache = self._cache()
+        parte = cache.parte(b"ogg", 'audio/ogg', "u1")
+        assert parte.inline_data.data == b"ogg"
+        assert self.enviados == []
+        assert cache.metricas()['inline'] == 1
+
+    def test_midia_repetida_nao_sobe_de_novo(self) -> None:
+        cache = self._cache()
+        dados = b"x" * 100
+        primeira = cache.parte(dados, 'image/jpeg', "foto-1")
+        segunda = cache.parte(dados, 'image/jpeg', "foto-1")
+        assert primeira.file_data.file_uri == segunda.file_data.file_uri
+        assert self.enviados == [dados]
+        assert cache.metricas()['reaproveitados'] == 1
+
+    def test_envios_simultaneos_da_mesma_midia(self) -> None:
+        import threading, time
+        from google.genai import types
+        from midia_gemini import CacheMidiaGemini
+        chamadas: list[int] = []
+
+        def enviar(arquivo, mime_type):
+            chamadas.append(1)
+            time.sleep(0.1)
+            return types.File(name="files/1", uri="https://gemini/files/1", mime_type=mime_type)
+
+        cache = CacheMidiaGemini(enviar, lambda nome: None, limite_inline=0)
+        threads = [threading.Thread(target=cache.parte, args=(b"abc", 'audio/ogg', "a1")) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(chamadas) == 1
+
+    def test_expirar_preserva_arquivos_em_uso(self) -> None:
+        cache = self._cache(retencao_segundos=0)
+        em_uso = cache.parte(b"a" * 100, 'image/jpeg', "f1").file_data.file_uri
+        cache.parte(b"b" * 100, 'image/jpeg', "f2")
+
+        assert cache.expirar([em_uso]) == 1
+        assert self.apagados == ["files/2"]
+        assert cache.metricas()['arquivos'] == 1
+
+    def test_parte_async_compartilha_o_upload(self) -> None:
+        import asyncio
+        from google.genai import types
+        from midia_gemini import CacheMidiaGemini
+        chamadas: list[int] = []
+
+        async def enviar_async(arquivo, mime_type):
+            chamadas.append(1)
+            await asyncio.sleep(0.01)
+            return types.File(name="files/9", uri="https://gemini/files/9", mime_type=mime_type)
+
+        cache = CacheMidiaGemini(lambda a, m: None, lambda nome: None, enviar_async=enviar_async, limite_inline=0)
+
+        async def cenario():
+            return await asyncio.gather(*(cache.parte_async(b"abc", 'audio/ogg', "a9") for _ in range(3)))
+
+        partes = asyncio.run(cenario())
+        assert len(chamadas) == 1
+        assert {p.file_data.file_uri for p in partes} == {"https://gemini/files/9"}
+
+
+# ==========================================
+# TESTES DO PREPARO DE FOTOS
+# ==========================================
+class TestImagemFoto:
+    """Escolha do PhotoSize, redução da foto e registro dos pixels enviados."""
+
+    def _jpeg(self, largura: int, altura: int) -> bytes:
+        import io
+        from PIL import Image
+        saida = io.BytesIO()
+        Image.new('RGB', (largura, altura), (200, 80, 40)).save(saida, format='JPEG')
+        return saida.getvalue()
+
+    def test_escolhe_menor_tamanho_que_atende(self) -> None:
+        from imagem_foto import escolher_tamanho_foto
+        tamanhos = [SimpleNamespace(width=w, height=h) for w, h in ((90, 67), (320, 240), (800, 600), (1280, 960))]
+        assert escolher_tamanho_foto(tamanhos, 768).width == 800
+        assert escolher_tamanho_foto(tamanhos, 2000).width == 1280
+
+    def test_legenda_de_equipamento_pede_mais_detalhe(self) -> None:
+        from imagem_foto import lado_alvo_foto
+        from config import RESOLUCAO_FOTO_PX, RESOLUCAO_FOTO_DETALHE_PX
+        assert lado_alvo_foto(None) == RESOLUCAO_FOTO_PX
+        assert lado_alvo_foto("olha a trilha de hoje") == RESOLUCAO_FOTO_PX
+        assert lado_alvo_foto("como está o desgaste da corrente?") == RESOLUCAO_FOTO_DETALHE_PX
+        assert lado_alvo_foto("pneu gasto?") == RESOLUCAO_FOTO_DETALHE_PX
+
+    def test_reduz_mantendo_proporcao(self) -> None:
+        import io
+        from PIL import Image
+        from imagem_foto import reduzir_foto
+        dados, pixels = reduzir_foto(self._jpeg(2000, 1500), 768)
+        with Image.open(io.BytesIO(dados)) as imagem:
+            assert imagem.size == (768, 576)
+        assert pixels == 768 * 576
+
+    def test_imagem_dentro_do_alvo_nao_e_recodificada(self) -> None:
+        from imagem_foto import reduzir_foto
+        original = self._jpeg(800, 600)
+        assert reduzir_foto(original, 768) == (original, 800 * 600)
+
+    def test_bytes_invalidos_seguem_sem_reducao(self) -> None:
+        from imagem_foto import reduzir_foto
+        assert reduzir_foto(b"nao sou imagem", 768) == (b"nao sou imagem", 0)
+
+    def test_pixels_registrados_em_banco_antigo(self) -> None:
+        tmp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        tmp_db.close()
+        conn = sqlite3.connect(tmp_db.name)
+        conn.execute('''
+            CREATE TABLE uso_tokens (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id TEXT NOT NULL, comando TEXT NOT NULL,
+                tokens_sistema INTEGER DEFAULT 0, tokens_historico INTEGER DEFAULT 0,
+                tokens_dados INTEGER DEFAULT 0, tokens_usuario INTEGER DEFAULT 0,
+                tokens_entrada INTEGER DEFAULT 0, tokens_resposta INTEGER DEFAULT 0,
+                data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.commit()
+        conn.close()
+        try:
+            with patch('ai_engine.DB_PATH', tmp_db.name):
+                from ai_engine import init_db, registrar_uso_tokens
+                init_db()
+                registrar_uso_tokens("1", 'foto', {'total': 300}, 50, pixels_midia=768 * 576)
+            conn = sqlite3.connect(tmp_db.name)
+            assert conn.execute('SELECT pixels_midia FROM uso_tokens').fetchone() == (768 * 576,)
+            conn.close()
+        finally:
+            os.remove(tmp_db.name)
+
+
+# ==========================================
+# TESTES DA CAMADA HTTP (cliente_http)
+# ==========================================
+class TestClienteHTTP:
+    """Sessões compartilhadas: timeout padrão, disjuntor e política de retry."""
+
+    def test_disjuntor_abre_apos_falhas_seguidas(self) -> None:
+        from cliente_http import Disjuntor, DisjuntorAberto
+        disjuntor = Disjuntor('Teste', limite_falhas=3, tempo_aberto=60)
+        for _ in range(2):
+            disjuntor.permitir()
+            disjuntor.registrar_falha()
+        assert disjuntor.estado == 'fechado'
+        disjuntor.registrar_falha()
+        assert disjuntor.estado == 'aberto'
+        with pytest.raises(DisjuntorAberto):
+            disjuntor.permitir()
+
+    def test_sucesso_zera_contagem_de_falhas(self) -> None:
+        from cliente_http import Disjuntor
+        disjuntor = Disjuntor('Teste', limite_falhas=2, tempo_aberto=60)
+        disjuntor.registrar_falha()
+        disjuntor.registrar_sucesso()
+        disjuntor.registrar_falha()
+        assert disjuntor.estado == 'fechado'
+
+    def test_meio_aberto_deixa_passar_um_teste(self) -> None:
+        from cliente_http import Disjuntor, DisjuntorAberto
+        disjuntor = Disjuntor('Teste', limite_falhas=1, tempo_aberto=0)
+        disjuntor.registrar_falha()
+        assert disjuntor.estado == 'meio_aberto'
+        disjuntor.permitir()  # a chamada de teste
+        with pytest.raises(DisjuntorAberto):
+            disjuntor.permitir()  # as outras esperam o resultado do teste
+        disjuntor.registrar_falha()
+        disjuntor.permitir()  # tempo_aberto=0: novo teste liberado
+        disjuntor.registrar_sucesso()
+        assert disjuntor.estado == 'fechado'
+
+    def test_sessao_aplica_timeout_e_conta_erros_do_servidor(self) -> None:
+        import requests
+        from cliente_http import SessaoHTTP, DisjuntorAberto
+        sessao = SessaoHTTP('Teste', timeout=(1.0, 2.0), limite_falhas=2, tempo_aberto=60)
+        with patch.object(requests.Session, 'request', return_value=MagicMock(status_code=503)) as mock_request:
+            sessao.get('https://exemplo.invalid/a')
+            assert mock_request.call_args.kwargs['timeout'] == (1.0, 2.0)
+            sessao.get('https://exemplo.invalid/b', timeout=5)
+            assert mock_request.call_args.kwargs['timeout'] == 5
+            with pytest.raises(DisjuntorAberto):
+                sessao.get('https://exemplo.invalid/c')
+            assert mock_request.call_count == 2
+
+    def test_sessao_nao_conta_erro_do_cliente(self) -> None:
+        import requests
+        from cliente_http import SessaoHTTP
+        sessao = SessaoHTTP('Teste', limite_falhas=1)
+        with patch.object(requests.Session, 'request', return_value=MagicMock(status_code=404)):
+            sessao.get('https://exemplo.invalid/')
+        assert sessao.disjuntor.estado == 'fechado'
+
+    def test_teste_do_meio_aberto_com_erro_inesperado_libera_o_disjuntor(self) -> None:
+        import time
+        import requests
+        from cliente_http import SessaoHTTP, DisjuntorAberto
+        sessao = SessaoHTTP('Teste', limite_falhas=1, tempo_aberto=0.05)
+        with patch.object(requests.Session, 'request', side_effect=requests.exceptions.Timeout()):
+            with pytest.raises(requests.exceptions.Timeout):
+                sessao.get('https://exemplo.invalid/')
+        # A chamada de teste falha com um erro que não é de conexão nem timeout
+        time.sleep(0.06)
+        with patch.object(requests.Session, 'request', side_effect=requests.exceptions.ChunkedEncodingError()):
+            with pytest.raises(requests.exceptions.ChunkedEncodingError):
+                sessao.get('https://exemplo.invalid/')
+        assert sessao.disjuntor.estado == 'aberto'
+        with pytest.raises(DisjuntorAberto):
+            sessao.get('https://exemplo.invalid/')
+        # Passado o tempo aberto, um novo teste é liberado e fecha o disjuntor
+        time.sleep(0.06)
+        with patch.object(requests.Session, 'request', return_value=MagicMock(status_code=200)):
+            sessao.get('https://exemplo.invalid/')
+        assert sessao.disjuntor.estado == 'fechado'
+
+    def test_retry_nao_insiste_com_disjuntor_aberto(self) -> None:
+        from cliente_http import politica_retry, DisjuntorAberto
+        chamadas = []
+
+        @politica_retry(tentativas=3, espera_maxima=0)
+        def buscar():
+            chamadas.append(1)
+            raise DisjuntorAberto("fora do ar")
+
+        with pytest.raises(DisjuntorAberto):
+            buscar()
+        assert len(chamadas) == 1
+
+    def test_retry_repete_erro_de_rede(self) -> None:
+        import requests
+        from cliente_http import politica_retry
+        chamadas = []
+
+        @politica_retry(tentativas=3, espera_maxima=0)
+        def buscar():
+            chamadas.append(1)
+            if len(chamadas) < 3:
+                raise requests.exceptions.Timeout()
+            return "ok"
+
+        assert buscar() == "ok"
+        assert len(chamadas) == 3
+
+    @patch('weather_service.sessao_openweather.get')
+    def test_clima_com_disjuntor_aberto(self, mock_get) -> None:
+        from cliente_http import DisjuntorAberto
+        from weather_service import cache_clima, obter_previsao_tempo
+        cache_clima.limpar()
+        mock_get.side_effect = DisjuntorAberto("OpenWeather indisponível")
+        assert "fora do ar" in obter_previsao_tempo()
+        assert mock_get.call_count == 1
+
+
+# ==========================================
+# TESTES DO CACHE STALE-WHILE-REVALIDATE
+# ==========================================
+class TestCacheSWR:
+    """Valor velho servido na hora, renovação em segundo plano e limite com a fonte fora do ar."""
+
+    def _envelhecer(self, cache, chave, segundos: float) -> None:
+        import time
+        cache.guardar(chave, cache.ler(chave).valor, guardado_em=time.time() - segundos)
+
+    def _esperar_renovacao(self, cache, chave) -> None:
+        # A chave só sai de "em andamento" depois que o resultado foi guardado
+        import time
+        limite = time.monotonic() + 2
+        while chave in cache._em_andamento and time.monotonic() < limite:
+            time.sleep(0.005)
+
+    def test_valor_fresco_nao_busca_de_novo(self) -> None:
+        from cache_swr import CacheSWR
+        cache = CacheSWR('teste', fresco=60, limite=600, armazem=None)
+        buscar = MagicMock(return_value="v1")
+        assert cache.obter('k', buscar).valor == "v1"
+        assert cache.obter('k', buscar).valor == "v1"
+        assert buscar.call_count == 1
+
+    def test_valor_velho_servido_enquanto_renova(self) -> None:
+        import threading
+        from cache_swr import CacheSWR
+        cache = CacheSWR('teste', fresco=60, limite=600, armazem=None)
+        cache.guardar('k', "antigo")
+        self._envelhecer(cache, 'k', 120)
+        liberar = threading.Event()
+
+        def buscar_lento():
+            liberar.wait(2)
+            return "novo"
+
+        leitura = cache.obter('k', buscar_lento)
+        assert leitura.valor == "antigo" and not leitura.desatualizado
+        liberar.set()
+        self._esperar_renovacao(cache, 'k')
+        assert cache.obter('k', buscar_lento).valor == "novo"
+
+    def test_fonte_fora_do_ar_serve_valor_marcado(self) -> None:
+        from cache_swr import CacheSWR, nota_desatualizado
+        cache = CacheSWR('teste', fresco=60, limite=600, armazem=None)
+        cache.guardar('k', "antigo")
+        self._envelhecer(cache, 'k', 300)
+        falha = MagicMock(side_effect=ConnectionError("fora do ar"))
+        cache.obter('k', falha)
+        self._esperar_renovacao(cache, 'k')
+        leitura = cache.obter('k', falha)
+        assert leitura.valor == "antigo" and leitura.desatualizado
+        assert "5 min atrás" in nota_desatualizado(leitura)
+
+    def test_passado_o_limite_busca_na_hora(self) -> None:
+        from cache_swr import CacheSWR
+        cache = CacheSWR('teste', fresco=60, limite=600, armazem=None)
+        cache.guardar('k', "antigo")
+        self._envelhecer(cache, 'k', 700)
+        with pytest.raises(ConnectionError):
+            cache.obter('k', MagicMock(side_effect=ConnectionError("fora do ar")))
+        assert cache.obter('k', MagicMock(return_value="novo")).valor == "novo"
+
+    def test_obter_async_uma_busca_por_chave(self) -> None:
+        import asyncio
+        from cache_swr import CacheSWR
+        cache = CacheSWR('teste', fresco=60, limite=600, armazem=None)
+        chamadas = []
+
+        async def buscar():
+            chamadas.append(1)
+            await asyncio.sleep(0.01)
+            return "v"
+
+        async def cenario():
+            return await asyncio.gather(*(cache.obter_async('k', buscar) for _ in range(5)))
+
+        leituras = asyncio.run(cenario())
+        assert [l.valor for l in leituras] == ["v"] * 5
+        assert len(chamadas) == 1
+
+    @patch('ai_engine.DB_PATH')
+    @patch('strava_service._obter_atividades_com_retry')
+    def test_resumo_semana_avisa_dado_antigo(self, mock_buscar, mock_db_path) -> None:
+        from strava_service import cache_sincronizacao, CHAVE_SINCRONIZACAO, obter_resumo_semana
+        tmp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        tmp_db.close()
+        try:
+            with patch('ai_engine.DB_PATH', tmp_db.name):
+                from ai_engine import init_db
+                init_db()
+                cache_sincronizacao.limpar()
+                cache_sincronizacao.guardar(CHAVE_SINCRONIZACAO, 0)
+                self._envelhecer(cache_sincronizacao, CHAVE_SINCRONIZACAO, cache_sincronizacao.fresco + 60)
+                mock_buscar.side_effect = ConnectionError("Strava fora do ar")
+                obter_resumo_semana()
+                self._esperar_renovacao(cache_sincronizacao, CHAVE_SINCRONIZACAO)
+                texto = obter_resumo_semana()
+        finally:
+            cache_sincronizacao.limpar()
+            os.remove(tmp_db.name)
+        assert texto.startswith("Nenhum pedal registado")
+        assert "fonte fora do ar" in texto
+
+
+# ==========================================
+# TESTES DO CACHE EM DUAS CAMADAS
+# ==========================================
+class TestCachePersistente:
+    """LRU em memória sobre SQLite: TTL, despejo, restart aquecido e estatísticas."""
+
+    def setup_method(self) -> None:
+        from cache_persistente import ArmazemCache
+        self.tmp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.tmp_db.close()
+        self.armazem = ArmazemCache(self.tmp_db.name)
+
+    def teardown_method(self) -> None:
+        if self.armazem._conn is not None:
+            self.armazem._conn.close()
+        for sufixo in ('', '-wal', '-shm'):
+            if os.path.exists(self.tmp_db.name + sufixo):
+                os.remove(self.tmp_db.name + sufixo)
+
+    def test_restart_le_do_disco(self) -> None:
+        from cache_persistente import CacheDuasCamadas
+        CacheDuasCamadas('teste', ttl=60, armazem=self.armazem).guardar(('progresso', 200.0), {'km': 42})
+        novo_processo = CacheDuasCamadas('teste', ttl=60, armazem=self.armazem)
+        assert novo_processo.obter(('progresso', 200.0)) == {'km': 42}
+        assert novo_processo.obter(('progresso', 200.0)) == {'km': 42}
+        est = novo_processo.estatisticas()
+        assert (est['acertos_disco'], est['acertos_memoria'], est['faltas']) == (1, 1, 0)
+
+    def test_ttl_vencido_e_falta(self) -> None:
+        import time
+        from cache_persistente import CacheDuasCamadas
+        cache = CacheDuasCamadas('teste', ttl=60, armazem=self.armazem)
+        cache.guardar('k', "velho", guardado_em=time.time() - 120)
+        assert cache.obter('k') is None
+        cache.guardar('k', "curto", ttl=0)
+        assert cache.obter('k', "padrao") == "padrao"
+        assert cache.estatisticas()['faltas'] == 2
+
+    def test_lru_despeja_o_menos_usado_mas_disco_mantem(self) -> None:
+        from cache_persistente import CacheDuasCamadas
+        cache = CacheDuasCamadas('teste', ttl=60, max_itens=2, armazem=self.armazem)
+        cache.guardar('a', 1)
+        cache.guardar('b', 2)
+        cache.obter('a')
+        cache.guardar('c', 3)  # 'b' é o menos usado
+        assert len(cache) == 2 and 'b' not in cache._memoria
+        assert cache.obter('b') == 2
+        assert cache.estatisticas()['despejos'] >= 1
+
+    def test_valor_nao_serializavel_fica_so_na_memoria(self) -> None:
+        import threading
+        from cache_persistente import CacheDuasCamadas
+        trava = threading.Lock()
+        CacheDuasCamadas('teste', ttl=60, armazem=self.armazem).guardar('trava', trava)
+        assert self.armazem.ler('teste', repr('trava')) is None
+
+    def test_podar_e_limpar_por_namespace(self) -> None:
+        import time
+        from cache_persistente import CacheDuasCamadas
+        cache = CacheDuasCamadas('teste', ttl=60, max_itens_disco=2, armazem=self.armazem)
+        outro = CacheDuasCamadas('outro', ttl=60, armazem=self.armazem)
+        cache.guardar('vencido', 0, guardado_em=time.time() - 120)
+        for i in range(3):
+            cache.guardar(f'k{i}', i, guardado_em=time.time() + i)
+        outro.guardar('x', 'y')
+        assert cache.podar() == 2  # o vencido e o mais antigo acima do limite
+        cache.limpar()
+        assert cache.obter('k2') is None
+        assert outro.obter('x') == 'y'
+
+    def test_caminho_assincrono_nao_toca_o_disco_no_event_loop(self) -> None:
+        import asyncio
+        import threading
+        from cache_persistente import CacheDuasCamadas, _gravacoes_disco
+        threads_disco = []
+        ler, gravar = self.armazem.ler, self.armazem.gravar
+
+        def ler_registrando(*args):
+            threads_disco.append(('ler', threading.get_ident()))
+            return ler(*args)
+
+        def gravar_registrando(*args):
+            threads_disco.append(('gravar', threading.get_ident()))
+            return gravar(*args)
+
+        self.armazem.ler, self.armazem.gravar = ler_registrando, gravar_registrando
+        CacheDuasCamadas('async', ttl=60, armazem=self.armazem).guardar('a', {'km': 10})
+        threads_disco.clear()
+
+        async def cenario():
+            cache = CacheDuasCamadas('async', ttl=60, armazem=self.armazem)
+            item = await cache.obter_item_async('a')  # memória vazia: vem do disco
+            cache.guardar('b', [1, 2], disco_em_segundo_plano=True)
+            assert await cache.obter_item_async('b') is not None  # já na memória
+            return item, threading.get_ident()
+
+        item, thread_loop = asyncio.run(cenario())
+        _gravacoes_disco.submit(lambda: None).result(timeout=5)
+        assert item[0] == {'km': 10}
+        assert [operacao for operacao, _ in threads_disco] == ['ler', 'gravar']
+        assert all(thread != thread_loop for _, thread in threads_disco)
+        assert CacheDuasCamadas('async', ttl=60, armazem=self.armazem).obter('b') == [1, 2]
+
+
+# ==========================================
+# TESTES DO PRÉ-AQUECIMENTO
+# ==========================================
+class TestPreAquecimento:
+    """Horários habituais, janelas de sexta e orçamento do Strava."""
+
+    def test_horarios_habituais_do_historico(self) -> None:
+        from datetime import datetime, timedelta, timezone
+        tmp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        tmp_db.close()
+        base = datetime.now(timezone.utc).replace(minute=30, second=0, microsecond=0) - timedelta(days=7)
+        try:
+            with patch('ai_engine.DB_PATH', tmp_db.name):
+                from ai_engine import init_db, obter_horarios_conversa
+                init_db()
+                conn = sqlite3.connect(tmp_db.name)
+                linhas = [
+                    ('1', 'user', base), ('1', 'user', base - timedelta(days=7)),  # mesmo horário, 2 semanas
+                    ('1', 'model', base - timedelta(days=14)),
+                    ('1', 'user', base - timedelta(hours=5)),  # uma vez só: não é hábito
+                    ('2', 'user', base - timedelta(days=60)), ('2', 'user', base - timedelta(days=67)),  # antigo
+                ]
+                conn.executemany(
+                    'INSERT INTO conversas (chat_id, role, mensagem, data_criacao) VALUES (?, ?, ?, ?)',
+                    [(c, r, 'oi', d.strftime('%Y-%m-%d %H:%M:%S')) for c, r, d in linhas]
+                )
+                conn.commit()
+                conn.close()
+                local = base.astimezone()
+                assert obter_horarios_conversa(dias=28, minimo_dias=2) == {'1': {(local.weekday(), local.hour)}}
+        finally:
+            os.remove(tmp_db.name)
+
+    def test_aquece_antes_do_habito_e_da_janela_de_sexta(self) -> None:
+        from datetime import datetime
+        from preaquecimento import PreAquecedor
+        aquecer = MagicMock()
+        preaquecedor = PreAquecedor(
+            aquecer=aquecer, habitos=lambda: {'1': {(4, 18)}, '3': {(0, 7)}},
+            chats_janelas_fixas=lambda: ['2'], janelas_fixas=[(4, "18:00")], antecedencia_min=10
+        )
+        sexta = datetime(2026, 3, 13, 17, 52)  # sexta-feira
+        assert sorted(preaquecedor.verificar(sexta)) == ['1', '2']
+        assert sorted(aquecer.call_args.args[0]) == ['1', '2']
+        # Só quem tem hábito no horário ganha sessão; a janela fixa é envio pré-gerado
+        assert aquecer.call_args.args[1] == ['1']
+        assert preaquecedor.verificar(sexta.replace(minute=57)) == []  # já aquecidos
+        assert preaquecedor.verificar(datetime(2026, 3, 13, 17, 40)) == []  # cedo demais
+
+    def test_aquecer_respeita_orcamento_e_cache(self) -> None:
+        from preaquecimento import OrcamentoChamadas, aquecer_chats
+        registro = MagicMock()
+        registro.em_cache.side_effect = lambda pedido: pedido == 'bike'
+        hidratar = MagicMock()
+        resultado = aquecer_chats(['1', '2'], registro, lambda chat_id: 200.0, hidratar, OrcamentoChamadas(2),
+                                  chats_sessao=['1', '2'], vagas_sessoes=5)
+        registro.resolver.assert_called_once_with(['clima', 'semana', 'ultimo_pedal'], prazo=60.0)
+        assert resultado == {'buscas_strava': 2, 'adiadas': 1, 'sessoes': 2}
+        assert hidratar.call_count == 2
+
+    def test_hidrata_so_chats_habituais_dentro_das_vagas_do_pool(self) -> None:
+        from preaquecimento import OrcamentoChamadas, aquecer_chats
+        registro = MagicMock()
+        registro.em_cache.return_value = True
+        hidratar = MagicMock()
+        resultado = aquecer_chats(['1', '2', '3'], registro, lambda chat_id: 200.0, hidratar, OrcamentoChamadas(5),
+                                  chats_sessao=['1', '2'], vagas_sessoes=1)
+        assert resultado['sessoes'] == 1
+        hidratar.assert_called_once_with('1')
+        # Sem chats habituais (janela fixa de sexta): nenhuma sessão
+        hidratar.reset_mock()
+        assert aquecer_chats(['1', '2'], registro, lambda chat_id: 200.0, hidratar, OrcamentoChamadas(5),
+                             vagas_sessoes=10)['sessoes'] == 0
+        hidratar.assert_not_called()
+
+    def test_orcamento_janela_deslizante(self) -> None:
+        from preaquecimento import OrcamentoChamadas
+        orcamento = OrcamentoChamadas(3, janela_segundos=3600)
+        assert orcamento.reservar(2) == 2
+        assert orcamento.reservar(2) == 1
+        assert orcamento.reservar(1) == 0
+        orcamento._chamadas[0] -= 3600  # a mais antiga saiu da janela
+        assert orcamento.reservar(5) == 1
+
+
+# ==========================================
+# TESTES DO TOKEN DO STRAVA (token_strava)
+# ==========================================
+class TestTokenStrava:
+    """Renovação antecipada, única e persistida no banco do token do Strava."""
+
+    @staticmethod
+    def _gerenciador(salvos: Optional[dict], renovar_remoto, **kwargs):
+        from token_strava import GerenciadorTokenStrava
+        kwargs.setdefault('executar_em_segundo_plano', lambda funcao: funcao())
+        return GerenciadorTokenStrava(
+            renovar_remoto=renovar_remoto, carregar=lambda: salvos, salvar=MagicMock(),
+            access_inicial='env_access', refresh_reserva='env_refresh', **kwargs
+        )
+
+    @staticmethod
+    def _resposta(access: str, validade: float = 6 * 3600) -> dict:
+        import time
+        return {'access_token': access, 'refresh_token': f'refresh_{access}', 'expires_at': time.time() + validade}
+
+    def test_token_valido_nao_renova(self) -> None:
+        import time
+        remoto = MagicMock()
+        gerenciador = self._gerenciador(
+            {'access_token': 'a1', 'refresh_token': 'r1', 'expires_at': time.time() + 3 * 3600}, remoto
+        )
+        assert gerenciador.token() == 'a1'
+        remoto.assert_not_called()
+
+    def test_renova_em_segundo_plano_antes_de_vencer(self) -> None:
+        import time
+        tarefas = []
+        remoto = MagicMock(return_value=self._resposta('a2'))
+        ao_renovar = MagicMock()
+        gerenciador = self._gerenciador(
+            {'access_token': 'a1', 'refresh_token': 'r1', 'expires_at': time.time() + 600}, remoto,
+            ao_renovar=ao_renovar, executar_em_segundo_plano=tarefas.append
+        )
+        # Ainda válido: quem pede recebe o token atual na hora, a renovação fica agendada
+        assert gerenciador.token() == 'a1'
+        assert len(tarefas) == 1
+        gerenciador.token()
+        assert len(tarefas) == 1  # uma renovação por vez
+        tarefas[0]()
+        remoto.assert_called_once_with('r1')
+        assert gerenciador.token() == 'a2'
+        ao_renovar.assert_called_with('a2')
+
+    def test_renovacao_unica_com_varias_threads(self) -> None:
+        import threading
+        import time
+        liberar = threading.Event()
+
+        def remoto(refresh_token: str) -> dict:
+            liberar.wait(2)
+            return self._resposta('novo')
+
+        remoto_mock = MagicMock(side_effect=remoto)
+        gerenciador = self._gerenciador(
+            {'access_token': 'velho', 'refresh_token': 'r1', 'expires_at': time.time() - 10}, remoto_mock
+        )
+        resultados: list[str] = []
+        threads = [threading.Thread(target=lambda: resultados.append(gerenciador.token())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        liberar.set()
+        for thread in threads:
+            thread.join(5)
+        assert remoto_mock.call_count == 1
+        assert resultados == ['novo'] * 8
+
+    def test_refresh_recusado_usa_o_de_reserva(self) -> None:
+        from token_strava import ErroRenovacaoToken
+
+        def remoto(refresh_token: str) -> dict:
+            if refresh_token == 'r_banco':
+                raise ErroRenovacaoToken("Status: 400")
+            return self._resposta('a_reserva')
+
+        gerenciador = self._gerenciador(
+            {'access_token': 'a1', 'refresh_token': 'r_banco', 'expires_at': 0}, MagicMock(side_effect=remoto)
+        )
+        assert gerenciador.token() == 'a_reserva'
+        gerenciador._salvar.assert_called_once()
+
+    def test_pausa_apos_falha(self) -> None:
+        from token_strava import ErroRenovacaoToken
+        remoto = MagicMock(side_effect=ErroRenovacaoToken("Status: 401"))
+        gerenciador = self._gerenciador(None, remoto)
+        # Sem tokens no banco: começa pelos do .env, com expiração desconhecida
+        assert gerenciador.token() == 'env_access'
+        assert remoto.call_count == 1
+        gerenciador.token()
+        assert remoto.call_count == 1  # não insiste a cada pedido
+
+    @patch('ai_engine.DB_PATH')
+    def test_tokens_persistidos_no_banco(self, mock_db_path) -> None:
+        tmp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        tmp_db.close()
+        try:
+            with patch('ai_engine.DB_PATH', tmp_db.name):
+                from ai_engine import init_db, carregar_tokens_strava, salvar_tokens_strava
+                init_db()
+                assert carregar_tokens_strava() is None
+                salvar_tokens_strava({'access_token': 'a1', 'refresh_token': 'r1', 'expires_at': 100})
+                salvar_tokens_strava({'access_token': 'a2', 'refresh_token': 'r2', 'expires_at': 200.7})
+                assert carregar_tokens_strava() == {'access_token': 'a2', 'refresh_token': 'r2', 'expires_at': 200}
+        finally:
+            os.remove(tmp_db.name)
+
+
+# ==========================================
+# TESTES DA IMPORTAÇÃO DO HISTÓRICO (importacao_historico)
+# ==========================================
+class TestImportacaoHistorico:
+    """Importação do histórico do Strava em páginas, com checkpoint e retomada."""
+
+    @staticmethod
+    def _strava(total: int):
+        """API falsa: atividades 1..total, uma por dia, `inicio` crescente com o id."""
+        atividades = [{'id': i, 'inicio': 1_600_000_000 + i * 86400} for i in range(1, total + 1)]
+        chamadas: list = []
+
+        def buscar(antes_de, depois_de, tamanho):
+            chamadas.append((antes_de, depois_de))
+            if depois_de is not None:
+                return [a for a in atividades if a['inicio'] > depois_de][:tamanho]
+            anteriores = [a for a in atividades if antes_de is None or a['inicio'] < antes_de]
+            return sorted(anteriores, key=lambda a: a['inicio'], reverse=True)[:tamanho]
+        return atividades, buscar, chamadas
+
+    @staticmethod
+    def _importacao(buscar, banco: dict, **kwargs):
+        from importacao_historico import ImportacaoHistorico
+        from preaquecimento import OrcamentoChamadas
+
+        def gravar(registros, checkpoint):
+            banco.setdefault('atividades', {}).update({r['id']: r for r in registros})
+            banco['checkpoint'] = checkpoint
+
+        kwargs.setdefault('orcamento', OrcamentoChamadas(100))
+        return ImportacaoHistorico(buscar, gravar, lambda: banco.get('checkpoint'), tamanho_pagina=10, **kwargs)
+
+    def test_importa_tudo_e_retoma_do_checkpoint(self) -> None:
+        atividades, buscar, chamadas = self._strava(25)
+        banco: dict = {}
+        assert self._importacao(buscar, banco, paginas_por_rodada=2).rodada()['paginas'] == 2
+        assert len(banco['atividades']) == 20 and not banco['checkpoint']['concluida']
+
+        # "Restart": nova instância continua a partir do checkpoint gravado
+        assert self._importacao(buscar, banco, paginas_por_rodada=2).rodada() == {
+            'paginas': 1, 'atividades': 5, 'motivo': 'em dia'
+        }
+        assert sorted(banco['atividades']) == list(range(1, 26))
+        assert banco['checkpoint']['concluida']
+        assert banco['checkpoint']['recente_ate'] == atividades[-1]['inicio']
+        assert len([c for c in chamadas if c[1] is None]) == 3
+
+    def test_busca_atividades_novas_depois_de_concluir(self) -> None:
+        atividades, buscar, chamadas = self._strava(5)
+        banco: dict = {}
+        importacao = self._importacao(buscar, banco, intervalo_novas_seg=0)
+        importacao.rodada()
+        atividades.append({'id': 6, 'inicio': atividades[-1]['inicio'] + 3600})
+        assert importacao.rodada() == {'paginas': 1, 'atividades': 1, 'motivo': 'em dia'}
+        assert 6 in banco['atividades']
+        assert chamadas[-1] == (None, atividades[-2]['inicio'])
+        assert importacao.rodada()['paginas'] == 0  # nada novo: não conta página
+
+    def test_cede_a_vez_e_respeita_orcamento(self) -> None:
+        from preaquecimento import OrcamentoChamadas
+        _, buscar, chamadas = self._strava(50)
+        banco: dict = {}
+        ocupado = [True]
+        importacao = self._importacao(buscar, banco, ocupado=lambda: ocupado[0], orcamento=OrcamentoChamadas(2))
+        assert importacao.rodada()['motivo'] == 'conversas em andamento'
+        assert chamadas == []
+        ocupado[0] = False
+        assert importacao.rodada() == {'paginas': 2, 'atividades': 20, 'motivo': 'orçamento do Strava esgotado'}
+        assert "pausada" in importacao.texto_progresso()
+
+    def test_falha_na_busca_nao_avanca_checkpoint(self) -> None:
+        _, buscar, _ = self._strava(30)
+        banco: dict = {}
+        falhar = [False]
+
+        def buscar_instavel(antes_de, depois_de, tamanho):
+            if falhar[0]:
+                raise ConnectionError("Strava fora do ar")
+            return buscar(antes_de, depois_de, tamanho)
+
+        importacao = self._importacao(buscar_instavel, banco, paginas_por_rodada=1)
+        importacao.rodada()
+        checkpoint = dict(banco['checkpoint'])
+        falhar[0] = True
+        assert importacao.rodada()['motivo'] == 'erro na busca'
+        assert banco['checkpoint'] == checkpoint
+
+    @patch('ai_engine.DB_PATH')
+    def test_pagina_e_checkpoint_gravados_no_banco(self, mock_db_path) -> None:
+        tmp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        tmp_db.close()
+        try:
+            with patch('ai_engine.DB_PATH', tmp_db.name):
+                from ai_engine import init_db, gravar_pagina_importacao, carregar_checkpoint_importacao
+                init_db()
+                assert carregar_checkpoint_importacao() is None
+                registro = {'id': 7, 'inicio': 1_700_000_000, 'data_local': '2023-11-14 19:13:20', 'tipo': 'Ride',
+                            'nome': 'Pedal', 'distancia_m': 30000.0, 'elevacao_m': 250.0,
+                            'tempo_movimento_s': 3600, 'polyline': 'abc'}
+                checkpoint = {'antes_de': 1_700_000_000, 'recente_ate': 1_700_000_000, 'paginas': 1,
+                              'atividades': 1, 'concluida': True}
+                gravar_pagina_importacao([registro], checkpoint)
+                gravar_pagina_importacao([registro], checkpoint)  # idempotente
+                assert carregar_checkpoint_importacao() == checkpoint
+                conn = sqlite3.connect(tmp_db.name)
+                assert conn.execute('SELECT COUNT(*) FROM atividades_strava').fetchone()[0] == 1
+                conn.close()
+        finally:
+            os.remove(tmp_db.name)
+
+    def test_registro_atividade_do_stravalib(self) -> None:
+        from stravalib.model import SummaryActivity
+        from strava_service import registro_atividade
+        act = SummaryActivity.model_validate({
+            'id': 1, 'name': 'Trilha', 'type': 'Ride', 'sport_type': 'Ride', 'distance': 1000.5,
+            'moving_time': 3600, 'total_elevation_gain': 10, 'start_date': '2024-01-01T10:00:00Z',
+            'start_date_local': '2024-01-01T07:00:00Z', 'map': {'id': 'a1', 'summary_polyline': 'abc'}
+        })
+        registro = registro_atividade(act)
+        assert registro['tipo'] == 'Ride' and registro['polyline'] == 'abc'
+        assert registro['inicio'] == 1704103200 and registro['data_local'] == '2024-01-01 07:00:00'
+
+
+# ==========================================
+# TESTES DO ÚLTIMO PEDAL (iteração preguiçosa do Strava)
+# ==========================================
+class TestUltimoPedal:
+    """Busca do último pedal página a página, parando no primeiro encontrado."""
+
+    class _IteradorPaginado:
+        """Imita o BatchedResultsIterator: pede uma página só quando a anterior acaba."""
+
+        def __init__(self, atividades: list) -> None:
+            self.atividades = atividades
+            self.per_page = 200
+            self.paginas = 0
+
+        def __iter__(self):
+            for inicio in range(0, len(self.atividades), self.per_page):
+                self.paginas += 1
+                yield from self.atividades[inicio:inicio + self.per_page]
+
+    @staticmethod
+    def _atividade(tipo: str, id_: int) -> SimpleNamespace:
+        from datetime import datetime
+        return SimpleNamespace(id=id_, type=tipo, distance=20000.0, total_elevation_gain=150.0, moving_time=3600,
+                               average_speed=5.5, start_date_local=datetime(2026, 1, 10, 7, 30))
+
+    def test_para_na_primeira_pagina_com_pedal(self) -> None:
+        import strava_service
+        atividades = [self._atividade('Run', 1), self._atividade('Ride', 2)] + \
+            [self._atividade('Ride', i) for i in range(3, 500)]
+        iterador = self._IteradorPaginado(atividades)
+        with patch.object(strava_service.client_strava, 'get_activities', return_value=iterador), \
+                patch.object(strava_service.gerenciador_token, 'token'):
+            ultimo = strava_service._buscar_ultimo_pedal()
+        assert ultimo.id == 2
+        assert iterador.per_page == strava_service.POR_PAGINA_ULTIMO_PEDAL
+        assert iterador.paginas == 1
+
+    def test_limite_de_paginas_sem_pedal(self) -> None:
+        import strava_service
+        iterador = self._IteradorPaginado([self._atividade('Run', i) for i in range(1000)])
+        with patch.object(strava_service.client_strava, 'get_activities', return_value=iterador), \
+                patch.object(strava_service.gerenciador_token, 'token'):
+            assert strava_service._buscar_ultimo_pedal() is None
+        assert iterador.paginas == strava_service.MAX_PAGINAS_ULTIMO_PEDAL
+
+    def test_iterar_atividades_filtra_e_limita(self) -> None:
+        import strava_service
+        atividades = [self._atividade(tipo, i) for i, tipo in enumerate(['Ride', 'Run', 'Ride', 'Ride'])]
+        with patch.object(strava_service.client_strava, 'get_activities',
+                          return_value=self._IteradorPaginado(atividades)), \
+                patch.object(strava_service.gerenciador_token, 'token'):
+            encontradas = list(strava_service.iterar_atividades(tipos=['Ride'], limite=2, por_pagina=2))
+        assert [a.id for a in encontradas] == [0, 2]
+
+    @patch('strava_service._buscar_ultimo_pedal')
+    def test_obter_ultimo_pedal_usa_cache(self, mock_buscar) -> None:
+        from strava_service import cache_ultimo_pedal, obter_ultimo_pedal
+        cache_ultimo_pedal.limpar()
+        mock_buscar.return_value = self._atividade('Ride', 1)
+        try:
+            texto = obter_ultimo_pedal()
+            assert "20.0 km" in texto and "Tipo: Ride" in texto
+            obter_ultimo_pedal()
+            mock_buscar.assert_called_once()
+        finally:
+            cache_ultimo_pedal.limpar()
+
+
+# ==========================================
+# TESTES DOS AGREGADOS DIÁRIOS (estatisticas_diarias)
+# ==========================================
+class TestEstatisticasDiarias:
+    """Agregados por dia e tipo mantidos junto com a tabela de atividades."""
+
+    def setup_method(self) -> None:
+        self.tmp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.tmp_db.close()
+        self.patch_db = patch('ai_engine.DB_PATH', self.tmp_db.name)
+        self.patch_db.start()
+        from ai_engine import init_db
+        init_db()
+
+    def teardown_method(self) -> None:
+        self.patch_db.stop()
+        os.remove(self.tmp_db.name)
+
+    @staticmethod
+    def _registro(id_: int, data_local: str, km: float, tipo: str = 'Ride') -> dict:
+        from datetime import datetime, timezone
+        inicio = int(datetime.strptime(data_local, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp())
+        return {'id': id_, 'inicio': inicio, 'data_local': data_local, 'tipo': tipo, 'nome': 'Pedal',
+                'distancia_m': km * 1000, 'elevacao_m': 100.0, 'tempo_movimento_s': 3600, 'polyline': None}
+
+    def _linhas(self) -> list:
+        conn = sqlite3.connect(self.tmp_db.name)
+        linhas = conn.execute('SELECT data, tipo, km, atividades FROM estatisticas_diarias ORDER BY data, tipo').fetchall()
+        conn.close()
+        return linhas
+
+    def test_agrega_por_dia_e_tipo(self) -> None:
+        from ai_engine import gravar_atividades_strava, somar_estatisticas_diarias, km_por_dia_estatisticas
+        gravar_atividades_strava([
+            self._registro(1, '2026-03-02 07:00:00', 30),
+            self._registro(2, '2026-03-02 18:00:00', 20),
+            self._registro(3, '2026-03-02 19:00:00', 5, tipo='Run'),
+            self._registro(4, '2026-03-05 07:00:00', 40, tipo='MountainBikeRide'),
+        ])
+        assert self._linhas() == [('2026-03-02', 'Ride', 50.0, 2), ('2026-03-02', 'Run', 5.0, 1),
+                                  ('2026-03-05', 'MountainBikeRide', 40.0, 1)]
+        soma = somar_estatisticas_diarias('2026-03-01', '2026-03-31', ['Ride', 'MountainBikeRide'])
+        assert soma == {'km': 90.0, 'elevacao_m': 300.0, 'tempo_movimento_s': 10800, 'atividades': 3}
+        assert km_por_dia_estatisticas('2026-03-01', '2026-03-04', ['Ride']) == {'2026-03-02': 50.0}
+
+    def test_edicao_e_exclusao_atualizam_os_dias_afetados(self) -> None:
+        from ai_engine import gravar_atividades_strava
+        gravar_atividades_strava([self._registro(1, '2026-03-02 07:00:00', 30),
+                                  self._registro(2, '2026-03-03 07:00:00', 20)])
+        # Atividade 1 mudou de dia; a 2 foi apagada no Strava (não veio na janela sincronizada)
+        desde = self._registro(0, '2026-03-01 00:00:00', 0)['inicio']
+        gravar_atividades_strava([self._registro(1, '2026-03-04 07:00:00', 35)], desde=desde)
+        assert self._linhas() == [('2026-03-04', 'Ride', 35.0, 1)]
+
+    def test_ressincronizar_sem_mudancas_nao_regrava_nada(self) -> None:
+        from ai_engine import gravar_atividades_strava, salvar_trajetos, carregar_trajetos
+        registros = [self._registro(1, '2026-03-02 07:00:00', 30), self._registro(2, '2026-03-03 07:00:00', 20)]
+        gravar_atividades_strava(registros)
+        salvar_trajetos({1: b'\x01\x00\x00\x00' * 2})
+        conn = sqlite3.connect(self.tmp_db.name)
+        # Marca as linhas: um recálculo dos agregados as apagaria
+        conn.execute("UPDATE estatisticas_diarias SET atividades = 99")
+        conn.commit()
+        conn.close()
+
+        desde = self._registro(0, '2026-03-01 00:00:00', 0)['inicio']
+        gravar_atividades_strava([dict(r) for r in registros], desde=desde)
+        assert self._linhas() == [('2026-03-02', 'Ride', 30.0, 99), ('2026-03-03', 'Ride', 20.0, 99)]
+        assert carregar_trajetos([1]) == {1: b'\x01\x00\x00\x00' * 2}
+
+        # Só o dia da atividade que mudou é recalculado
+        gravar_atividades_strava([registros[0], self._registro(2, '2026-03-03 07:00:00', 25)], desde=desde)
+        assert self._linhas() == [('2026-03-02', 'Ride', 30.0, 99), ('2026-03-03', 'Ride', 25.0, 1)]
+
+    def test_importacao_alimenta_os_agregados(self) -> None:
+        from ai_engine import gravar_pagina_importacao, somar_estatisticas_diarias
+        checkpoint = {'antes_de': 1, 'recente_ate': 2, 'paginas': 1, 'atividades': 1, 'concluida': False}
+        gravar_pagina_importacao([self._registro(9, '2021-06-01 08:00:00', 60)], checkpoint)
+        assert somar_estatisticas_diarias('2021-06-01', '2021-06-30', ['Ride'])['km'] == 60.0
+
+    @patch('strava_service._obter_atividades_com_retry')
+    def test_resumos_saem_do_banco_sincronizado(self, mock_buscar) -> None:
+        from datetime import datetime
+        from strava_service import (cache_sincronizacao, obter_progresso_mensal, obter_resumo_semana,
+                                    obter_km_por_dia)
+        hoje = datetime.now().strftime('%Y-%m-%d')
+        mock_buscar.return_value = [SimpleNamespace(
+            id=1, start_date=datetime.now().astimezone(), start_date_local=datetime.now(), type='Ride',
+            name='Pedal', distance=42000.0, total_elevation_gain=300.0, moving_time=5400, map=None
+        )]
+        cache_sincronizacao.limpar()
+        try:
+            assert obter_resumo_semana() == "1 pedais, 42.0 km rodados, 300m de elevação."
+            assert obter_progresso_mensal(84)['percentual_concluido'] == 50.0
+            assert obter_km_por_dia(30) == {hoje: 42.0}
+            mock_buscar.assert_called_once()  # uma sincronização para todos os resumos
+        finally:
+            cache_sincronizacao.limpar()
+
+    @patch('strava_service._obter_atividades_com_retry')
+    def test_strava_fora_do_ar_usa_o_banco(self, mock_buscar) -> None:
+        from datetime import datetime
+        from ai_engine import gravar_atividades_strava
+        from strava_service import cache_sincronizacao, obter_resumo_semana
+        gravar_atividades_strava([self._registro(1, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 25)])
+        mock_buscar.side_effect = ConnectionError("Strava fora do ar")
+        cache_sincronizacao.limpar()
+        try:
+            texto = obter_resumo_semana()
+        finally:
+            cache_sincronizacao.limpar()
+        assert texto.startswith("1 pedais, 25.0 km")
+        assert "Strava fora do ar" in texto
+
+
+# ==========================================
+# TESTES DO MAPA DE CALOR
+# ==========================================
+class TestMapaCalor:
+    """Traçados decodificados uma vez, rasterização vetorizada e tiles por mês somados aos poucos."""
+
+    # Exemplo da documentação do formato: (38.5, -120.2), (40.7, -120.95), (43.252, -126.453)
+    POLYLINE_EXEMPLO = '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+
+    @staticmethod
+    def _polyline(pontos: list[tuple[float, float]]) -> str:
+        """Codificação de referência (laço simples), para gerar traçados de teste."""
+        texto, anterior = [], (0, 0)
+        for lat, lon in pontos:
+            atual = (round(lat * 1e5), round(lon * 1e5))
+            for valor in (atual[0] - anterior[0], atual[1] - anterior[1]):
+                valor = ~(valor << 1) if valor < 0 else valor << 1
+                while valor >= 0x20:
+                    texto.append(chr((0x20 | (valor & 0x1f)) + 63))
+                    valor >>= 5
+                texto.append(chr(valor + 63))
+            anterior = atual
+        return ''.join(texto)
+
+    def test_decodifica_polyline(self) -> None:
+        from mapa_calor import decodificar_polyline
+        pontos = decodificar_polyline(self.POLYLINE_EXEMPLO)
+        assert pontos.dtype.name == 'int32'
+        assert pontos.tolist() == [[3850000, -12020000], [4070000, -12095000], [4325200, -12645300]]
+        assert decodificar_polyline('').shape == (0, 2)
+        trajeto = [(-23.55, -46.63), (-23.5512, -46.6288), (-23.549, -46.64)]
+        assert (decodificar_polyline(self._polyline(trajeto)) / 1e5).round(5).tolist() == [list(p) for p in trajeto]
+
+    def test_pontos_em_bytes_compactos(self) -> None:
+        from mapa_calor import decodificar_polyline, pontos_para_bytes, bytes_para_pontos
+        pontos = decodificar_polyline(self.POLYLINE_EXEMPLO)
+        dados = pontos_para_bytes(pontos)
+        assert len(dados) == 3 * 2 * 4
+        assert (bytes_para_pontos(dados) == pontos).all()
+
+    def test_rasteriza_segmento_continuo_e_conta_uma_vez_por_atividade(self) -> None:
+        import numpy as np
+        from mapa_calor import decodificar_polyline, rasterizar
+        # ~1 km para leste (~14,6 px em z12): o segmento vira uma linha contínua de pixels, não dois pontos
+        ida = decodificar_polyline(self._polyline([(-23.55, -46.64), (-23.55, -46.63)]))
+        tiles = rasterizar(ida)
+        assert sum(int(g.sum()) for g in tiles.values()) in (15, 16)
+        assert max(float(g.max()) for g in tiles.values()) == 1
+        # Ida e volta pela mesma rua: cada pixel ainda conta uma vez
+        ida_volta = decodificar_polyline(self._polyline([(-23.55, -46.64), (-23.55, -46.63), (-23.55, -46.64)]))
+        tiles_ida_volta = rasterizar(ida_volta)
+        assert tiles_ida_volta.keys() == tiles.keys()
+        assert all(np.array_equal(tiles[k], tiles_ida_volta[k]) for k in tiles)
+
+    def test_salto_de_gps_nao_e_ligado(self) -> None:
+        from mapa_calor import decodificar_polyline, rasterizar
+        # Dois pontos a ~100 km: só as pontas aparecem
+        pontos = decodificar_polyline(self._polyline([(-23.55, -46.64), (-22.9, -47.06)]))
+        assert sum(int(g.sum()) for g in rasterizar(pontos).values()) == 2
+
+    def test_mosaico_recorta_em_volta_da_regiao_mais_densa(self) -> None:
+        import numpy as np
+        from mapa_calor import montar_mosaico, TILE_PX
+        denso = np.zeros((TILE_PX, TILE_PX), dtype=np.float32)
+        denso[10:20, 10:20] = 5
+        distante = np.zeros((TILE_PX, TILE_PX), dtype=np.float32)
+        distante[0:4, 0:4] = 1
+        mosaico = montar_mosaico({(100, 100): denso, (101, 100): denso, (500, 500): distante}, max_lado=4)
+        # Viagem distante fora da janela; bordas vazias cortadas (com margem de 8 px)
+        assert mosaico.shape == (10 + 16, TILE_PX + 10 + 16)
+        assert mosaico.sum() == 2 * denso.sum()
+        assert montar_mosaico({}) is None
+
+    def test_meses_do_periodo(self) -> None:
+        from datetime import date
+        from mapa_calor import meses_do_periodo
+        assert meses_do_periodo(3, hoje=date(2026, 2, 10)) == ['2025-12', '2026-01', '2026-02']
+        assert meses_do_periodo(1, hoje=date(2026, 2, 10)) == ['2026-02']
+
+    def _mapa(self, atividades: dict[str, dict[int, str]]):
+        from cache_persistente import CacheDuasCamadas
+        from mapa_calor import MapaCalor
+        self.trajetos: dict[int, bytes] = {}
+        self.decodificados: list[int] = []
+
+        def salvar(novos: dict[int, bytes]) -> None:
+            self.decodificados.extend(novos)
+            self.trajetos.update(novos)
+
+        return MapaCalor(
+            listar_polylines=lambda mes: list(atividades.get(mes, {}).items()),
+            carregar_pontos=lambda ids: {i: self.trajetos[i] for i in ids if i in self.trajetos},
+            salvar_pontos=salvar,
+            cache=CacheDuasCamadas('teste_mapa_calor', ttl=3600, max_itens=12),
+        )
+
+    @staticmethod
+    def _total(tiles) -> float:
+        return float(sum(g.sum() for g in tiles.values()))
+
+    def test_mes_soma_so_as_atividades_novas(self) -> None:
+        from mapa_calor import rasterizar, decodificar_polyline
+        rota_a = self._polyline([(-23.55, -46.64), (-23.55, -46.63)])
+        rota_b = self._polyline([(-23.56, -46.64), (-23.56, -46.63)])
+        atividades = {'2026-03': {1: rota_a, 2: rota_b}}
+        mapa = self._mapa(atividades)
+
+        tiles = mapa.tiles_mes('2026-03')
+        assert sorted(self.decodificados) == [1, 2]
+        # Sem atividade nova: o mesmo objeto do cache, nada decodificado nem rasterizado
+        with patch('mapa_calor.rasterizar') as rasterizar_mock:
+            assert mapa.tiles_mes('2026-03') is tiles
+        rasterizar_mock.assert_not_called()
+
+        atividades['2026-03'][3] = rota_a
+        with patch('mapa_calor.rasterizar', wraps=rasterizar) as rasterizar_mock:
+            tiles_novos = mapa.tiles_mes('2026-03')
+        assert rasterizar_mock.call_count == 1
+        assert sorted(self.decodificados) == [1, 2, 3]
+        uma_rota = self._total(rasterizar(decodificar_polyline(rota_a)))
+        assert self._total(tiles_novos) == self._total(tiles) + uma_rota
+        # A grade em cache de antes não foi alterada
+        assert self._total(tiles) == self._total(tiles_novos) - uma_rota
+
+    def test_atividade_apagada_ou_recortada_refaz_o_mes(self) -> None:
+        rota_a = self._polyline([(-23.55, -46.64), (-23.55, -46.63)])
+        rota_b = self._polyline([(-23.56, -46.64), (-23.56, -46.63)])
+        atividades = {'2026-03': {1: rota_a, 2: rota_b}}
+        mapa = self._mapa(atividades)
+        total_dois = self._total(mapa.tiles_mes('2026-03'))
+
+        del atividades['2026-03'][2]
+        total_um = self._total(mapa.tiles_mes('2026-03'))
+        assert 0 < total_um < total_dois
+
+        atividades['2026-03'][1] = self._polyline([(-23.55, -46.64), (-23.55, -46.635)])
+        self.trajetos.clear()  # o banco apaga o traçado da atividade regravada
+        assert 0 < self._total(mapa.tiles_mes('2026-03')) < total_um
+
+    def test_gera_imagem_e_sem_tracados_retorna_none(self) -> None:
+        from mapa_calor import meses_do_periodo
+        mes_atual = meses_do_periodo(1)[0]
+        mapa = self._mapa({mes_atual: {1: self._polyline([(-23.55, -46.64), (-23.55, -46.63), (-23.54, -46.63)])}})
+        caminho = mapa.gerar_imagem(3)
+        try:
+            assert caminho and os.path.getsize(caminho) > 0
+        finally:
+            if caminho:
+                os.remove(caminho)
+        assert self._mapa({}).gerar_imagem(3) is None
+
+
+class TestTrajetosBanco:
+    """Traçados das atividades no banco: listagem por mês e pontos decodificados guardados."""
+
+    def setup_method(self) -> None:
+        self.tmp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        self.tmp_db.close()
+        self.patch_db = patch('ai_engine.DB_PATH', self.tmp_db.name)
+        self.patch_db.start()
+        from ai_engine import init_db
+        init_db()
+
+    def teardown_method(self) -> None:
+        self.patch_db.stop()
+        os.remove(self.tmp_db.name)
+
+    @staticmethod
+    def _registro(id_: int, data_local: str, tipo: str = 'Ride', polyline: Optional[str] = 'abc') -> dict:
+        from datetime import datetime, timezone
+        inicio = int(datetime.strptime(data_local, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp())
+        return {'id': id_, 'inicio': inicio, 'data_local': data_local, 'tipo': tipo, 'nome': 'Pedal',
+                'distancia_m': 10000.0, 'elevacao_m': 0.0, 'tempo_movimento_s': 1800, 'polyline': polyline}
+
+    def test_lista_polylines_do_mes(self) -> None:
+        from ai_engine import gravar_atividades_strava, listar_polylines_mes
+        gravar_atividades_strava([
+            self._registro(1, '2026-03-02 07:00:00'),
+            self._registro(2, '2026-03-03 07:00:00', polyline=None),
+            self._registro(3, '2026-03-04 07:00:00', tipo='Run'),
+            self._registro(4, '2026-04-01 07:00:00'),
+        ])
+        assert listar_polylines_mes('2026-03', ['Ride']) == [(1, 'abc')]
+
+    def test_tracado_decodificado_so_e_descartado_quando_muda(self) -> None:
+        from ai_engine import gravar_atividades_strava, salvar_trajetos, carregar_trajetos
+        gravar_atividades_strava([self._registro(1, '2026-03-02 07:00:00'), self._registro(2, '2026-03-03 07:00:00')])
+        salvar_trajetos({1: b'\x01\x00\x00\x00' * 2, 2: b'\x02\x00\x00\x00' * 2})
+        assert carregar_trajetos([1, 2, 3]) == {1: b'\x01\x00\x00\x00' * 2, 2: b'\x02\x00\x00\x00' * 2}
+
+        # Regravar sem mudar o traçado (sincronização da última semana) mantém o decodificado
+        gravar_atividades_strava([self._registro(1, '2026-03-02 07:00:00'), self._registro(2, '2026-03-03 07:00:00')])
+        assert carregar_trajetos([1, 2]) == {1: b'\x01\x00\x00\x00' * 2, 2: b'\x02\x00\x00\x00' * 2}
+
+        gravar_atividades_strava([self._registro(1, '2026-03-02 07:00:00', polyline='abd')])
+        assert carregar_trajetos([1, 2]) == {2: b'\x02\x00\x00\x00' * 2}
@@ -0,0 +1,172 @@
+"""
+Gerenciador do token de acesso do Strava.
+O token dura 6h e a resposta do OAuth informa quando expira (`expires_at`). O gerenciador
+guarda access token, refresh token e expiração no banco e renova antes da hora: em
+segundo plano quando faltam menos de `antecedencia` segundos e, só se o token já estiver
+praticamente vencido, na hora, com uma única renovação para todas as threads que
+esperam. Nenhum pedido paga uma chamada recusada + renovação + nova tentativa.
+"""
+from __future__ import annotations
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+from config import logger
+
+# Faltando menos que isso, a renovação vai para o segundo plano (o Strava só emite
+# token novo quando falta menos de 1h; antes disso devolve o mesmo)
+ANTECEDENCIA_RENOVACAO_SEG: float = 1800
+
+# Faltando menos que isso, o token é tratado como vencido e a renovação é esperada
+MARGEM_EXPIRACAO_SEG: float = 120
+
+# Depois de uma renovação recusada, espera antes de tentar de novo no caminho dos pedidos
+_PAUSA_APOS_FALHA_SEG: float = 60
+
+
+class ErroRenovacaoToken(Exception):
+    """O Strava recusou a renovação (refresh token inválido ou revogado)."""
+
+
+class GerenciadorTokenStrava:
+    """
+    Token do Strava sempre válido para quem chama `token()`.
+
+    - `renovar_remoto(refresh_token)` troca o refresh token por {'access_token', 'refresh_token', 'expires_at'};
+    - `carregar()` / `salvar(tokens)` leem e gravam os tokens no banco;
+    - `ao_renovar(access_token)` avisa os clientes (ex.: o `Client` do stravalib);
+    - `refresh_reserva` é o refresh token do .env, usado se o do banco for recusado
+      (ex.: o setup foi refeito e os tokens do banco ficaram velhos).
+    """
+
+    def __init__(self, renovar_remoto: Callable[[str], dict], carregar: Callable[[], Optional[dict]],
+                 salvar: Callable[[dict], None], ao_renovar: Callable[[str], None] = lambda _: None,
+                 access_inicial: Optional[str] = None, refresh_reserva: Optional[str] = None,
+                 executar_em_segundo_plano: Optional[Callable[[Callable[[], None]], None]] = None) -> None:
+        self._renovar_remoto = renovar_remoto
+        self._carregar = carregar
+        self._salvar = salvar
+        self._ao_renovar = ao_renovar
+        self._refresh_reserva = refresh_reserva
+        self._em_segundo_plano = executar_em_segundo_plano or _thread_daemon
+        self._lock = threading.Lock()
+        self._renovacao: Optional[Future] = None
+        self._falhou_em: float = 0.0
+        self._tokens: Optional[dict] = None
+        self._access_inicial = access_inicial
+
+    # ------------------------------------------
+    # Estado
+    # ------------------------------------------
+    def _estado(self) -> dict:
+        if self._tokens is None:
+            salvos = self._carregar()
+            if salvos:
+                self._tokens = dict(salvos)
+            else:
+                # Primeira execução: tokens do setup (.env), expiração desconhecida
+                self._tokens = {'access_token': self._access_inicial,
+                                'refresh_token': self._refresh_reserva, 'expires_at': 0}
+            self._ao_renovar(self._tokens['access_token'])
+        return self._tokens
+
+    def segundos_restantes(self) -> float:
+        with self._lock:
+            return self._estado()['expires_at'] - time.time()
+
+    def expirado(self) -> bool:
+        """Se `token()` vai esperar por uma renovação (útil para o runtime assíncrono)."""
+        return self.segundos_restantes() <= MARGEM_EXPIRACAO_SEG
+
+    # ------------------------------------------
+    # Renovação (uma por vez)
+    # ------------------------------------------
+    def _renovar_agora(self) -> None:
+        with self._lock:
+            estado = dict(self._estado())
+        candidatos = [estado['refresh_token']]
+        if self._refresh_reserva and self._refresh_reserva not in candidatos:
+            candidatos.append(self._refresh_reserva)
+
+        ultimo_erro: Optional[Exception] = None
+        for refresh_token in candidatos:
+            if not refresh_token:
+                continue
+            try:
+                dados = self._renovar_remoto(refresh_token)
+            except ErroRenovacaoToken as e:
+                ultimo_erro = e
+                continue
+            novos = {'access_token': dados['access_token'], 'refresh_token': dados['refresh_token'],
+                     'expires_at': int(dados['expires_at'])}
+            self._salvar(novos)
+            with self._lock:
+                self._tokens = novos
+                self._falhou_em = 0.0
+            self._ao_renovar(novos['access_token'])
+            logger.info(f"Token do Strava renovado; expira em {(novos['expires_at'] - time.time()) / 60:.0f} min.")
+            return
+        raise ultimo_erro or ErroRenovacaoToken("Nenhum refresh token do Strava configurado.")
+
+    def _iniciar_renovacao(self) -> tuple[Future, bool]:
+        """Futuro da renovação em andamento (ou de uma nova) e se quem chamou deve executá-la."""
+        with self._lock:
+            if self._renovacao is not None:
+                return self._renovacao, False
+            self._renovacao = Future()
+            return self._renovacao, True
+
+    def _executar_renovacao(self, futuro: Future) -> None:
+        try:
+            self._renovar_agora()
+            futuro.set_result(True)
+        except Exception as e:
+            with self._lock:
+                self._falhou_em = time.monotonic()
+            logger.error(f"Erro ao renovar token do Strava: {e}")
+            futuro.set_result(False)
+        finally:
+            with self._lock:
+                self._renovacao = None
+
+    def renovar(self, timeout: float = 30.0) -> bool:
+        """Renova agora (ou espera a renovação já em andamento). Retorna se deu certo."""
+        futuro, executar = self._iniciar_renovacao()
+        if executar:
+            self._executar_renovacao(futuro)
+        try:
+            return futuro.result(timeout=timeout)
+        except Exception:
+            return False
+
+    def renovar_em_segundo_plano(self) -> None:
+        futuro, executar = self._iniciar_renovacao()
+        if executar:
+            self._em_segundo_plano(lambda: self._executar_renovacao(futuro))
+
+    def renovar_se_preciso(self) -> None:
+        """Tarefa periódica: renova em segundo plano se o token entrou na janela de antecedência."""
+        if self.segundos_restantes() <= ANTECEDENCIA_RENOVACAO_SEG:
+            self.renovar_em_segundo_plano()
+
+    # ------------------------------------------
+    # Caminho dos pedidos
+    # ------------------------------------------
+    def token(self) -> str:
+        """Access token válido; só espera pela renovação se o atual já estiver vencido."""
+        restantes = self.segundos_restantes()
+        with self._lock:
+            # Renovação recusada há pouco: segue com o token atual em vez de insistir a cada pedido
+            em_pausa = bool(self._falhou_em) and time.monotonic() - self._falhou_em < _PAUSA_APOS_FALHA_SEG
+        if not em_pausa:
+            if restantes <= MARGEM_EXPIRACAO_SEG:
+                self.renovar()
+            elif restantes <= ANTECEDENCIA_RENOVACAO_SEG:
+                self.renovar_em_segundo_plano()
+        with self._lock:
+            return self._estado()['access_token']
+
+
+def _thread_daemon(funcao: Callable[[], None]) -> None:
+    threading.Thread(target=funcao, daemon=True, name='renovacao-token-strava').start()
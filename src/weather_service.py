@@ -3,55 +3,74 @@ Serviço de previsão do tempo via OpenWeather API.
 """
 from __future__ import annotations
 
-import requests
-from cachetools import TTLCache
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from config import OPENWEATHER_API_KEY, CITY, CACHE_CLIMA_FRESCO_SEG, CACHE_CLIMA_LIMITE_SEG, logger
+from cliente_http import sessao_openweather, politica_retry, DisjuntorAberto
+from cache_swr import CacheSWR, Leitura, nota_desatualizado
 
-from config import OPENWEATHER_API_KEY, CITY, logger
-
-# Cache de previsão do tempo com TTL de 10 minutos
-_weather_cache: TTLCache = TTLCache(maxsize=5, ttl=600)
+# Previsão do tempo: renovada em segundo plano quando deixa de ser fresca, servida até o limite
+cache_clima: CacheSWR = CacheSWR('clima', fresco=CACHE_CLIMA_FRESCO_SEG, limite=CACHE_CLIMA_LIMITE_SEG, max_itens=5)
 
 
 # ==========================================
 # SERVIÇO DE CLIMA (OPENWEATHER)
 # ==========================================
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=2, max=10),
-    retry=retry_if_exception_type(requests.exceptions.Timeout),
-    reraise=True
-)
+CHAVE_CACHE_CLIMA: str = f"weather_{CITY}"
+
+
+class ErroRespostaClima(Exception):
+    """A API respondeu, mas sem previsão (cidade inválida, chave recusada...)."""
+
+
+def url_previsao() -> str:
+    """URL da previsão de 5 dias / 3 horas da cidade configurada."""
+    return (
+        f"https://api.openweathermap.org/data/2.5/forecast"
+        f"?q={CITY}&appid={OPENWEATHER_API_KEY}&units=metric&lang=pt"
+    )
+
+
+def resumir_previsao(res: dict) -> str:
+    """
+    Converte a resposta da API no resumo das próximas 24h.
+    Compartilhado entre o cliente síncrono (requests) e o assíncrono.
+    """
+    if res.get('cod') != '200':
+        raise ErroRespostaClima(res.get('message', 'erro desconhecido'))
+
+    previsoes = res['list'][:8]  # Próximas 24h
+    resumo = ""
+    for p in previsoes[::2]:  # Pula de 6 em 6 horas
+        resumo += f" {p['dt_txt'][11:16]}h: {p['main']['temp']:.0f}°C, {p['weather'][0]['description']} |"
+    return resumo
+
+
+def texto_previsao(leitura: Leitura) -> str:
+    """Resumo do cache com o aviso de dado antigo, se a última renovação falhou."""
+    return leitura.valor + nota_desatualizado(leitura)
+
+
+def erro_previsao(e: Exception) -> str:
+    """Texto devolvido no lugar da previsão quando não há nem valor antigo para servir."""
+    if isinstance(e, DisjuntorAberto):
+        return "Clima: serviço de previsão fora do ar no momento."
+    if isinstance(e, ErroRespostaClima):
+        logger.error(f"Erro na API do clima: {e}")
+        return f"Erro ao buscar clima: {e}"
+    logger.error(f"Erro ao buscar previsão: {e}")
+    return f"Erro ao buscar previsão: {e}"
+
+
+@politica_retry()
+def _buscar_previsao() -> str:
+    """Vai à API (com retry em falhas de rede) e devolve o resumo."""
+    return resumir_previsao(sessao_openweather.get(url_previsao()).json())
+
+
 def obter_previsao_tempo() -> str:
     """Retorna previsão do tempo das próximas 24h para a cidade configurada."""
-    cache_key = f"weather_{CITY}"
-    if cache_key in _weather_cache:
-        logger.debug("Cache hit para previsão do tempo.")
-        return _weather_cache[cache_key]
-
     if not OPENWEATHER_API_KEY:
         return "Clima: API Key não configurada."
     try:
-        url = (
-            f"http://api.openweathermap.org/data/2.5/forecast"
-            f"?q={CITY}&appid={OPENWEATHER_API_KEY}&units=metric&lang=pt"
-        )
-        res = requests.get(url, timeout=10).json()
-
-        if res.get('cod') != '200':
-            logger.error(f"Erro na API do clima: {res.get('message', 'desconhecido')}")
-            return f"Erro ao buscar clima: {res.get('message', 'erro desconhecido')}"
-
-        previsoes = res['list'][:8]  # Próximas 24h
-        resumo = ""
-        for p in previsoes[::2]:  # Pula de 6 em 6 horas
-            resumo += f" {p['dt_txt'][11:16]}h: {p['main']['temp']:.0f}°C, {p['weather'][0]['description']} |"
-
-        _weather_cache[cache_key] = resumo
-        return resumo
-    except requests.exceptions.Timeout:
-        logger.error("Timeout ao buscar previsão do tempo.")
-        raise  # Re-raise para o tenacity tentar novamente
+        return texto_previsao(cache_clima.obter(CHAVE_CACHE_CLIMA, _buscar_previsao))
     except Exception as e:
-        logger.error(f"Erro ao buscar previsão: {e}")
-        return f"Erro ao buscar previsão: {e}"
+        return erro_previsao(e)